@@ -1,6 +1,9 @@
 from nit import Nit
 from bat import Bat
 from sdt import Sdt
+from eit import Eit
+from tdt import Tdt
+from tot import Tot
 
 SAMPLE_BAT = [
     0x4A, 0xF1, 0xD3, 0x00, 0x0A, 0xC5, 0x00, 0x00, 0xF0, 0x38, 0x5F, 0x04,
@@ -189,6 +192,25 @@ SAMPLE_SDT = [
     0x0C, 0x58, 0xFD, 0x80, 0x0D, 0x48, 0x0B, 0x02, 0x03, 0x4D, 0x43, 0x4B,
     0x05, 0x44, 0x49, 0x6E, 0x66, 0x6F, 0x2B, 0x24, 0x7E, 0xAF]
 
+SAMPLE_EIT = [
+    0x50, 0xF0, 0x5E, 0x06, 0x54, 0xC7, 0x00, 0x08, 0x00, 0x10, 0x18, 0x00,
+    0x00, 0x50, 0x10, 0x01, 0xE0, 0x75, 0x18, 0x00, 0x00, 0x00, 0x30, 0x00,
+    0x80, 0x1B, 0x4D, 0x19, 0x65, 0x6E, 0x67, 0x04, 0x4E, 0x65, 0x77, 0x73,
+    0x10, 0x54, 0x68, 0x65, 0x20, 0x65, 0x76, 0x65, 0x6E, 0x69, 0x6E, 0x67,
+    0x20, 0x6E, 0x65, 0x77, 0x73, 0x10, 0x02, 0xE0, 0x75, 0x18, 0x30, 0x00,
+    0x01, 0x00, 0x00, 0x20, 0x1C, 0x4D, 0x1A, 0x65, 0x6E, 0x67, 0x05, 0x4D,
+    0x6F, 0x76, 0x69, 0x65, 0x10, 0x41, 0x20, 0x66, 0x69, 0x6C, 0x6D, 0x20,
+    0x61, 0x62, 0x6F, 0x75, 0x74, 0x20, 0x44, 0x56, 0x42, 0x67, 0x45, 0x49,
+    0x93]
+
+SAMPLE_TDT = [
+    0x70, 0x70, 0x05, 0xE0, 0x75, 0x18, 0x30, 0x05]
+
+SAMPLE_TOT = [
+    0x73, 0x70, 0x1A, 0xE0, 0x75, 0x18, 0x30, 0x05, 0xF0, 0x0F, 0x58, 0x0D,
+    0x47, 0x42, 0x52, 0x02, 0x00, 0x00, 0xE0, 0x82, 0x01, 0x00, 0x00, 0x01,
+    0x00, 0x5A, 0x86, 0xA9, 0x84]
+
 def get_sample_sdt_data():
     return {0:SAMPLE_SDT}
 
@@ -210,3 +232,21 @@ def get_sample_sdt_sections():
     return {0:Sdt(SAMPLE_SDT)}
     
     
+
+def get_sample_eit_data():
+    return {0:SAMPLE_EIT}
+
+def get_sample_eit_sections():
+    return {0:Eit(SAMPLE_EIT)}
+
+def get_sample_tdt_data():
+    return {0:SAMPLE_TDT}
+
+def get_sample_tot_data():
+    return {0:SAMPLE_TOT}
+
+def get_sample_tdt_sections():
+    return {0:Tdt(SAMPLE_TDT)}
+
+def get_sample_tot_sections():
+    return {0:Tot(SAMPLE_TOT)}
@@ -14,6 +14,18 @@ class Bat(BatNitBase):
     described as a part of DVB SI
     """
     TABLE_ID = 0x4A
+
+    def create(cls, bouquet_id, bouquet_descriptors, ts_loop, version=0, section_number=0, last_section_number=0):
+        """Builds a BAT section, see BatNitBase.create()"""
+        bat = super(Bat, cls).create(bouquet_id, bouquet_descriptors, ts_loop, version, section_number,
+                                     last_section_number)
+        bat.bouquet_id = bouquet_id
+        return bat
+
+    create = classmethod(create)
+
+    def _get_table_id_extension(self):
+        return self.bouquet_id
     
     def parse(self, data=None):
         """Parses the given data to generate all the BAT information
@@ -68,6 +80,11 @@ class Bat(BatNitBase):
                     return (desc.eits_transport_stream_id, desc.eits_service_id)
         return None
     
+    def to_dict(self):
+        res = super(Bat, self).to_dict()
+        res['bouquet_id'] = self.table_id_extension
+        return res
+
     def __str__(self):
         res = super(Bat, self).__str__()
         resar = res.split('\n')
@@ -114,6 +131,19 @@ if __name__ == '__main__':
                 print bat
                 function(self, bat)
 
+        def testToBytes(self):
+            bat = Bat(sample_bat)
+            self.assertEqual(sample_bat, list(bat.to_bytes()))
+            for desc in bat.descriptors:
+                if type(desc) == descriptors.BouquetNameDescriptor: desc.bouquet_name = u'Bouquet \u00e9'
+            edited = Bat(list(bat.to_bytes()))
+            self.assertEqual(u'Bouquet \u00e9', edited.get_name())
+            self.assertEqual(bat.bouquet_id, edited.bouquet_id)
+            self.assertEqual(bat.get_service_list(5), edited.get_service_list(5))
+            built = Bat.create(bat.bouquet_id, Bat(sample_bat).descriptors, bat.ts_loop, bat.version,
+                               bat.section_number, bat.last_section_number)
+            self.assertEqual(sample_bat, list(built.to_bytes()))
+
     unittest.main()
 
 
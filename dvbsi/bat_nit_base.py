@@ -129,7 +129,37 @@ class TsItem(object):
         self.descriptors = descriptors.get_descriptors(desc_data)
         self.length = self.ts_descriptors_len + 6
         return self.ts_descriptors_len + 6 + offset
+
+    def create(cls, transport_stream_id, original_network_id, ts_descriptors=None):
+        """Builds a transport stream item for BatNitBase.create()"""
+        tsi = cls()
+        tsi.transport_stream_id = transport_stream_id
+        tsi.original_network_id = original_network_id
+        tsi.descriptors = list(ts_descriptors or [])
+        return tsi
+
+    create = classmethod(create)
+
+    def get_size(self):
+        return 6 + descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_into(self, buffer, offset):
+        """Writes the transport stream item into buffer at offset and returns the offset after it"""
+        self.ts_descriptors_len = descriptors.get_descriptors_size(self.descriptors)
+        self.length = self.ts_descriptors_len + 6
+        buffer[offset]     = self.transport_stream_id >> 8
+        buffer[offset + 1] = self.transport_stream_id & 0xff
+        buffer[offset + 2] = self.original_network_id >> 8
+        buffer[offset + 3] = self.original_network_id & 0xff
+        buffer[offset + 4] = 0xf0 | (self.ts_descriptors_len >> 8)
+        buffer[offset + 5] = self.ts_descriptors_len & 0xff
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 6)
     
+    def to_dict(self):
+        return {'transport_stream_id': self.transport_stream_id,
+                'original_network_id': self.original_network_id,
+                'descriptors'        : [desc.to_dict() for desc in self.descriptors]}
+
     def __str__(self):
         res = '\tTransport Stream Loop Item:\n'
         res += '\t\ttransport stream ID[%d]\n'%(self.transport_stream_id)
@@ -157,6 +187,31 @@ class BatNitBase(Section):
         self.descriptors   = []
         self.ts_loop       = []
         super(BatNitBase, self).__init__(data)
+
+    def create(cls, table_id_extension, table_descriptors, ts_loop, version=0, section_number=0,
+               last_section_number=0, table_id=None):
+        """Builds a BAT or NIT section
+
+        Arguments:
+            table_id_extension  -- the network ID of a NIT or the bouquet ID of a BAT
+            table_descriptors   -- a list of Descriptor objects for the network or bouquet
+            ts_loop             -- a list of TsItem objects, see TsItem.create()
+            version             -- the version number (default 0)
+            section_number      -- the section number (default 0)
+            last_section_number -- the last section number of the table (default 0)
+            table_id            -- None uses the TABLE_ID of the class, eg. 0x41 for an other network NIT
+                                   (default None)
+        Returns:
+            A complete section that can be serialised with to_bytes()
+        """
+        table = cls()
+        if table_id is None: table_id = cls.TABLE_ID
+        table.set_header(table_id, table_id_extension, version, section_number, last_section_number)
+        table.descriptors = list(table_descriptors)
+        table.ts_loop = list(ts_loop)
+        return table
+
+    create = classmethod(create)
     
     def parse(self, data=None):
         """Parses the given data to generate all the BAT/NIT information
@@ -223,6 +278,28 @@ class BatNitBase(Section):
             self.ts_loop.append(tsi)
             ln -= tsi.length
     
+    def get_body_size(self):
+        size = 4 + descriptors.get_descriptors_size(self.descriptors)
+        for ts in self.ts_loop:
+            size += ts.get_size()
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the BAT/NIT descriptors and the transport stream loop into buffer at offset"""
+        self.descriptors_len = descriptors.get_descriptors_size(self.descriptors)
+        buffer[offset]     = 0xf0 | (self.descriptors_len >> 8)
+        buffer[offset + 1] = self.descriptors_len & 0xff
+        offset = descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 2)
+        self.ts_loop_len = 0
+        for ts in self.ts_loop:
+            self.ts_loop_len += ts.get_size()
+        buffer[offset]     = 0xf0 | (self.ts_loop_len >> 8)
+        buffer[offset + 1] = self.ts_loop_len & 0xff
+        offset += 2
+        for ts in self.ts_loop:
+            offset = ts.serialize_into(buffer, offset)
+        return offset
+
     def get_channel_number(self, service_id, ts_id=None):
         """Gets the channel number for the given service ID
         
@@ -306,6 +383,12 @@ class BatNitBase(Section):
             service_lists[ts.original_network_id, ts.transport_stream_id] = ts.get_service_list()
         return service_lists
             
+    def to_dict(self):
+        res = super(BatNitBase, self).to_dict()
+        res.update({'descriptors': [desc.to_dict() for desc in self.descriptors],
+                    'ts_loop'    : [ts.to_dict() for ts in self.ts_loop]})
+        return res
+
     def __str__(self):
         res = super(BatNitBase, self).__str__()
         resar = res.split('\n')
@@ -401,6 +484,10 @@ if __name__ == '__main__':
                 print batnit.get_service_list(5)
                 function(self, batnit)
 
+        def testToBytes(self):
+            for data in (sample_bat, sample_nit_0, sample_nit_1):
+                self.assertEqual(bytearray(data), BatNitBase(data).to_bytes())
+
     unittest.main()
 
 
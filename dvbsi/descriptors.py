@@ -1,5 +1,9 @@
+from collections import OrderedDict
 from mpeg2psi import descriptors
-from mpeg2psi.descriptors import Descriptor
+from mpeg2psi.descriptors import Descriptor, get_descriptors_size, serialize_descriptors_into
+from mpeg2psi.json_output import to_hex
+from dvb_time import decode_utc_time, decode_offset, encode_utc_time, encode_offset, BCD_ENCODE_TABLE
+from text import decode_text, encode_text, to_str
 
 POL_LINEAR_HORIZONTAL = int('00', 2)
 POL_LINEAR_VERTICAL   = int('01', 2)
@@ -129,6 +133,38 @@ def bcd2int(data):
         index += 1
     return res
 
+def int2bcd(value, buffer, offset, length):
+    """Writes value as 2 * length BCD digits into buffer at offset, the inverse of bcd2int()
+
+    Returns:
+        The offset after the digits
+    """
+    end = offset + length
+    index = end
+    while index > offset:
+        index -= 1
+        value, digits = divmod(value, 100)
+        buffer[index] = BCD_ENCODE_TABLE[digits]
+    return end
+
+def set_uint16(buffer, offset, value):
+    buffer[offset] = (value >> 8) & 0xff
+    buffer[offset + 1] = value & 0xff
+
+def decode_text_field(desc, name, data):
+    """Decodes a text field of a descriptor, keeping its raw bytes in desc.raw_text[name]
+
+    encode_text_field() writes the raw bytes back as long as the field still holds the text they decode to, so an
+    unedited descriptor is re-emitted byte for byte.
+    """
+    raw = str(bytearray(data))
+    desc.raw_text[name] = raw
+    return decode_text(raw)
+
+def encode_text_field(desc, name, text):
+    """Returns the text of a descriptor field encoded, see decode_text_field()"""
+    return encode_text(text, desc.raw_text.get(name))
+
 class LinkageDescriptor(Descriptor):
     tag = 0x4a
     def __init__(self, data):
@@ -150,7 +186,7 @@ class LinkageDescriptor(Descriptor):
         else:
             flags = data[9]
             offset = 0
-            self.hand_over_type = flags & int('11110000', 2)
+            self.hand_over_type = (flags & int('11110000', 2)) >> 4
             self.origin_type    = flags & int('00000001', 2)
             if self.hand_over_type >= 1 and self.hand_over_type <= 3:
                 self.network_id = (data[10] << 8) + data[11]
@@ -159,11 +195,52 @@ class LinkageDescriptor(Descriptor):
                 self.initial_service_id = (data[10 + offset] << 8) + data[11 + offset]
                 offset += 2
             self.private_data = data[10+offset:self.length]
-                
+
+    def get_payload_size(self):
+        size = 7 + len(self.private_data)
+        if self.linkage_type == 0x08:
+            size += 1
+            if self.hand_over_type >= 1 and self.hand_over_type <= 3: size += 2
+            if self.origin_type == 0: size += 2
+        return size
+
+    def serialize_payload_into(self, buffer, offset):
+        set_uint16(buffer, offset, self.transport_stream_id)
+        set_uint16(buffer, offset + 2, self.original_network_id)
+        set_uint16(buffer, offset + 4, self.service_id)
+        buffer[offset + 6] = self.linkage_type
+        offset += 7
+        if self.linkage_type == 0x08:
+            buffer[offset] = (self.hand_over_type << 4) | int('00001110', 2) | self.origin_type
+            offset += 1
+            if self.hand_over_type >= 1 and self.hand_over_type <= 3:
+                set_uint16(buffer, offset, self.network_id)
+                offset += 2
+            if self.origin_type == 0:
+                set_uint16(buffer, offset, self.initial_service_id)
+                offset += 2
+        end = offset + len(self.private_data)
+        buffer[offset:end] = bytearray(self.private_data)
+        return end
+
+    def to_dict(self):
+        res = super(LinkageDescriptor, self).to_dict()
+        res.update({'transport_stream_id': self.transport_stream_id,
+                    'original_network_id': self.original_network_id,
+                    'service_id'         : self.service_id,
+                    'linkage_type'       : self.linkage_type,
+                    'private_data'       : to_hex(self.private_data)})
+        if self.linkage_type == 0x08:
+            res['hand_over_type'] = self.hand_over_type
+            res['origin_type'] = self.origin_type
+            if self.hand_over_type >= 1 and self.hand_over_type <= 3: res['network_id'] = self.network_id
+            if self.origin_type == 0: res['initial_service_id'] = self.initial_service_id
+        return res
+
     def _get_handover_string(self):
         res = '\tMobile Handover:\n'
         handover_type = 'RESERVED'
-        if self.hando_over_type in HANDOVER_TYPE_STRINGS:
+        if self.hand_over_type in HANDOVER_TYPE_STRINGS:
             handover_type = HANDOVER_TYPE_STRINGS[self.hand_over_type]
         res += '\t\tHandover Type = [%s]\n'%(handover_type)
         res += '\t\tOrigin Type   = [%s]\n'%(ORIGIN_TYPE_STRINGS[self.origin_type])
@@ -171,7 +248,7 @@ class LinkageDescriptor(Descriptor):
             res += '\t\tNetwork ID = [0x%x]\n'%(self.network_id)
         if self.origin_type == 0:
             res += '\t\tInitial service ID = [0x%x]\n'%(self.initial_service_id)
-            
+        return res
     
     def __str__(self):
         res = 'LinkageDescriptor:\n'
@@ -203,7 +280,24 @@ class CountryAvailabilityDescriptor(Descriptor):
             self.countries.append(country)
             offset += 3
             loop_len -= 3 
+
+    def get_payload_size(self):
+        return 1 + 3 * len(self.countries)
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset] = int('01111111', 2)
+        if self.available: buffer[offset] |= int('10000000', 2)
+        offset += 1
+        for country in self.countries:
+            buffer[offset:offset + 3] = country
+            offset += 3
+        return offset
         
+    def to_dict(self):
+        res = super(CountryAvailabilityDescriptor, self).to_dict()
+        res.update({'available': self.available, 'countries': list(self.countries)})
+        return res
+
     def __str__(self):
         res = 'CountryAvailabilityDescriptor:\n'
         temp = 'NOT '
@@ -217,7 +311,7 @@ class MuxTransportListDescriptor(Descriptor):
     tag = 0x95
     def __init__(self, data):
         self.service_type = None
-        self.networks = {}
+        self.networks = OrderedDict()
         self.version = None
         self.behaviour = None
         self.duration = None
@@ -241,7 +335,37 @@ class MuxTransportListDescriptor(Descriptor):
                 self.networks[nid].append(ts_id)
                 offset += 2
                 tll -= 2
-                loop_len -= 3
+                loop_len -= 2
+
+    def get_payload_size(self):
+        size = 4
+        for nid in self.networks:
+            size += 3 + 2 * len(self.networks[nid])
+        return size
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset] = self.version
+        buffer[offset + 1] = self.behaviour
+        set_uint16(buffer, offset + 2, self.duration)
+        offset += 4
+        for nid in self.networks:
+            ts_ids = self.networks[nid]
+            set_uint16(buffer, offset, nid)
+            buffer[offset + 2] = 2 * len(ts_ids)
+            offset += 3
+            for ts_id in ts_ids:
+                set_uint16(buffer, offset, ts_id)
+                offset += 2
+        return offset
+
+    def to_dict(self):
+        res = super(MuxTransportListDescriptor, self).to_dict()
+        res.update({'version'  : self.version,
+                    'behaviour': self.behaviour,
+                    'duration' : self.duration,
+                    'networks' : [{'network_id': nid, 'transport_stream_ids': list(self.networks[nid])}
+                                  for nid in self.networks]})
+        return res
 
     def __str__(self):
         res = 'MuxTransportListDescriptor:\n'
@@ -268,7 +392,21 @@ class MuxSignatureDescriptor(Descriptor):
     def parse(self, data):
         super(MuxSignatureDescriptor, self).parse(data)
         self.version = data[2]
-        self.signature = data[3:]
+        self.signature = data[3:self.length]
+
+    def get_payload_size(self):
+        return 1 + len(self.signature)
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset] = self.version
+        end = offset + 1 + len(self.signature)
+        buffer[offset + 1:end] = bytearray(self.signature)
+        return end
+
+    def to_dict(self):
+        res = super(MuxSignatureDescriptor, self).to_dict()
+        res.update({'version': self.version, 'signature': to_hex(self.signature)})
+        return res
 
     def __str__(self):
         res = 'MuxSignatureDescriptor:\n'
@@ -282,7 +420,17 @@ class ServiceDescriptor(Descriptor):
         self.service_type = None
         self.service_provider_name = ''
         self.service_name = ''
+        self.raw_text = {}
         super(ServiceDescriptor, self).__init__(data)
+
+    def create(cls, service_type, service_name, service_provider_name=u''):
+        """Builds a service descriptor from its fields"""
+        provider = encode_text(service_provider_name)
+        name = encode_text(service_name)
+        data = bytearray([cls.tag, 3 + len(provider) + len(name), service_type, len(provider)]) + provider
+        return cls(data + chr(len(name)) + name)
+
+    create = classmethod(create)
     
     def parse(self, data):
         super(ServiceDescriptor, self).parse(data)
@@ -290,13 +438,34 @@ class ServiceDescriptor(Descriptor):
         service_provider_name_len = data[3]
         pn_offset = 4
         pn_data = data[pn_offset : pn_offset + service_provider_name_len]
-        self.service_provider_name = ''.join([chr(x) for x in pn_data])
+        self.service_provider_name = decode_text_field(self, 'service_provider_name', pn_data)
         
         service_name_len = data[pn_offset + service_provider_name_len]
         sn_offset = pn_offset + service_provider_name_len + 1
         sn_data = data[sn_offset : sn_offset + service_name_len]
-        self.service_name = ''.join([chr(x) for x in sn_data])
+        self.service_name = decode_text_field(self, 'service_name', sn_data)
+
+    def get_payload_size(self):
+        return (3 + len(encode_text_field(self, 'service_provider_name', self.service_provider_name)) +
+                len(encode_text_field(self, 'service_name', self.service_name)))
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset] = self.service_type
+        offset += 1
+        for name in ('service_provider_name', 'service_name'):
+            text = encode_text_field(self, name, getattr(self, name))
+            buffer[offset] = len(text)
+            buffer[offset + 1:offset + 1 + len(text)] = text
+            offset += 1 + len(text)
+        return offset
     
+    def to_dict(self):
+        res = super(ServiceDescriptor, self).to_dict()
+        res.update({'service_type'         : self.service_type,
+                    'service_name'         : self.service_name,
+                    'service_provider_name': self.service_provider_name})
+        return res
+
     def __str__(self):
         if self.service_type in SERVICE_TYPE_STRINGS:
             type = SERVICE_TYPE_STRINGS[self.service_type]
@@ -304,14 +473,146 @@ class ServiceDescriptor(Descriptor):
             type = '0x%x'%(self.service_type)
         res = 'ServiceDescriptor:\n'
         res += '\tservice type     = [%s]\n'%(type)
-        res += '\tservice name     = [%s]\n'%(self.service_name)
-        res += '\tservice provider = [%s]\n'%(self.service_provider_name)
+        res += '\tservice name     = [%s]\n'%(to_str(self.service_name))
+        res += '\tservice provider = [%s]\n'%(to_str(self.service_provider_name))
+        return res
+
+class ShortEventDescriptor(Descriptor):
+    tag = 0x4d
+    def __init__(self, data):
+        self.language = ''
+        self.event_name = ''
+        self.text = ''
+        self.raw_text = {}
+        super(ShortEventDescriptor, self).__init__(data)
+
+    def parse(self, data):
+        super(ShortEventDescriptor, self).parse(data)
+        self.language = ''.join([chr(x) for x in data[2:5]])
+        event_name_len = data[5]
+        en_data = data[6 : 6 + event_name_len]
+        self.event_name = decode_text_field(self, 'event_name', en_data)
+
+        text_len = data[6 + event_name_len]
+        t_offset = 7 + event_name_len
+        t_data = data[t_offset : t_offset + text_len]
+        self.text = decode_text_field(self, 'text', t_data)
+
+    def get_payload_size(self):
+        return (5 + len(encode_text_field(self, 'event_name', self.event_name)) +
+                len(encode_text_field(self, 'text', self.text)))
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset:offset + 3] = self.language
+        offset += 3
+        for name in ('event_name', 'text'):
+            text = encode_text_field(self, name, getattr(self, name))
+            buffer[offset] = len(text)
+            buffer[offset + 1:offset + 1 + len(text)] = text
+            offset += 1 + len(text)
+        return offset
+
+    def to_dict(self):
+        res = super(ShortEventDescriptor, self).to_dict()
+        res.update({'language': self.language, 'event_name': self.event_name, 'text': self.text})
+        return res
+
+    def __str__(self):
+        res = 'ShortEventDescriptor:\n'
+        res += '\tlanguage   = [%s]\n'%(self.language)
+        res += '\tevent name = [%s]\n'%(to_str(self.event_name))
+        res += '\ttext       = [%s]\n'%(to_str(self.text))
+        return res
+
+class LocalTimeOffset(object):
+    """A single entry of the local time offset descriptor loop
+
+    Offsets are in seconds and already carry the sign given by the polarity bit. The time of change
+    is in seconds since the unix epoch (UTC).
+    """
+    def __init__(self, data, offset):
+        self.country_code = ''.join([chr(x) for x in data[offset:offset+3]])
+        self.country_region_id = data[offset+3] >> 2
+        self.polarity = data[offset+3] & int('00000001', 2)
+        self.local_time_offset = decode_offset(data, offset+4)
+        self.time_of_change = decode_utc_time(data, offset+6)
+        self.next_time_offset = decode_offset(data, offset+11)
+        if self.polarity:
+            self.local_time_offset = -self.local_time_offset
+            self.next_time_offset = -self.next_time_offset
+
+    def serialize_into(self, buffer, offset):
+        """Writes the 13 byte entry into buffer at offset and returns the offset after it"""
+        if self.local_time_offset or self.next_time_offset:
+            self.polarity = int(self.local_time_offset < 0 or self.next_time_offset < 0)
+        buffer[offset:offset + 3] = self.country_code
+        buffer[offset + 3] = (self.country_region_id << 2) | int('00000010', 2) | self.polarity
+        encode_offset(self.local_time_offset, buffer, offset + 4)
+        encode_utc_time(self.time_of_change, buffer, offset + 6)
+        return encode_offset(self.next_time_offset, buffer, offset + 11)
+
+    def get_offset_at(self, utc_time):
+        """Returns the offset in seconds that applies at the given UTC time"""
+        if self.time_of_change is not None and utc_time >= self.time_of_change:
+            return self.next_time_offset
+        return self.local_time_offset
+
+    def to_dict(self):
+        return {'country_code'     : self.country_code,
+                'country_region_id': self.country_region_id,
+                'local_time_offset': self.local_time_offset,
+                'time_of_change'   : self.time_of_change,
+                'next_time_offset' : self.next_time_offset}
+
+class LocalTimeOffsetDescriptor(Descriptor):
+    tag = 0x58
+    def __init__(self, data):
+        self.offsets = []
+        super(LocalTimeOffsetDescriptor, self).__init__(data)
+
+    def parse(self, data):
+        super(LocalTimeOffsetDescriptor, self).parse(data)
+        loop_len = self.descriptor_length
+        offset = 2
+        while loop_len >= 13:
+            self.offsets.append(LocalTimeOffset(data, offset))
+            offset += 13
+            loop_len -= 13
+
+    def get_payload_size(self):
+        return 13 * len(self.offsets)
+
+    def serialize_payload_into(self, buffer, offset):
+        for entry in self.offsets:
+            offset = entry.serialize_into(buffer, offset)
+        return offset
+
+    def get_offset(self, country_code, region_id=0):
+        """Returns the LocalTimeOffset for the given country and region, or None if there is none"""
+        for entry in self.offsets:
+            if entry.country_code == country_code and entry.country_region_id == region_id:
+                return entry
+        return None
+
+    def to_dict(self):
+        res = super(LocalTimeOffsetDescriptor, self).to_dict()
+        res['offsets'] = [entry.to_dict() for entry in self.offsets]
+        return res
+
+    def __str__(self):
+        res = 'LocalTimeOffsetDescriptor:\n'
+        for entry in self.offsets:
+            res += '\tCountry [%s] region [%d] offset [%d] changes at [%s] to [%d]\n'%(entry.country_code,
+                                                                                    entry.country_region_id,
+                                                                                    entry.local_time_offset,
+                                                                                    str(entry.time_of_change),
+                                                                                    entry.next_time_offset)
         return res
 
 class ChannelListMappingDescriptor(Descriptor):
     tag = 0x93
     def __init__(self, data):
-        self.service_channel_map = {}
+        self.service_channel_map = OrderedDict()
         super(ChannelListMappingDescriptor, self).__init__(data)
     
     def parse(self, data):
@@ -324,7 +625,23 @@ class ChannelListMappingDescriptor(Descriptor):
             self.service_channel_map[service_id] = channel_number
             ln -= 4
             offset += 4
+
+    def get_payload_size(self):
+        return 4 * len(self.service_channel_map)
+
+    def serialize_payload_into(self, buffer, offset):
+        for service_id in self.service_channel_map:
+            set_uint16(buffer, offset, service_id)
+            set_uint16(buffer, offset + 2, self.service_channel_map[service_id])
+            offset += 4
+        return offset
     
+    def to_dict(self):
+        res = super(ChannelListMappingDescriptor, self).to_dict()
+        res['channels'] = [{'service_id': service_id, 'channel_number': self.service_channel_map[service_id]}
+                           for service_id in self.service_channel_map]
+        return res
+
     def __str__(self):
         res = 'ChannelListMappingDescriptor:\n'
         for service_id in self.service_channel_map:
@@ -346,7 +663,21 @@ class BouquetListDescriptor(Descriptor):
             self.bouquet_ids.append(bouquet_id)
             ln -= 2
             offset += 2
+
+    def get_payload_size(self):
+        return 2 * len(self.bouquet_ids)
+
+    def serialize_payload_into(self, buffer, offset):
+        for bouquet_id in self.bouquet_ids:
+            set_uint16(buffer, offset, bouquet_id)
+            offset += 2
+        return offset
     
+    def to_dict(self):
+        res = super(BouquetListDescriptor, self).to_dict()
+        res['bouquet_ids'] = list(self.bouquet_ids)
+        return res
+
     def __str__(self):
         res = 'BouquetListDescriptor:\n'
         res += '\tThis transport stream has %d bouquets\n'%(len(self.bouquet_ids))
@@ -371,6 +702,19 @@ class PrivateDataSpecifierDescriptor(Descriptor):
         self.private_data_specifier <<= 8
         self.private_data_specifier += data[5]
 
+    def get_payload_size(self):
+        return 4
+
+    def serialize_payload_into(self, buffer, offset):
+        set_uint16(buffer, offset, self.private_data_specifier >> 16)
+        set_uint16(buffer, offset + 2, self.private_data_specifier & 0xffff)
+        return offset + 4
+
+    def to_dict(self):
+        res = super(PrivateDataSpecifierDescriptor, self).to_dict()
+        res['private_data_specifier'] = self.private_data_specifier
+        return res
+
     def __str__(self):
         res = 'PrivateDataSpecifierDescriptor:\n'
         res += '\tprivate data descriptor [' + hex(self.private_data_specifier) + ']\n'
@@ -388,16 +732,40 @@ class NetworkNameDescriptor(Descriptor):
     tag = 0x40
     def __init__(self, data):
         self.network_name = ''
+        self.raw_text = {}
         super(NetworkNameDescriptor, self).__init__(data)
+
+    def create(cls, name):
+        """Builds a network (or bouquet) name descriptor from the name"""
+        name = encode_text(name)
+        return cls(bytearray([cls.tag, len(name)]) + name)
+
+    create = classmethod(create)
     
     def parse(self, data):
         super(NetworkNameDescriptor, self).parse(data)
         nndata = data[2:2+self.descriptor_length]
-        self.network_name = ''.join([chr(x) for x in nndata])
+        self.network_name = decode_text_field(self, 'name', nndata)
+
+    def _encode_name(self):
+        return encode_text_field(self, 'name', self.network_name)
+
+    def get_payload_size(self):
+        return len(self._encode_name())
+
+    def serialize_payload_into(self, buffer, offset):
+        text = self._encode_name()
+        buffer[offset:offset + len(text)] = text
+        return offset + len(text)
             
+    def to_dict(self):
+        res = super(NetworkNameDescriptor, self).to_dict()
+        res['network_name'] = self.network_name
+        return res
+
     def __str__(self):
         res = 'NetworkNameDescriptor:\n'
-        res += '\tnetwork name [' + self.network_name + ']\n'
+        res += '\tnetwork name [' + to_str(self.network_name) + ']\n'
         return res
     
 class BouquetNameDescriptor(NetworkNameDescriptor):
@@ -409,18 +777,35 @@ class BouquetNameDescriptor(NetworkNameDescriptor):
     def parse(self, data):
         super(BouquetNameDescriptor, self).parse(data)
         self.bouquet_name = self.network_name
+
+    def _encode_name(self):
+        return encode_text_field(self, 'name', self.bouquet_name)
             
+    def to_dict(self):
+        res = Descriptor.to_dict(self)
+        res['bouquet_name'] = self.bouquet_name
+        return res
+
     def __str__(self):
         res = 'BouquetNameDescriptor:\n'
-        res += '\tbouquet name [' + self.bouquet_name + ']\n'
+        res += '\tbouquet name [' + to_str(self.bouquet_name) + ']\n'
         return res
 
 class ServiceListDescriptor(Descriptor):
     tag = 0x41
     def __init__(self, data):
-        self.services = {}
+        self.services = OrderedDict()
         super(ServiceListDescriptor, self).__init__(data)
-    
+
+    def create(cls, services):
+        """Builds a service list descriptor from a list of (service ID, service type) pairs"""
+        data = bytearray([cls.tag, 3 * len(services)])
+        for service_id, service_type in services:
+            data += bytearray([service_id >> 8, service_id & 0xff, service_type])
+        return cls(data)
+
+    create = classmethod(create)
+
     def parse(self, data):
         super(ServiceListDescriptor, self).parse(data)
         ln = self.descriptor_length
@@ -431,7 +816,23 @@ class ServiceListDescriptor(Descriptor):
             self.services[service_id] = service_type
             ln -= 3
             offset += 3
+
+    def get_payload_size(self):
+        return 3 * len(self.services)
+
+    def serialize_payload_into(self, buffer, offset):
+        for service_id in self.services:
+            set_uint16(buffer, offset, service_id)
+            buffer[offset + 2] = self.services[service_id]
+            offset += 3
+        return offset
     
+    def to_dict(self):
+        res = super(ServiceListDescriptor, self).to_dict()
+        res['services'] = [{'service_id': service_id, 'service_type': self.services[service_id]}
+                           for service_id in self.services]
+        return res
+
     def __str__(self):
         res = 'ServiceListDescriptor:\n'
         for svc in self.services:
@@ -462,7 +863,33 @@ class SatelliteDeliverySystemDescriptor(Descriptor):
         self.symbol_rate  = bcd2int(data[9:9+4]) / 10
         self.symbol_rate = self.symbol_rate * 100
         self.fec = data[12] & int('00001111', 2)
+
+    def get_payload_size(self):
+        return 11
+
+    def serialize_payload_into(self, buffer, offset):
+        int2bcd(int(round(self.frequency * 100000)), buffer, offset, 4)
+        int2bcd(int(round(self.orbital_pos * 10)), buffer, offset + 4, 2)
+        flags = (self.polarization << 5) | (self.roll_off << 3) | (self.mod_system << 2) | self.mod_type
+        if self.east_flag: flags |= int('10000000', 2)
+        buffer[offset + 6] = flags
+        int2bcd(self.symbol_rate // 100 * 10, buffer, offset + 7, 4) # 7 digits, the last nibble is the FEC
+        buffer[offset + 10] |= self.fec
+        return offset + 11
         
+    def to_dict(self):
+        res = super(SatelliteDeliverySystemDescriptor, self).to_dict()
+        res.update({'frequency'   : self.frequency,
+                    'orbital_pos' : self.orbital_pos,
+                    'east_flag'   : self.east_flag,
+                    'polarization': self.polarization,
+                    'roll_off'    : self.roll_off,
+                    'mod_system'  : self.mod_system,
+                    'mod_type'    : self.mod_type,
+                    'symbol_rate' : self.symbol_rate,
+                    'fec'         : self.fec})
+        return res
+
     def __str__(self):
         res = 'SatelliteDeliverySystemDescriptor:\n'
         res += '\tfrequency      [' + str(self.frequency) + ']\n'
@@ -486,7 +913,8 @@ class SatelliteDeliverySystemDescriptor(Descriptor):
 class MultiLingualNetworkNameDescriptor(Descriptor):
     tag = 0x5b
     def __init__(self, data):
-        self.names = {}
+        self.names = OrderedDict()
+        self.raw_text = {}
         super(MultiLingualNetworkNameDescriptor, self).__init__(data)
     
     def parse(self, data):
@@ -496,16 +924,36 @@ class MultiLingualNetworkNameDescriptor(Descriptor):
         while ln > 0:
             language = ''.join([chr(x) for x in data[offset:offset+3]])
             network_name_length = data[offset + 3]
-            nn_data = data[6:6 + network_name_length]
-            network_name = ''.join([chr(x) for x in nn_data])
+            nn_data = data[offset + 4:offset + 4 + network_name_length]
+            network_name = decode_text_field(self, language, nn_data)
             self.names[language] = network_name
             ln -= (network_name_length + 4)
             offset += (network_name_length + 4)
+
+    def get_payload_size(self):
+        size = 0
+        for language in self.names:
+            size += 4 + len(encode_text_field(self, language, self.names[language]))
+        return size
+
+    def serialize_payload_into(self, buffer, offset):
+        for language in self.names:
+            text = encode_text_field(self, language, self.names[language])
+            buffer[offset:offset + 3] = language
+            buffer[offset + 3] = len(text)
+            buffer[offset + 4:offset + 4 + len(text)] = text
+            offset += 4 + len(text)
+        return offset
     
+    def to_dict(self):
+        res = super(MultiLingualNetworkNameDescriptor, self).to_dict()
+        res['names'] = [{'language': language, 'name': self.names[language]} for language in self.names]
+        return res
+
     def __str__(self):
         res = 'MultiLingualNetworkNameDescriptor:\n'
         for language in self.names:
-            res += '\tlanguage[' + language + '] -> name[' + self.names[language] + ']\n'
+            res += '\tlanguage[' + language + '] -> name[' + to_str(self.names[language]) + ']\n'
         return res
     
 DESC_TABLE = {NetworkNameDescriptor.tag                 :NetworkNameDescriptor,
@@ -518,9 +966,103 @@ DESC_TABLE = {NetworkNameDescriptor.tag                 :NetworkNameDescriptor,
               BouquetNameDescriptor.tag                 :BouquetNameDescriptor,
               ChannelListMappingDescriptor.tag          :ChannelListMappingDescriptor,
               ServiceDescriptor.tag                     :ServiceDescriptor,
+              ShortEventDescriptor.tag                  :ShortEventDescriptor,
+              LocalTimeOffsetDescriptor.tag             :LocalTimeOffsetDescriptor,
               MuxTransportListDescriptor.tag            :MuxTransportListDescriptor,
               MuxSignatureDescriptor.tag                :MuxSignatureDescriptor,
               CountryAvailabilityDescriptor.tag         :CountryAvailabilityDescriptor}
 
 for tag in DESC_TABLE:
-    descriptors.add_descriptor_class(DESC_TABLE[tag])
\ No newline at end of file
+    descriptors.add_descriptor_class(DESC_TABLE[tag])
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing dvbsi descriptors'
+    import unittest
+    import _known_tables
+    from mpeg2psi import _known_tables as psi_tables
+    from mpeg2psi.cat import Cat
+    from mpeg2psi.pmt import Pmt
+    from sdt import Sdt
+    from nit import Nit
+    from bat import Bat
+    from eit import Eit
+    from tot import Tot
+
+    def get_sample_descriptors():
+        '''every descriptor of every sample table'''
+        descs = []
+        for table in (Nit(_known_tables.SAMPLE_NIT_0), Nit(_known_tables.SAMPLE_NIT_1), Bat(_known_tables.SAMPLE_BAT)):
+            descs += table.descriptors
+            for ts in table.ts_loop: descs += ts.descriptors
+        for service in Sdt(_known_tables.SAMPLE_SDT).service_loop: descs += service.descriptors
+        for event in Eit(_known_tables.SAMPLE_EIT).event_loop: descs += event.descriptors
+        descs += Tot(_known_tables.SAMPLE_TOT).descriptors + Cat(psi_tables.SAMPLE_CAT).descriptors
+        pmt = Pmt(psi_tables.SAMPLE_PMT)
+        descs += pmt.descriptors
+        for es in pmt.es_loop: descs += es.descriptors
+        return descs
+
+    def get_fields(desc):
+        return dict([(name, value) for name, value in vars(desc).items() if name not in ('raw_data', 'raw_text')])
+
+    class RoundTrip(unittest.TestCase):
+        def testSampleDescriptors(self):
+            descs = get_sample_descriptors()
+            self.assertTrue(len(set([type(desc) for desc in descs])) > 10)
+            for desc in descs:
+                data = desc.to_bytes()
+                self.assertEqual(list(desc.raw_data), list(data), type(desc).__name__)
+                self.assertEqual(desc.get_size(), len(data))
+                copy = type(desc)(data)
+                self.assertEqual(list(data), list(copy.to_bytes()))
+
+        def testOtherDescriptors(self):
+            samples = [[0x4a, 0x0d, 0, 1, 0, 2, 0, 3, 0x08, 0x1e, 0, 4, 0, 5, 0xaa], # mobile hand-over, both IDs
+                       [0x4a, 0x08, 0, 1, 0, 2, 0, 3, 0x09, 0xaa],
+                       [0x95, 0x0b, 1, 2, 0xff, 0xff, 0x12, 0x34, 0x04, 0, 1, 0, 2],
+                       [0x96, 0x04, 3, 0xde, 0xad, 0xbe],
+                       [0x5b, 0x0c, 0x65, 0x6e, 0x67, 0x02, 0x41, 0x42, 0x66, 0x72, 0x61, 0x02, 0x43, 0x44],
+                       [0x58, 0x0d, 0x47, 0x42, 0x52, 0x06, 0x01, 0x00, 0xC0, 0x79, 0x12, 0x45, 0x00, 0x02, 0x00]]
+            classes = [LinkageDescriptor, LinkageDescriptor, MuxTransportListDescriptor, MuxSignatureDescriptor,
+                       MultiLingualNetworkNameDescriptor, LocalTimeOffsetDescriptor]
+            for DescriptorClass, data in zip(classes, samples):
+                desc = DescriptorClass(data)
+                self.assertEqual(data, list(desc.to_bytes()), DescriptorClass.__name__)
+            handover = LinkageDescriptor(samples[0])
+            self.assertEqual((1, 4, 5), (handover.hand_over_type, handover.network_id, handover.initial_service_id))
+            mux = MuxTransportListDescriptor(samples[2])
+            self.assertEqual([1, 2], mux.networks[0x1234])
+
+        def testToDict(self):
+            import json
+            for desc in get_sample_descriptors():
+                res = json.loads(json.dumps(desc.to_dict()))
+                self.assertEqual((type(desc).__name__, desc.descriptor_tag), (res['descriptor'], res['tag']))
+            handover = LinkageDescriptor([0x4a, 0x0d, 0, 1, 0, 2, 0, 3, 0x08, 0x1e, 0, 4, 0, 5, 0xaa]).to_dict()
+            self.assertEqual((4, 5, 'aa'), (handover['network_id'], handover['initial_service_id'],
+                                            handover['private_data']))
+            mux = MuxTransportListDescriptor([0x95, 0x0b, 1, 2, 0xff, 0xff, 0x12, 0x34, 0x04, 0, 1, 0, 2]).to_dict()
+            self.assertEqual([{'network_id': 0x1234, 'transport_stream_ids': [1, 2]}], mux['networks'])
+            self.assertEqual(u'Sky', BouquetNameDescriptor.create(u'Sky').to_dict()['bouquet_name'])
+
+        def testEdit(self):
+            sd = ServiceDescriptor([0x48, 0x0b, 0x01, 0x03, 0x53, 0x41, 0x42, 0x05, 0x53, 0x41, 0x42, 0x43, 0x31])
+            sd.service_name = u'SABC \u00e9'
+            data = sd.to_bytes()
+            self.assertEqual(list(bytearray('\x15SABC \xc3\xa9')), list(data[8:]))
+            copy = ServiceDescriptor(data)
+            self.assertEqual((u'SAB', u'SABC \u00e9'), (copy.service_provider_name, copy.service_name))
+            self.assertEqual(len(data) - 2, copy.descriptor_length)
+            built = ServiceDescriptor.create(0x01, u'SABC \u00e9', u'SAB')
+            self.assertEqual(list(data), list(built.to_bytes()))
+            self.assertEqual(u'Sky', BouquetNameDescriptor.create(u'Sky').bouquet_name)
+            sdd = get_sample_descriptors()
+            sdd = [desc for desc in sdd if type(desc) == SatelliteDeliverySystemDescriptor][0]
+            sdd.frequency, sdd.symbol_rate, sdd.fec = 11.72, 27500000, FEC_3_4
+            copy = SatelliteDeliverySystemDescriptor(sdd.to_bytes())
+            self.assertEqual((11.72, 27500000, FEC_3_4), (copy.frequency, copy.symbol_rate, copy.fec))
+            self.assertEqual(list(bytearray([0x01, 0x17, 0x20, 0x00])), list(sdd.to_bytes()[2:6]))
+
+    unittest.main()
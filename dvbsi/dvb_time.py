@@ -0,0 +1,165 @@
+"""DVB time module
+
+    Provides functions to decode the Modified Julian Date (MJD) and Binary Coded Decimal (BCD) time
+    fields used in DVB SI tables (EN 300 468 annex C), and to encode them again. Times are given and returned as
+    seconds since the unix epoch (UTC).
+"""
+
+MJD_UNIX_EPOCH = 40587 # MJD of 1970-01-01
+
+# value of every possible BCD byte, used instead of decoding the nibbles of each digit pair
+BCD_TABLE = tuple([((byte >> 4) * 10) + (byte & 0x0f) for byte in range(256)])
+# BCD byte of every value 0-99, the inverse of BCD_TABLE
+BCD_ENCODE_TABLE = tuple([((value // 10) << 4) | (value % 10) for value in range(100)])
+
+def mjd_to_date(mjd):
+    """Converts a Modified Julian Date to a calendar date
+
+    Uses the conversion given in EN 300 468 annex C.
+    Arguments:
+        mjd -- the 16 bit Modified Julian Date
+    Returns:
+        The date as a tuple (year, month, day)
+    """
+    yp = int((mjd - 15078.2) / 365.25)
+    mp = int((mjd - 14956.1 - int(yp * 365.25)) / 30.6001)
+    day = mjd - 14956 - int(yp * 365.25) - int(mp * 30.6001)
+    k = 0
+    if mp == 14 or mp == 15: k = 1
+    return 1900 + yp + k, mp - 1 - k * 12, day
+
+def decode_utc_time(data, offset=0):
+    """Decodes a 40 bit MJD + BCD UTC time field
+
+    The MJD maps directly onto days since the unix epoch so no calendar conversion is needed.
+    Arguments:
+        data   -- array of data bytes, 16 bit MJD followed by 6 BCD digits hhmmss
+        offset -- the byte offset of the field in data (default 0)
+    Returns:
+        The time in seconds since the unix epoch or None if the time is undefined (all bits set)
+    """
+    mjd = (data[offset] << 8) | data[offset + 1]
+    hours, minutes, seconds = data[offset + 2], data[offset + 3], data[offset + 4]
+    if mjd == 0xffff and hours == 0xff and minutes == 0xff and seconds == 0xff: return None
+    return ((mjd - MJD_UNIX_EPOCH) * 86400 + BCD_TABLE[hours] * 3600 + BCD_TABLE[minutes] * 60 +
+            BCD_TABLE[seconds])
+
+def decode_duration(data, offset=0):
+    """Decodes a 24 bit BCD hhmmss duration field
+
+    Arguments:
+        data   -- array of data bytes
+        offset -- the byte offset of the field in data (default 0)
+    Returns:
+        The duration in seconds or None if the duration is undefined (all bits set)
+    """
+    hours, minutes, seconds = data[offset], data[offset + 1], data[offset + 2]
+    if hours == 0xff and minutes == 0xff and seconds == 0xff: return None
+    return BCD_TABLE[hours] * 3600 + BCD_TABLE[minutes] * 60 + BCD_TABLE[seconds]
+
+def decode_offset(data, offset=0):
+    """Decodes a 16 bit BCD hhmm time offset field
+
+    Arguments:
+        data   -- array of data bytes
+        offset -- the byte offset of the field in data (default 0)
+    Returns:
+        The offset in seconds
+    """
+    return BCD_TABLE[data[offset]] * 3600 + BCD_TABLE[data[offset + 1]] * 60
+
+def encode_utc_time(utc_time, buffer, offset=0):
+    """Encodes a 40 bit MJD + BCD UTC time field, the inverse of decode_utc_time()
+
+    Arguments:
+        utc_time -- the time in seconds since the unix epoch, None for an undefined time
+        buffer   -- bytearray to write the 5 bytes into
+        offset   -- the byte offset of the field in buffer (default 0)
+    Returns:
+        The offset after the field
+    """
+    if utc_time is None:
+        buffer[offset:offset + 5] = '\xff\xff\xff\xff\xff'
+        return offset + 5
+    days, seconds = divmod(int(utc_time), 86400)
+    mjd = days + MJD_UNIX_EPOCH
+    buffer[offset] = (mjd >> 8) & 0xff
+    buffer[offset + 1] = mjd & 0xff
+    return encode_duration(seconds, buffer, offset + 2)
+
+def encode_duration(duration, buffer, offset=0):
+    """Encodes a 24 bit BCD hhmmss duration field, the inverse of decode_duration()
+
+    Arguments:
+        duration -- the duration in seconds (under 100 hours), None for an undefined duration
+        buffer   -- bytearray to write the 3 bytes into
+        offset   -- the byte offset of the field in buffer (default 0)
+    Returns:
+        The offset after the field
+    """
+    if duration is None:
+        buffer[offset:offset + 3] = '\xff\xff\xff'
+        return offset + 3
+    minutes, seconds = divmod(int(duration), 60)
+    hours, minutes = divmod(minutes, 60)
+    buffer[offset] = BCD_ENCODE_TABLE[hours]
+    buffer[offset + 1] = BCD_ENCODE_TABLE[minutes]
+    buffer[offset + 2] = BCD_ENCODE_TABLE[seconds]
+    return offset + 3
+
+def encode_offset(time_offset, buffer, offset=0):
+    """Encodes a 16 bit BCD hhmm time offset field, the inverse of decode_offset()
+
+    Arguments:
+        time_offset -- the offset in seconds, its sign is not encoded and seconds are dropped
+        buffer      -- bytearray to write the 2 bytes into
+        offset      -- the byte offset of the field in buffer (default 0)
+    Returns:
+        The offset after the field
+    """
+    hours, minutes = divmod(abs(int(time_offset)) // 60, 60)
+    buffer[offset] = BCD_ENCODE_TABLE[hours]
+    buffer[offset + 1] = BCD_ENCODE_TABLE[minutes]
+    return offset + 2
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing dvb_time'
+    import calendar
+    import unittest
+
+    class KnownTimes(unittest.TestCase):
+        def testAnnexCExample(self):
+            # 93/10/13 12:45:00 is coded as 0xC079124500
+            self.assertEqual((1993, 10, 13), mjd_to_date(0xC079))
+            self.assertEqual(calendar.timegm((1993, 10, 13, 12, 45, 0)), decode_utc_time([0xC0, 0x79, 0x12, 0x45, 0x00]))
+            self.assertEqual(None, decode_utc_time([0xff] * 5))
+
+        def testDuration(self):
+            self.assertEqual(3600 + 45 * 60 + 30, decode_duration([0x01, 0x45, 0x30]))
+            self.assertEqual(None, decode_duration([0xff] * 3))
+            self.assertEqual(5400, decode_duration([0x00, 0x01, 0x30, 0x00], 1))
+            self.assertEqual(2 * 3600 + 30 * 60, decode_offset([0x02, 0x30]))
+
+        def testEncode(self):
+            buffer = bytearray(10)
+            self.assertEqual(5, encode_utc_time(calendar.timegm((1993, 10, 13, 12, 45, 0)), buffer))
+            self.assertEqual([0xC0, 0x79, 0x12, 0x45, 0x00], list(buffer[0:5]))
+            self.assertEqual(8, encode_duration(3600 + 45 * 60 + 30, buffer, 5))
+            self.assertEqual([0x01, 0x45, 0x30], list(buffer[5:8]))
+            encode_offset(-(2 * 3600 + 30 * 60), buffer, 8)
+            self.assertEqual([0x02, 0x30], list(buffer[8:10]))
+            encode_utc_time(None, buffer)
+            encode_duration(None, buffer, 5)
+            self.assertEqual((None, None), (decode_utc_time(buffer), decode_duration(buffer, 5)))
+            for value in range(100):
+                self.assertEqual(value, BCD_TABLE[BCD_ENCODE_TABLE[value]])
+
+        def testBcdTable(self):
+            from descriptors import bcd2int
+            for byte in range(256):
+                self.assertEqual(bcd2int([byte]), BCD_TABLE[byte])
+
+    unittest.main()
@@ -0,0 +1,385 @@
+"""Event Information Table module
+
+    Provides a set of functions and an EIT section class to parse and encapsulate information about the
+    DVBSI Event Information Table (present/following and schedule).
+"""
+
+from mpeg2psi.section import Section
+from sdt import RUNNING_STATUS_STRINGS, RUNNING_STATUS_RUNNING
+from dvb_time import decode_utc_time, decode_duration, encode_utc_time, encode_duration
+import descriptors
+
+TABLE_ID_PF_ACTUAL       = 0x4E
+TABLE_ID_PF_OTHER        = 0x4F
+TABLE_ID_SCHEDULE_ACTUAL = 0x50 # to 0x5F
+TABLE_ID_SCHEDULE_OTHER  = 0x60 # to 0x6F
+TABLE_ID_LAST            = 0x6F
+
+def is_present_following(table_id):
+    """Returns True if the table ID is that of a present/following EIT"""
+    return table_id == TABLE_ID_PF_ACTUAL or table_id == TABLE_ID_PF_OTHER
+
+def is_schedule(table_id):
+    """Returns True if the table ID is that of a schedule EIT"""
+    return TABLE_ID_SCHEDULE_ACTUAL <= table_id <= TABLE_ID_LAST
+
+def get_transport_stream_id(data):
+    """Gets the transport stream ID from the given EIT section data
+
+    Parses the given array of section data bytes, from the beginning of the section, and returns the
+    transport stream ID of the service the events belong to.
+    """
+    return (data[8] << 8) + data[9]
+
+def get_original_network_id(data):
+    """Gets the original network ID from the given EIT section data
+
+    Parses the given array of section data bytes, from the beginning of the section, and returns the
+    original network ID of the service the events belong to.
+    """
+    return (data[10] << 8) + data[11]
+
+class EventItem(object):
+    """EIT event class
+
+    An EIT contains a list of events. Each holds the event ID, start time, duration, running status,
+    CA mode and event descriptors. This class can parse event data from an EIT and save the relevant
+    information as members.
+    """
+    def __init__(self):
+        """Constructor
+
+        This is just a basic constructor. The resulting object will be 'empty'. To gain useful
+        information, EventItem.parse() should be called.
+        """
+        self.event_id           = None
+        self.start_time         = None
+        self.duration           = None
+        self.running_status     = None
+        self.free_ca_mode       = False
+        self.descriptors_len    = None
+        self.descriptors        = []
+
+    def parse(self, data, offset=0):
+        """Parse the given data saving the event information
+
+        Parses the given data starting at the given offset to save the event information.
+        Once the parsing is complete the offset at which it was completed is returned. This
+        allows a loop to process a block of EIT event data.
+        Arguments:
+            data   -- array of data bytes to parse to build the event information
+            offset -- the byte offset at which to start the parsing (default 0)
+        Returns:
+            The byte offset at which this event data ends
+        """
+        ln = len(data) - offset
+        if ln < 12: #TODO - add exception here
+            return None
+        self.event_id   = (data[0+offset] << 8) + data[1+offset]
+        self.start_time = decode_utc_time(data, 2+offset)
+        self.duration   = decode_duration(data, 7+offset)
+        self.running_status = (data[10+offset] & int('11100000', 2)) >> 5
+        if data[10+offset] & int('00010000', 2):
+            self.free_ca_mode = True
+        self.descriptors_len = ((data[10+offset] & int('00001111', 2)) << 8) + data[11+offset]
+
+        if self.descriptors_len + 12 > ln: #TODO - add exception here
+            return None
+
+        desc_data = data[12+offset:self.descriptors_len + 12 + offset]
+        self.descriptors = descriptors.get_descriptors(desc_data)
+        self.length = self.descriptors_len + 12
+        return self.descriptors_len + 12 + offset
+
+    def create(cls, event_id, start_time, duration, event_descriptors=None, running_status=RUNNING_STATUS_RUNNING,
+               free_ca_mode=False):
+        """Builds an event for Eit.create()
+
+        Arguments:
+            event_id          -- the event ID
+            start_time        -- start in seconds since the epoch (UTC), None if it is not defined
+            duration          -- duration in seconds, None if it is not defined
+            event_descriptors -- a list of Descriptor objects, eg. a ShortEventDescriptor (default None)
+            running_status    -- the running status (default RUNNING_STATUS_RUNNING)
+            free_ca_mode      -- True if the event is scrambled (default False)
+        """
+        event = cls()
+        event.event_id = event_id
+        event.start_time = start_time
+        event.duration = duration
+        event.descriptors = list(event_descriptors or [])
+        event.running_status = running_status
+        event.free_ca_mode = free_ca_mode
+        return event
+
+    create = classmethod(create)
+
+    def get_size(self):
+        return 12 + descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_into(self, buffer, offset):
+        """Writes the event into buffer at offset and returns the offset after it"""
+        self.descriptors_len = descriptors.get_descriptors_size(self.descriptors)
+        self.length = self.descriptors_len + 12
+        buffer[offset]     = self.event_id >> 8
+        buffer[offset + 1] = self.event_id & 0xff
+        encode_utc_time(self.start_time, buffer, offset + 2)
+        encode_duration(self.duration, buffer, offset + 7)
+        flags = (self.running_status << 5) | (self.descriptors_len >> 8)
+        if self.free_ca_mode: flags |= 0x10
+        buffer[offset + 10] = flags
+        buffer[offset + 11] = self.descriptors_len & 0xff
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 12)
+
+    def get_short_event_descriptor(self):
+        """Returns the first ShortEventDescriptor of this event or None"""
+        for desc in self.descriptors:
+            if type(desc) == descriptors.ShortEventDescriptor:
+                return desc
+        return None
+
+    def get_name(self):
+        """Returns the name of the event from its short event descriptor, or None if it has none"""
+        desc = self.get_short_event_descriptor()
+        if desc is None: return None
+        return desc.event_name
+
+    def get_text(self):
+        """Returns the short description of the event from its short event descriptor, or None"""
+        desc = self.get_short_event_descriptor()
+        if desc is None: return None
+        return desc.text
+
+    def get_end_time(self):
+        """Returns the end time of the event in seconds since the epoch, or None if it is not known"""
+        if self.start_time is None or self.duration is None: return None
+        return self.start_time + self.duration
+
+    def to_dict(self):
+        return {'event_id'      : self.event_id,
+                'start_time'    : self.start_time,
+                'duration'      : self.duration,
+                'running_status': self.running_status,
+                'free_ca_mode'  : self.free_ca_mode,
+                'descriptors'   : [desc.to_dict() for desc in self.descriptors]}
+
+    def __str__(self):
+        res = '\tEvent Loop Item:\n'
+        res += '\t\tEvent ID      [0x%x]\n'%(self.event_id)
+        res += '\t\tStart time    [%s]\n'%(str(self.start_time))
+        res += '\t\tDuration      [%s]\n'%(str(self.duration))
+        res += '\t\tRunning status[%s]\n'%(RUNNING_STATUS_STRINGS.get(self.running_status, str(self.running_status)))
+        res += '\t\tFree CA mode  [%s]\n'%(str(self.free_ca_mode))
+        res += 'DESCRIPTORS for event 0x%x============================\n' % (self.event_id)
+        for desc in self.descriptors:
+            res += str(desc)
+        res += '==========================================DESCRIPTORS\n'
+        return res
+
+class Eit(Section):
+    """Event Information Table class
+
+    Inherits from Section and holds information specific to the Event Information Table
+    described as a part of DVB SI. One class covers the present/following and schedule tables
+    for both the actual and other transport streams.
+    """
+    TABLE_ID  = TABLE_ID_PF_ACTUAL
+    TABLE_IDS = range(TABLE_ID_PF_ACTUAL, TABLE_ID_LAST + 1)
+    PID = 0x12
+
+    def __init__(self, data=None):
+        """Constructor
+
+        If the given array is None then the EIT object will be created but incomplete. To build the information
+        Eit.parse() or Eit.add_data() should be called.
+        Arguments:
+            data -- array of data bytes to parse to build the section information (default None)
+        """
+        self.event_loop = []
+        self.service_id = None
+        super(Eit, self).__init__(data)
+
+    def create(cls, service_id, transport_stream_id, original_network_id, event_loop, table_id=TABLE_ID_PF_ACTUAL,
+               version=0, section_number=0, last_section_number=0, segment_last_section_number=None,
+               last_table_id=None):
+        """Builds an EIT section
+
+        Arguments:
+            service_id                  -- the service the events belong to
+            transport_stream_id         -- the transport stream ID of the service
+            original_network_id         -- the original network ID of the service
+            event_loop                  -- a list of EventItem objects, see EventItem.create()
+            table_id                    -- present/following or schedule, actual or other (default TABLE_ID_PF_ACTUAL)
+            version                     -- the version number (default 0)
+            section_number              -- the section number (default 0)
+            last_section_number         -- the last section number of the table (default 0)
+            segment_last_section_number -- None uses last_section_number (default None)
+            last_table_id               -- None uses table_id (default None)
+        Returns:
+            A complete Eit that can be serialised with Eit.to_bytes()
+        """
+        eit = cls()
+        eit.set_header(table_id, service_id, version, section_number, last_section_number)
+        if segment_last_section_number is None: segment_last_section_number = last_section_number
+        if last_table_id is None: last_table_id = table_id
+        eit.service_id = service_id
+        eit.transport_stream_id = transport_stream_id
+        eit.original_network_id = original_network_id
+        eit.segment_last_section_number = segment_last_section_number
+        eit.last_table_id = last_table_id
+        eit.event_loop = list(event_loop)
+        return eit
+
+    create = classmethod(create)
+
+    def _get_table_id_extension(self):
+        return self.service_id
+
+    def parse(self, data=None):
+        """Parses the given data to generate all the EIT information
+
+        Given an array of bytes that comprise an EIT section, this method will parse and record all the section information
+        in object members. Inherits from Section.parse. Will call the Section.parse() method and once complete will parse
+        the section table_data to get the EIT specific information.
+        Arguments:
+            data -- Array of data bytes that describe all or part of the EIT section (default None)
+        """
+        super(Eit, self).parse(data)
+        if self.complete:
+            self.service_id = self.table_id_extension
+            self.payload = self.table_body[5:]
+            data = self.payload
+            self.transport_stream_id         = (data[0] << 8) + data[1]
+            self.original_network_id         = (data[2] << 8) + data[3]
+            self.segment_last_section_number = data[4]
+            self.last_table_id               = data[5]
+            self._get_event_loop()
+            del(self.payload)
+
+    def _get_event_loop(self):
+        """Generates and saves a list of EventItem objects from the EIT
+
+        Private method used to parse the event loop data chunk generating EventItem objects for each event
+        in the loop.
+        """
+        data = self.payload[6:-4]
+        offset = 0
+        ln = len(data)
+        self.event_loop = []
+        while ln >= 12:
+            event = EventItem()
+            offset = event.parse(data, offset)
+            if offset == None: break
+            self.event_loop.append(event)
+            ln -= event.length
+
+    def get_body_size(self):
+        size = 6
+        for event in self.event_loop:
+            size += event.get_size()
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the transport stream and network IDs, the segment fields and the event loop into buffer at offset"""
+        buffer[offset]     = self.transport_stream_id >> 8
+        buffer[offset + 1] = self.transport_stream_id & 0xff
+        buffer[offset + 2] = self.original_network_id >> 8
+        buffer[offset + 3] = self.original_network_id & 0xff
+        buffer[offset + 4] = self.segment_last_section_number
+        buffer[offset + 5] = self.last_table_id
+        offset += 6
+        for event in self.event_loop:
+            offset = event.serialize_into(buffer, offset)
+        return offset
+
+    def get_triplet(self):
+        """Returns the DVB triplet (network ID, transport stream ID, service ID) of the service the events belong to"""
+        return self.original_network_id, self.transport_stream_id, self.service_id
+
+    def is_present_following(self):
+        return is_present_following(self.table_id)
+
+    def is_schedule(self):
+        return is_schedule(self.table_id)
+
+    def to_dict(self):
+        res = super(Eit, self).to_dict()
+        res.update({'service_id'                 : self.service_id,
+                    'transport_stream_id'        : getattr(self, 'transport_stream_id', None),
+                    'original_network_id'        : getattr(self, 'original_network_id', None),
+                    'segment_last_section_number': getattr(self, 'segment_last_section_number', None),
+                    'last_table_id'              : getattr(self, 'last_table_id', None),
+                    'event_loop'                 : [event.to_dict() for event in self.event_loop]})
+        return res
+
+    def __str__(self):
+        res = super(Eit, self).__str__()
+        resar = res.split('\n')
+        resar[0] = 'EIT:'
+        resar[6] = '\tService ID [0x%x] Transport stream ID [0x%x] Network ID [0x%x]\n'%(self.service_id,
+                                                                                    self.transport_stream_id,
+                                                                                    self.original_network_id)
+        res = '\n'.join(resar)
+        res += ' Event Loop:\n'
+        for event in self.event_loop:
+            res += str(event)
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing Eit class'
+    import calendar
+    import unittest
+    import _known_tables
+    sample_eit = _known_tables.get_sample_eit_data()[0]
+
+    def testEitSection(test_case, section):
+        test_case.assertEqual(0x50, section.table_id, 'incorrect table id')
+        test_case.assertEqual(True, section.section_syntax_indicator, 'incorrect section syntax indicator')
+        test_case.assertEqual(94, section.section_length, 'incorrect section length')
+        test_case.assertEqual(0x654, section.service_id, 'incorrect service id')
+        test_case.assertEqual(3, section.version, 'incorrect version')
+        test_case.assertEqual(8, section.last_section_number, 'incorrect last section number')
+        test_case.assertEqual((0x1800, 0x10, 0x654), section.get_triplet(), 'incorrect triplet')
+        test_case.assertEqual(0x50, section.last_table_id, 'incorrect last table id')
+        test_case.assertEqual(True, section.is_schedule())
+        test_case.assertEqual(2, len(section.event_loop), 'incorrect event count')
+        event = section.event_loop[1]
+        test_case.assertEqual(0x1002, event.event_id, 'incorrect event id')
+        test_case.assertEqual(calendar.timegm((2016, 3, 14, 18, 30, 0)), event.start_time, 'incorrect start time')
+        test_case.assertEqual(3600, event.duration, 'incorrect duration')
+        test_case.assertEqual('Movie', event.get_name(), 'incorrect event name')
+        test_case.assertEqual('A film about DVB', event.get_text(), 'incorrect event text')
+        test_case.assertEqual(4, section.event_loop[0].running_status, 'incorrect running status')
+        test_case.assertEqual(0x67454993, section.crc, 'bad crc')
+
+    class KnownSections(unittest.TestCase):
+        known_sections = {testEitSection:sample_eit}
+
+        def testKnownSections(self):
+            for function in self.known_sections:
+                data = self.known_sections[function]
+                eit = Eit(data)
+                function(self, eit)
+                print eit
+
+        def testToBytes(self):
+            eit = Eit(sample_eit)
+            self.assertEqual(sample_eit, list(eit.to_bytes()))
+            event = eit.event_loop[1]
+            event.get_short_event_descriptor().event_name = u'Film'
+            event.duration += 1800
+            eit.version += 1
+            edited = Eit(list(eit.to_bytes()))
+            self.assertEqual((u'Film', 5400, 4), (edited.event_loop[1].get_name(), edited.event_loop[1].duration,
+                                                  edited.version))
+            self.assertEqual(len(sample_eit) - 1, edited.length)
+            built = Eit.create(0x654, 0x10, 0x1800, eit.event_loop, TABLE_ID_SCHEDULE_ACTUAL, eit.version, 0, 8, 0)
+            self.assertEqual(list(eit.to_bytes()), list(built.to_bytes()))
+            empty = Eit(list(Eit.create(1, 2, 3, [EventItem.create(7, None, None)]).to_bytes()))
+            self.assertEqual((7, None, None), (empty.event_loop[0].event_id, empty.event_loop[0].start_time,
+                                               empty.event_loop[0].duration))
+
+    unittest.main()
@@ -0,0 +1,454 @@
+"""Electronic Programme Guide store module
+
+    Provides an EpgStore class that ingests EIT sections as they are acquired and keeps an index of
+    events per service ordered by start time.
+
+    A week of schedule for a few thousand services is millions of events, so events are not kept as
+    parsed EventItem objects. Each service holds its events in flat arrays (start time, duration,
+    event ID, running status and interned name/text IDs) and the event names and texts are interned
+    in a reference counted StringTable. Events older than a configurable horizon are evicted so the
+    memory used by a long running probe stays flat.
+"""
+
+import array
+import bisect
+import time
+from mpeg2psi.section import get_table_id, get_table_id_extension, get_version_number, get_section_number
+from eit import get_transport_stream_id, get_original_network_id
+
+NO_STRING = 0 # string ID used for a missing name or text
+MAX_TIME  = 0xffffffff # the start times are unsigned 32 bit, from the epoch to 2106
+
+class StringTable(object):
+    """Reference counted string interning table
+
+    Maps strings to small integer IDs so every event only costs an array slot per string. IDs of
+    strings that are no longer referenced are reused.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.strings = [None]
+        self.refs = array.array('I', [0])
+        self.free = []
+
+    def intern(self, string):
+        """Returns the ID of the given string, adding a reference to it"""
+        if string is None: return NO_STRING
+        sid = self.ids.get(string)
+        if sid is None:
+            if self.free:
+                sid = self.free.pop()
+                self.strings[sid] = string
+                self.refs[sid] = 0
+            else:
+                sid = len(self.strings)
+                self.strings.append(string)
+                self.refs.append(0)
+            self.ids[string] = sid
+        self.refs[sid] += 1
+        return sid
+
+    def release(self, sid):
+        """Drops a reference to the string with the given ID"""
+        if sid == NO_STRING: return
+        self.refs[sid] -= 1
+        if self.refs[sid] == 0:
+            del self.ids[self.strings[sid]]
+            self.strings[sid] = None
+            self.free.append(sid)
+
+    def get(self, sid):
+        return self.strings[sid]
+
+    def __len__(self):
+        return len(self.ids)
+
+class EpgEvent(object):
+    """A single event read back out of the EpgStore
+
+    Built on demand by queries. Offers the same accessors as dvbsi.eit.EventItem.
+    """
+    __slots__ = ('event_id', 'start_time', 'duration', 'running_status', 'name', 'text')
+
+    def __init__(self, event_id, start_time, duration, running_status, name, text):
+        self.event_id       = event_id
+        self.start_time     = start_time
+        self.duration       = duration
+        self.running_status = running_status
+        self.name           = name
+        self.text           = text
+
+    def get_name(self):
+        return self.name
+
+    def get_text(self):
+        return self.text
+
+    def get_end_time(self):
+        return self.start_time + self.duration
+
+    def __str__(self):
+        res = '\tEvent [0x%x] start[%d] duration[%d] name[%s]\n'%(self.event_id, self.start_time,
+                                                                 self.duration, self.name)
+        return res
+
+class ServiceSchedule(object):
+    """Events of a single service stored as columns ordered by start time
+
+    Keeps parallel arrays so that time range queries are a binary search on the start times and
+    each stored event costs a few bytes. The sections column counts the EIT sections that carry each
+    event (eg. present/following and schedule), the event is removed once none of them do.
+    """
+    def __init__(self, service_index, strings):
+        self.service_index  = service_index
+        self.strings        = strings
+        self.starts         = array.array('I')
+        self.durations      = array.array('I')
+        self.event_ids      = array.array('H')
+        self.running_status = array.array('B')
+        self.name_ids       = array.array('I')
+        self.text_ids       = array.array('I')
+        self.sections       = array.array('B')
+        self.event_starts   = {} # event ID -> start time, to find an event with a binary search
+
+    def _columns(self):
+        return (self.starts, self.durations, self.event_ids, self.running_status, self.name_ids, self.text_ids,
+                self.sections)
+
+    def _find(self, event_id):
+        """Returns the index of the event with the given ID, -1 if it is not stored"""
+        start = self.event_starts.get(event_id)
+        if start is None: return -1
+        index = bisect.bisect_left(self.starts, start)
+        while self.event_ids[index] != event_id:
+            index += 1
+        return index
+
+    def _remove(self, index):
+        self.strings.release(self.name_ids[index])
+        self.strings.release(self.text_ids[index])
+        del self.event_starts[self.event_ids[index]]
+        for column in self._columns():
+            del column[index]
+
+    def add_event(self, event, new_section=True):
+        """Adds or replaces (by event ID) the given EventItem
+
+        Arguments:
+            event       -- dvbsi.eit.EventItem
+            new_section -- False if the section carrying the event carried it before, ie. a new version of
+                           the section, so the count of sections carrying a stored event stays the same
+                           (default True)
+        Returns:
+            True if the event is stored. An event without a start time, or one before the epoch or past
+            MAX_TIME (eg. from a corrupt date), is not added and a copy stored before is kept
+        """
+        if event.start_time is None or not 0 <= event.start_time <= MAX_TIME:
+            index = self._find(event.event_id)
+            if index < 0: return False
+            if new_section: self.sections[index] = min(self.sections[index] + 1, 0xff)
+            return True
+        sections = 1
+        index = self._find(event.event_id)
+        if index >= 0:
+            sections = self.sections[index]
+            if new_section: sections += 1
+            self._remove(index)
+        duration = event.duration
+        if duration is None: duration = 0
+        index = bisect.bisect_right(self.starts, event.start_time)
+        self.starts.insert(index, event.start_time)
+        self.durations.insert(index, duration)
+        self.event_ids.insert(index, event.event_id)
+        self.running_status.insert(index, event.running_status)
+        self.name_ids.insert(index, self.strings.intern(event.get_name()))
+        self.text_ids.insert(index, self.strings.intern(event.get_text()))
+        self.sections.insert(index, min(sections, 0xff))
+        self.event_starts[event.event_id] = event.start_time
+        return True
+
+    def release_event(self, event_id):
+        """Drops a section carrying the event with the given ID, removing it if no section does any more"""
+        index = self._find(event_id)
+        if index < 0: return
+        if self.sections[index] > 1:
+            self.sections[index] -= 1
+        else:
+            self._remove(index)
+
+    def _get_event(self, index):
+        return EpgEvent(self.event_ids[index], self.starts[index], self.durations[index],
+                        self.running_status[index], self.strings.get(self.name_ids[index]),
+                        self.strings.get(self.text_ids[index]))
+
+    def get_events(self, start, end):
+        """Returns the events that overlap the time range [start, end)"""
+        first = bisect.bisect_right(self.starts, start) - 1
+        if first < 0: first = 0
+        last = bisect.bisect_left(self.starts, end)
+        events = []
+        for index in xrange(first, last):
+            if self.starts[index] + self.durations[index] <= start: continue
+            events.append(self._get_event(index))
+        return events
+
+    def evict(self, cutoff):
+        """Removes every event that ended at or before the cutoff time. Returns the number removed"""
+        count = bisect.bisect_left(self.starts, cutoff)
+        # events are sorted by start so only the last candidate can still be running at the cutoff
+        if count > 0 and self.starts[count - 1] + self.durations[count - 1] > cutoff: count -= 1
+        if count == 0: return 0
+        for index in xrange(count):
+            self.strings.release(self.name_ids[index])
+            self.strings.release(self.text_ids[index])
+            del self.event_starts[self.event_ids[index]]
+        for column in self._columns():
+            del column[:count]
+        return count
+
+    def __len__(self):
+        return len(self.starts)
+
+class EpgStore(object):
+    """EPG store class
+
+    Ingests EIT sections incrementally. A section is only parsed and stored once per
+    (service triplet, table ID, version, section number); EpgStore.need_section() answers that
+    from the section header alone so a SectionBuilder can skip assembling repeats. A new version of a
+    section replaces the events it carried, so events it no longer carries (cancelled or moved to
+    another section) are removed. Events are indexed by service triplet and start time.
+    """
+    def __init__(self, horizon=None, clock=time.time, evict_interval=60):
+        """Constructor
+
+        Arguments:
+            horizon        -- events that ended more than this many seconds before the clock time are
+                              evicted. None keeps every event (default None)
+            clock          -- function returning the current time in seconds since the epoch. For
+                              recordings pass a function returning the stream time (default time.time)
+            evict_interval -- minimum number of clock seconds between automatic evictions (default 60)
+        """
+        self.horizon = horizon
+        self.clock = clock
+        self.evict_interval = evict_interval
+        self.last_eviction = None
+        self.section_versions = {}
+        self.section_events = {} # section key -> array of the IDs of the events the section carries
+        self.service_indexes = {}
+        self.triplets = []
+        self.schedules = []
+        self.strings = StringTable()
+
+    def _section_key(self, triplet, table_id, section_number):
+        return triplet, table_id, section_number
+
+    def _get_schedule(self, triplet):
+        service_index = self.service_indexes.get(triplet)
+        if service_index is None:
+            service_index = len(self.schedules)
+            self.service_indexes[triplet] = service_index
+            self.triplets.append(triplet)
+            self.schedules.append(ServiceSchedule(service_index, self.strings))
+        return self.schedules[service_index]
+
+    def need_section(self, data):
+        """Checks whether the EIT section starting with the given data is new to the store
+
+        Only the section header (the first 12 bytes) is needed.
+        Arguments:
+            data -- array of section data bytes from the beginning of the section
+        Returns:
+            True if the section has not been stored yet, or has a different version to the one that was
+        """
+        if len(data) < 12: return True # header split across packets, decide once it is complete
+        triplet = (get_original_network_id(data), get_transport_stream_id(data), get_table_id_extension(data))
+        key = self._section_key(triplet, get_table_id(data), get_section_number(data))
+        return self.section_versions.get(key) != get_version_number(data)
+
+    def add_section(self, eit):
+        """Adds the events of the given complete Eit section to the store
+
+        Arguments:
+            eit -- dvbsi.Eit object
+        """
+        triplet = eit.get_triplet()
+        key = self._section_key(triplet, eit.table_id, eit.section_number)
+        if self.section_versions.get(key) == eit.version: return
+        schedule = self._get_schedule(triplet)
+        previous = frozenset(self.section_events.get(key, ()))
+        event_ids = array.array('H')
+        for event in eit.event_loop:
+            if schedule.add_event(event, event.event_id not in previous): event_ids.append(event.event_id)
+        self.section_events[key] = event_ids
+        for event_id in previous.difference(event_ids):
+            schedule.release_event(event_id)
+        self.section_versions[key] = eit.version # only once it is stored, so a failed section is retried
+        if self.horizon is not None:
+            now = self.clock()
+            if self.last_eviction is None or now - self.last_eviction >= self.evict_interval:
+                self.evict(now)
+
+    def evict(self, now=None):
+        """Removes events that ended more than the horizon before the given time
+
+        Arguments:
+            now -- time in seconds since the epoch (default None, in which case the clock is used)
+        Returns:
+            The number of events removed
+        """
+        if self.horizon is None: return 0
+        if now is None: now = self.clock()
+        self.last_eviction = now
+        cutoff = now - self.horizon
+        count = 0
+        for schedule in self.schedules:
+            count += schedule.evict(cutoff)
+        return count
+
+    def get_events(self, triplet, start, end):
+        """Get the events on the given service between two times
+
+        Arguments:
+            triplet -- DVB triplet (network ID, transport stream ID, service ID) of the service
+            start   -- start of the time range in seconds since the epoch
+            end     -- end of the time range in seconds since the epoch
+        Returns:
+            A list of EpgEvent objects, ordered by start time, that overlap the range
+        """
+        service_index = self.service_indexes.get(triplet)
+        if service_index is None: return []
+        return self.schedules[service_index].get_events(start, end)
+
+    def get_event_at(self, triplet, time):
+        """Returns the EpgEvent running on the given service at the given time or None"""
+        events = self.get_events(triplet, time, time + 1)
+        if len(events) == 0: return None
+        return events[0]
+
+    def get_event_count(self):
+        count = 0
+        for schedule in self.schedules:
+            count += len(schedule)
+        return count
+
+    def __str__(self):
+        res = 'EPG store:\n'
+        for schedule in self.schedules:
+            triplet = self.triplets[schedule.service_index]
+            res += '\tservice dvb://%x.%x.%x has %d events\n'%(triplet[0], triplet[1], triplet[2], len(schedule))
+        res += '\t%d interned strings\n'%(len(self.strings))
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing EpgStore class'
+    import calendar
+    import unittest
+    import _known_tables
+    from eit import Eit, EventItem
+    sample_eit = _known_tables.get_sample_eit_data()[0]
+
+    class FakeEit(object):
+        def __init__(self, triplet, version, events, table_id=0x50, section_number=None):
+            self.triplet = triplet
+            self.table_id = table_id
+            self.version = version
+            self.section_number = section_number
+            if section_number is None: self.section_number = events[0].event_id & 0xff
+            self.event_loop = events
+
+        def get_triplet(self):
+            return self.triplet
+
+    def make_event(event_id, start, duration, name):
+        event = EventItem()
+        event.event_id, event.start_time, event.duration, event.running_status = event_id, start, duration, 1
+        event.get_name = lambda: name
+        event.get_text = lambda: None
+        return event
+
+    class KnownSections(unittest.TestCase):
+        def testIngest(self):
+            store = EpgStore()
+            self.assertEqual(True, store.need_section(sample_eit))
+            store.add_section(Eit(sample_eit))
+            self.assertEqual(False, store.need_section(sample_eit))
+            store.add_section(Eit(sample_eit))
+            self.assertEqual(2, store.get_event_count())
+            self.assertEqual(4, len(store.strings))
+            newer = list(sample_eit)
+            newer[5] = (newer[5] & 0xc1) | (4 << 1)
+            self.assertEqual(True, store.need_section(newer))
+
+        def testRangeQuery(self):
+            store = EpgStore()
+            store.add_section(Eit(sample_eit))
+            triplet = (0x1800, 0x10, 0x654)
+            t = calendar.timegm((2016, 3, 14, 18, 0, 0))
+            self.assertEqual([0x1001, 0x1002], [e.event_id for e in store.get_events(triplet, t, t + 3600)])
+            self.assertEqual([0x1002], [e.event_id for e in store.get_events(triplet, t + 1800, t + 7200)])
+            self.assertEqual([0x1001], [e.event_id for e in store.get_events(triplet, t + 60, t + 120)])
+            self.assertEqual([], store.get_events(triplet, t + 5400, t + 7200))
+            self.assertEqual([], store.get_events((1, 2, 3), t, t + 3600))
+            self.assertEqual('Movie', store.get_event_at(triplet, t + 1800).get_name())
+            self.assertEqual('A film about DVB', store.get_event_at(triplet, t + 1800).get_text())
+
+        def testReplaceAndEvict(self):
+            now = [1000000]
+            store = EpgStore(horizon=3600, clock=lambda: now[0], evict_interval=0)
+            triplet = (1, 2, 3)
+            events = [make_event(i, 1000000 + i * 1800, 1800, 'show %d'%(i % 3)) for i in range(48)]
+            for i in range(0, 48, 4):
+                store.add_section(FakeEit(triplet, 0, events[i:i + 4]))
+            self.assertEqual(48, store.get_event_count())
+            self.assertEqual(3, len(store.strings))
+            store.add_section(FakeEit(triplet, 1, [make_event(0, 1000000, 900, 'replaced')]))
+            self.assertEqual(45, store.get_event_count()) # events 1 to 3 are no longer in section 0
+            self.assertEqual('replaced', store.get_event_at(triplet, 1000000).get_name())
+            self.assertEqual(None, store.get_event_at(triplet, 1000000 + 1800))
+            self.assertEqual(4, len(store.strings))
+            # a day later everything that ended over an hour ago is gone
+            self.assertEqual(43, store.evict(1000000 + 24 * 3600))
+            self.assertEqual(2, store.get_event_count())
+            self.assertEqual(None, store.get_event_at(triplet, 1000000))
+            self.assertEqual(2, len(store.strings))
+            self.assertEqual([46, 47], [e.event_id for e in store.get_events(triplet, 0, 2000000)])
+            store.add_section(FakeEit(triplet, 1, events[44:48]))
+            self.assertEqual([44, 45, 46, 47], [e.event_id for e in store.get_events(triplet, 0, 2000000)])
+
+        def testBadStartTime(self):
+            store = EpgStore()
+            triplet = (1, 2, 3)
+            events = [make_event(i, 1000000 + i * 1800, 1800, 'show %d'%(i)) for i in range(3)]
+            store.add_section(FakeEit(triplet, 0, events))
+            corrupt = [make_event(0, -86400, 60, 'corrupt'), make_event(1, MAX_TIME + 1, 60, 'corrupt'),
+                       make_event(5, -1, 60, 'corrupt')]
+            store.add_section(FakeEit(triplet, 1, corrupt + events[2:], section_number=0))
+            self.assertEqual([0, 1, 2], [e.event_id for e in store.get_events(triplet, 0, 2000000)])
+            self.assertEqual('show 0', store.get_event_at(triplet, 1000000).get_name())
+            self.assertEqual(1, store.section_versions[(triplet, 0x50, 0)])
+            broken = make_event(9, 1000000, 60, 'broken')
+            broken.get_name = lambda: bytearray([0xff]).decode('utf-8') # eg. text that fails to decode
+            self.assertRaises(UnicodeDecodeError, store.add_section, FakeEit(triplet, 2, [broken], section_number=0))
+            self.assertEqual(1, store.section_versions[(triplet, 0x50, 0)]) # not recorded, the section is retried
+
+        def testSharedEvents(self):
+            store = EpgStore()
+            triplet = (1, 2, 3)
+            events = [make_event(i, 1000000 + i * 1800, 1800, 'show %d'%(i)) for i in range(4)]
+            store.add_section(FakeEit(triplet, 0, events[0:2], table_id=0x4e, section_number=0))
+            store.add_section(FakeEit(triplet, 0, events, table_id=0x50, section_number=0))
+            self.assertEqual(4, store.get_event_count())
+            # present/following moves on, the schedule still carries the finished event
+            store.add_section(FakeEit(triplet, 1, events[1:3], table_id=0x4e, section_number=0))
+            self.assertEqual(4, store.get_event_count())
+            store.add_section(FakeEit(triplet, 1, events[1:], table_id=0x50, section_number=0))
+            self.assertEqual([1, 2, 3], [e.event_id for e in store.get_events(triplet, 0, 2000000)])
+            self.assertEqual(3, len(store.strings))
+            store.add_section(FakeEit(triplet, 2, events[3:], table_id=0x4e, section_number=0))
+            store.add_section(FakeEit(triplet, 2, [], table_id=0x50, section_number=0))
+            self.assertEqual([3], [e.event_id for e in store.get_events(triplet, 0, 2000000)])
+
+    unittest.main()
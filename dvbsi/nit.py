@@ -4,7 +4,7 @@
     Network Information Table.
 """
 
-from bat_nit_base import BatNitBase
+from bat_nit_base import BatNitBase, TsItem
 
 class Nit(BatNitBase):
     """Network Information Table class
@@ -13,7 +13,20 @@ class Nit(BatNitBase):
     described as a part of DVB SI
     """
     TABLE_ID = 0x40
-    
+
+    def create(cls, network_id, network_descriptors, ts_loop, version=0, section_number=0, last_section_number=0,
+               table_id=None):
+        """Builds a NIT section, see BatNitBase.create()"""
+        nit = super(Nit, cls).create(network_id, network_descriptors, ts_loop, version, section_number,
+                                     last_section_number, table_id)
+        nit.network_id = network_id
+        return nit
+
+    create = classmethod(create)
+
+    def _get_table_id_extension(self):
+        return self.network_id
+
     def parse(self, data=None):
         """Parses the given data to generate all the NIT information
         
@@ -44,6 +57,11 @@ class Nit(BatNitBase):
                 return ts.get_satellite_delivery_descriptor()
         return None
 
+    def to_dict(self):
+        res = super(Nit, self).to_dict()
+        res['network_id'] = self.table_id_extension
+        return res
+
     def __str__(self):
         res = super(Nit, self).__str__()
         resar = res.split('\n')
@@ -112,6 +130,20 @@ if __name__ == '__main__':
                 print nit
                 print svl
             print svl
+
+        def testToBytes(self):
+            nit = Nit(sample_nit_0)
+            self.assertEqual(bytearray(sample_nit_0), nit.to_bytes())
+            nit.network_id = 0x1801
+            ts_loop = [TsItem.create(7, 0x1801, nit.ts_loop[0].descriptors)]
+            parsed = Nit(list(Nit.create(0x1801, nit.descriptors, ts_loop, version=4).to_bytes()))
+            self.assertEqual(0x1801, parsed.network_id)
+            self.assertEqual([7], parsed.get_ts_list())
+            self.assertEqual(4, parsed.version)
+            self.assertEqual(nit.ts_loop[0].get_satellite_delivery_descriptor().frequency,
+                             parsed.get_satellite_delivery_descriptor(7).frequency)
+            self.assertEqual([desc.to_bytes() for desc in nit.descriptors],
+                             [desc.to_bytes() for desc in parsed.descriptors])
             
     unittest.main()
 
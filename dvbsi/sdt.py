@@ -74,6 +74,39 @@ class ServiceDescription(object):
         self.descriptors = descriptors.get_descriptors(desc_data)
         self.length = self.descriptors_len + 5
         return self.descriptors_len + 5 + offset
+
+    def create(cls, service_id, service_descriptors, running_status=RUNNING_STATUS_RUNNING, free_ca_mode=False,
+               eit_schedule_flag=False, eit_present_following_flag=False):
+        """Builds a service description for Sdt.create()"""
+        sd = cls()
+        sd.service_id = service_id
+        sd.descriptors = list(service_descriptors)
+        sd.running_status = running_status
+        sd.free_ca_mode = free_ca_mode
+        sd.eit_schedule_flag = eit_schedule_flag
+        sd.eit_present_following_flag = eit_present_following_flag
+        return sd
+
+    create = classmethod(create)
+
+    def get_size(self):
+        return 5 + descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_into(self, buffer, offset):
+        """Writes the service description into buffer at offset and returns the offset after it"""
+        self.descriptors_len = descriptors.get_descriptors_size(self.descriptors)
+        self.length = self.descriptors_len + 5
+        flags = 0xfc
+        if self.eit_schedule_flag: flags |= 0x02
+        if self.eit_present_following_flag: flags |= 0x01
+        buffer[offset]     = self.service_id >> 8
+        buffer[offset + 1] = self.service_id & 0xff
+        buffer[offset + 2] = flags
+        flags = (self.running_status << 5) | (self.descriptors_len >> 8)
+        if self.free_ca_mode: flags |= 0x10
+        buffer[offset + 3] = flags
+        buffer[offset + 4] = self.descriptors_len & 0xff
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 5)
     
     def get_service_name(self):
         """Returns the name of the service if it exists in the descriptors
@@ -102,6 +135,14 @@ class ServiceDescription(object):
         return None
                 
     
+    def to_dict(self):
+        return {'service_id'                : self.service_id,
+                'eit_schedule_flag'         : self.eit_schedule_flag,
+                'eit_present_following_flag': self.eit_present_following_flag,
+                'running_status'            : self.running_status,
+                'free_ca_mode'              : self.free_ca_mode,
+                'descriptors'               : [desc.to_dict() for desc in self.descriptors]}
+
     def __str__(self):
         res = '\tService Loop Item:\n'
         res += '\t\tService ID    [0x%x]\n'%(self.service_id)
@@ -137,8 +178,35 @@ class Sdt(Section):
             data -- array of data bytes to parse to build the section information (default None)
         """
         self.service_loop = []
+        self.transport_stream_id = None
+        self.original_network_id = None
         super(Sdt, self).__init__(data)
 
+    def create(cls, transport_stream_id, original_network_id, service_loop, version=0, section_number=0,
+               last_section_number=0, table_id=None):
+        """Builds an SDT section
+
+        Arguments:
+            transport_stream_id -- the transport stream ID
+            original_network_id -- the original network ID
+            service_loop        -- a list of ServiceDescription objects, see ServiceDescription.create()
+            version             -- the version number (default 0)
+            section_number      -- the section number (default 0)
+            last_section_number -- the last section number of the table (default 0)
+            table_id            -- None for the actual TS (0x42), 0x46 for an other TS SDT (default None)
+        Returns:
+            A complete Sdt that can be serialised with Sdt.to_bytes()
+        """
+        sdt = cls()
+        if table_id is None: table_id = cls.TABLE_ID
+        sdt.set_header(table_id, transport_stream_id, version, section_number, last_section_number)
+        sdt.transport_stream_id = transport_stream_id
+        sdt.original_network_id = original_network_id
+        sdt.service_loop = list(service_loop)
+        return sdt
+
+    create = classmethod(create)
+
     def parse(self, data=None):
         """Parses the given data to generate all the SDT information
         
@@ -193,6 +261,25 @@ class Sdt(Section):
             self.service_loop.append(sd)
             ln -= sd.length
     
+    def _get_table_id_extension(self):
+        return self.transport_stream_id
+
+    def get_body_size(self):
+        size = 3
+        for service in self.service_loop:
+            size += service.get_size()
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the original network ID and the service loop into buffer at offset"""
+        buffer[offset]     = self.original_network_id >> 8
+        buffer[offset + 1] = self.original_network_id & 0xff
+        buffer[offset + 2] = 0xff
+        offset += 3
+        for service in self.service_loop:
+            offset = service.serialize_into(buffer, offset)
+        return offset
+
     def get_double(self):
         """Returns the SDT double (network ID and Transport Stream ID)
         
@@ -234,6 +321,13 @@ class Sdt(Section):
         return svl
 
 
+    def to_dict(self):
+        res = super(Sdt, self).to_dict()
+        res.update({'transport_stream_id': self.transport_stream_id,
+                    'original_network_id': self.original_network_id,
+                    'service_loop'       : [service.to_dict() for service in self.service_loop]})
+        return res
+
     def __str__(self):
         res = super(Sdt, self).__str__()
         resar = res.split('\n')
@@ -275,6 +369,17 @@ if __name__ == '__main__':
                 function(self, sdt)
                 print sdt
 
+        def testToBytes(self):
+            sdt = Sdt(sample_sdt)
+            self.assertEqual(bytearray(sample_sdt), sdt.to_bytes())
+            services = [ServiceDescription.create(0x654, sdt.service_loop[0].descriptors, eit_schedule_flag=True)]
+            parsed = Sdt(list(Sdt.create(0x10, 0x1800, services, version=2).to_bytes()))
+            self.assertEqual(0x10, parsed.transport_stream_id)
+            self.assertEqual(0x1800, parsed.original_network_id)
+            self.assertEqual(True, parsed.service_loop[0].eit_schedule_flag)
+            self.assertEqual(RUNNING_STATUS_RUNNING, parsed.service_loop[0].running_status)
+            self.assertEqual(sdt.service_loop[0].get_service_name(), parsed.get_service_name(0x654))
+
     unittest.main()
 
 
@@ -4,6 +4,7 @@
 """
 
 from descriptors import SERVICE_TYPE_STRINGS
+from text import to_str
 
 class Service(object):
     """Service class
@@ -91,6 +92,15 @@ class Service(object):
         """
         return not self == other
         
+    def to_dict(self):
+        return {'nid'   : self.nid,
+                'tsid'  : self.tsid,
+                'svid'  : self.svid,
+                'chan'  : self.chan,
+                'name'  : self.name,
+                'type'  : self.type,
+                'number': self.number}
+
     def __str__(self):
         nid, tsid, pn = self.nid, self.tsid, self.svid
         res =  'service:\n'
@@ -99,7 +109,7 @@ class Service(object):
                 if self.svid != None:
                     res += 'locator=dvb://%x.%x.%x\n'%(nid, tsid, pn)
         if self.chan: res += 'channel_number=%d\n'%(self.chan)
-        if self.name: res += 'name=%s\n'%(self.name)
+        if self.name: res += 'name=%s\n'%(to_str(self.name))
         if self.number: res += 'number=%s\n'%(self.number)
         if self.type:
             type = '%d'%(self.type)
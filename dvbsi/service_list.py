@@ -3,6 +3,9 @@
     Provides a ServiceList class to maintain a list of DVB services using DVB-SI tables
 """
 
+from mpeg2psi import profiling
+from mpeg2psi import json_output
+
 class ServiceList(object):
     """Service List class
     
@@ -82,6 +85,7 @@ class ServiceList(object):
             nid = double[0]
             tid = double[1]
             nsvl = nit_service_lists[double]
+            if nsvl is None: continue # the TS item has no service list descriptor
             #dict_sync(nsvl, self.svl)
             self._svl_sync(nsvl, nid, tid)
     
@@ -126,9 +130,11 @@ class ServiceList(object):
             bat -- dvbsi.Bat object (default, None)
             sdt -- dvbsi.Sdt object (default, None)
         """
+        frame = profiling.enabled and profiling.begin('update')
         if nit: self._update_nit(nit)
         if bat: self._update_bat(bat) 
         if sdt: self._update_sdt(sdt)
+        if frame: profiling.end(frame)
     
     def get_service(self, identifier):
         """Get a service Object from the ServiceList
@@ -193,6 +199,20 @@ class ServiceList(object):
         return doubles
         
     
+    def get_sorted_services(self):
+        """Returns the services ordered by triplet"""
+        return [self.svl[triplet] for triplet in sorted(self.svl)]
+
+    def to_dict(self):
+        return {'services': [service.to_dict() for service in self.get_sorted_services()]}
+
+    def iter_json(self):
+        """Yields the JSON of ServiceList.to_dict() a service at a time, see json_output.write_json()"""
+        yield '{"services":'
+        for piece in json_output.iter_json_array(self.get_sorted_services()):
+            yield piece
+        yield '}'
+
     def __str__(self):
         res = "service list:\n"
         for svc in self.svl:
@@ -244,6 +264,21 @@ if __name__ == '__main__':
             self.assertEqual(service.get_triplet(), (0x1800, 0x10, 0x67b), 'incorrect service found')
             self.assertEqual(service.name, 'PVOD', 'incorrect service name')
             print svl.get_doubles()
+
+        def testJson(self):
+            import json
+            from StringIO import StringIO
+            svl = ServiceList()
+            svl.update(nit=sample_nit_0)
+            svl.update(nit=sample_nit_1)
+            svl.update(sdt=sample_sdt)
+            output = StringIO()
+            json_output.write_json(output, svl.iter_json(), block_size=1024)
+            res = json.loads(output.getvalue())
+            self.assertEqual(svl.to_dict(), res)
+            self.assertEqual(282, len(res['services']))
+            service = [service for service in res['services'] if service['svid'] == 0x67b][0]
+            self.assertEqual(('PVOD', 0x1800, 0x10), (service['name'], service['nid'], service['tsid']))
             
             
     unittest.main()        
\ No newline at end of file
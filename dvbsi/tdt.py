@@ -0,0 +1,111 @@
+"""Time and Date Table module
+
+    Provides a TDT section class to parse and encapsulate the UTC time carried by the DVBSI Time and Date Table.
+"""
+
+from mpeg2psi.section import Section
+from dvb_time import decode_utc_time, encode_utc_time
+
+class Tdt(Section):
+    """Time and Date Table class
+
+    Inherits from Section and holds the UTC time of the Time and Date Table described as a part of DVB SI.
+    The TDT is a short section (no extended header and no CRC) that only carries the current time.
+    """
+    TABLE_ID = 0x70
+    PID = 0x14
+
+    def __init__(self, data=None):
+        """Constructor
+
+        If the given array is None then the TDT object will be created but incomplete. To build the information
+        Tdt.parse() or Tdt.add_data() should be called.
+        Arguments:
+            data -- array of data bytes to parse to build the section information (default None)
+        """
+        self.utc_time = None
+        super(Tdt, self).__init__(data)
+
+    def create(cls, utc_time):
+        """Builds a TDT section
+
+        Arguments:
+            utc_time -- the time in seconds since the epoch (UTC)
+        Returns:
+            A complete section that can be serialised with to_bytes()
+        """
+        tdt = cls()
+        tdt.set_header(cls.TABLE_ID, section_syntax_indicator=False)
+        tdt.utc_time = utc_time
+        return tdt
+
+    create = classmethod(create)
+
+    def parse(self, data=None):
+        """Parses the given data to generate the TDT information
+
+        Will call the Section.parse() method and once complete will decode the UTC time from the table body.
+        Arguments:
+            data -- Array of data bytes that describe all or part of the TDT section (default None)
+        """
+        super(Tdt, self).parse(data)
+        if self.complete:
+            self.utc_time = decode_utc_time(self.table_body)
+
+    def get_body_size(self):
+        return 5
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the UTC time into buffer at offset"""
+        return encode_utc_time(self.utc_time, buffer, offset)
+
+    def to_dict(self):
+        res = super(Tdt, self).to_dict()
+        res['utc_time'] = self.utc_time
+        return res
+
+    def __str__(self):
+        res = super(Tdt, self).__str__()
+        resar = res.split('\n')
+        resar[0] = 'TDT:'
+        res = '\n'.join(resar)
+        res += '\tUTC time [%s]\n'%(str(self.utc_time))
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing Tdt class'
+    import calendar
+    import unittest
+    import _known_tables
+    sample_tdt = _known_tables.get_sample_tdt_data()[0]
+
+    def testTdtSection(test_case, section):
+        test_case.assertEqual(0x70, section.table_id, 'incorrect table id')
+        test_case.assertEqual(False, section.section_syntax_indicator, 'incorrect section syntax indicator')
+        test_case.assertEqual(5, section.section_length, 'incorrect section length')
+        test_case.assertEqual(calendar.timegm((2016, 3, 14, 18, 30, 5)), section.utc_time, 'incorrect utc time')
+
+    class KnownSections(unittest.TestCase):
+        known_sections = {testTdtSection:sample_tdt}
+
+        def testKnownSections(self):
+            for function in self.known_sections:
+                data = self.known_sections[function]
+                tdt = Tdt(data)
+                function(self, tdt)
+                print tdt
+
+        def testToBytes(self):
+            self.assertEqual(sample_tdt, list(Tdt(sample_tdt).to_bytes()))
+            self.assertEqual(sample_tdt, list(Tdt.create(Tdt(sample_tdt).utc_time).to_bytes()))
+
+        def testPartialData(self):
+            tdt = Tdt(sample_tdt[:4])
+            self.assertEqual(False, tdt.complete)
+            tdt.add_data(sample_tdt[4:])
+            testTdtSection(self, tdt)
+
+    unittest.main()
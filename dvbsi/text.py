@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""DVB text module
+
+    Decodes DVB SI text fields (service, network, bouquet and event names) as described in EN 300 468 annex A.
+    The first byte of a text field selects the character table: ISO/IEC 6937 by default, one of the ISO/IEC 8859
+    parts, ISO/IEC 10646 (UCS-2) or UTF-8. Control codes are mapped to their meaning (emphasis on/off are dropped,
+    CR/LF becomes a new line). The same names are broadcast again on every carousel cycle so decoded text is kept
+    in an LRU cache keyed by the raw bytes, which also means repeated names share one unicode object.
+    encode_text() goes the other way, keeping the original bytes of a field whose text has not been changed.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import unicodedata
+
+# first byte of the text field -> codec, EN 300 468 table A.3
+CHARACTER_TABLES = {0x01: 'iso8859_5',
+                    0x02: 'iso8859_6',
+                    0x03: 'iso8859_7',
+                    0x04: 'iso8859_8',
+                    0x05: 'iso8859_9',
+                    0x06: 'iso8859_10',
+                    0x07: 'iso8859_11',
+                    0x09: 'iso8859_13',
+                    0x0A: 'iso8859_14',
+                    0x0B: 'iso8859_15',
+                    0x11: 'utf_16_be',
+                    0x12: 'euc_kr',
+                    0x13: 'gb2312',
+                    0x14: 'big5',
+                    0x15: 'utf_8'}
+
+TABLE_ISO8859   = 0x10 # followed by 0x00 and the ISO/IEC 8859 part number
+TABLE_ENCODING  = 0x1F # followed by an encoding_type_id, not supported
+
+# control codes (table A.1) after decoding; single byte tables use 0x80-0x9F, the others 0xE080-0xE09F
+_CONTROL_CODES = {}
+for code in range(0x80, 0xA0):
+    _CONTROL_CODES[code] = None
+    _CONTROL_CODES[0xE000 + code] = None
+_CONTROL_CODES[0x8A] = u'\n'
+_CONTROL_CODES[0xE08A] = u'\n'
+
+# ISO/IEC 6937 (EN 300 468 figure A.1) upper half. Bytes 0xC1-0xCF are non-spacing diacritical marks that
+# prefix the letter they apply to
+_ISO6937_UPPER = (u'\u00a0¡¢£$¥#§¤‘“«←↑→↓'
+                  u'°±²³×µ¶·÷’”»¼½¾¿'
+                  u'\ufffd\u0300\u0301\u0302\u0303\u0304\u0306\u0307\u0308\ufffd\u030a\u0327\ufffd\u030b\u0328\u030c'
+                  u'―¹®©™♪¬¦\ufffd\ufffd\ufffd\ufffd⅛⅜⅝⅞'
+                  u'ΩÆĐªĦ\ufffdĲĿŁØŒºÞŦŊŉ'
+                  u'ĸæđðħıĳŀłøœßþŧŋ\u00ad')
+ISO6937_TABLE = tuple([unichr(byte) for byte in range(0xA0)]) + tuple(_ISO6937_UPPER)
+
+CACHE_SIZE = 4096
+
+def decode_iso6937(raw):
+    """Decodes a byte string in the default DVB character table (ISO/IEC 6937)"""
+    try:
+        return raw.decode('ascii')
+    except UnicodeDecodeError:
+        pass
+    res = []
+    diacritic = None
+    for char in raw:
+        byte = ord(char)
+        if 0xC1 <= byte <= 0xCF:
+            diacritic = ISO6937_TABLE[byte]
+            continue
+        res.append(ISO6937_TABLE[byte])
+        if diacritic is not None:
+            res.append(diacritic) # unicode puts the combining mark after the letter
+            diacritic = None
+    return unicodedata.normalize('NFC', u''.join(res))
+
+def _decode(raw):
+    """Decodes the raw bytes of a text field, see decode_text()"""
+    if not raw: return u''
+    first = ord(raw[0])
+    if first >= 0x20:
+        text = decode_iso6937(raw)
+    else:
+        codec = CHARACTER_TABLES.get(first)
+        start = 1
+        if first == TABLE_ISO8859 and len(raw) >= 3:
+            codec = 'iso8859_%d'%(ord(raw[2]))
+            start = 3
+        elif first == TABLE_ENCODING:
+            start = 2
+        if codec is None:
+            text = decode_iso6937(raw[start:])
+        else:
+            try:
+                text = raw[start:].decode(codec, 'replace')
+            except LookupError:
+                text = decode_iso6937(raw[start:])
+    return text.translate(_CONTROL_CODES)
+
+class TextCache(object):
+    """LRU cache of decoded text fields keyed by their raw bytes
+
+    The cache is shared by the SectionBuilder threads of a TsReader, so it is locked while it is used.
+    """
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, raw):
+        """Returns the decoded text of the raw byte string, decoding it only if it is not cached"""
+        self.lock.acquire()
+        try:
+            text = self.entries.pop(raw, None)
+            if text is None:
+                self.misses += 1
+                text = _decode(raw)
+                if len(self.entries) >= self.size:
+                    self.entries.popitem(last=False)
+            else:
+                self.hits += 1
+            self.entries[raw] = text
+            return text
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self.lock.release()
+
+_cache = TextCache()
+
+def decode_text(data, cache=_cache):
+    """Decodes a DVB SI text field
+
+    Arguments:
+        data  -- the bytes of the text field, including any character table selector, as a list of ints,
+                 bytearray or byte string
+        cache -- TextCache to look the text up in, None to always decode (default module cache)
+    Returns:
+        The text as a unicode string
+    """
+    raw = str(bytearray(data))
+    if cache is None: return _decode(raw)
+    return cache.decode(raw)
+
+def encode_text(text, raw=None):
+    """Encodes a DVB SI text field, the inverse of decode_text()
+
+    When the raw bytes the text was decoded from are given and still decode to the text they are returned
+    as they are, so an unedited field keeps its character table. Otherwise text that is plain ASCII is
+    written in the default table and anything else as UTF-8 (selector 0x15). New lines become CR/LF.
+    Arguments:
+        text -- the text as a unicode string (or an ASCII/UTF-8 byte string), None for an empty field
+        raw  -- the bytes the text was decoded from, as for decode_text() (default None)
+    Returns:
+        The encoded field as a byte string, including any character table selector
+    """
+    if text is None: text = u''
+    elif isinstance(text, str): text = text.decode('utf-8')
+    if raw is not None:
+        raw = str(bytearray(raw))
+        if decode_text(raw) == text: return raw
+    try:
+        encoded = text.encode('ascii')
+        if not encoded or encoded[0] >= '\x20': return encoded.replace('\n', '\x8a')
+    except UnicodeEncodeError:
+        pass
+    return '\x15' + text.replace(u'\n', u'\ue08a').encode('utf-8')
+
+def to_str(text):
+    """Returns the given text as a UTF-8 byte string for printing, None if text is None"""
+    if isinstance(text, unicode): return text.encode('utf-8')
+    return text
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing text'
+    import unittest
+
+    class KnownText(unittest.TestCase):
+        def testDefaultTable(self):
+            self.assertEqual(u'SABC1', decode_text([0x53, 0x41, 0x42, 0x43, 0x31]))
+            # 0xC2 is the acute accent prefix, 0xA3 the pound sign, 0xFB sharp s
+            self.assertEqual(u'Café £ ß', decode_text(bytearray('Caf\xc2e \xa3 \xfb')))
+
+        def testSelectors(self):
+            self.assertEqual(u'Ж', decode_text([0x01, 0xB6])) # ISO 8859-5 cyrillic
+            self.assertEqual(u'Ж', decode_text([0x10, 0x00, 0x05, 0xB6]))
+            self.assertEqual(u'été', decode_text([0x15] + list(bytearray(u'été'.encode('utf-8')))))
+            self.assertEqual(u'€', decode_text([0x11, 0x20, 0xAC]))
+            self.assertEqual(u'', decode_text([]))
+
+        def testControlCodes(self):
+            self.assertEqual(u'News\nat ten', decode_text(bytearray('\x86News\x87\x8aat ten')))
+            self.assertEqual(u'a\nb', decode_text([0x15] + list(bytearray(u'a\ue08ab'.encode('utf-8')))))
+
+        def testCache(self):
+            cache = TextCache(size=2)
+            first = decode_text('One', cache)
+            self.assertTrue(first is decode_text(bytearray('One'), cache))
+            decode_text('Two', cache)
+            decode_text('Three', cache)
+            self.assertEqual(['Two', 'Three'], list(cache.entries))
+            self.assertEqual((1, 3), (cache.hits, cache.misses))
+            self.assertEqual('caf\xc3\xa9', to_str(decode_text([0x15, 0x63, 0x61, 0x66, 0xc3, 0xa9], None)))
+
+        def testThreads(self):
+            import threading
+            cache = TextCache(size=8)
+            errors = []
+            def work(seed):
+                try:
+                    for index in range(2000):
+                        decode_text('Name %d'%((index * seed) % 20), cache)
+                except Exception, e:
+                    errors.append(e)
+            threads = [threading.Thread(target=work, args=(seed,)) for seed in range(1, 5)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            self.assertEqual([], errors)
+            self.assertEqual(8000, cache.hits + cache.misses)
+            self.assertEqual(8, len(cache.entries))
+
+        def testEncode(self):
+            self.assertEqual('SABC1', encode_text(u'SABC1'))
+            self.assertEqual('News\x8aat ten', encode_text(u'News\nat ten'))
+            self.assertEqual('\x15caf\xc3\xa9', encode_text(u'café'))
+            self.assertEqual('', encode_text(None))
+            raw = [0x01, 0xB6]
+            self.assertEqual('\x01\xb6', encode_text(u'Ж', raw)) # unchanged, keeps its table
+            self.assertEqual('\x15\xd0\x96\xd0\x96', encode_text(u'ЖЖ', raw))
+            for text in (u'News\nat ten', u'Café £ ß', u'\x01 leading control', u'a\nб'):
+                self.assertEqual(text, decode_text(encode_text(text)))
+
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Time Offset Table module
+
+    Provides a TOT section class to parse and encapsulate the UTC time and local time offsets carried by the
+    DVBSI Time Offset Table.
+"""
+
+from tdt import Tdt
+import descriptors
+
+class Tot(Tdt):
+    """Time Offset Table class
+
+    Inherits from Tdt since the TOT starts with the same UTC time field. It is followed by a descriptor loop,
+    normally holding a local time offset descriptor, and a CRC even though the TOT is a short section.
+    """
+    TABLE_ID = 0x73
+    PID = 0x14
+
+    def __init__(self, data=None):
+        """Constructor
+
+        If the given array is None then the TOT object will be created but incomplete. To build the information
+        Tot.parse() or Tot.add_data() should be called.
+        Arguments:
+            data -- array of data bytes to parse to build the section information (default None)
+        """
+        self.descriptors = []
+        super(Tot, self).__init__(data)
+
+    def create(cls, utc_time, tot_descriptors):
+        """Builds a TOT section
+
+        Arguments:
+            utc_time        -- the time in seconds since the epoch (UTC)
+            tot_descriptors -- a list of Descriptor objects, normally a LocalTimeOffsetDescriptor
+        Returns:
+            A complete Tot that can be serialised with Tot.to_bytes()
+        """
+        tot = super(Tot, cls).create(utc_time)
+        tot.descriptors = list(tot_descriptors)
+        return tot
+
+    create = classmethod(create)
+
+    def _has_crc(self):
+        return True # unlike other short sections
+
+    def parse(self, data=None):
+        """Parses the given data to generate the TOT information
+
+        Will call the Tdt.parse() method and once complete will parse the descriptor loop and the CRC.
+        Arguments:
+            data -- Array of data bytes that describe all or part of the TOT section (default None)
+        """
+        super(Tot, self).parse(data)
+        if self.complete:
+            data = self.table_body
+            self.descriptors_length = ((data[5] & int('00001111', 2)) << 8) + data[6]
+            self.descriptors = descriptors.get_descriptors(data[7:7 + self.descriptors_length])
+            self.crc = (data[-4] << 24) + (data[-3] << 16) + (data[-2] << 8) + data[-1]
+
+    def get_body_size(self):
+        return 7 + descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the UTC time and the descriptor loop into buffer at offset"""
+        self.descriptors_length = descriptors.get_descriptors_size(self.descriptors)
+        offset = super(Tot, self).serialize_body_into(buffer, offset)
+        buffer[offset]     = 0xf0 | (self.descriptors_length >> 8)
+        buffer[offset + 1] = self.descriptors_length & 0xff
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 2)
+
+    def get_local_time_offset(self, country_code, region_id=0):
+        """Returns the LocalTimeOffset entry for the given country and region, or None if there is none"""
+        for desc in self.descriptors:
+            if type(desc) == descriptors.LocalTimeOffsetDescriptor:
+                entry = desc.get_offset(country_code, region_id)
+                if entry is not None: return entry
+        return None
+
+    def get_local_time(self, country_code, region_id=0):
+        """Returns the local time in seconds since the epoch for the given country, or None if it is not known"""
+        entry = self.get_local_time_offset(country_code, region_id)
+        if entry is None or self.utc_time is None: return None
+        return self.utc_time + entry.get_offset_at(self.utc_time)
+
+    def to_dict(self):
+        res = super(Tot, self).to_dict()
+        res['descriptors'] = [desc.to_dict() for desc in self.descriptors]
+        return res
+
+    def __str__(self):
+        res = super(Tot, self).__str__()
+        res = res.replace('TDT:', 'TOT:', 1)
+        res += '\tCRC[0x%x]\n'%(self.crc)
+        for desc in self.descriptors:
+            res += str(desc)
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing Tot class'
+    import calendar
+    import unittest
+    import _known_tables
+    sample_tot = _known_tables.get_sample_tot_data()[0]
+
+    def testTotSection(test_case, section):
+        utc_time = calendar.timegm((2016, 3, 14, 18, 30, 5))
+        test_case.assertEqual(0x73, section.table_id, 'incorrect table id')
+        test_case.assertEqual(False, section.section_syntax_indicator, 'incorrect section syntax indicator')
+        test_case.assertEqual(26, section.section_length, 'incorrect section length')
+        test_case.assertEqual(utc_time, section.utc_time, 'incorrect utc time')
+        test_case.assertEqual(0x5A86A984, section.crc, 'bad crc')
+        entry = section.get_local_time_offset('GBR')
+        test_case.assertEqual(0, entry.local_time_offset, 'incorrect local time offset')
+        test_case.assertEqual(3600, entry.next_time_offset, 'incorrect next time offset')
+        test_case.assertEqual(calendar.timegm((2016, 3, 27, 1, 0, 0)), entry.time_of_change, 'incorrect time of change')
+        test_case.assertEqual(3600, entry.get_offset_at(entry.time_of_change))
+        test_case.assertEqual(utc_time, section.get_local_time('GBR'))
+        test_case.assertEqual(None, section.get_local_time('FRA'))
+
+    class KnownSections(unittest.TestCase):
+        known_sections = {testTotSection:sample_tot}
+
+        def testKnownSections(self):
+            for function in self.known_sections:
+                data = self.known_sections[function]
+                tot = Tot(data)
+                function(self, tot)
+                print tot
+
+        def testToBytes(self):
+            tot = Tot(sample_tot)
+            self.assertEqual(sample_tot, list(tot.to_bytes()))
+            self.assertEqual(sample_tot, list(Tot.create(tot.utc_time, tot.descriptors).to_bytes()))
+            entry = tot.get_local_time_offset('GBR')
+            entry.local_time_offset, entry.next_time_offset = -5 * 3600, -4 * 3600
+            tot.utc_time += 60
+            edited = Tot(list(tot.to_bytes()))
+            self.assertEqual(tot.crc, edited.crc)
+            self.assertEqual((-5 * 3600, -4 * 3600, entry.time_of_change),
+                             (edited.get_local_time_offset('GBR').local_time_offset,
+                              edited.get_local_time_offset('GBR').next_time_offset,
+                              edited.get_local_time_offset('GBR').time_of_change))
+
+    unittest.main()
@@ -25,6 +25,26 @@ class Cat(Section):
         """
         super(Cat, self).__init__(data)
 
+    def create(cls, ca_descriptors, version=0):
+        """Builds a CAT section
+
+        Arguments:
+            ca_descriptors -- a list of Descriptor objects, normally ConditionalAccessDescriptors
+            version        -- the version number (default 0)
+        Returns:
+            A complete Cat that can be serialised with Cat.to_bytes()
+        """
+        cat = cls()
+        cat.set_header(cls.TABLE_ID, 0xffff, version)
+        cat.descriptors = list(ca_descriptors)
+        return cat
+
+    create = classmethod(create)
+
+    def _get_table_id_extension(self):
+        if self.table_id_extension is None: return 0xffff # reserved in a CAT
+        return self.table_id_extension
+
     def parse(self, data):
         """Parses the given data to generate all the Cat information
         
@@ -41,6 +61,13 @@ class Cat(Section):
             self.descriptors = descriptors.get_descriptors(desc_data)
             del(self.payload)
 
+    def get_body_size(self):
+        return descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the CAT descriptors into buffer at offset"""
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset)
+
     def get_ca_pid(self):
         """Returns the first CA PID found in the CAT descriptors
         
@@ -71,6 +98,11 @@ class Cat(Section):
                 pids[desc.ca_system_id] = desc.ca_pid
         return pids
 
+    def to_dict(self):
+        res = super(Cat, self).to_dict()
+        res['descriptors'] = [desc.to_dict() for desc in self.descriptors]
+        return res
+
     def __str__(self):
         res = super(Cat, self).__str__()
         resar = res.split('\n')
@@ -116,5 +148,15 @@ if __name__ == '__main__':
                 data = self.known_sections[function]
                 cat = Cat(data)
                 function(self, cat)                            
+
+        def testToBytes(self):
+            cat = Cat(cat_section)
+            self.assertEqual(cat_section, list(cat.to_bytes()))
+            cat.descriptors[0].ca_pid = 0x501
+            cat.version = 1
+            edited = Cat(list(cat.to_bytes()))
+            self.assertEqual({1542:0x501}, edited.get_ca_pids())
+            self.assertEqual(1, edited.version)
+            self.assertEqual(cat_section, list(Cat.create(Cat(cat_section).descriptors).to_bytes()))
                 
     unittest.main()
\ No newline at end of file
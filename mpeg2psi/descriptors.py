@@ -2,6 +2,9 @@
 
 MPEG2PSI Descriptors Module
 """
+from collections import OrderedDict
+from json_output import to_hex
+
 AUDIO_TYPE_STRINGS = {0x00:'Undefined',
                       0x01:'Clean effects',
                       0x02:'Hearing impaired',
@@ -42,6 +45,23 @@ def get_descriptors(data):
         descriptors.append(desc)
     return descriptors
 
+def get_descriptors_size(descriptors):
+    """Returns the number of bytes the given descriptors take when serialised"""
+    size = 0
+    for desc in descriptors:
+        size += desc.get_size()
+    return size
+
+def serialize_descriptors_into(descriptors, buffer, offset):
+    """Writes the given descriptors one after the other into buffer at offset
+
+    Returns:
+        The offset after the last descriptor
+    """
+    for desc in descriptors:
+        offset = desc.serialize_into(buffer, offset)
+    return offset
+
 class Descriptor(object):
     """MPEG2 PSI Descriptor class
     
@@ -72,7 +92,54 @@ class Descriptor(object):
         #TODO - Add a tag check for sanity?
         self.descriptor_length = data[1]
         self.length = self.descriptor_length + 2
-    
+        self.raw_data = data[:self.length]
+
+    def get_size(self):
+        """Returns the size of the serialised descriptor, tag and length bytes included"""
+        return 2 + self.get_payload_size()
+
+    def get_payload_size(self):
+        """Returns the size of the descriptor data after the length byte"""
+        return self.length - 2
+
+    def serialize_into(self, buffer, offset):
+        """Writes the descriptor into buffer at offset and returns the offset after it
+
+        The tag and length are written here, the data by serialize_payload_into().
+        """
+        length = self.get_payload_size()
+        if length > 0xff: raise ValueError('descriptor 0x%x is %d bytes long, over 255'%(self.descriptor_tag, length))
+        buffer[offset] = self.descriptor_tag
+        buffer[offset + 1] = length
+        end = self.serialize_payload_into(buffer, offset + 2)
+        self.descriptor_length = length
+        self.length = length + 2
+        return end
+
+    def serialize_payload_into(self, buffer, offset):
+        """Writes the descriptor data into buffer at offset and returns the offset after it
+
+        The base class writes the data exactly as it was parsed, subclasses encode their fields.
+        """
+        end = offset + self.length - 2
+        buffer[offset:end] = bytearray(self.raw_data[2:self.length])
+        return end
+
+    def to_bytes(self):
+        """Returns the serialised descriptor as a bytearray"""
+        buffer = bytearray(self.get_size())
+        self.serialize_into(buffer, 0)
+        return buffer
+
+    def to_dict(self):
+        """Returns the descriptor as a dict of plain values, see json_output
+
+        Subclasses add their decoded fields, the data of a descriptor that is not decoded is given as hex.
+        """
+        res = {'descriptor': type(self).__name__, 'tag': self.descriptor_tag}
+        if type(self) is Descriptor: res['data'] = to_hex(self.raw_data[2:self.length])
+        return res
+
     def __str__(self):
         res = 'Descriptor:\n'
         res += '\ttag    = [0x%x]\n'%(self.descriptor_tag)
@@ -93,6 +160,7 @@ class ConditionalAccessDescriptor(Descriptor):
         """
         self.ca_system_id = None
         self.ca_pid = None
+        self.reserved = int('111', 2) # kept as parsed, some encoders leave these bits clear
         super(ConditionalAccessDescriptor, self).__init__(data)
     
     def parse(self, data):
@@ -103,10 +171,28 @@ class ConditionalAccessDescriptor(Descriptor):
         """
         super(ConditionalAccessDescriptor, self).parse(data)
         self.ca_system_id = (data[2] << 8) + data[3]
+        self.reserved = data[4] >> 5
         self.ca_pid = (data[4] & int('00011111', 2)) << 8
         self.ca_pid += data[5]
         self.private_data = data[6:self.length]
-                
+
+    def get_payload_size(self):
+        return 4 + len(self.private_data)
+
+    def serialize_payload_into(self, buffer, offset):
+        buffer[offset] = self.ca_system_id >> 8
+        buffer[offset + 1] = self.ca_system_id & 0xff
+        buffer[offset + 2] = (self.reserved << 5) | (self.ca_pid >> 8)
+        buffer[offset + 3] = self.ca_pid & 0xff
+        end = offset + 4 + len(self.private_data)
+        buffer[offset + 4:end] = bytearray(self.private_data)
+        return end
+
+    def to_dict(self):
+        res = super(ConditionalAccessDescriptor, self).to_dict()
+        res.update({'ca_system_id': self.ca_system_id, 'ca_pid': self.ca_pid, 'private_data': to_hex(self.private_data)})
+        return res
+
     def __str__(self):
         res = 'ConditionalAccessDescriptor:\n'
         res += '\tca system id = [0x%x]\n'%(self.ca_system_id)
@@ -128,7 +214,7 @@ class Iso639LanguageDescriptor(Descriptor):
         
         Creates the descriptor from the given data by calling Iso639LanguageDescriptor.parse().
         """
-        self.audio_streams = {}
+        self.audio_streams = OrderedDict()
         super(Iso639LanguageDescriptor, self).__init__(data)
     
     def parse(self, data):
@@ -146,7 +232,23 @@ class Iso639LanguageDescriptor(Descriptor):
             self.audio_streams[language] = type
             ln -= 4
             offset += 4
+
+    def get_payload_size(self):
+        return 4 * len(self.audio_streams)
+
+    def serialize_payload_into(self, buffer, offset):
+        for language in self.audio_streams:
+            buffer[offset:offset + 3] = language
+            buffer[offset + 3] = self.audio_streams[language]
+            offset += 4
+        return offset
     
+    def to_dict(self):
+        res = super(Iso639LanguageDescriptor, self).to_dict()
+        res['audio_streams'] = [{'language': language, 'audio_type': self.audio_streams[language]}
+                                for language in self.audio_streams]
+        return res
+
     def __str__(self):
         res = 'Iso639LanguageDescriptor:\n'
         for language in self.audio_streams:
@@ -0,0 +1,115 @@
+"""json_output module
+
+    JSON output of tables, loop items, descriptors and services. Each of them has a to_dict() method that returns
+    its fields as plain values (numbers, strings, lists and dicts), maps keyed by numbers such as the programs of
+    a PAT become lists of dicts and raw bytes become hex strings.
+
+    Whole collections (the sections of an SiTable, the services of a ServiceList) are streamed: iter_json_array()
+    encodes a batch of objects at a time and yields the pieces, so a large lineup is never held as one dict tree or
+    one giant string, and write_json() writes the pieces out in large blocks. One encoder call per batch rather
+    than per object halves the time to encode a lineup.
+"""
+
+import binascii
+import json
+
+BLOCK_SIZE = 65536
+BATCH_SIZE = 256
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+def to_hex(data):
+    """Returns a list of bytes (or a bytearray or string) as a lower case hex string"""
+    return binascii.hexlify(bytearray(data))
+
+def dumps(obj):
+    """Returns the JSON of one object with a to_dict() method"""
+    return _encode(obj.to_dict())
+
+def iter_json_array(objects, batch_size=BATCH_SIZE):
+    """Yields the JSON array of the to_dict() of each of the objects, one piece per batch of objects"""
+    yield '['
+    separator = ''
+    batch = []
+    for obj in objects:
+        batch.append(obj.to_dict())
+        if len(batch) >= batch_size:
+            yield separator + _encode(batch)[1:-1]
+            separator = ','
+            batch = []
+    if batch: yield separator + _encode(batch)[1:-1]
+    yield ']'
+
+def write_json(fileobj, pieces, block_size=BLOCK_SIZE):
+    """Writes JSON pieces, eg. from SiTable.iter_json(), to the open file
+
+    Arguments:
+        fileobj    -- file to write to, eg. a socket file or the body of an HTTP response
+        pieces     -- iterable of strings
+        block_size -- the pieces are joined and written once at least this many bytes are pending (default BLOCK_SIZE)
+    Returns:
+        The number of bytes written
+    """
+    pending = []
+    size = 0
+    written = 0
+    for piece in pieces:
+        pending.append(piece)
+        size += len(piece)
+        if size >= block_size:
+            fileobj.write(''.join(pending))
+            written += size
+            pending = []
+            size = 0
+    if pending:
+        fileobj.write(''.join(pending))
+        written += size
+    return written
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing json_output module'
+    import unittest
+    from StringIO import StringIO
+    import _known_tables
+    from pat import Pat
+    from pmt import Pmt
+    from cat import Cat
+
+    class KnownJson(unittest.TestCase):
+        def testTables(self):
+            pat = Pat(_known_tables.SAMPLE_PAT)
+            res = json.loads(dumps(pat))
+            self.assertEqual('Pat', res['table'])
+            self.assertEqual(pat.transport_stream_id, res['transport_stream_id'])
+            self.assertEqual(pat.version, res['version'])
+            self.assertEqual(sorted(pat.table.items()),
+                             [(program['program_number'], program['pmt_pid']) for program in res['programs']])
+            pmt = Pmt(_known_tables.SAMPLE_PMT)
+            res = json.loads(dumps(pmt))
+            self.assertEqual([(es.stream_type, es.pid) for es in pmt.es_loop],
+                             [(es['stream_type'], es['pid']) for es in res['es_loop']])
+            cat = Cat(_known_tables.SAMPLE_CAT)
+            desc = json.loads(dumps(cat))['descriptors'][0]
+            self.assertEqual('ConditionalAccessDescriptor', desc['descriptor'])
+            self.assertEqual(cat.get_ca_pid(), desc['ca_pid'])
+
+        def testStreaming(self):
+            sections = [Pat(_known_tables.SAMPLE_PAT), Pmt(_known_tables.SAMPLE_PMT)]
+            pieces = list(iter_json_array(sections, batch_size=1))
+            self.assertEqual(4, len(pieces))
+            self.assertEqual(''.join(pieces), ''.join(iter_json_array(sections)))
+            output = StringIO()
+            written = write_json(output, pieces, block_size=10)
+            self.assertEqual(len(output.getvalue()), written)
+            self.assertEqual([section.to_dict() for section in sections], json.loads(output.getvalue()))
+            self.assertEqual([], json.loads(''.join(iter_json_array([]))))
+
+        def testUnknownDescriptor(self):
+            import descriptors
+            desc = descriptors.get_descriptors([0xfe, 0x02, 0xab, 0xcd])[0]
+            self.assertEqual({'descriptor': 'Descriptor', 'tag': 0xfe, 'data': 'abcd'}, desc.to_dict())
+
+    unittest.main()
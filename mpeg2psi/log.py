@@ -0,0 +1,154 @@
+"""log module
+
+    Logging for the packages, on top of the standard logging module. Library code logs to named loggers under
+    'mpeg2psi', 'dvbsi' and 'tsreader' with %-style arguments, so a message is only formatted when its level
+    is enabled; each package logger has a NullHandler so nothing is written until the application configures
+    logging, eg. with logging.basicConfig(level=logging.DEBUG).
+
+    Below DEBUG there is a TRACE level for the structured trace of section assembly: trace() records an event
+    name and its fields, and enable_trace() writes them as one JSON object per line. Trace call sites are
+    guarded with the module flag,
+        if log.tracing: log.trace(LOG, 'section_start', table_id=tid)
+    so that while tracing is off the fields are not even built.
+"""
+
+import json
+import logging
+import sys
+
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+PACKAGE_LOGGERS = ('mpeg2psi', 'dvbsi', 'tsreader')
+TRACE_LOGGERS   = ('tsreader.section_builder', 'mpeg2psi.section')
+
+tracing = False
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+for name in PACKAGE_LOGGERS:
+    logging.getLogger(name).addHandler(NullHandler())
+
+class _Fields(object):
+    '''renders the fields of a trace event only when the record is formatted'''
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(['%s=%s'%(key, self.fields[key]) for key in sorted(self.fields)])
+
+def trace(logger, event, **fields):
+    """Logs a structured trace event at the TRACE level
+
+    Arguments:
+        logger -- the logging.Logger to log to
+        event  -- name of the event, eg. 'section_complete'
+        fields -- the values describing the event, numbers or strings
+    """
+    logger.log(TRACE, '%s %s', event, _Fields(fields), extra={'event': event, 'fields': fields})
+
+class TraceFormatter(logging.Formatter):
+    """Formats each record as a line of JSON: time, logger, level, then the event and its fields for a trace
+    event or the message for any other record"""
+    def format(self, record):
+        line = {'time': record.created, 'logger': record.name, 'level': record.levelname}
+        event = getattr(record, 'event', None)
+        if event is None:
+            line['message'] = record.getMessage()
+        else:
+            line['event'] = event
+            line.update(record.fields)
+        return json.dumps(line, sort_keys=True)
+
+def enable_trace(stream=None, loggers=TRACE_LOGGERS):
+    """Writes the section assembly trace as JSON lines
+
+    Arguments:
+        stream  -- file to write to (default sys.stderr)
+        loggers -- names of the loggers to trace (default TRACE_LOGGERS)
+    Returns:
+        The handler, to pass to disable_trace()
+    """
+    global tracing
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(TraceFormatter())
+    handler.loggers = loggers
+    for name in loggers:
+        logger = logging.getLogger(name)
+        logger.setLevel(TRACE)
+        logger.addHandler(handler)
+    tracing = True
+    return handler
+
+def disable_trace(handler):
+    """Stops the trace started by enable_trace()"""
+    global tracing
+    for name in handler.loggers:
+        logger = logging.getLogger(name)
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+    tracing = False
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing log module'
+    import unittest
+    from StringIO import StringIO
+
+    class KnownLog(unittest.TestCase):
+        def testLazyFormatting(self):
+            class Expensive(object):
+                formatted = 0
+                def __str__(self):
+                    Expensive.formatted += 1
+                    return 'expensive'
+            logger = logging.getLogger('mpeg2psi.test')
+            logger.debug('%s', Expensive())
+            self.assertEqual(0, Expensive.formatted)
+
+        def testTrace(self):
+            import log # the module Section uses, this file runs as __main__
+            import _known_tables
+            from pat import Pat
+            output = StringIO()
+            handler = log.enable_trace(output, ('mpeg2psi.section',))
+            try:
+                self.assertTrue(log.tracing)
+                Pat(_known_tables.SAMPLE_PAT)
+            finally:
+                log.disable_trace(handler)
+            self.assertFalse(log.tracing)
+            lines = [json.loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(['DEBUG', 'TRACE'], [line['level'] for line in lines]) # trace mode shows debug too
+            self.assertTrue(lines[0]['message'].startswith('section complete'))
+            self.assertEqual('section_complete', lines[1]['event'])
+            self.assertEqual(0, lines[1]['table_id'])
+            self.assertEqual('mpeg2psi.section', lines[1]['logger'])
+            Pat(_known_tables.SAMPLE_PAT)
+            self.assertEqual(len(lines), len(output.getvalue().splitlines()))
+
+        def testSectionBuilderTrace(self):
+            from mpeg2psi import log # the module the tsreader package uses
+            from tsreader import packet_tools as pct
+            from tsreader.section_builder import SectionBuilder
+            from tsreader.synthetic import make_stream, NIT_PID
+            from dvbsi.nit import Nit
+            output = StringIO()
+            handler = log.enable_trace(output)
+            try:
+                scanner = SectionBuilder(None, Nit)
+                data = make_stream(duration=2.5, section_size=600)
+                for offset in range(0, len(data), pct.PACKET_SIZE):
+                    packet = bytearray(data[offset:offset + pct.PACKET_SIZE])
+                    if pct.get_pid(packet) == NIT_PID: scanner.process_packet(packet)
+            finally:
+                log.disable_trace(handler)
+            events = [line['event'] for line in map(json.loads, output.getvalue().splitlines()) if 'event' in line]
+            self.assertEqual(['section_start', 'section_data', 'section_data', 'section_complete', 'section_data',
+                              'section_saved', 'section_dropped', 'section_dropped'], events)
+
+    unittest.main()
@@ -0,0 +1,348 @@
+"""metrics module
+
+    Provides a small registry of counters, gauges and histograms for instrumenting the hot paths of the
+    packages (TsReader, Buffer, SectionBuilder and Section), a snapshot of their values and an exporter to the
+    Prometheus text format.
+
+    Metrics are off by default. Instrumented code checks the module flag before touching a metric,
+        if metrics.enabled: PACKETS.inc(labels=(pid,))
+    so while they are off the cost is one attribute lookup per call site. Turn them on with metrics.enable().
+    The registry lives in this base package so that Section can use it; the tsreader and dvbsi modules share
+    the same default registry, REGISTRY.
+"""
+
+import time
+from threading import Lock
+
+enabled = False
+
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+clock = time.time
+
+def enable():
+    """Turns the instrumentation of the hot paths on"""
+    global enabled
+    enabled = True
+
+def disable():
+    """Turns the instrumentation off, the values recorded so far are kept"""
+    global enabled
+    enabled = False
+
+def _format_value(value):
+    if value == float('inf'): return '+Inf'
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15: return '%d'%(value)
+    return repr(value)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"'%(name, _escape(value)) for name, value in zip(names, values)]
+    if extra: pairs.append('%s="%s"'%(extra[0], _escape(extra[1])))
+    if not pairs: return ''
+    return '{' + ','.join(pairs) + '}'
+
+class Metric(object):
+    """Base class of the metric types
+
+    A metric has a name, a help string and optional label names; each combination of label values is a
+    series with its own value. Label values are passed as a tuple in the order of the label names.
+    """
+    TYPE = None
+    def __init__(self, name, help='', labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        self.values = {} # label values -> value
+
+    def get(self, labels=()):
+        """Returns the value of a series, None if it has not been recorded"""
+        return self.values.get(tuple(labels))
+
+    def reset(self):
+        self.lock.acquire()
+        self.values = {}
+        self.lock.release()
+
+    def _snapshot_value(self, value):
+        return value
+
+    def snapshot(self):
+        """Returns the metric as a dict: type, help, labels and the list of series"""
+        self.lock.acquire()
+        try:
+            series = [{'labels': dict(zip(self.label_names, labels)), 'value': self._snapshot_value(value)}
+                      for labels, value in sorted(self.values.items())]
+        finally:
+            self.lock.release()
+        return {'type': self.TYPE, 'help': self.help, 'labels': list(self.label_names), 'series': series}
+
+    def _prometheus_lines(self, labels, value):
+        return ['%s%s %s'%(self.name, _format_labels(self.label_names, labels), _format_value(value))]
+
+    def to_prometheus(self):
+        lines = ['# HELP %s %s'%(self.name, self.help.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE %s %s'%(self.name, self.TYPE)]
+        self.lock.acquire()
+        try:
+            for labels, value in sorted(self.values.items()):
+                lines.extend(self._prometheus_lines(labels, value))
+        finally:
+            self.lock.release()
+        return '\n'.join(lines) + '\n'
+
+class Counter(Metric):
+    """A count that only goes up, eg. packets read"""
+    TYPE = 'counter'
+    def inc(self, amount=1, labels=()):
+        if amount < 0: raise ValueError('counters only go up')
+        self.lock.acquire()
+        self.values[labels] = self.values.get(labels, 0) + amount
+        self.lock.release()
+
+class Gauge(Metric):
+    """A value that goes up and down, eg. a buffer depth, or with set_max() its high-water mark"""
+    TYPE = 'gauge'
+    def set(self, value, labels=()):
+        self.lock.acquire()
+        self.values[labels] = value
+        self.lock.release()
+
+    def inc(self, amount=1, labels=()):
+        self.lock.acquire()
+        self.values[labels] = self.values.get(labels, 0) + amount
+        self.lock.release()
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set_max(self, value, labels=()):
+        '''keeps the largest value set'''
+        if value <= self.values.get(labels, value - 1): return
+        self.lock.acquire()
+        if value > self.values.get(labels, value - 1): self.values[labels] = value
+        self.lock.release()
+
+class Histogram(Metric):
+    """Counts observations, eg. parse times, into buckets and keeps their sum and count
+
+    The value of a series is [bucket counts..., sum, count] with one count per upper bound in buckets, plus
+    one for the observations above the last bound.
+    """
+    TYPE = 'histogram'
+    def __init__(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        buckets = self.buckets
+        index = 0
+        while index < len(buckets) and value > buckets[index]: index += 1
+        self.lock.acquire()
+        try:
+            series = self.values.get(labels)
+            if series is None:
+                series = [0] * (len(buckets) + 1) + [0.0, 0]
+                self.values[labels] = series
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+        finally:
+            self.lock.release()
+
+    def _cumulative(self, value):
+        counts = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-2]):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+    def _snapshot_value(self, value):
+        return {'buckets': [[_format_value(bound), count] for bound, count in self._cumulative(value)],
+                'sum': value[-2], 'count': value[-1]}
+
+    def _prometheus_lines(self, labels, value):
+        lines = []
+        for bound, count in self._cumulative(value):
+            lines.append('%s_bucket%s %d'%(self.name, _format_labels(self.label_names, labels,
+                                                                    ('le', _format_value(bound))), count))
+        label_text = _format_labels(self.label_names, labels)
+        lines.append('%s_sum%s %s'%(self.name, label_text, _format_value(value[-2])))
+        lines.append('%s_count%s %d'%(self.name, label_text, value[-1]))
+        return lines
+
+class Registry(object):
+    """A set of metrics by name
+
+    Registry.counter(), Registry.gauge() and Registry.histogram() return the metric of that name, creating it
+    the first time, so modules can declare their metrics at import time.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help, labels, **options):
+        self.lock.acquire()
+        try:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **options)
+                self.metrics[name] = metric
+            elif type(metric) != cls or metric.label_names != tuple(labels):
+                raise ValueError('metric %s is already registered as a %s with labels %s'%(
+                    name, metric.TYPE, metric.label_names))
+            return metric
+        finally:
+            self.lock.release()
+
+    def counter(self, name, help='', labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def reset(self):
+        """Clears the values of every metric, the metrics stay registered"""
+        for name in list(self.metrics):
+            self.metrics[name].reset()
+
+    def snapshot(self):
+        """Returns the values of every metric as a JSON friendly dict
+
+        Returns:
+            {'time': seconds since the epoch, 'metrics': {name: Metric.snapshot()}}
+        """
+        metrics = {}
+        for name in sorted(self.metrics):
+            metrics[name] = self.metrics[name].snapshot()
+        return {'time': clock(), 'metrics': metrics}
+
+    def to_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        return ''.join([self.metrics[name].to_prometheus() for name in sorted(self.metrics)])
+
+    def write_prometheus(self, filename):
+        """Writes the Prometheus text to a file, eg. for the node exporter textfile collector
+
+        The text is written to a temporary file which is then renamed, so a collector never reads half a file.
+        """
+        import os
+        temp = filename + '.tmp'
+        f = open(temp, 'w')
+        try:
+            f.write(self.to_prometheus())
+        finally:
+            f.close()
+        os.rename(temp, filename)
+
+def get_rates(before, after):
+    """Works out the per second rate of every counter series between two snapshots
+
+    Arguments:
+        before -- an earlier Registry.snapshot()
+        after  -- a later Registry.snapshot()
+    Returns:
+        A dict {name: {label values tuple: rate}}, eg. the packets per second of each PID
+    """
+    seconds = after['time'] - before['time']
+    rates = {}
+    if seconds <= 0: return rates
+    for name in after['metrics']:
+        metric = after['metrics'][name]
+        if metric['type'] != 'counter': continue
+        old = {}
+        if name in before['metrics']:
+            for series in before['metrics'][name]['series']:
+                old[tuple([series['labels'][label] for label in metric['labels']])] = series['value']
+        rates[name] = {}
+        for series in metric['series']:
+            labels = tuple([series['labels'][label] for label in metric['labels']])
+            rates[name][labels] = (series['value'] - old.get(labels, 0)) / seconds
+    return rates
+
+REGISTRY = Registry()
+
+counter   = REGISTRY.counter
+gauge     = REGISTRY.gauge
+histogram = REGISTRY.histogram
+snapshot  = REGISTRY.snapshot
+to_prometheus = REGISTRY.to_prometheus
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing metrics module'
+    import unittest
+
+    class KnownMetrics(unittest.TestCase):
+        def testCounterAndGauge(self):
+            registry = Registry()
+            packets = registry.counter('packets_total', 'Packets read', ('pid',))
+            self.assertTrue(packets is registry.counter('packets_total', 'Packets read', ('pid',)))
+            self.assertRaises(ValueError, registry.gauge, 'packets_total')
+            packets.inc(labels=(17,))
+            packets.inc(3, (17,))
+            packets.inc(labels=(0,))
+            self.assertEqual(4, packets.get((17,)))
+            self.assertRaises(ValueError, packets.inc, -1, (17,))
+            depth = registry.gauge('depth_high_water', 'Deepest buffer')
+            depth.set_max(10)
+            depth.set_max(5)
+            self.assertEqual(10, depth.get())
+            text = registry.to_prometheus()
+            self.assertTrue('# TYPE packets_total counter\n' in text)
+            self.assertTrue('packets_total{pid="17"} 4\n' in text)
+            self.assertTrue('depth_high_water 10\n' in text)
+            registry.reset()
+            self.assertEqual(None, packets.get((17,)))
+
+        def testHistogram(self):
+            registry = Registry()
+            parse = registry.histogram('parse_seconds', 'Parse time', ('table',), buckets=(0.1, 1.0))
+            for value in (0.05, 0.5, 0.7, 2.0):
+                parse.observe(value, ('Pat',))
+            series = registry.snapshot()['metrics']['parse_seconds']['series'][0]
+            self.assertEqual({'table': 'Pat'}, series['labels'])
+            self.assertEqual([['0.1', 1], ['1', 3], ['+Inf', 4]], series['value']['buckets'])
+            self.assertEqual(4, series['value']['count'])
+            self.assertAlmostEqual(3.25, series['value']['sum'])
+            text = registry.to_prometheus()
+            self.assertTrue('parse_seconds_bucket{table="Pat",le="+Inf"} 4\n' in text)
+            self.assertTrue('parse_seconds_count{table="Pat"} 4\n' in text)
+
+        def testRates(self):
+            registry = Registry()
+            packets = registry.counter('packets_total', 'Packets read', ('pid',))
+            packets.inc(10, (17,))
+            before = registry.snapshot()
+            packets.inc(20, (17,))
+            packets.inc(5, (18,))
+            after = registry.snapshot()
+            after['time'] = before['time'] + 2.0
+            self.assertEqual({'packets_total': {(17,): 10.0, (18,): 2.5}}, get_rates(before, after))
+
+        def testSection(self):
+            import _known_tables
+            import metrics # the module Section uses, this file runs as __main__
+            from pat import Pat
+            metrics.enable()
+            try:
+                metrics.REGISTRY.reset()
+                Pat(_known_tables.SAMPLE_PAT)
+                series = metrics.snapshot()['metrics']['section_parse_seconds']['series']
+                self.assertEqual([{'table': 'Pat'}], [entry['labels'] for entry in series])
+                self.assertEqual(1, series[0]['value']['count'])
+            finally:
+                metrics.disable()
+            Pat(_known_tables.SAMPLE_PAT)
+            self.assertEqual(1, metrics.REGISTRY.metrics['section_parse_seconds'].get(('Pat',))[-1])
+
+    unittest.main()
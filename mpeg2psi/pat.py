@@ -31,6 +31,21 @@ def get_program_map(data=None):
         table_entries -= 1
     return programs
 
+def get_network_pid(data=None):
+    """Returns the network PID, the PID of program 0, in the PAT section data
+
+    Arguments:
+        data -- Array of data bytes that represent a complete PAT payload (default None)
+    Returns:
+        The NIT PID or None if the PAT does not list program 0
+    """
+    offset = 0
+    while offset + 8 <= len(data): # the last 4 bytes are the crc32
+        if data[offset] == 0 and data[offset+1] == 0:
+            return ((data[offset+2] & int('00011111',2)) << 8) + data[offset+3]
+        offset = offset + 4
+    return None
+
 class Pat(Section):
     """Program Association Table class
     
@@ -47,9 +62,31 @@ class Pat(Section):
         Arguments:
             data -- array of data bytes to parse to build the section information (default None)
         """
+        self.table = {}
+        self.network_pid = None
         super(Pat, self).__init__(data)
         self.transport_stream_id = self.table_id_extension
 
+    def create(cls, transport_stream_id, programs, network_pid=None, version=0):
+        """Builds a single section PAT
+
+        Arguments:
+            transport_stream_id -- the transport stream ID
+            programs            -- a dictionary mapping program numbers to PMT PIDs
+            network_pid         -- the NIT PID listed as program 0, None to leave it out (default None)
+            version             -- the version number (default 0)
+        Returns:
+            A complete Pat that can be serialised with Pat.to_bytes()
+        """
+        pat = cls()
+        pat.set_header(cls.TABLE_ID, transport_stream_id, version)
+        pat.transport_stream_id = transport_stream_id
+        pat.table = dict(programs)
+        pat.network_pid = network_pid
+        return pat
+
+    create = classmethod(create)
+
     def parse(self, data=None):
         """Parses the given data to generate all the PAT information
         
@@ -64,8 +101,37 @@ class Pat(Section):
         if self.complete:
             self.payload = self.table_body[5:]
             self.table = get_program_map(self.payload)
+            self.network_pid = get_network_pid(self.payload)
             del(self.payload)
 
+    def _get_table_id_extension(self):
+        return self.transport_stream_id
+
+    def get_body_size(self):
+        size = 4 * len(self.table)
+        if self.network_pid is not None: size += 4
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes program 0 (the network PID) then the programs in order into buffer at offset"""
+        entries = sorted(self.table.items())
+        if self.network_pid is not None: entries.insert(0, (0, self.network_pid))
+        for prog, pid in entries:
+            buffer[offset]     = prog >> 8
+            buffer[offset + 1] = prog & 0xff
+            buffer[offset + 2] = 0xe0 | (pid >> 8)
+            buffer[offset + 3] = pid & 0xff
+            offset += 4
+        return offset
+
+    def to_dict(self):
+        res = super(Pat, self).to_dict()
+        res.update({'transport_stream_id': self.transport_stream_id,
+                    'network_pid'        : self.network_pid,
+                    'programs'           : [{'program_number': program, 'pmt_pid': self.table[program]}
+                                            for program in sorted(self.table)]})
+        return res
+
     def __str__(self):
         res = super(Pat, self).__str__()
         resar = res.split('\n')
@@ -114,4 +180,15 @@ if __name__ == '__main__':
                 function(self, pat)
                 print pat
 
+        def testToBytes(self):
+            pat = Pat(pat_data)
+            self.assertEqual(None, pat.network_pid)
+            self.assertEqual(bytearray(pat_data), pat.to_bytes())
+            pat = Pat.create(16, {1: 0x100, 2: 0x200}, network_pid=0x10, version=5)
+            parsed = Pat(list(pat.to_bytes()))
+            self.assertEqual({1: 0x100, 2: 0x200}, parsed.table)
+            self.assertEqual(0x10, parsed.network_pid)
+            self.assertEqual(5, parsed.version)
+            self.assertEqual(pat.crc, parsed.crc)
+
     unittest.main()
\ No newline at end of file
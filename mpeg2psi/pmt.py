@@ -7,6 +7,19 @@
 from section import Section
 import descriptors
 
+STREAM_TYPE_MPEG1_VIDEO = 0x01
+STREAM_TYPE_MPEG2_VIDEO = 0x02
+STREAM_TYPE_MPEG1_AUDIO = 0x03
+STREAM_TYPE_MPEG2_AUDIO = 0x04
+STREAM_TYPE_PRIVATE     = 0x06
+STREAM_TYPE_AAC_AUDIO   = 0x0F
+STREAM_TYPE_MPEG4_VIDEO = 0x10
+STREAM_TYPE_H264_VIDEO  = 0x1B
+STREAM_TYPE_HEVC_VIDEO  = 0x24
+
+VIDEO_STREAM_TYPES = (STREAM_TYPE_MPEG1_VIDEO, STREAM_TYPE_MPEG2_VIDEO, STREAM_TYPE_MPEG4_VIDEO,
+                      STREAM_TYPE_H264_VIDEO, STREAM_TYPE_HEVC_VIDEO)
+
 def get_pcr_pid(data):
     """Get the PCR PID from the given section data
     
@@ -106,6 +119,30 @@ class PmtElementaryStream(object):
         self.es_data = data[offset+5:offset+5+self.es_info_length]
         self.descriptors = descriptors.get_descriptors(self.es_data)
         return 5 + self.es_info_length
+
+    def create(cls, stream_type, pid, es_descriptors=None):
+        """Builds an elementary stream entry for Pmt.create()"""
+        esd = cls()
+        esd.stream_type = stream_type
+        esd.pid = pid
+        esd.descriptors = list(es_descriptors or [])
+        esd.es_info_length = descriptors.get_descriptors_size(esd.descriptors)
+        return esd
+
+    create = classmethod(create)
+
+    def get_size(self):
+        return 5 + descriptors.get_descriptors_size(self.descriptors)
+
+    def serialize_into(self, buffer, offset):
+        """Writes the elementary stream entry into buffer at offset and returns the offset after it"""
+        self.es_info_length = descriptors.get_descriptors_size(self.descriptors)
+        buffer[offset]     = self.stream_type
+        buffer[offset + 1] = 0xe0 | (self.pid >> 8)
+        buffer[offset + 2] = self.pid & 0xff
+        buffer[offset + 3] = 0xf0 | (self.es_info_length >> 8)
+        buffer[offset + 4] = self.es_info_length & 0xff
+        return descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 5)
     
     def get_ca_pids(self):
         """Returns the all the CA PIDs found in the elementary stream (ES) descriptors
@@ -122,6 +159,15 @@ class PmtElementaryStream(object):
                 pids.append(desc.ca_pid)
         return pids
     
+    def is_video(self):
+        """Returns True if the stream type of this elementary stream is a known video type"""
+        return self.stream_type in VIDEO_STREAM_TYPES
+
+    def to_dict(self):
+        return {'stream_type': self.stream_type,
+                'pid'        : self.pid,
+                'descriptors': [desc.to_dict() for desc in self.descriptors]}
+
     def __str__(self):
         if self.stream_type == None: return '\tempty'
         res = '\tElementary Stream Loop:\n'
@@ -170,7 +216,32 @@ class Pmt(Section):
             data -- array of data bytes to parse to build the section information (default None)
         """
         self.descriptors = []
+        self.es_loop = []
         super(Pmt, self).__init__(data)
+        self.program_number = self.table_id_extension
+
+    def create(cls, program_number, pcr_pid, es_loop, program_descriptors=None, version=0):
+        """Builds a single section PMT
+
+        Arguments:
+            program_number      -- the program number
+            pcr_pid             -- the PCR PID, 0x1fff if the program has no PCR
+            es_loop             -- a list of PmtElementaryStream objects, see PmtElementaryStream.create()
+            program_descriptors -- a list of Descriptor objects for the program (default None)
+            version             -- the version number (default 0)
+        Returns:
+            A complete Pmt that can be serialised with Pmt.to_bytes()
+        """
+        pmt = cls()
+        pmt.set_header(cls.TABLE_ID, program_number, version)
+        pmt.program_number = program_number
+        pmt.pcr_pid = pcr_pid
+        pmt.es_loop = list(es_loop)
+        pmt.descriptors = list(program_descriptors or [])
+        pmt.program_info_length = descriptors.get_descriptors_size(pmt.descriptors)
+        return pmt
+
+    create = classmethod(create)
 
 
     def parse(self, data):
@@ -253,6 +324,14 @@ class Pmt(Section):
         pids = list(set(pids))
         return pids
     
+    def get_video_streams(self):
+        """Returns the video elementary streams in this program
+
+        Returns:
+            A list of PmtElementaryStream objects whose stream type is a known video type
+        """
+        return [es for es in self.es_loop if es.is_video()]
+
     def _get_es_loop(self, data):
         """Parses the given data to get the elementary stream information
         
@@ -262,7 +341,36 @@ class Pmt(Section):
             data -- array section data bytes in the PMT payload
         """
         self.es_loop = get_elementary_stream_loop(data)
+
+    def _get_table_id_extension(self):
+        return self.program_number
+
+    def get_body_size(self):
+        size = 4 + descriptors.get_descriptors_size(self.descriptors)
+        for es in self.es_loop:
+            size += es.get_size()
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the PCR PID, the program descriptors and the elementary stream loop into buffer at offset"""
+        self.program_info_length = descriptors.get_descriptors_size(self.descriptors)
+        buffer[offset]     = 0xe0 | (self.pcr_pid >> 8)
+        buffer[offset + 1] = self.pcr_pid & 0xff
+        buffer[offset + 2] = 0xf0 | (self.program_info_length >> 8)
+        buffer[offset + 3] = self.program_info_length & 0xff
+        offset = descriptors.serialize_descriptors_into(self.descriptors, buffer, offset + 4)
+        for es in self.es_loop:
+            offset = es.serialize_into(buffer, offset)
+        return offset
         
+    def to_dict(self):
+        res = super(Pmt, self).to_dict()
+        res.update({'program_number': self.program_number,
+                    'pcr_pid'       : getattr(self, 'pcr_pid', None),
+                    'descriptors'   : [desc.to_dict() for desc in self.descriptors],
+                    'es_loop'       : [es.to_dict() for es in self.es_loop]})
+        return res
+
     def __str__(self):
         res = super(Pmt, self).__str__()
         resar = res.split('\n')
@@ -316,4 +424,14 @@ if __name__ == '__main__':
                 function(self, pmt)
                 print pmt
 
+        def testToBytes(self):
+            self.assertEqual(bytearray(sample_pmt), Pmt(sample_pmt).to_bytes())
+            pmt = Pmt.create(7, 0x100, [PmtElementaryStream.create(STREAM_TYPE_H264_VIDEO, 0x100),
+                                        PmtElementaryStream.create(STREAM_TYPE_MPEG2_AUDIO, 0x101,
+                                                                   Pmt(sample_pmt).es_loop[1].descriptors)])
+            parsed = Pmt(list(pmt.to_bytes()))
+            self.assertEqual(7, parsed.program_number)
+            self.assertEqual([0x100, 0x101], sorted(parsed.get_pids()))
+            self.assertEqual(1, parsed.es_loop[1].descriptors[0].audio_streams['eng'])
+
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""profiling module
+
+    Opt-in timing of the pipeline stages: read (Source.read_chunk), sync (finding sync again after junk),
+    dispatch (TsReader.feed_packet), assemble (SectionBuilder.process_packet), parse (Section parsing, per table
+    class) and update (ServiceList.update). Stages nest, eg. a section parsed while a packet is dispatched to a
+    handler is timed as dispatch;assemble;parse:Pat, and the wall and CPU time of each stack of stages is
+    aggregated so it can be reported per stage, per table class or as a collapsed stack file for flame graph
+    tools (flamegraph.pl, speedscope).
+
+    Profiling is off by default; instrumented code checks the module flag first,
+        frame = profiling.enabled and profiling.begin('dispatch')
+        ...
+        if frame: profiling.end(frame)
+    so while it is off the cost is one attribute lookup per boundary. Stages run through profiling.call() are
+    ordinary function calls, so they also show up as their own entries under cProfile.
+
+    CPU time is the CPU time of the process (time.clock()), so it is only meaningful per stage when the stages
+    run in one thread; wall time is per thread.
+"""
+
+import threading
+import time
+
+enabled = False
+
+wall_clock = time.time
+cpu_clock  = time.clock
+
+class Profile(object):
+    """The stage timings, kept per thread and merged when reported
+
+    Each thread keeps a stack of open stages and a dict of stack -> [calls, wall, cpu], so recording a stage
+    takes no lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread_stats = []
+
+    def _get_local(self):
+        local = self.local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.stats = {}
+            self.lock.acquire()
+            self.thread_stats.append(local.stats)
+            self.lock.release()
+        return local
+
+    def begin(self, stage, detail=None):
+        """Opens a stage, returns the frame to pass to end()"""
+        local = self._get_local()
+        if detail is not None: stage = '%s:%s'%(stage, detail)
+        stack = local.stack
+        path = (stack[-1][0] + (stage,)) if stack else (stage,)
+        frame = (path, len(stack), wall_clock(), cpu_clock())
+        stack.append(frame)
+        return frame
+
+    def end(self, frame):
+        """Closes the stage opened by begin(), and any stage left open inside it by an exception"""
+        wall = wall_clock()
+        cpu = cpu_clock()
+        local = self._get_local()
+        path, depth, start_wall, start_cpu = frame
+        del local.stack[depth:]
+        entry = local.stats.get(path)
+        if entry is None:
+            entry = [0, 0.0, 0.0]
+            local.stats[path] = entry
+        entry[0] += 1
+        entry[1] += wall - start_wall
+        entry[2] += cpu - start_cpu
+
+    def call(self, stage, detail, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) as a stage and returns its result"""
+        frame = self.begin(stage, detail)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.end(frame)
+
+    def reset(self):
+        self.lock.acquire()
+        for stats in self.thread_stats:
+            stats.clear()
+        self.lock.release()
+
+    def get_stats(self):
+        """Returns the merged timings as a dict {stack tuple: (calls, wall, cpu, self wall, self cpu)}
+
+        The times of a stack include those of the stages nested in it, the self times do not.
+        """
+        merged = {}
+        self.lock.acquire()
+        try:
+            for stats in self.thread_stats:
+                for path, entry in stats.items():
+                    total = merged.setdefault(path, [0, 0.0, 0.0])
+                    total[0] += entry[0]
+                    total[1] += entry[1]
+                    total[2] += entry[2]
+        finally:
+            self.lock.release()
+        children = {}
+        for path, entry in merged.items():
+            if len(path) > 1:
+                child = children.setdefault(path[:-1], [0.0, 0.0])
+                child[0] += entry[1]
+                child[1] += entry[2]
+        stats = {}
+        for path, entry in merged.items():
+            child = children.get(path, (0.0, 0.0))
+            stats[path] = (entry[0], entry[1], entry[2], max(0.0, entry[1] - child[0]), max(0.0, entry[2] - child[1]))
+        return stats
+
+    def get_summary(self, level=None):
+        """Totals the self times by stage
+
+        Arguments:
+            level -- None totals by stage name without the table class ('parse'), 'detail' keeps it ('parse:Pat')
+        Returns:
+            A dict {stage: {'calls': n, 'wall': seconds, 'cpu': seconds}} of the time spent in each stage itself
+        """
+        summary = {}
+        for path, (calls, wall, cpu, self_wall, self_cpu) in self.get_stats().items():
+            stage = path[-1]
+            if level != 'detail': stage = stage.split(':')[0]
+            total = summary.setdefault(stage, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['calls'] += calls
+            total['wall'] += self_wall
+            total['cpu'] += self_cpu
+        return summary
+
+    def get_collapsed(self, clock='wall'):
+        """Returns the timings in the collapsed stack format, one 'stage;stage;stage microseconds' line per stack
+
+        Arguments:
+            clock -- 'wall' or 'cpu' (default 'wall')
+        """
+        index = 3
+        if clock == 'cpu': index = 4
+        lines = []
+        for path, entry in sorted(self.get_stats().items()):
+            micro_seconds = int(round(entry[index] * 1e6))
+            if micro_seconds > 0: lines.append('%s %d'%(';'.join(path), micro_seconds))
+        return '\n'.join(lines) + '\n'
+
+    def write_collapsed(self, filename, clock='wall'):
+        f = open(filename, 'w')
+        try:
+            f.write(self.get_collapsed(clock))
+        finally:
+            f.close()
+
+    def __str__(self):
+        res = 'Profile:\n'
+        summary = self.get_summary('detail')
+        for stage in sorted(summary, key=lambda stage: -summary[stage]['wall']):
+            total = summary[stage]
+            res += '\t%-20s calls[%d], wall[%0.3fs], cpu[%0.3fs]\n'%(stage, total['calls'], total['wall'], total['cpu'])
+        return res
+
+PROFILE = Profile()
+
+begin = PROFILE.begin
+end   = PROFILE.end
+call  = PROFILE.call
+
+def enable(reset=True):
+    """Turns stage profiling on, by default clearing the timings recorded so far"""
+    global enabled
+    if reset: PROFILE.reset()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing profiling module'
+    import unittest
+
+    class KnownProfiling(unittest.TestCase):
+        def testNesting(self):
+            profile = Profile()
+            clock = [0.0]
+            global wall_clock, cpu_clock
+            saved = wall_clock, cpu_clock
+            wall_clock = cpu_clock = lambda: clock[0]
+            try:
+                for packet in range(2):
+                    outer = profile.begin('dispatch')
+                    clock[0] += 1.0
+                    inner = profile.begin('assemble', 'Pat')
+                    clock[0] += 2.0
+                    profile.call('parse', 'Pat', lambda: clock.__setitem__(0, clock[0] + 4.0))
+                    profile.end(inner)
+                    profile.end(outer)
+                frame = profile.begin('dispatch')
+                profile.begin('assemble') # left open by an exception
+                clock[0] += 8.0
+                profile.end(frame)
+                self.assertEqual([], profile.local.stack)
+            finally:
+                wall_clock, cpu_clock = saved
+            stats = profile.get_stats()
+            self.assertEqual((3, 22.0, 22.0, 10.0, 10.0), stats[('dispatch',)])
+            self.assertEqual((2, 12.0, 12.0, 4.0, 4.0), stats[('dispatch', 'assemble:Pat')])
+            self.assertEqual((2, 8.0, 8.0, 8.0, 8.0), stats[('dispatch', 'assemble:Pat', 'parse:Pat')])
+            self.assertEqual({'calls': 2, 'wall': 8.0, 'cpu': 8.0}, profile.get_summary()['parse'])
+            self.assertEqual('dispatch 10000000\ndispatch;assemble:Pat 4000000\ndispatch;assemble:Pat;parse:Pat 8000000\n',
+                             profile.get_collapsed())
+
+        def testThreads(self):
+            profile = Profile()
+            def work():
+                for index in range(100):
+                    profile.call('update', None, time.sleep, 0)
+            threads = [threading.Thread(target=work) for index in range(4)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            self.assertEqual(400, profile.get_stats()[('update',)][0])
+
+        def testPipeline(self):
+            import profiling # the module the sections use, this file runs as __main__
+            import _known_tables
+            from pat import Pat
+            profiling.enable()
+            try:
+                Pat(_known_tables.SAMPLE_PAT)
+            finally:
+                profiling.disable()
+            Pat(_known_tables.SAMPLE_PAT)
+            self.assertEqual(['parse:Pat'], profiling.PROFILE.get_summary('detail').keys())
+            self.assertEqual(1, profiling.PROFILE.get_summary()['parse']['calls'])
+
+        def testReaderPipeline(self):
+            from StringIO import StringIO
+            from mpeg2psi import profiling # the module the tsreader package uses
+            from tsreader import packet_tools as pct
+            from tsreader.ts_reader import TsReader
+            from tsreader.section_builder import SectionBuilder
+            from tsreader.synthetic import make_stream, SDT_PID, TRANSPORT_STREAM_ID
+            from dvbsi.sdt import Sdt
+            from dvbsi.service_list import ServiceList
+            data = make_stream(duration=1.0)
+            profiling.enable()
+            try:
+                reader = TsReader(StringIO('\x00' * 100 + data)) # junk to resync over
+                sdt = SectionBuilder(None, Sdt)
+                reader.link_handler(SDT_PID, sdt.process_packet)
+                reader.run()
+                ServiceList().update(sdt=sdt.si_table.sections[0][TRANSPORT_STREAM_ID][0])
+            finally:
+                profiling.disable()
+            stats = profiling.PROFILE.get_stats()
+            self.assertEqual(len(data) // pct.PACKET_SIZE, stats[('dispatch',)][0])
+            self.assertEqual(1, stats[('sync',)][0])
+            self.assertTrue(stats[('read',)][0] > 0)
+            self.assertEqual(stats[('dispatch', 'assemble:Sdt')][0], reader.pids[SDT_PID])
+            self.assertTrue(('dispatch', 'assemble:Sdt', 'parse:Sdt') in stats)
+            self.assertEqual(1, stats[('update',)][0])
+            self.assertEqual(set(['read', 'sync', 'dispatch', 'assemble', 'parse', 'update']),
+                             set(profiling.PROFILE.get_summary()))
+            self.assertTrue('dispatch;assemble:Sdt;parse:Sdt ' in profiling.PROFILE.get_collapsed())
+            profiling.PROFILE.reset()
+
+    unittest.main()
@@ -4,21 +4,61 @@
     MPEG2-TS PSI section.
 """
 
+import logging
+import log
+import metrics
+import profiling
+
+LOG = logging.getLogger('mpeg2psi.section')
+
 _DEV   = False
 _DEBUG = False
 
+PARSE_TIME = metrics.histogram('section_parse_seconds', 'Time taken to parse a complete section, by table class',
+                               ('table',))
+
 if _DEV:
     import struct
     def _save_section_to_file(section):
         filename = 'dev_data/section_tid_%d_ver_%d_scn_%d.sect'%(section.table_id,
                                                             section.version,
                                                             section.section_number)
-        print 'SAVING section to file %s'%(filename)
+        LOG.debug('saving section to file %s', filename)
         f = open(filename, 'wb')
         for byte in section.data_cache:
             f.write(struct.pack('B', byte))
         f.close()
 
+def _make_crc32_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for bit in range(8):
+            if crc & 0x80000000: crc = ((crc << 1) ^ 0x04c11db7) & 0xffffffff
+            else: crc = (crc << 1) & 0xffffffff
+        table.append(crc)
+    return tuple(table)
+
+CRC32_TABLE = _make_crc32_table()
+
+def crc32(data, start=0, end=None):
+    """Calculates the MPEG2 CRC32 of a block of section data
+
+    The CRC of a whole section, including its CRC_32 field, is 0.
+    Arguments:
+        data  -- array of data bytes (a list or a bytearray)
+        start -- offset of the first byte (default 0)
+        end   -- offset after the last byte, None for the end of data (default None)
+    Returns:
+        The 32 bit CRC value
+    """
+    if end is None: end = len(data)
+    table = CRC32_TABLE
+    crc = 0xffffffff
+    for index in xrange(start, end):
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ data[index]]
+    return crc
+
 def get_pointer_field(data):
     """Get the pointer field from the packet payload
 
@@ -137,8 +177,19 @@ class Section(object):
         self.complete        = False
         self.header          = False
         self.extended_header = False
+        self.table_id_extension = None
         self.data_cache      = None
-        if data: self.parse(data)
+        if data: self._parse_timed(data)
+
+    def _parse_timed(self, data=None):
+        """Calls Section.parse(), timing it into PARSE_TIME when metrics are enabled and the section completes,
+        and as the parse stage when profiling is enabled"""
+        if not (metrics.enabled or profiling.enabled): return self.parse(data)
+        frame = profiling.enabled and profiling.begin('parse', type(self).__name__)
+        start = metrics.clock()
+        self.parse(data)
+        if metrics.enabled and self.complete: PARSE_TIME.observe(metrics.clock() - start, (type(self).__name__,))
+        if frame: profiling.end(frame)
 
     def _get_header(self, data):
         """Parses the given data to generate the simple section header
@@ -220,7 +271,11 @@ class Section(object):
         if len(data) >= self.section_length + 3:
             self.table_body = data[3:3+self.section_length]
             self.complete = True
-            print('section complete - id[%d], length[%d]'%(self.table_id, self.section_length))
+            LOG.debug('section complete - id[%d], length[%d]', self.table_id, self.section_length)
+            if log.tracing:
+                log.trace(LOG, 'section_complete', table=type(self).__name__, table_id=self.table_id,
+                          length=self.section_length, table_id_extension=getattr(self, 'table_id_extension', None),
+                          version=getattr(self, 'version', None), section_number=getattr(self, 'section_number', None))
             self._get_crc(self.table_body)
             if _DEV: _save_section_to_file(self)
             del (self.data_cache)
@@ -238,7 +293,7 @@ class Section(object):
         """
         if self.complete: return
         if not self.data_cache:
-            self.parse(data)
+            self._parse_timed(data)
             return self.length
 
         data = list(data)
@@ -258,7 +313,7 @@ class Section(object):
         self.data_cache.extend(data[0:missing_data_len])
 
         if len(self.data_cache) == (self.section_length + 3):
-            self.parse()
+            self._parse_timed()
 
         return min (datalen, missing_data_len + extra_len)
 
@@ -280,6 +335,129 @@ class Section(object):
         self.crc <<= 8
         self.crc += crc_data[3]
 
+    def set_header(self, table_id, table_id_extension=0, version=0, section_number=0, last_section_number=0,
+                   section_syntax_indicator=True, private_indicator=None, current_next_indicator=True):
+        """Fills in the header of a section that is built rather than parsed
+
+        The section is marked complete so that it can be serialised with Section.to_bytes(). The section
+        length is worked out when it is serialised.
+        Arguments:
+            table_id                 -- the table ID
+            table_id_extension       -- the table ID extension (default 0)
+            version                  -- the version number, 0 to 31 (default 0)
+            section_number           -- the section number (default 0)
+            last_section_number      -- the last section number of the table (default 0)
+            section_syntax_indicator -- True for a long section with an extended header and a CRC (default True)
+            private_indicator        -- None sets it for DVB SI tables, table IDs from 0x40 up (default None)
+            current_next_indicator   -- False if the section is not yet applicable (default True)
+        """
+        if private_indicator is None: private_indicator = table_id >= 0x40
+        self.table_id                 = table_id
+        self.section_syntax_indicator = section_syntax_indicator
+        self.private_indicator        = private_indicator
+        self.section_length           = 0
+        self.length                   = 3
+        self.header                   = True
+        self.table_id_extension       = table_id_extension
+        self.version                  = version
+        self.current_next_indicator   = current_next_indicator
+        self.section_number           = section_number
+        self.last_section_number      = last_section_number
+        self.extended_header          = section_syntax_indicator
+        self.complete                 = True
+
+    def _has_crc(self):
+        """True if the section ends with a CRC_32, which every long section does"""
+        return self.section_syntax_indicator
+
+    def _get_table_id_extension(self):
+        """Returns the table ID extension to serialise, overridden by tables that keep it under another name"""
+        return self.table_id_extension
+
+    def get_body_size(self):
+        """Returns the size in bytes of the section body, between the (extended) header and the CRC
+
+        The base class serialises the body exactly as it was parsed, tables override this and
+        Section.serialize_body_into() to encode their fields.
+        """
+        size = len(self.table_body)
+        if self.section_syntax_indicator: size -= 5
+        if self._has_crc(): size -= 4
+        return size
+
+    def serialize_body_into(self, buffer, offset):
+        """Writes the section body into buffer at offset and returns the offset after it"""
+        start = 0
+        if self.section_syntax_indicator: start = 5
+        size = self.get_body_size()
+        buffer[offset:offset + size] = bytearray(self.table_body[start:start + size])
+        return offset + size
+
+    def get_size(self):
+        """Returns the size in bytes of the whole serialised section"""
+        size = 3 + self.get_body_size()
+        if self.section_syntax_indicator: size += 5
+        if self._has_crc(): size += 4
+        return size
+
+    def serialize_into(self, buffer, offset=0):
+        """Writes the whole section, header to CRC, into a preallocated buffer
+
+        The section length, and the CRC when the section has one, are worked out from the fields.
+        Arguments:
+            buffer -- a bytearray with at least Section.get_size() bytes from offset
+            offset -- where to write the section (default 0)
+        Returns:
+            The offset after the section
+        """
+        start = offset
+        self.section_length = self.get_size() - 3
+        self.length = self.section_length + 3
+        flags = 0x30
+        if self.section_syntax_indicator: flags |= 0x80
+        if self.private_indicator: flags |= 0x40
+        buffer[offset]     = self.table_id
+        buffer[offset + 1] = flags | (self.section_length >> 8)
+        buffer[offset + 2] = self.section_length & 0xff
+        offset += 3
+        if self.section_syntax_indicator:
+            table_id_extension = self._get_table_id_extension()
+            buffer[offset]     = table_id_extension >> 8
+            buffer[offset + 1] = table_id_extension & 0xff
+            buffer[offset + 2] = 0xc0 | ((self.version & 0x1f) << 1) | int(bool(self.current_next_indicator))
+            buffer[offset + 3] = self.section_number
+            buffer[offset + 4] = self.last_section_number
+            offset += 5
+        offset = self.serialize_body_into(buffer, offset)
+        if self._has_crc():
+            self.crc = crc32(buffer, start, offset)
+            buffer[offset]     = self.crc >> 24
+            buffer[offset + 1] = (self.crc >> 16) & 0xff
+            buffer[offset + 2] = (self.crc >> 8) & 0xff
+            buffer[offset + 3] = self.crc & 0xff
+            offset += 4
+        return offset
+
+    def to_bytes(self):
+        """Returns the serialised section as a bytearray"""
+        buffer = bytearray(self.get_size())
+        self.serialize_into(buffer, 0)
+        return buffer
+
+    def to_dict(self):
+        """Returns the section as a dict of plain values, see json_output
+
+        The header fields are given here, subclasses add the fields of their table.
+        """
+        res = {'table': type(self).__name__, 'table_id': self.table_id}
+        if self.header and self.section_syntax_indicator and self.extended_header:
+            res.update({'table_id_extension' : self.table_id_extension,
+                        'version'            : self.version,
+                        'current_next'       : bool(self.current_next_indicator),
+                        'section_number'     : self.section_number,
+                        'last_section_number': self.last_section_number})
+        return res
+
     def __str__(self):
         if self.table_id == None: return 'Empty'
         res = 'Section:\n'
@@ -345,4 +523,22 @@ if __name__ == '__main__':
                 section = Section(data)
                 function(self, section)
 
+        def testToBytes(self):
+            for data in (nit_data_0, nit_data_1):
+                section = Section(data)
+                self.assertEqual(bytearray(data), section.to_bytes())
+                self.assertEqual(0, crc32(section.to_bytes()))
+
+        def testBuiltSection(self):
+            section = Section()
+            section.set_header(0x40, 0x1800, version=3)
+            section.table_body = [0] * 5 + [0xf0, 0x00, 0xf0, 0x00] + [0] * 4
+            data = section.to_bytes()
+            self.assertEqual(16, len(data))
+            parsed = Section(list(data))
+            self.assertEqual(13, parsed.section_length)
+            self.assertEqual(3, parsed.version)
+            self.assertEqual(True, parsed.private_indicator)
+            self.assertEqual(section.crc, parsed.crc)
+
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,9 @@
 
 
+import logging
+
+LOG = logging.getLogger('mpeg2psi.sitable')
+
 class SiTable (object):
     """A basic SI TABLE class
     
@@ -18,7 +22,7 @@ class SiTable (object):
         pass
     
     def add_section(self, section):
-        print section
+        LOG.debug('%s', section)
         if section.table_id != self.tid: return
         tide = section.table_id_extension
         if self.tide != None:
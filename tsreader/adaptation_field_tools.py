@@ -28,6 +28,9 @@ class Pcr:
     def __str__(self):
         return "base[" + str(self.base) + "], extension[" + str(self.extension) + "]"
 
+    def to_27mhz(self):
+        return (self.base * 300) + self.extension
+
     def to_micro_seconds(self):
         base = (1.0/90000.0) * self.base
         ext  = (1.0/27000000.0) * self.extension
@@ -0,0 +1,192 @@
+'''
+    Parallel scan of many recordings.
+
+    Each recording is scanned by scanner.scan_file() in a multiprocessing pool worker and the picklable
+    summaries are merged into one report. Python 2 has no concurrent.futures so a multiprocessing.Pool is
+    used; its maxtasksperchild recycles workers and an address space limit can be set on every worker so a
+    runaway scan fails that recording instead of the whole batch.
+
+    usage: python batch_scan.py [-j WORKERS] [--chunksize N] [--memory-limit MB] [--json] recording.ts ...
+'''
+
+import argparse
+import json
+import multiprocessing
+import signal
+import sys
+import time
+from scanner import scan_file
+
+def init_worker(memory_limit):
+    '''pool initializer: leave ctrl-c to the parent and cap the address space of the worker'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        import resource
+        hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+        if hard != resource.RLIM_INFINITY: memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+
+def _scan_job(job):
+    '''pool worker: job is (index, filename, max_packets), returns (index, summary)'''
+    index, filename, max_packets = job
+    return index, scan_file(filename, max_packets)
+
+def scan_files(filenames, workers=None, chunksize=1, max_tasks_per_child=None, memory_limit=None,
+               max_packets=None, callback=None):
+    """Scans the given recordings in parallel
+
+    Arguments:
+        filenames           -- list of recordings to scan
+        workers             -- number of worker processes, None uses one per CPU, 1 scans in this process
+                               (default None)
+        chunksize           -- recordings handed to a worker at a time (default 1)
+        max_tasks_per_child -- recordings a worker scans before it is replaced, None never replaces
+                               workers (default None)
+        memory_limit        -- address space limit of each worker in bytes, None for no limit (default None)
+        max_packets         -- stop scanning each recording after this many packets (default None)
+        callback            -- called with each summary as soon as it is ready (default None)
+    Returns:
+        The list of summaries in the order of filenames
+    """
+    jobs = [(index, filename, max_packets) for index, filename in enumerate(filenames)]
+    summaries = [None] * len(jobs)
+    if workers is None: workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        for job in jobs:
+            index, summary = _scan_job(job)
+            summaries[index] = summary
+            if callback: callback(summary)
+        return summaries
+    pool = multiprocessing.Pool(workers, init_worker, (memory_limit,), max_tasks_per_child)
+    try:
+        for index, summary in pool.imap_unordered(_scan_job, jobs, chunksize):
+            summaries[index] = summary
+            if callback: callback(summary)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return summaries
+
+def merge_summaries(summaries):
+    """Merges per recording summaries into one report
+
+    Returns:
+        A dict with the number of files, packets, continuity errors and sync losses over all recordings,
+        the recordings that failed with their errors and every service found, keyed by 'onid/tsid/sid'
+        so that the report can be written as JSON
+    """
+    report = {'files'      : len(summaries),
+              'packets'    : 0,
+              'cc_errors'  : 0,
+              'sync_losses': 0,
+              'elapsed'    : 0.0,
+              'failed'     : [],
+              'services'   : {}}
+    for summary in summaries:
+        report['packets'] += summary['packets']
+        report['cc_errors'] += sum(summary['cc_errors'].values())
+        report['sync_losses'] += summary['sync_losses']
+        report['elapsed'] += summary['elapsed']
+        if summary['error'] is not None:
+            report['failed'].append((summary['filename'], summary['error']))
+        for onid, tsid, sid, service_type, name in summary['services']:
+            key = '%d/%d/%d'%(onid, tsid, sid)
+            entry = report['services'].setdefault(key, {'type': service_type, 'name': name, 'files': []})
+            entry['files'].append(summary['filename'])
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan transport stream recordings in parallel')
+    parser.add_argument('files', nargs='+', help='recordings to scan')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--chunksize', type=int, default=1, help='recordings handed to a worker at a time')
+    parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                        help='recordings a worker scans before it is replaced')
+    parser.add_argument('--memory-limit', type=int, default=None, help='address space limit per worker in MB')
+    parser.add_argument('--max-packets', type=int, default=None, help='packets to scan per recording')
+    parser.add_argument('--json', action='store_true', help='write the summaries and report as JSON')
+    args = parser.parse_args(argv)
+
+    memory_limit = None
+    if args.memory_limit: memory_limit = args.memory_limit * 1024 * 1024
+    def progress(summary):
+        status = 'ok'
+        if summary['error']: status = summary['error']
+        sys.stderr.write('%s: %d packets in %0.1fs - %s\n'%(summary['filename'], summary['packets'],
+                                                            summary['elapsed'], status))
+    start = time.time()
+    summaries = scan_files(args.files, args.workers, args.chunksize, args.max_tasks_per_child, memory_limit,
+                           args.max_packets, progress)
+    report = merge_summaries(summaries)
+    report['wall_time'] = time.time() - start
+    if args.json:
+        json.dump({'report': report, 'summaries': summaries}, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print '%d files, %d packets, %d continuity errors, %d sync losses, %d services in %0.1fs'%(
+            report['files'], report['packets'], report['cc_errors'], report['sync_losses'],
+            len(report['services']), report['wall_time'])
+        for filename, error in report['failed']:
+            print 'FAILED %s: %s'%(filename, error)
+    if report['failed']: return 1
+    return 0
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 1: sys.exit(main())
+    print 'Testing batch_scan'
+    import os
+    import shutil
+    import tempfile
+    import unittest
+    from mpeg2psi import _known_tables as psi_tables
+    import packet_tools as pct
+
+    def write_recording(filename, packets):
+        pat = [0] + psi_tables.SAMPLE_PAT
+        f = open(filename, 'wb')
+        for cc in range(packets):
+            f.write(bytearray([pct.SYNC_BYTE, 0x40, 0x00, 0x10 | (cc & 0x0f)] + pat + [0xff] * (184 - len(pat))))
+        f.close()
+
+    class KnownBatch(unittest.TestCase):
+        def setUp(self):
+            self.tmp_dir = tempfile.mkdtemp()
+            self.files = []
+            for i in range(4):
+                filename = os.path.join(self.tmp_dir, 'rec%d.ts'%(i))
+                write_recording(filename, 10 * (i + 1))
+                self.files.append(filename)
+            self.files.append(os.path.join(self.tmp_dir, 'missing.ts'))
+
+        def tearDown(self):
+            shutil.rmtree(self.tmp_dir)
+
+        def check(self, summaries):
+            self.assertEqual(self.files, [summary['filename'] for summary in summaries])
+            self.assertEqual([10, 20, 30, 40, 0], [summary['packets'] for summary in summaries])
+            self.assertEqual(2003, summaries[0]['pat']['programs'][1696])
+            report = merge_summaries(summaries)
+            self.assertEqual(100, report['packets'])
+            self.assertEqual(0, report['cc_errors'])
+            self.assertEqual([self.files[-1]], [filename for filename, error in report['failed']])
+
+        def testSerial(self):
+            self.check(scan_files(self.files, workers=1))
+
+        def testPool(self):
+            seen = []
+            self.check(scan_files(self.files, workers=2, chunksize=2, max_tasks_per_child=1,
+                                  memory_limit=1024 * 1024 * 1024, callback=seen.append))
+            self.assertEqual(5, len(seen))
+
+        def testCli(self):
+            self.assertEqual(1, main(['-j', '2', '--max-packets', '5'] + self.files))
+
+    unittest.main()
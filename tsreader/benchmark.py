@@ -0,0 +1,338 @@
+'''
+    Benchmark suite.
+
+    Times the main paths of the package at small, medium and huge scales: raw TsReader ingestion of a synthetic
+    stream, SectionBuilder assembly of multi-packet SDT and NIT sections, parsing of each table type, descriptor
+    loop parsing and building a ServiceList from a NIT and its SDTs. Each scenario is set up once (not timed)
+    and then run a number of times; the best and median times and the rate of the best run are reported, and
+    the results can be written as JSON and compared with those of an earlier run to spot regressions between
+    releases.
+
+    With --profile the stages of the pipeline are profiled while the scenarios run (see mpeg2psi.profiling) and
+    written as a collapsed stack file for flame graph tools.
+
+    usage: python benchmark.py [--scale small,medium,huge] [--repeat N] [--filter NAME] [--json FILE]
+                               [--compare BASELINE [--tolerance 0.1]] [--profile COLLAPSED]
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+from collections import OrderedDict
+from StringIO import StringIO
+import packet_tools as pct
+from ts_reader import TsReader
+from section_builder import SectionBuilder
+from carousel import packetise
+from synthetic import make_stream, SDT_PID, NIT_PID
+from mpeg2psi import profiling
+from mpeg2psi.pat import Pat
+from mpeg2psi.pmt import Pmt
+from mpeg2psi import _known_tables as psi_tables
+from mpeg2psi.descriptors import get_descriptors, serialize_descriptors_into, get_descriptors_size
+from dvbsi.sdt import Sdt, ServiceDescription
+from dvbsi.nit import Nit
+from dvbsi.bat import Bat
+from dvbsi.bat_nit_base import TsItem
+from dvbsi.descriptors import ServiceDescriptor, ServiceListDescriptor, NetworkNameDescriptor
+from dvbsi.service_list import ServiceList
+from dvbsi import _known_tables as si_tables
+
+FORMAT_VERSION  = 1
+SCALES          = OrderedDict([('small', 1), ('medium', 10), ('huge', 100)]) # scale -> size factor
+DEFAULT_SCALES  = ('small', 'medium')
+DEFAULT_REPEAT  = 5
+STREAM_SECONDS  = 0.5  # seconds of 10 Mbit/s stream read by TsReader at the small scale
+SERVICES        = 50   # services in the service list at the small scale
+SERVICES_PER_TS = 20
+PARSES          = 200  # sections parsed at the small scale
+SECTION_LIMIT   = 1000 # NIT sections are filled with transport streams up to about this size
+NETWORK_ID      = 1
+
+def make_service_tables(services, services_per_ts=SERVICES_PER_TS):
+    """Builds a NIT listing the given number of services and the SDTs naming them
+
+    Returns:
+        (nit_sections, sdt_sections), one SDT section per transport stream
+    """
+    ts_items = []
+    sdts = []
+    for index, first in enumerate(range(0, services, services_per_ts)):
+        tsid = index + 1
+        ids = range(first + 1, min(first + services_per_ts, services) + 1)
+        ts_items.append(TsItem.create(tsid, NETWORK_ID, [ServiceListDescriptor.create([(sid, 0x19) for sid in ids])]))
+        sdts.append(Sdt.create(tsid, NETWORK_ID, [ServiceDescription.create(sid, [ServiceDescriptor.create(
+            0x19, u'Service %d'%(sid), u'Benchmark')]) for sid in ids]))
+    nits = []
+    for item in ts_items:
+        if not nits or nits[-1].get_size() + item.get_size() > SECTION_LIMIT:
+            nits.append(Nit.create(NETWORK_ID, [NetworkNameDescriptor.create(u'Benchmark network')], []))
+        nits[-1].ts_loop.append(item)
+    for number, nit in enumerate(nits):
+        nit.section_number = number
+        nit.last_section_number = len(nits) - 1
+    return nits, sdts
+
+def bench_ts_reader(factor):
+    '''raw TsReader ingestion, no buffers or handlers linked'''
+    data = make_stream(duration=STREAM_SECONDS * factor)
+    def run():
+        TsReader(StringIO(data)).run()
+    return run, len(data) // pct.PACKET_SIZE, 'packets'
+
+def _bench_builder(section_class, pid, sections):
+    data = packetise([section.to_bytes() for section in sections], pid)
+    packets = [data[offset:offset + pct.PACKET_SIZE] for offset in range(0, len(data), pct.PACKET_SIZE)]
+    def run():
+        builder = SectionBuilder(None, section_class)
+        for packet in packets:
+            builder.process_packet(packet)
+    return run, len(packets), 'packets'
+
+def bench_section_builder_sdt(factor):
+    '''SectionBuilder assembly of one SDT section per transport stream'''
+    return _bench_builder(Sdt, SDT_PID, make_service_tables(SERVICES * factor)[1])
+
+def bench_section_builder_nit(factor):
+    '''SectionBuilder assembly of a NIT of many sections'''
+    return _bench_builder(Nit, NIT_PID, make_service_tables(SERVICES * factor)[0])
+
+def _bench_parse(section_class, samples):
+    samples = [bytearray(sample) for sample in samples]
+    def run(count):
+        for index in xrange(count):
+            section_class(samples[index % len(samples)])
+    return run
+
+def _make_parse_bench(section_class, samples, doc):
+    def bench(factor):
+        count = PARSES * factor
+        run = _bench_parse(section_class, samples)
+        return (lambda: run(count)), count, 'sections'
+    bench.__doc__ = doc
+    return bench
+
+bench_parse_pat = _make_parse_bench(Pat, [psi_tables.SAMPLE_PAT], 'Pat parsing of the sample section')
+bench_parse_pmt = _make_parse_bench(Pmt, [psi_tables.SAMPLE_PMT], 'Pmt parsing of the sample section')
+bench_parse_sdt = _make_parse_bench(Sdt, [si_tables.SAMPLE_SDT], 'Sdt parsing of the sample section')
+bench_parse_nit = _make_parse_bench(Nit, [si_tables.SAMPLE_NIT_0, si_tables.SAMPLE_NIT_1],
+                                    'Nit parsing of the two sample sections')
+bench_parse_bat = _make_parse_bench(Bat, [si_tables.SAMPLE_BAT], 'Bat parsing of the sample section')
+
+def bench_descriptor_loop(factor):
+    '''get_descriptors over the descriptor loops of the sample NIT, BAT and SDT'''
+    loops = []
+    items = [Nit(bytearray(sample)) for sample in (si_tables.SAMPLE_NIT_0, si_tables.SAMPLE_NIT_1)]
+    items.append(Bat(bytearray(si_tables.SAMPLE_BAT)))
+    items.extend(Sdt(bytearray(si_tables.SAMPLE_SDT)).service_loop)
+    for section in items[:3]:
+        items.extend(section.ts_loop)
+    descriptors = 0
+    for item in items:
+        if not item.descriptors: continue
+        data = bytearray(get_descriptors_size(item.descriptors))
+        serialize_descriptors_into(item.descriptors, data, 0)
+        loops.append(data)
+        descriptors += len(item.descriptors)
+    count = factor * 10
+    def run():
+        for index in xrange(count):
+            for data in loops:
+                get_descriptors(data)
+    return run, descriptors * count, 'descriptors'
+
+def bench_service_list(factor):
+    '''ServiceList.update with a NIT and one SDT per transport stream'''
+    services = SERVICES * factor
+    nits, sdts = make_service_tables(services)
+    def run():
+        service_list = ServiceList()
+        for nit in nits:
+            service_list.update(nit=nit)
+        for sdt in sdts:
+            service_list.update(sdt=sdt)
+    return run, services, 'services'
+
+SCENARIOS = OrderedDict([
+    ('ts_reader',           bench_ts_reader),
+    ('section_builder_sdt', bench_section_builder_sdt),
+    ('section_builder_nit', bench_section_builder_nit),
+    ('parse_pat',           bench_parse_pat),
+    ('parse_pmt',           bench_parse_pmt),
+    ('parse_sdt',           bench_parse_sdt),
+    ('parse_nit',           bench_parse_nit),
+    ('parse_bat',           bench_parse_bat),
+    ('descriptor_loop',     bench_descriptor_loop),
+    ('service_list',        bench_service_list),
+])
+
+def run_scenario(name, scale, repeat=DEFAULT_REPEAT):
+    """Sets up and times one scenario
+
+    Arguments:
+        name   -- a key of SCENARIOS
+        scale  -- a key of SCALES
+        repeat -- number of timed runs (default DEFAULT_REPEAT)
+    Returns:
+        A dict of the results: name, scale, items and unit (work done by one run), repeat, best, median and
+        mean (seconds per run) and rate (items per second of the best run)
+    """
+    run, items, unit = SCENARIOS[name](SCALES[scale])
+    times = []
+    for index in range(repeat):
+        start = timeit.default_timer()
+        run()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    best = times[0]
+    result = OrderedDict()
+    result['name'] = name
+    result['scale'] = scale
+    result['items'] = items
+    result['unit'] = unit
+    result['repeat'] = repeat
+    result['best'] = best
+    result['median'] = times[len(times) // 2]
+    result['mean'] = sum(times) / len(times)
+    result['rate'] = items / best if best > 0 else 0.0
+    return result
+
+def run_benchmarks(names=None, scales=DEFAULT_SCALES, repeat=DEFAULT_REPEAT, callback=None):
+    """Runs every scenario (or the named ones) at each scale
+
+    Arguments:
+        names    -- list of scenario names, None for all of them (default None)
+        scales   -- list of scales (default DEFAULT_SCALES)
+        repeat   -- timed runs per scenario (default DEFAULT_REPEAT)
+        callback -- called with each result as soon as it is ready (default None)
+    Returns:
+        A dict with the format version, the Python version, the platform, the time and the list of results
+    """
+    if names is None: names = list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS: raise ValueError('unknown scenario %s'%(name))
+    for scale in scales:
+        if scale not in SCALES: raise ValueError('unknown scale %s'%(scale))
+    results = []
+    for scale in scales:
+        for name in names:
+            result = run_scenario(name, scale, repeat)
+            results.append(result)
+            if callback: callback(result)
+    report = OrderedDict()
+    report['format'] = FORMAT_VERSION
+    report['python'] = platform.python_version()
+    report['platform'] = platform.platform()
+    report['time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    report['results'] = results
+    return report
+
+def compare(baseline, report, tolerance=0.1):
+    """Finds the scenarios that got slower than in a baseline report
+
+    Arguments:
+        baseline  -- an earlier report, as returned by run_benchmarks() or loaded from its JSON
+        report    -- the report to check
+        tolerance -- share the best time may grow by before it counts as a regression (default 0.1)
+    Returns:
+        A list of (name, scale, baseline best, best, ratio) for each regression, worst first
+    """
+    old = {}
+    for result in baseline['results']:
+        old[result['name'], result['scale']] = result['best']
+    regressions = []
+    for result in report['results']:
+        before = old.get((result['name'], result['scale']))
+        if not before: continue
+        ratio = result['best'] / before
+        if ratio > 1.0 + tolerance:
+            regressions.append((result['name'], result['scale'], before, result['best'], ratio))
+    regressions.sort(key=lambda regression: -regression[4])
+    return regressions
+
+def format_result(result):
+    return '%-20s %-6s %10.3f ms best %10.3f ms median %14.1f %s/s'%(result['name'], result['scale'],
+        result['best'] * 1e3, result['median'] * 1e3, result['rate'], result['unit'])
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Times the main paths of the package')
+    parser.add_argument('--scale', default=','.join(DEFAULT_SCALES),
+                        help='comma separated scales out of %s (default %%(default)s)'%(', '.join(SCALES)))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed runs per scenario')
+    parser.add_argument('--filter', action='append', help='run only the scenarios whose name contains this')
+    parser.add_argument('--json', help='write the report to this file, - for stdout')
+    parser.add_argument('--compare', help='report of an earlier run to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slow down allowed by --compare')
+    parser.add_argument('--profile', help='profile the stages and write a collapsed stack file here')
+    options = parser.parse_args(args)
+    names = list(SCENARIOS)
+    if options.filter:
+        names = [name for name in names if any(part in name for part in options.filter)]
+    def show(result):
+        sys.stderr.write(format_result(result) + '\n')
+    if options.profile: profiling.enable()
+    try:
+        report = run_benchmarks(names, options.scale.split(','), options.repeat, show)
+    finally:
+        profiling.disable()
+    if options.profile:
+        profiling.PROFILE.write_collapsed(options.profile)
+        sys.stderr.write(str(profiling.PROFILE))
+    if options.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif options.json:
+        f = open(options.json, 'w')
+        json.dump(report, f, indent=2)
+        f.close()
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(baseline, report, options.tolerance)
+        for name, scale, before, after, ratio in regressions:
+            sys.stderr.write('REGRESSION %s %s: %0.3f ms -> %0.3f ms (x%0.2f)\n'%(name, scale, before * 1e3,
+                                                                                  after * 1e3, ratio))
+        if regressions: return 1
+    return 0
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
+    print 'Testing benchmark module'
+    import unittest
+
+    class KnownBenchmark(unittest.TestCase):
+        def testServiceTables(self):
+            nits, sdts = make_service_tables(130)
+            self.assertEqual(7, len(sdts))
+            service_list = ServiceList()
+            for nit in nits:
+                self.assertTrue(len(nit.to_bytes()) <= 1024)
+                service_list.update(nit=Nit(nit.to_bytes()))
+            for sdt in sdts:
+                service_list.update(sdt=Sdt(sdt.to_bytes()))
+            self.assertEqual(130, len(service_list.svl))
+            self.assertEqual('Service 130', service_list.svl[NETWORK_ID, 7, 130].name)
+
+        def testScenarios(self):
+            report = run_benchmarks(scales=['small'], repeat=1)
+            self.assertEqual(len(SCENARIOS), len(report['results']))
+            for result in report['results']:
+                self.assertTrue(result['items'] > 0, result['name'])
+                self.assertTrue(result['best'] > 0, result['name'])
+            report = json.loads(json.dumps(report))
+            self.assertEqual([], compare(report, report))
+            slower = json.loads(json.dumps(report))
+            slower['results'][0]['best'] *= 2
+            self.assertEqual([(report['results'][0]['name'], 'small')], [r[:2] for r in compare(report, slower)])
+            self.assertRaises(ValueError, run_benchmarks, ['no_such_scenario'])
+
+    unittest.main()
@@ -2,16 +2,26 @@
     Simple raw data buffer... buff those bytes :)
 '''
 
+import logging
 from threading import Lock, Thread
+from mpeg2psi import metrics
+
+LOG = logging.getLogger('tsreader.buffer')
+
+DEPTH      = metrics.gauge('buffer_depth_bytes', 'Bytes waiting in a buffer', ('buffer',))
+HIGH_WATER = metrics.gauge('buffer_high_water_bytes', 'Most bytes ever waiting in a buffer', ('buffer',))
+OVERFLOWS  = metrics.counter('buffer_overflows_total', 'Writes refused because a buffer was full', ('buffer',))
 
 class Buffer(object):
-    def __init__(self, size):
+    def __init__(self, size, name=None):
+        '''name labels the metrics of the buffer, TsReader.link() names it after its PID by default'''
         self.lock = Lock()
         self.data = []
         self.max_size = size
         self.size = 0
         self.linked = False
         self.empty = False
+        self.name = name
 
     def write(self, data):
         self.lock.acquire()
@@ -19,11 +29,15 @@ class Buffer(object):
         try:
             bytes = len(data)
             if self.size + bytes > self.max_size:
-                print 'buffer overflow'
+                if metrics.enabled: OVERFLOWS.inc(labels=(self.name,))
+                LOG.warning('buffer %s overflow, %d bytes held', self.name, self.size)
                 raise Exception
                 return 0
             self.size = self.size + bytes
             self.data.append(data)
+            if metrics.enabled:
+                DEPTH.set(self.size, (self.name,))
+                HIGH_WATER.set_max(self.size, (self.name,))
         finally:
             self.lock.release()
         return bytes
@@ -34,11 +48,12 @@ class Buffer(object):
         try:
             if self.size <= 0 and not self.linked:
                 self.empty = True
-                print "Buffer empty"
+                LOG.debug('buffer %s empty', self.name)
                 return -1
             if len(self.data) <= 0: return None
             data = self.data.pop(0)
             self.size = self.size - len(data)
+            if metrics.enabled: DEPTH.set(self.size, (self.name,))
         finally:
             self.lock.release()
         return data
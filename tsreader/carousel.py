@@ -0,0 +1,251 @@
+'''
+    SI carousel generator.
+
+    Tables (Pat, Pmt, Sdt, Nit or any other Section) are serialised with Section.to_bytes() and packed back to
+    back into 188 byte TS packets with pointer fields. The packets of a PID are cached per table version: a
+    table whose version and section numbers have not changed is not serialised again, and the packets of a
+    PID are only rebuilt when one of its tables changes. As the continuity counter runs on from one repetition
+    to the next, the cache keeps a copy of the packets for each counter value the repetition can start at (at
+    most 16), so after the first few cycles emitting a table costs a string copy.
+
+    As in DVB, a table is taken to be unchanged while its version is, so bump the version after editing it.
+'''
+
+import packet_tools as pct
+
+STUFFING_BYTE = 0xff
+PAYLOAD_SIZE  = pct.PACKET_SIZE - 4
+
+def packetise(sections, pid, cc=0):
+    """Packs serialised sections into TS packets
+
+    Sections follow each other without stuffing, a packet in which a section starts has the payload unit start
+    indicator set and a pointer field giving the offset of that section, and the last packet is stuffed with
+    0xff. The one exception is a section that would start in the last payload byte of a packet without a
+    pointer field: that byte is stuffed and the section starts the next packet.
+    Arguments:
+        sections -- list of serialised sections (bytearrays or strings)
+        pid      -- PID of the packets
+        cc       -- continuity counter of the first packet (default 0)
+    Returns:
+        The packets as one bytearray
+    """
+    data = bytearray()
+    starts = []
+    for section in sections:
+        starts.append(len(data))
+        data.extend(section)
+    packets = bytearray()
+    position = 0
+    next_start = 0 # index into starts of the next section to begin
+    while position < len(data):
+        while next_start < len(starts) and starts[next_start] < position: next_start += 1
+        header = bytearray([pct.SYNC_BYTE, (pid >> 8) & 0x1f, pid & 0xff, 0x10 | (cc & 0x0f)])
+        end = position + PAYLOAD_SIZE
+        # a pointer field is only possible if the section starts within this packet's payload, after it
+        if next_start < len(starts) and starts[next_start] - position < PAYLOAD_SIZE - 1:
+            header[1] |= 0x40
+            header.append(starts[next_start] - position)
+            end -= 1
+        elif next_start < len(starts) and starts[next_start] - position == PAYLOAD_SIZE - 1:
+            end = starts[next_start] # no room for the pointer, stuff the last byte and start it in the next packet
+        payload = data[position:end]
+        position += len(payload)
+        packets.extend(header)
+        packets.extend(payload)
+        packets.extend(bytearray([STUFFING_BYTE]) * (pct.PACKET_SIZE - len(header) - len(payload)))
+        cc += 1
+    return packets
+
+def get_version_key(sections):
+    '''identifies a version of a table: the table does not need serialising again while this key is the same'''
+    key = []
+    for section in sections:
+        key.append((section.table_id, section.table_id_extension, getattr(section, 'version', None),
+                    getattr(section, 'section_number', None), getattr(section, 'last_section_number', None),
+                    getattr(section, 'current_next_indicator', None)))
+    return tuple(key)
+
+class CarouselPid(object):
+    """The tables carried on one PID of a carousel and the cached packets for them
+
+    Statistics: encodes (tables serialised), packetisations (times the PID was packetised) and repetitions.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.tables = []     # table keys in the order they are sent
+        self.versions = {}   # table key -> version key
+        self.encoded = {}    # table key -> list of serialised sections
+        self.packets = None  # packets of one repetition starting at cc 0, None when a table changed
+        self.variants = {}   # starting cc -> packets of one repetition as a string
+        self.cc = 0
+        self.encodes = 0
+        self.packetisations = 0
+        self.repetitions = 0
+
+    def set_table(self, sections):
+        """Sets the sections of one table, serialising them only if the table version changed
+
+        Returns:
+            True if the table was serialised, False if the cached sections were kept
+        """
+        sections = list(sections)
+        key = (sections[0].table_id, sections[0].table_id_extension)
+        version = get_version_key(sections)
+        if self.versions.get(key) == version: return False
+        if key not in self.versions: self.tables.append(key)
+        self.versions[key] = version
+        self.encoded[key] = [section.to_bytes() for section in sections]
+        self.encodes += 1
+        self._invalidate()
+        return True
+
+    def remove_table(self, table_id, table_id_extension):
+        key = (table_id, table_id_extension)
+        if key not in self.versions: return
+        self.tables.remove(key)
+        del self.versions[key]
+        del self.encoded[key]
+        self._invalidate()
+
+    def _invalidate(self):
+        self.packets = None
+        self.variants = {}
+
+    def get_packets(self):
+        """Returns the packets of one repetition of every table on the PID, continuing the continuity counter"""
+        data = self.variants.get(self.cc)
+        if data is None:
+            if self.packets is None:
+                sections = []
+                for key in self.tables:
+                    sections.extend(self.encoded[key])
+                self.packets = packetise(sections, self.pid)
+                self.packetisations += 1
+            packets = bytearray(self.packets)
+            for index, offset in enumerate(xrange(3, len(packets), pct.PACKET_SIZE)):
+                packets[offset] = (packets[offset] & 0xf0) | ((self.cc + index) & 0x0f)
+            data = str(packets)
+            self.variants[self.cc] = data
+        self.cc = (self.cc + len(data) // pct.PACKET_SIZE) & 0x0f
+        self.repetitions += 1
+        return data
+
+class Carousel(object):
+    """An SI carousel over any number of PIDs
+
+    Tables are set with Carousel.set_table(); Carousel.get_packets() gives one repetition of a PID so that the
+    caller can repeat each PID at its own rate, Carousel.get_cycle() one repetition of every PID.
+    """
+    def __init__(self):
+        self.pids = {}
+
+    def set_table(self, pid, sections):
+        """Sets the sections of a table carried on the PID
+
+        A table is identified by its table ID and table ID extension; setting it again replaces it, and it is
+        only serialised again if its version (or its section numbers) changed.
+        Arguments:
+            pid      -- the PID carrying the table
+            sections -- a Section, or a list of the sections of one table
+        Returns:
+            True if the table was serialised, False if the cached copy was kept
+        """
+        if not isinstance(sections, (list, tuple)): sections = [sections]
+        if pid not in self.pids: self.pids[pid] = CarouselPid(pid)
+        return self.pids[pid].set_table(sections)
+
+    def remove_table(self, pid, table_id, table_id_extension):
+        if pid in self.pids: self.pids[pid].remove_table(table_id, table_id_extension)
+
+    def get_packets(self, pid):
+        """Returns one repetition of the tables on the PID as a string of TS packets"""
+        return self.pids[pid].get_packets()
+
+    def get_cycle(self):
+        """Returns one repetition of every PID, in PID order, as a string of TS packets"""
+        return ''.join([self.pids[pid].get_packets() for pid in sorted(self.pids)])
+
+    def write_cycle(self, fileobj):
+        fileobj.write(self.get_cycle())
+
+    def __str__(self):
+        res = 'Carousel:\n'
+        for pid in sorted(self.pids):
+            entry = self.pids[pid]
+            res += '\tpid[0x%x] - tables[%d], encodes[%d], packetisations[%d], repetitions[%d]\n'%(
+                pid, len(entry.tables), entry.encodes, entry.packetisations, entry.repetitions)
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing Carousel class'
+    import unittest
+    from scanner import StreamScanner, PAT_PID, NIT_PID, SDT_PID
+    from mpeg2psi.pat import Pat
+    from mpeg2psi.pmt import Pmt, PmtElementaryStream, STREAM_TYPE_H264_VIDEO
+    from mpeg2psi import _known_tables as psi_tables
+    from dvbsi.sdt import Sdt
+    from dvbsi.nit import Nit
+    from dvbsi import _known_tables as si_tables
+
+    def make_carousel():
+        carousel = Carousel()
+        carousel.set_table(PAT_PID, Pat(psi_tables.SAMPLE_PAT))
+        carousel.set_table(2003, Pmt(psi_tables.SAMPLE_PMT))
+        carousel.set_table(SDT_PID, Sdt(si_tables.SAMPLE_SDT))
+        carousel.set_table(NIT_PID, [Nit(si_tables.SAMPLE_NIT_0), Nit(si_tables.SAMPLE_NIT_1)])
+        return carousel
+
+    class KnownCarousel(unittest.TestCase):
+        def testPacketise(self):
+            sections = [bytearray([0x42] + [1] * 181), bytearray([0x42] + [2] * 9), bytearray([0x42] + [3] * 300)]
+            data = packetise(sections, 0x11, cc=15)
+            self.assertEqual(3 * pct.PACKET_SIZE, len(data))
+            self.assertEqual([0x47, 0x40, 0x11, 0x1f, 0], list(data[0:5]))
+            self.assertEqual(0x42, data[5 + 182]) # the second section starts in the last byte of the first packet
+            self.assertEqual([0x47, 0x40, 0x11, 0x10, 9], list(data[188:193])) # pointer to the third section
+            self.assertEqual(0x42, data[193 + 9])
+            self.assertEqual([0x47, 0x00, 0x11, 0x11], list(data[376:380]))
+            self.assertEqual(STUFFING_BYTE, data[-1])
+            # the second section would start in the last byte of a packet with no room for a pointer field
+            data = packetise(['A' * 366, 'B' * 10], 0x11)
+            self.assertEqual([0x40, 0x00, 0x40], [data[offset + 1] for offset in range(0, len(data), pct.PACKET_SIZE)])
+            self.assertEqual('A' * 183 + chr(STUFFING_BYTE), str(data[192:376]))
+            self.assertEqual([0, ord('B')], list(data[380:382]))
+
+        def testRoundTrip(self):
+            carousel = make_carousel()
+            scanner = StreamScanner()
+            for cycle in range(3):
+                data = bytearray(carousel.get_cycle())
+                for offset in range(0, len(data), pct.PACKET_SIZE):
+                    scanner.add_packet(data[offset:offset + pct.PACKET_SIZE])
+            summary = scanner.get_summary()
+            self.assertEqual({}, summary['cc_errors'])
+            self.assertEqual(2003, summary['pat']['programs'][1696])
+            self.assertEqual([(27, 2003), (4, 2004), (6, 2005), (4, 2006)], summary['pmts'][1010]['streams'])
+            self.assertEqual(13, len(summary['network']['transport_streams']))
+            self.assertTrue(len(summary['services']) > 0)
+
+        def testCache(self):
+            carousel = make_carousel()
+            for cycle in range(20):
+                carousel.get_cycle()
+            entry = carousel.pids[NIT_PID]
+            self.assertEqual(1, entry.encodes)
+            self.assertEqual(1, entry.packetisations)
+            self.assertFalse(carousel.set_table(NIT_PID, [Nit(si_tables.SAMPLE_NIT_0), Nit(si_tables.SAMPLE_NIT_1)]))
+            pat = Pat.create(16, {1: 0x100}) # replaces the sample PAT, same transport stream ID
+            self.assertTrue(carousel.set_table(PAT_PID, pat))
+            pat.table[2] = 0x200
+            self.assertFalse(carousel.set_table(PAT_PID, pat)) # same version, kept
+            pat.version += 1
+            self.assertTrue(carousel.set_table(PAT_PID, pat))
+            self.assertEqual({1: 0x100, 2: 0x200}, Pat(list(bytearray(carousel.get_packets(PAT_PID))[5:])).table)
+            carousel.set_table(0x100, Pmt.create(1, 0x101, [PmtElementaryStream.create(STREAM_TYPE_H264_VIDEO, 0x101)]))
+            self.assertEqual(pct.PACKET_SIZE, len(carousel.get_packets(0x100)))
+
+    unittest.main()
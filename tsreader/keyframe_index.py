@@ -0,0 +1,363 @@
+'''
+    Video random access point (keyframe) index.
+
+    Scans a recording for the start of I-frames on its video PIDs. Only packets with the payload start
+    flag or the random access indicator set are looked at; everything else is skipped after a two byte
+    header check, so building the index is much faster than a full demux. The index is written to a
+    compact binary sidecar next to the recording.
+'''
+
+import array
+import bisect
+import struct
+import sys
+import packet_tools as pct
+import adaptation_field_tools as aft
+import pes_tools
+from packet_index import VALUE_TYPECODE, READ_SIZE, PTS_WRAP, unwrap
+from mpeg2psi import pmt
+
+INDEX_MAGIC   = 'TSKF'
+INDEX_VERSION = 1
+
+# why a packet was recorded as a keyframe
+KF_RANDOM_ACCESS = int('00000001', 2) # random access indicator set in the adaptation field
+KF_CODED_IFRAME  = int('00000010', 2) # the video elementary stream starts an intra coded picture
+
+H264_NAL_SLICE     = 1
+H264_NAL_IDR_SLICE = 5
+HEVC_NAL_IRAP_MIN  = 16 # BLA_W_LP
+HEVC_NAL_IRAP_MAX  = 23 # RSV_IRAP_VCL23
+HEVC_NAL_VCL_MAX   = 31
+MPEG2_PICTURE_START = 0x00
+MPEG2_I_PICTURE     = 1
+
+_HEADER = struct.Struct('<4sBccI')
+_PID_HEADER = struct.Struct('<HBI')
+
+def _read_ue(data, bit):
+    '''reads an Exp-Golomb coded number from data starting at the given bit offset.
+    returns (value, next bit offset) or (None, bit) if data runs out'''
+    zeros = 0
+    nbits = len(data) * 8
+    while bit < nbits and not (data[bit >> 3] & (0x80 >> (bit & 7))):
+        zeros += 1
+        bit += 1
+    if bit + zeros >= nbits: return None, bit
+    bit += 1
+    value = 0
+    for i in xrange(zeros):
+        value = (value << 1) | ((data[bit >> 3] >> (7 - (bit & 7))) & 1)
+        bit += 1
+    return (1 << zeros) - 1 + value, bit
+
+def _find_start_codes(data):
+    '''yields the offset of the byte following every 00 00 01 start code in data'''
+    ln = len(data) - 3
+    i = 0
+    while i < ln:
+        if data[i + 2] > 1:
+            i += 3
+        elif data[i] == 0 and data[i + 1] == 0 and data[i + 2] == 1:
+            yield i + 3
+            i += 3
+        else:
+            i += 1
+
+def h264_is_keyframe(es_data):
+    '''Returns True, False or None (undecided) for the first coded slice found in the H.264 data'''
+    for offset in _find_start_codes(es_data):
+        nal_type = es_data[offset] & 0x1f
+        if nal_type == H264_NAL_IDR_SLICE: return True
+        if nal_type == H264_NAL_SLICE:
+            # first_mb_in_slice then slice_type; types 2, 4, 7 and 9 are I and SI slices
+            first_mb, bit = _read_ue(es_data[offset + 1:offset + 9], 0)
+            if first_mb is None: return None
+            slice_type, bit = _read_ue(es_data[offset + 1:offset + 9], bit)
+            if slice_type is None: return None
+            return slice_type % 5 in (2, 4)
+    return None
+
+def hevc_is_keyframe(es_data):
+    '''Returns True, False or None (undecided) for the first coded slice found in the HEVC data'''
+    for offset in _find_start_codes(es_data):
+        nal_type = (es_data[offset] >> 1) & 0x3f
+        if nal_type > HEVC_NAL_VCL_MAX: continue
+        return HEVC_NAL_IRAP_MIN <= nal_type <= HEVC_NAL_IRAP_MAX
+    return None
+
+def mpeg2_is_keyframe(es_data):
+    '''Returns True, False or None (undecided) for the first picture header found in MPEG-1/2 video data'''
+    for offset in _find_start_codes(es_data):
+        if es_data[offset] != MPEG2_PICTURE_START: continue
+        if offset + 2 >= len(es_data): return None
+        return ((es_data[offset + 2] >> 3) & 0x07) == MPEG2_I_PICTURE
+    return None
+
+KEYFRAME_DETECTORS = {pmt.STREAM_TYPE_MPEG1_VIDEO: mpeg2_is_keyframe,
+                      pmt.STREAM_TYPE_MPEG2_VIDEO: mpeg2_is_keyframe,
+                      pmt.STREAM_TYPE_H264_VIDEO : h264_is_keyframe,
+                      pmt.STREAM_TYPE_HEVC_VIDEO : hevc_is_keyframe}
+
+class VideoPidKeyframes(object):
+    """Keyframes found on a single video PID
+
+    Holds parallel arrays of packet offsets, unwrapped PTS values and KF_* flags for every keyframe.
+    """
+    def __init__(self, pid, stream_type):
+        self.pid = pid
+        self.stream_type = stream_type
+        self.offsets = array.array(VALUE_TYPECODE)
+        self.pts     = array.array(VALUE_TYPECODE)
+        self.flags   = array.array('B')
+        self.pending_rai = False
+        self._pts_raw   = None
+        self._pts_wraps = 0
+
+    def add_pes_start(self, packet, offset):
+        payload = pct.get_payload(packet)
+        pts = pes_tools.get_pts(payload)
+        if pts is None: # cannot be placed on the time line
+            self.pending_rai = False
+            return
+        value, self._pts_wraps = unwrap(pts, self._pts_raw, self._pts_wraps, PTS_WRAP)
+        self._pts_raw = pts
+        flags = 0
+        if self.pending_rai: flags |= KF_RANDOM_ACCESS
+        self.pending_rai = False
+        detector = KEYFRAME_DETECTORS.get(self.stream_type)
+        if detector is not None and detector(pes_tools.get_es_data(payload)):
+            flags |= KF_CODED_IFRAME
+        if not flags: return
+        self.offsets.append(offset)
+        self.pts.append(value)
+        self.flags.append(flags)
+
+    def find(self, pts):
+        """Returns (offset, pts) of the last keyframe at or before the given unwrapped PTS or None"""
+        i = bisect.bisect_right(self.pts, pts) - 1
+        if i < 0: return None
+        return int(self.offsets[i]), int(self.pts[i])
+
+    def _arrays(self):
+        return (self.offsets, self.pts, self.flags)
+
+    def __str__(self):
+        return 'pid[0x%x] stream type[0x%x] - %d keyframes\n'%(self.pid, self.stream_type, len(self.offsets))
+
+class KeyframeIndex(object):
+    """Keyframe index for the video PIDs of a recording
+
+    Video PIDs are registered with KeyframeIndex.add_pid() or taken from a parsed Pmt with
+    KeyframeIndex.add_pmt(). KeyframeIndex.build() then scans the recording.
+    """
+    def __init__(self):
+        self.pids = {}
+
+    def add_pid(self, pid, stream_type):
+        if pid not in self.pids:
+            self.pids[pid] = VideoPidKeyframes(pid, stream_type)
+
+    def add_pmt(self, pmt_section):
+        """Registers every video elementary stream in the given Pmt"""
+        for es in pmt_section.get_video_streams():
+            self.add_pid(es.pid, es.stream_type)
+
+    def add_packet(self, packet, offset):
+        """Process one packet. Only PUSI/RAI packets on registered PIDs do any work"""
+        pusi = packet[1] & 0x40
+        rai = (packet[3] & 0x20) and packet[4] > 0 and aft.random_access_flag(packet)
+        if not (pusi or rai): return
+        video = self.pids.get(((packet[1] & 0x1f) << 8) | packet[2])
+        if video is None: return
+        if rai: video.pending_rai = True
+        if pusi: video.add_pes_start(packet, offset)
+
+    def build(self, filename):
+        """Scans the given recording for keyframes on the registered PIDs"""
+        if not self.pids: return self
+        f = open(filename, 'rb')
+        try:
+            data = bytearray()
+            base = 0
+            while True:
+                block = f.read(READ_SIZE)
+                if not block: break
+                data.extend(block)
+                offset = 0
+                end = len(data) - pct.PACKET_SIZE
+                while offset <= end:
+                    if data[offset] != pct.SYNC_BYTE:
+                        synced = pct.find_sync(data, offset)
+                        if synced < 0:
+                            offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                            break
+                        offset = synced
+                        continue
+                    # cheap header peek, only PUSI and RAI packets are sliced out
+                    if (data[offset + 1] & 0x40) or ((data[offset + 3] & 0x20) and data[offset + 4] and
+                                                     (data[offset + 5] & 0x40)):
+                        self.add_packet(data[offset:offset + pct.PACKET_SIZE], base + offset)
+                    offset += pct.PACKET_SIZE
+                del data[:offset]
+                base += offset
+        finally:
+            f.close()
+        return self
+
+    def find_keyframe(self, pid, pts):
+        """Returns (offset, pts) of the last keyframe on the PID at or before the given unwrapped PTS"""
+        if pid not in self.pids: return None
+        return self.pids[pid].find(pts)
+
+    def save(self, filename):
+        """Saves the index to a sidecar file"""
+        f = open(filename, 'wb')
+        try:
+            byteorder = '<'
+            if sys.byteorder == 'big': byteorder = '>'
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, VALUE_TYPECODE, byteorder, len(self.pids)))
+            for pid in sorted(self.pids):
+                video = self.pids[pid]
+                f.write(_PID_HEADER.pack(pid, video.stream_type, len(video.offsets)))
+                for values in video._arrays():
+                    values.tofile(f)
+        finally:
+            f.close()
+
+    def load(cls, filename):
+        """Loads an index previously written by KeyframeIndex.save()"""
+        f = open(filename, 'rb')
+        try:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size: raise IOError('%s is not a keyframe index'%(filename))
+            magic, version, typecode, byteorder, pid_count = _HEADER.unpack(header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise IOError('%s is not a version %d keyframe index'%(filename, INDEX_VERSION))
+            if array.array(typecode).itemsize < 8 and typecode != 'd':
+                raise IOError('%s was written on a platform with 64 bit longs'%(filename))
+            swap = byteorder != ('>' if sys.byteorder == 'big' else '<')
+            index = cls()
+            for i in xrange(pid_count):
+                pid, stream_type, count = _PID_HEADER.unpack(f.read(_PID_HEADER.size))
+                video = VideoPidKeyframes(pid, stream_type)
+                video.offsets = array.array(typecode)
+                video.pts     = array.array(typecode)
+                for values in video._arrays():
+                    values.fromfile(f, count)
+                    if swap: values.byteswap()
+                index.pids[pid] = video
+            return index
+        finally:
+            f.close()
+
+    load = classmethod(load)
+
+    def __str__(self):
+        res = 'Keyframe Index:\n'
+        for pid in sorted(self.pids):
+            res += str(self.pids[pid])
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing KeyframeIndex class'
+    import os
+    import tempfile
+    import unittest
+
+    AUD = [0x00, 0x00, 0x00, 0x01, 0x09, 0xf0]
+    H264_IDR = AUD + [0x00, 0x00, 0x01, 0x65, 0x88, 0x84]
+    H264_I   = AUD + [0x00, 0x00, 0x01, 0x41, 0xb8, 0x00] # first_mb 0, slice_type 2
+    H264_P   = AUD + [0x00, 0x00, 0x01, 0x41, 0x98, 0x00] # first_mb 0, slice_type 5
+    HEVC_CRA = [0x00, 0x00, 0x01, 0x46, 0x01, 0x10, 0x00, 0x00, 0x01, 0x2a, 0x01, 0xaf]
+    HEVC_TRAIL = [0x00, 0x00, 0x01, 0x46, 0x01, 0x10, 0x00, 0x00, 0x01, 0x02, 0x01, 0xd0]
+
+    def make_pes_packet(pid, pts, es_data, rai=False):
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0:4] = bytearray([pct.SYNC_BYTE, 0x40 | (pid >> 8), pid & 0xff, 0x10])
+        offset = 4
+        if rai:
+            packet[3] = 0x30
+            packet[4:6] = bytearray([1, 0x40])
+            offset = 6
+        pes = [0, 0, 1, 0xe0, 0, 0, 0x80, 0x80, 5, 0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff,
+               ((pts >> 14) & 0xfe) | 1, (pts >> 7) & 0xff, ((pts << 1) & 0xfe) | 1]
+        data = bytearray(pes + es_data)
+        packet[offset:offset + len(data)] = data
+        return packet
+
+    class Detectors(unittest.TestCase):
+        def testH264(self):
+            self.assertEqual(True, h264_is_keyframe(H264_IDR))
+            self.assertEqual(True, h264_is_keyframe(H264_I))
+            self.assertEqual(False, h264_is_keyframe(H264_P))
+            self.assertEqual(None, h264_is_keyframe(AUD))
+
+        def testHevc(self):
+            self.assertEqual(True, hevc_is_keyframe(HEVC_CRA))
+            self.assertEqual(False, hevc_is_keyframe(HEVC_TRAIL))
+
+        def testMpeg2(self):
+            self.assertEqual(True, mpeg2_is_keyframe([0, 0, 1, 0xb3, 0x2d, 0, 0, 1, 0, 0x00, 0x0f, 0xff]))
+            self.assertEqual(False, mpeg2_is_keyframe([0, 0, 1, 0, 0x00, 0x17, 0xff]))
+
+    class KnownIndex(unittest.TestCase):
+        def setUp(self):
+            fd, self.ts_file = tempfile.mkstemp(suffix='.ts')
+            f = os.fdopen(fd, 'wb')
+            for i in range(100):
+                pts = i * 3600
+                if i % 10 == 0:
+                    f.write(make_pes_packet(0x200, pts, H264_IDR, rai=True))
+                elif i % 10 == 5:
+                    f.write(make_pes_packet(0x200, pts, H264_I))
+                else:
+                    f.write(make_pes_packet(0x200, pts, H264_P))
+                f.write(make_pes_packet(0x300, pts, HEVC_CRA if i % 20 == 0 else HEVC_TRAIL))
+            f.close()
+            self.sidecar = self.ts_file + '.kfi'
+
+        def tearDown(self):
+            os.remove(self.ts_file)
+            if os.path.exists(self.sidecar): os.remove(self.sidecar)
+
+        def testBuild(self):
+            index = KeyframeIndex()
+            index.add_pid(0x200, pmt.STREAM_TYPE_H264_VIDEO)
+            index.add_pid(0x300, pmt.STREAM_TYPE_HEVC_VIDEO)
+            index.build(self.ts_file)
+            self.assertEqual(20, len(index.pids[0x200].offsets))
+            self.assertEqual(5, len(index.pids[0x300].offsets))
+            self.assertEqual(KF_RANDOM_ACCESS | KF_CODED_IFRAME, index.pids[0x200].flags[0])
+            self.assertEqual(KF_CODED_IFRAME, index.pids[0x200].flags[1])
+            self.assertEqual((15 * 2 * 188, 15 * 3600), index.find_keyframe(0x200, 17 * 3600))
+            self.assertEqual((40 * 2 * 188 + 188, 40 * 3600), index.find_keyframe(0x300, 59 * 3600))
+
+        def testSaveLoad(self):
+            index = KeyframeIndex()
+            index.add_pid(0x200, pmt.STREAM_TYPE_H264_VIDEO)
+            index.build(self.ts_file).save(self.sidecar)
+            loaded = KeyframeIndex.load(self.sidecar)
+            self.assertEqual(pmt.STREAM_TYPE_H264_VIDEO, loaded.pids[0x200].stream_type)
+            for a, b in zip(index.pids[0x200]._arrays(), loaded.pids[0x200]._arrays()):
+                self.assertEqual(list(a), list(b))
+
+        def testSynthetic(self):
+            from synthetic import SyntheticStream
+            fd, filename = tempfile.mkstemp(suffix='.ts')
+            f = os.fdopen(fd, 'wb')
+            SyntheticStream(programs=1).write(f, duration=1.0)
+            f.close()
+            try:
+                index = KeyframeIndex()
+                index.add_pid(0x111, pmt.STREAM_TYPE_H264_VIDEO)
+                keyframes = index.build(filename).pids[0x111]
+                self.assertTrue(len(keyframes.offsets) > 1)
+                self.assertEqual(KF_RANDOM_ACCESS | KF_CODED_IFRAME, keyframes.flags[0])
+            finally:
+                os.remove(filename)
+
+    unittest.main()
@@ -0,0 +1,186 @@
+'''
+    Real time pacing of a transport stream replay.
+
+    A Pacer wraps any iterable of packets (a Source, a PcapSource, a list) and hands them out at the native
+    bitrate of the stream, or at a multiple of it, instead of as fast as they can be read. The bitrate is
+    taken from the PCR of the stream, or given. Packets are released in slices of a few milliseconds with a
+    single precise sleep per slice rather than a sleep per packet, and the achieved rate is measured against
+    the target so a consumer that cannot keep up shows as late slices.
+
+    The same pacer drives the threaded path, TsReader(file, pacer=Pacer()), and the synchronous one,
+    StreamScanner.scan_packets(pacer.pace(packets)).
+
+    usage: python pacer.py FILE [SPEED [BITRATE]] > output.ts
+'''
+
+import time
+import packet_tools as pct
+from packet_index import PCR_HZ, PCR_WRAP
+import adaptation_field_tools as aft
+
+SLICE_TIME  = 0.005 # seconds of stream released per sleep
+SPIN_TIME   = 0.001 # the end of each wait is spun rather than slept, sleep() overshoots by about this much
+MAX_PCR_GAP = PCR_HZ # PCR steps over a second, or backwards, are discontinuities and do not change the rate
+PACKET_BITS = pct.PACKET_SIZE * 8
+
+class Pacer(object):
+    """Paces packets at the bitrate of the stream
+
+    Until the bitrate is known (two PCRs on the PCR PID) packets are released without delay. With a variable
+    bitrate the rate measured over the last PCR interval is used for the packets that follow it.
+    Statistics: packets, slices, late_slices (slices released more than a slice late), max_lateness (seconds),
+    get_target_rate() and get_achieved_rate() in bits per second.
+    """
+    def __init__(self, speed=1.0, bitrate=None, pcr_pid=None, slice_time=SLICE_TIME):
+        """Constructor
+
+        Arguments:
+            speed      -- multiple of the native rate to replay at (default 1.0)
+            bitrate    -- native rate in bits per second, None measures it from the PCR (default None)
+            pcr_pid    -- PID whose PCR is used, None uses the first PID carrying a PCR (default None)
+            slice_time -- seconds of stream released per sleep (default SLICE_TIME)
+        """
+        self.speed = speed
+        self.bitrate = bitrate
+        self.pcr_pid = pcr_pid
+        self.slice_time = slice_time
+        self.stopped = False
+        self.packets = 0
+        self.slices = 0
+        self.late_slices = 0
+        self.max_lateness = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.stream_time = 0.0
+        self._pcr = None
+        self._pcr_packet = 0
+
+    def add_pcr(self, pcr):
+        '''measures the bitrate from the packets sent since the previous PCR, pcr is the 27MHz value'''
+        if self._pcr is not None:
+            delta = (pcr - self._pcr) % PCR_WRAP
+            packets = self.packets - self._pcr_packet
+            if 0 < delta < MAX_PCR_GAP and packets:
+                self.bitrate = float(packets * PACKET_BITS * PCR_HZ) / delta
+        self._pcr = pcr
+        self._pcr_packet = self.packets
+
+    def _wait(self, stream_time):
+        '''sleeps until the wall clock time the given stream time is due at'''
+        due = self.start_time + stream_time / self.speed
+        delay = due - time.time()
+        if delay < -self.slice_time:
+            self.late_slices += 1
+            self.max_lateness = max(self.max_lateness, -delay)
+            return
+        if delay > SPIN_TIME: time.sleep(delay - SPIN_TIME)
+        while time.time() < due: pass
+
+    def pace(self, packets):
+        """Yields the packets, each one no earlier than its time in the stream"""
+        measure = self.bitrate is None
+        slice_end = 0.0
+        self.start_time = time.time()
+        for packet in packets:
+            if self.stopped: break
+            if measure and packet[3] & 0x20 and packet[4] > 0 and aft.pcr_flag(packet):
+                pid = pct.get_pid(packet)
+                if self.pcr_pid is None: self.pcr_pid = pid
+                if pid == self.pcr_pid: self.add_pcr(aft.get_pcr(packet).to_27mhz())
+            if self.stream_time >= slice_end:
+                self._wait(self.stream_time)
+                self.slices += 1
+                slice_end = self.stream_time + self.slice_time
+            self.packets += 1
+            yield packet
+            if self.bitrate: self.stream_time += float(PACKET_BITS) / self.bitrate
+        self.end_time = time.time()
+
+    def stop(self):
+        self.stopped = True
+
+    def get_target_rate(self):
+        if not self.bitrate: return 0.0
+        return self.bitrate * self.speed
+
+    def get_achieved_rate(self):
+        if self.start_time is None: return 0.0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        if elapsed <= 0: return 0.0
+        return float(self.packets * PACKET_BITS) / elapsed
+
+    def __str__(self):
+        return 'Pacer: packets[%d] in [%d] slices, target[%0.3f Mbit/s], achieved[%0.3f Mbit/s], late slices[%d] (worst %0.3fs)'%(
+            self.packets, self.slices, self.get_target_rate() / 1e6, self.get_achieved_rate() / 1e6,
+            self.late_slices, self.max_lateness)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        from source import Source
+        speed = 1.0
+        bitrate = None
+        if len(sys.argv) > 2: speed = float(sys.argv[2])
+        if len(sys.argv) > 3: bitrate = float(sys.argv[3])
+        pacer = Pacer(speed, bitrate)
+        try:
+            for packet in pacer.pace(Source(sys.argv[1])):
+                sys.stdout.write(packet)
+        except (KeyboardInterrupt, IOError):
+            pass
+        sys.stderr.write(str(pacer) + '\n')
+        sys.exit(0)
+
+    print 'Testing Pacer class'
+    import unittest
+    from StringIO import StringIO
+    from ts_reader import TsReader
+    from scanner import StreamScanner
+
+    def make_cbr_stream(count, pcr_every=10, packets_per_second=1000):
+        '''packets on PID 0x100 with a PCR every pcr_every packets'''
+        packets = []
+        ticks = PCR_HZ // packets_per_second
+        for i in range(count):
+            packet = bytearray([pct.SYNC_BYTE, 0x01, 0x00, 0x10 | (i & 0x0f)] + [0xff] * 184)
+            if i % pcr_every == 0:
+                base, extension = divmod(PCR_WRAP - 100 * ticks + i * ticks, 300) # wraps half way
+                base %= 1 << 33
+                packet[3] |= 0x20
+                packet[4:12] = bytearray([7, 0x10, base >> 25, (base >> 17) & 0xff, (base >> 9) & 0xff,
+                                          (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (extension >> 8),
+                                          extension & 0xff])
+            packets.append(packet)
+        return packets
+
+    class KnownPacer(unittest.TestCase):
+        def testNativeRate(self):
+            pacer = Pacer()
+            start = time.time()
+            self.assertEqual(300, len(list(pacer.pace(make_cbr_stream(300)))))
+            elapsed = time.time() - start
+            self.assertAlmostEqual(1000 * PACKET_BITS, pacer.bitrate, 3)
+            self.assertTrue(0.28 < elapsed < 0.4, elapsed) # the 10 packets before the rate is known are not paced
+            self.assertTrue(abs(pacer.get_achieved_rate() / pacer.get_target_rate() - 1) < 0.1)
+            self.assertTrue(pacer.slices < 100)
+
+        def testSpeed(self):
+            pacer = Pacer(speed=3.0, bitrate=1000 * PACKET_BITS)
+            start = time.time()
+            list(pacer.pace(make_cbr_stream(300, pcr_every=1000)))
+            self.assertTrue(0.09 < time.time() - start < 0.2)
+            self.assertEqual(3000 * PACKET_BITS, pacer.get_target_rate())
+
+        def testPaths(self):
+            reader = TsReader(StringIO(''.join([str(packet) for packet in make_cbr_stream(100)])), pacer=Pacer(speed=2.0))
+            reader.start()
+            reader.join()
+            self.assertEqual(100, reader.pids[0x100])
+            self.assertEqual(100, reader.pacer.packets)
+            scanner = StreamScanner().scan_packets(Pacer(speed=2.0).pace(make_cbr_stream(100)))
+            self.assertEqual(100, scanner.pid_counts[0x100])
+
+    unittest.main()
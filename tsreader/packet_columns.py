@@ -0,0 +1,242 @@
+'''
+    Columnar export of packet level statistics.
+
+    Every packet of a recording (or one in every interval packets) becomes a row of typed columns: its byte
+    offset, PID, continuity counter, payload unit start flag, scrambling control and its PCR. The rows are
+    collected in array.array columns of a fixed batch size and each full batch is written out and the arrays
+    emptied, so a recording of any length is exported in bounded memory.
+
+    The file is a header followed by the batches. The header is the magic 'TSPC', a format version byte, the
+    column count and per column the length of its name, the name and its array type code. Each batch is its
+    row count (32 bits) followed by every column as a contiguous little endian buffer of that many values.
+    These are the same buffers Arrow and Parquet use for non nullable primitive columns, so a batch loads
+    without conversion, eg. numpy.frombuffer(buffer, '<u2') for the PID or pyarrow.Array.from_buffers() for
+    a record batch; the PCR is only meaningful where has_pcr is 1, which is the validity bitmap to give it.
+
+    usage: python packet_columns.py RECORDING OUTPUT [INTERVAL]   (RECORDING may be '-' for stdin or a pipe)
+'''
+
+import array
+import struct
+import sys
+import packet_tools as pct
+import adaptation_field_tools as aft
+from packet_index import VALUE_TYPECODE
+from source import Source
+
+MAGIC          = 'TSPC'
+FORMAT_VERSION = 1
+BATCH_SIZE     = 65536
+
+COLUMNS = (('offset',     VALUE_TYPECODE),
+           ('pid',        'H'),
+           ('cc',         'B'),
+           ('pusi',       'B'),
+           ('scrambling', 'B'),
+           ('has_pcr',    'B'),
+           ('pcr',        VALUE_TYPECODE))
+
+_HEADER = struct.Struct('<4sBB')
+_BATCH  = struct.Struct('<I')
+
+class PacketColumnWriter(object):
+    """Collects packet statistics in column arrays and writes them out a batch at a time
+
+    Feed packets with PacketColumnWriter.add_packet() or a whole recording with PacketColumnWriter.scan(),
+    then call close() to write the last, partial, batch.
+    """
+    def __init__(self, fileobj, batch_size=BATCH_SIZE, interval=1):
+        """Constructor
+
+        Arguments:
+            fileobj    -- open file to write the columns to
+            batch_size -- number of rows written at a time, which bounds the memory used (default BATCH_SIZE)
+            interval   -- record one packet in every interval packets (default 1)
+        """
+        self.fileobj    = fileobj
+        self.batch_size = batch_size
+        self.interval   = interval
+        self.columns    = [array.array(typecode) for name, typecode in COLUMNS]
+        self.packet_count = 0
+        self.row_count    = 0
+        self.batch_count  = 0
+        fileobj.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(COLUMNS)))
+        for name, typecode in COLUMNS:
+            fileobj.write(chr(len(name)) + name + typecode)
+
+    def add_packet(self, packet, offset):
+        """Records a single packet found at the given byte offset in the recording"""
+        self.packet_count += 1
+        if self.interval > 1 and (self.packet_count - 1) % self.interval: return
+        offsets, pids, ccs, pusis, scramblings, has_pcrs, pcrs = self.columns
+        offsets.append(offset)
+        pids.append(((packet[1] & 0x1f) << 8) | packet[2])
+        ccs.append(packet[3] & 0x0f)
+        pusis.append((packet[1] & 0x40) >> 6)
+        scramblings.append(packet[3] >> 6)
+        if (packet[3] & 0x20) and packet[4] > 0 and aft.pcr_flag(packet):
+            has_pcrs.append(1)
+            pcrs.append(aft.get_pcr(packet).to_27mhz())
+        else:
+            has_pcrs.append(0)
+            pcrs.append(0)
+        if len(offsets) >= self.batch_size: self.flush()
+
+    def scan(self, input):
+        """Records every packet of a recording
+
+        Arguments:
+            input -- a source.Source or anything Source accepts: a path, '-' for stdin, an open file object
+                     or a file descriptor. A Source created here is closed at the end of the input
+        """
+        source = input
+        if not isinstance(source, Source): source = Source(input)
+        try:
+            for offset, packet in source.iter_packets():
+                self.add_packet(packet, offset)
+        finally:
+            if source is not input: source.close()
+        return self
+
+    def flush(self):
+        """Writes the rows collected so far as a batch"""
+        rows = len(self.columns[0])
+        if rows == 0: return
+        self.fileobj.write(_BATCH.pack(rows))
+        for column in self.columns:
+            if sys.byteorder == 'big': column.byteswap()
+            self.fileobj.write(column.tostring())
+            del column[:]
+        self.row_count += rows
+        self.batch_count += 1
+
+    def close(self):
+        self.flush()
+
+    def __str__(self):
+        return 'PacketColumnWriter: packets[%d], rows[%d], batches[%d]'%(self.packet_count, self.row_count,
+                                                                         self.batch_count)
+
+def read_batches(fileobj):
+    """Reads the batches written by a PacketColumnWriter
+
+    Arguments:
+        fileobj -- open file to read from
+    Returns:
+        A generator of dicts {column name: array.array}, one per batch
+    Raises:
+        IOError if the file is not a packet column file, is truncated or the platform cannot hold its columns
+    """
+    header = fileobj.read(_HEADER.size)
+    if len(header) < _HEADER.size: raise IOError('not a packet column file')
+    magic, version, count = _HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise IOError('not a version %d packet column file'%(FORMAT_VERSION))
+    columns = []
+    for index in range(count):
+        name = fileobj.read(ord(fileobj.read(1)))
+        typecode = fileobj.read(1)
+        if array.array(typecode).itemsize < 8 and typecode not in 'HBd':
+            raise IOError('the file was written on a platform with 64 bit longs')
+        columns.append((name, typecode))
+    while True:
+        data = fileobj.read(_BATCH.size)
+        if len(data) < _BATCH.size: break
+        rows = _BATCH.unpack(data)[0]
+        batch = {}
+        for name, typecode in columns:
+            column = array.array(typecode)
+            data = fileobj.read(rows * column.itemsize)
+            if len(data) < rows * column.itemsize: raise IOError('the packet column file is truncated')
+            column.fromstring(data)
+            if sys.byteorder == 'big': column.byteswap()
+            batch[name] = column
+        yield batch
+
+def export_file(input, output, batch_size=BATCH_SIZE, interval=1):
+    """Exports the packet statistics of a recording (anything a source.Source accepts, eg. a path or '-'),
+    returns the PacketColumnWriter used"""
+    out = open(output, 'wb')
+    try:
+        writer = PacketColumnWriter(out, batch_size, interval)
+        writer.scan(input)
+        writer.close()
+    finally:
+        out.close()
+    return writer
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        interval = 1
+        if len(sys.argv) > 3: interval = int(sys.argv[3])
+        print export_file(sys.argv[1], sys.argv[2], interval=interval)
+        sys.exit(0)
+
+    print 'Testing PacketColumnWriter class'
+    import unittest
+    from StringIO import StringIO
+
+    def make_packet(pid, cc, pusi=False, pcr=None, scrambling=0):
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0] = pct.SYNC_BYTE
+        packet[1] = (pid >> 8) & 0x1f
+        if pusi: packet[1] |= 0x40
+        packet[2] = pid & 0xff
+        packet[3] = (scrambling << 6) | 0x10 | cc
+        if pcr is not None:
+            base, ext = pcr // 300, pcr % 300
+            packet[3] |= 0x20
+            packet[4:12] = bytearray([7, 0x10, (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+                                      (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (ext >> 8), ext & 0xff])
+        return packet
+
+    class KnownPacketColumns(unittest.TestCase):
+        def setUp(self):
+            self.recording = '\x00' * 5 # junk before the first packet to exercise resync
+            for i in range(250):
+                if i % 10 == 0:
+                    self.recording += str(make_packet(0x100, i & 0x0f, pcr=i * 27000))
+                else:
+                    self.recording += str(make_packet(0x101, i & 0x0f, pusi=(i % 25 == 1), scrambling=2))
+
+        def export(self, batch_size=BATCH_SIZE, interval=1):
+            output = StringIO()
+            writer = PacketColumnWriter(output, batch_size, interval).scan(StringIO(self.recording))
+            writer.close()
+            return writer, list(read_batches(StringIO(output.getvalue())))
+
+        def testColumns(self):
+            writer, batches = self.export()
+            self.assertEqual(1, len(batches))
+            self.assertEqual(250, writer.row_count)
+            batch = batches[0]
+            self.assertEqual(sorted([name for name, typecode in COLUMNS]), sorted(batch))
+            self.assertEqual([5 + i * pct.PACKET_SIZE for i in range(250)], list(batch['offset']))
+            self.assertEqual([i & 0x0f for i in range(250)], list(batch['cc']))
+            self.assertEqual([0x100, 0x101, 0x101], list(batch['pid'][:3]))
+            self.assertEqual(10, sum(batch['pusi']))
+            self.assertEqual([0, 2], list(batch['scrambling'][:2]))
+            self.assertEqual(25, sum(batch['has_pcr']))
+            self.assertEqual([270000, 0], list(batch['pcr'][10:12]))
+
+        def testBatches(self):
+            writer, batches = self.export(batch_size=100)
+            self.assertEqual([100, 100, 50], [len(batch['pid']) for batch in batches])
+            self.assertEqual(3, writer.batch_count)
+            self.assertEqual(5 + 200 * pct.PACKET_SIZE, batches[2]['offset'][0])
+            writer, batches = self.export(interval=10)
+            self.assertEqual(25, writer.row_count)
+            self.assertEqual([0x100] * 25, list(batches[0]['pid']))
+
+        def testDamaged(self):
+            self.assertRaises(IOError, list, read_batches(StringIO('XXXX')))
+            self.assertRaises(IOError, list, read_batches(StringIO('XXXX\x01\x07')))
+            output = StringIO()
+            writer = PacketColumnWriter(output).scan(StringIO(self.recording))
+            writer.close()
+            self.assertRaises(IOError, list, read_batches(StringIO(output.getvalue()[:-10])))
+
+    unittest.main()
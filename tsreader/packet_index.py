@@ -0,0 +1,368 @@
+'''
+    Random access index for large transport stream recordings.
+
+    A recording is scanned once and, per PID, the byte offsets of payload start packets, PCR values and
+    (optionally) PES PTS values are recorded in flat arrays. The index can be saved to a compact sidecar
+    file so that seeking to a time, PTS or section becomes a binary search followed by a single read.
+'''
+
+import array
+import bisect
+import struct
+import sys
+import packet_tools as pct
+import adaptation_field_tools as aft
+import pes_tools
+
+INDEX_MAGIC   = 'TSIX'
+INDEX_VERSION = 1
+READ_SIZE     = pct.PACKET_SIZE * 5000
+PCR_HZ        = 27000000
+PTS_HZ        = 90000
+PCR_WRAP      = (1 << 33) * 300
+PTS_WRAP      = pes_tools.PTS_WRAP
+
+# offsets in a 20GB file and unwrapped PCRs need 64 bits. Python 2 arrays have no 'q' type code
+# so use unsigned long where it is 64 bits wide and fall back to doubles (exact to 2**53) elsewhere
+if array.array('L').itemsize >= 8:
+    VALUE_TYPECODE = 'L'
+else:
+    VALUE_TYPECODE = 'd'
+
+_HEADER = struct.Struct('<4sBccBIQI')
+_PID_HEADER = struct.Struct('<HIII')
+
+def unwrap(value, last, wraps, wrap):
+    '''returns (unwrapped value, wrap count) for a counter that wraps at wrap'''
+    if last is not None:
+        if value < last - (wrap >> 1):
+            wraps += 1
+        elif value > last + (wrap >> 1) and wraps > 0:
+            wraps -= 1
+    return value + wraps * wrap, wraps
+
+class PidIndex(object):
+    """Index entries for a single PID
+
+    Holds parallel arrays of byte offsets and values for payload start packets, PCRs and PTSs seen
+    on one PID. PCR and PTS values are unwrapped so that the value arrays only increase and can be
+    searched with bisect.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.pusi_offsets = array.array(VALUE_TYPECODE)
+        self.pcr_offsets  = array.array(VALUE_TYPECODE)
+        self.pcr_values   = array.array(VALUE_TYPECODE)
+        self.pts_offsets  = array.array(VALUE_TYPECODE)
+        self.pts_values   = array.array(VALUE_TYPECODE)
+        self._last_pusi = None
+        self._last_pcr  = None
+        self._last_pts  = None
+        self._pcr_raw   = None
+        self._pcr_wraps = 0
+        self._pts_raw   = None
+        self._pts_wraps = 0
+
+    def add_pusi(self, offset, spacing):
+        if self._last_pusi is not None and offset - self._last_pusi < spacing: return
+        self.pusi_offsets.append(offset)
+        self._last_pusi = offset
+
+    def add_pcr(self, offset, pcr, spacing):
+        value, self._pcr_wraps = unwrap(pcr, self._pcr_raw, self._pcr_wraps, PCR_WRAP)
+        self._pcr_raw = pcr
+        if self._last_pcr is not None and offset - self._last_pcr < spacing: return
+        self.pcr_offsets.append(offset)
+        self.pcr_values.append(value)
+        self._last_pcr = offset
+
+    def add_pts(self, offset, pts, spacing):
+        value, self._pts_wraps = unwrap(pts, self._pts_raw, self._pts_wraps, PTS_WRAP)
+        self._pts_raw = pts
+        if self._last_pts is not None and offset - self._last_pts < spacing: return
+        self.pts_offsets.append(offset)
+        self.pts_values.append(value)
+        self._last_pts = offset
+
+    def find_pcr(self, pcr):
+        """Returns the offset of the last indexed PCR at or before the given (unwrapped) PCR value or None"""
+        i = bisect.bisect_right(self.pcr_values, pcr) - 1
+        if i < 0: return None
+        return int(self.pcr_offsets[i])
+
+    def find_pts(self, pts):
+        """Returns the offset of the last indexed PTS at or before the given (unwrapped) PTS value or None"""
+        i = bisect.bisect_right(self.pts_values, pts) - 1
+        if i < 0: return None
+        return int(self.pts_offsets[i])
+
+    def _arrays(self):
+        return (self.pusi_offsets, self.pcr_offsets, self.pcr_values, self.pts_offsets, self.pts_values)
+
+    def __str__(self):
+        res = 'pid[0x%x] - pusi[%d], pcr[%d], pts[%d]\n'%(self.pid, len(self.pusi_offsets),
+                                                         len(self.pcr_offsets), len(self.pts_offsets))
+        return res
+
+class PacketIndex(object):
+    """Random access index for a transport stream recording
+
+    Build the index with PacketIndex.build() (or feed packets with PacketIndex.add_packet() from another
+    scanner), then save it next to the recording with PacketIndex.save(). PacketIndex.load() restores it
+    without rescanning the recording.
+    """
+    def __init__(self, granularity=1, index_pts=False, pids=None):
+        """Constructor
+
+        Arguments:
+            granularity -- minimum distance, in packets, between two recorded entries of the same kind
+                           on the same PID. 1 records every entry (default 1)
+            index_pts   -- also record the PTS of every PES header (default False)
+            pids        -- iterable of PIDs to index. None indexes every PID (default None)
+        """
+        self.granularity = granularity
+        self.index_pts   = index_pts
+        self.pid_filter  = None
+        if pids is not None: self.pid_filter = set(pids)
+        self.pids = {}
+        self.packet_count = 0
+
+    def _get_pid_index(self, pid):
+        pid_index = self.pids.get(pid)
+        if pid_index is None:
+            pid_index = PidIndex(pid)
+            self.pids[pid] = pid_index
+        return pid_index
+
+    def add_packet(self, packet, offset):
+        """Index a single packet found at the given byte offset in the recording"""
+        self.packet_count += 1
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        if self.pid_filter is not None and pid not in self.pid_filter: return
+        pusi = packet[1] & 0x40
+        af = (packet[3] & 0x30) >> 4
+        has_pcr = (af & pct.AF_ADAPTATION_FIELD_ONLY) and packet[4] > 0 and aft.pcr_flag(packet)
+        if not (pusi or has_pcr): return
+        spacing = self.granularity * pct.PACKET_SIZE
+        pid_index = self._get_pid_index(pid)
+        if has_pcr:
+            pid_index.add_pcr(offset, aft.get_pcr(packet).to_27mhz(), spacing)
+        if pusi:
+            pid_index.add_pusi(offset, spacing)
+            if self.index_pts and (af & pct.AF_PAYLOAD_ONLY):
+                pts = pes_tools.get_pts(pct.get_payload(packet))
+                if pts is not None:
+                    pid_index.add_pts(offset, pts, spacing)
+
+    def build(self, filename):
+        """Scan the given recording and index every packet in it
+
+        The recording is read in large blocks. If sync is lost the scan resumes at the next offset where
+        three consecutive sync bytes are found.
+        """
+        f = open(filename, 'rb')
+        try:
+            data = bytearray()
+            base = 0 # file offset of data[0]
+            while True:
+                block = f.read(READ_SIZE)
+                if not block: break
+                data.extend(block)
+                offset = 0
+                end = len(data) - pct.PACKET_SIZE
+                while offset <= end:
+                    if data[offset] != pct.SYNC_BYTE:
+                        synced = pct.find_sync(data, offset)
+                        if synced < 0:
+                            # keep the tail, the next sync may be split across reads
+                            offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                            break
+                        offset = synced
+                        continue
+                    self.add_packet(data[offset:offset + pct.PACKET_SIZE], base + offset)
+                    offset += pct.PACKET_SIZE
+                del data[:offset]
+                base += offset
+        finally:
+            f.close()
+        return self
+
+    def get_pcr_pid(self):
+        """Returns the PID with the most PCR entries, which is used as the time base for seeks"""
+        best, count = None, 0
+        for pid in self.pids:
+            n = len(self.pids[pid].pcr_values)
+            if n > count: best, count = pid, n
+        return best
+
+    def seek_pcr(self, pcr, pid=None):
+        """Returns the offset of the last PCR packet at or before the given unwrapped 27MHz PCR value"""
+        if pid is None: pid = self.get_pcr_pid()
+        if pid not in self.pids: return None
+        return self.pids[pid].find_pcr(pcr)
+
+    def seek_time(self, seconds, pid=None):
+        """Returns the offset of the last PCR packet at or before the given time from the first PCR"""
+        if pid is None: pid = self.get_pcr_pid()
+        if pid not in self.pids or len(self.pids[pid].pcr_values) == 0: return None
+        pid_index = self.pids[pid]
+        return pid_index.find_pcr(pid_index.pcr_values[0] + seconds * PCR_HZ)
+
+    def seek_pts(self, pts, pid):
+        """Returns the offset of the last PES header at or before the given unwrapped 90kHz PTS on the PID"""
+        if pid not in self.pids: return None
+        return self.pids[pid].find_pts(pts)
+
+    def get_pusi_offset(self, pid, number):
+        """Returns the offset of the number'th indexed payload start packet on the PID
+
+        With a granularity of 1 this is the start of the number'th section or PES on the PID.
+        """
+        if pid not in self.pids: return None
+        offsets = self.pids[pid].pusi_offsets
+        if number < 0 or number >= len(offsets): return None
+        return int(offsets[number])
+
+    def read_packets(self, fileobj, offset, count=1):
+        """Reads count packets from the open recording at the given offset with a single read"""
+        fileobj.seek(offset)
+        return fileobj.read(count * pct.PACKET_SIZE)
+
+    def save(self, filename):
+        """Saves the index to a sidecar file"""
+        f = open(filename, 'wb')
+        try:
+            byteorder = '<'
+            if sys.byteorder == 'big': byteorder = '>'
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, VALUE_TYPECODE, byteorder,
+                                 int(self.index_pts), self.granularity, self.packet_count, len(self.pids)))
+            for pid in sorted(self.pids):
+                pid_index = self.pids[pid]
+                f.write(_PID_HEADER.pack(pid, len(pid_index.pusi_offsets), len(pid_index.pcr_offsets),
+                                         len(pid_index.pts_offsets)))
+                for values in pid_index._arrays():
+                    values.tofile(f)
+        finally:
+            f.close()
+
+    def load(cls, filename):
+        """Loads an index previously written by PacketIndex.save()"""
+        f = open(filename, 'rb')
+        try:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size: raise IOError('%s is not a packet index'%(filename))
+            magic, version, typecode, byteorder, index_pts, granularity, packet_count, pid_count = _HEADER.unpack(header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise IOError('%s is not a version %d packet index'%(filename, INDEX_VERSION))
+            if array.array(typecode).itemsize < 8 and typecode != 'd':
+                raise IOError('%s was written on a platform with 64 bit longs'%(filename))
+            swap = byteorder != ('>' if sys.byteorder == 'big' else '<')
+            index = cls(granularity, bool(index_pts))
+            index.packet_count = packet_count
+            for i in xrange(pid_count):
+                pid, n_pusi, n_pcr, n_pts = _PID_HEADER.unpack(f.read(_PID_HEADER.size))
+                pid_index = PidIndex(pid)
+                pid_index.pusi_offsets = array.array(typecode)
+                pid_index.pcr_offsets  = array.array(typecode)
+                pid_index.pcr_values   = array.array(typecode)
+                pid_index.pts_offsets  = array.array(typecode)
+                pid_index.pts_values   = array.array(typecode)
+                for values, n in zip(pid_index._arrays(), (n_pusi, n_pcr, n_pcr, n_pts, n_pts)):
+                    values.fromfile(f, n)
+                    if swap: values.byteswap()
+                index.pids[pid] = pid_index
+            return index
+        finally:
+            f.close()
+
+    load = classmethod(load)
+
+    def __str__(self):
+        res = 'Packet Index: %d packets, granularity %d\n'%(self.packet_count, self.granularity)
+        for pid in sorted(self.pids):
+            res += str(self.pids[pid])
+        return res
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing PacketIndex class'
+    import os
+    import tempfile
+    import unittest
+
+    def make_packet(pid, pusi=False, pcr=None, pts=None, cc=0):
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0] = pct.SYNC_BYTE
+        packet[1] = (pid >> 8) & 0x1f
+        if pusi: packet[1] |= 0x40
+        packet[2] = pid & 0xff
+        offset = 4
+        if pcr is not None:
+            base, ext = pcr // 300, pcr % 300
+            packet[3] = 0x30 | cc
+            packet[4:12] = bytearray([7, 0x10, (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+                                      (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (ext >> 8), ext & 0xff])
+            offset = 12
+        else:
+            packet[3] = 0x10 | cc
+        if pts is not None:
+            packet[offset:offset + 14] = bytearray([0, 0, 1, 0xe0, 0, 0, 0x80, 0x80, 5,
+                                                    0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff,
+                                                    ((pts >> 14) & 0xfe) | 1, (pts >> 7) & 0xff,
+                                                    ((pts << 1) & 0xfe) | 1])
+        return packet
+
+    class KnownIndex(unittest.TestCase):
+        def setUp(self):
+            fd, self.ts_file = tempfile.mkstemp(suffix='.ts')
+            f = os.fdopen(fd, 'wb')
+            f.write('\x00' * 7) # junk before the first packet to exercise resync
+            for i in range(1000):
+                if i % 10 == 0:
+                    f.write(make_packet(0x100, pcr=(PCR_WRAP - 13500000 + i * 27000) % PCR_WRAP))
+                elif i % 25 == 0:
+                    f.write(make_packet(0x101, pusi=True, pts=(i * 900) % PTS_WRAP))
+                else:
+                    f.write(make_packet(0x101))
+            f.close()
+            self.sidecar = self.ts_file + '.idx'
+
+        def tearDown(self):
+            os.remove(self.ts_file)
+            if os.path.exists(self.sidecar): os.remove(self.sidecar)
+
+        def testBuildAndSeek(self):
+            index = PacketIndex(index_pts=True).build(self.ts_file)
+            self.assertEqual(1000, index.packet_count)
+            self.assertEqual(0x100, index.get_pcr_pid())
+            self.assertEqual(100, len(index.pids[0x100].pcr_values))
+            # PCR wrapped half way through the file but the unwrapped values still increase
+            self.assertEqual(sorted(index.pids[0x100].pcr_values), list(index.pids[0x100].pcr_values))
+            self.assertEqual(7, index.seek_time(0))
+            self.assertEqual(7 + 500 * 188, index.seek_time(0.5))
+            self.assertEqual(7 + 25 * 188, index.get_pusi_offset(0x101, 0))
+            self.assertEqual(7 + 75 * 188, index.seek_pts(75 * 900 + 10, 0x101))
+            f = open(self.ts_file, 'rb')
+            packet = bytearray(index.read_packets(f, index.seek_pts(75 * 900, 0x101)))
+            f.close()
+            self.assertEqual(75 * 900, pes_tools.get_pts(pct.get_payload(packet)))
+
+        def testGranularity(self):
+            index = PacketIndex(granularity=100).build(self.ts_file)
+            self.assertEqual(10, len(index.pids[0x100].pcr_values))
+            self.assertEqual(0, len(index.pids[0x101].pts_values))
+
+        def testSaveLoad(self):
+            index = PacketIndex(index_pts=True).build(self.ts_file)
+            index.save(self.sidecar)
+            loaded = PacketIndex.load(self.sidecar)
+            self.assertEqual(index.packet_count, loaded.packet_count)
+            self.assertEqual(sorted(index.pids), sorted(loaded.pids))
+            for pid in index.pids:
+                for a, b in zip(index.pids[pid]._arrays(), loaded.pids[pid]._arrays()):
+                    self.assertEqual(list(a), list(b))
+            self.assertEqual(index.seek_time(0.25), loaded.seek_time(0.25))
+
+    unittest.main()
@@ -10,6 +10,9 @@ SC_RESERVED       = int('01', 2)
 SC_SCRAMBLED_EVEN = int('10', 2)
 SC_SCRAMBLED_ODD  = int('11', 2)
 
+PACKET_SIZE = 188
+SYNC_BYTE   = 0x47
+
 AF_RESERVED              = int('00', 2)
 AF_PAYLOAD_ONLY          = int('01', 2)
 AF_ADAPTATION_FIELD_ONLY = int('10', 2)
@@ -61,5 +64,23 @@ def get_payload(packet):
         offset = offset + 1 + aft.get_length(packet)
     return packet[offset:]
 
+def find_sync(data, start=0, count=3):
+    '''returns the offset of the first sync byte in data (a bytearray or list of bytes) that is
+    followed by count - 1 more sync bytes at packet intervals, or -1 if there is none'''
+    end = len(data) - (count - 1) * PACKET_SIZE
+    offset = start
+    while offset < end:
+        if data[offset] != SYNC_BYTE:
+            offset += 1
+            continue
+        synced = True
+        for i in xrange(1, count):
+            if data[offset + i * PACKET_SIZE] != SYNC_BYTE:
+                synced = False
+                break
+        if synced: return offset
+        offset += 1
+    return -1
+
 if __name__ == '__main__':
     print 'Testing packet_tools'
\ No newline at end of file
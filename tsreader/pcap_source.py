@@ -0,0 +1,384 @@
+'''
+    Transport stream replay from packet captures.
+
+    PcapSource reads a pcap or pcapng capture of TS over UDP/RTP (eg. from tcpdump or Wireshark) without
+    libpcap. The capture is read in large chunks through source.Source, so it can come from a file, a pipe or
+    stdin, and records are parsed straight out of the chunk buffer. UDP datagrams for the chosen group and
+    port have any RTP header stripped and their packets are handed out like any other Source, either as fast
+    as possible or paced by the capture timestamps.
+
+    usage: python pcap_source.py CAPTURE [GROUP [PORT]]
+'''
+
+import socket
+import struct
+import time
+import packet_tools as pct
+import rtp
+from source import Source, CHUNK_SIZE, POLL_INTERVAL
+
+PCAP_MAGIC      = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d
+PCAPNG_SHB      = 0x0a0d0d0a
+PCAPNG_IDB      = 0x00000001
+PCAPNG_SPB      = 0x00000003
+PCAPNG_EPB      = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IF_TSRESOL       = 9
+
+LINKTYPE_NULL      = 0
+LINKTYPE_ETHERNET  = 1
+LINKTYPE_RAW       = 101
+LINKTYPE_LOOP      = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4      = 228
+LINKTYPE_IPV6      = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+IP_PROTO_UDP   = 17
+
+def get_ip_offset(data, start, end, linktype):
+    '''returns the offset of the IP header in a captured frame, or -1 if the frame does not carry IP'''
+    if linktype == LINKTYPE_ETHERNET:
+        offset = start + 12
+        ethertype = (data[offset] << 8) | data[offset + 1] if offset + 2 <= end else 0
+        while ethertype in ETHERTYPE_VLAN and offset + 6 <= end:
+            offset += 4
+            ethertype = (data[offset] << 8) | data[offset + 1]
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6): return -1
+        return offset + 2
+    if linktype == LINKTYPE_LINUX_SLL:
+        if end - start < 16 or ((data[start + 14] << 8) | data[start + 15]) not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return -1
+        return start + 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        if end - start < 20 or ((data[start] << 8) | data[start + 1]) not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return -1
+        return start + 20
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return start
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        return start + 4
+    return -1
+
+def get_udp_payload(data, start, end, linktype):
+    """Finds the UDP payload of a captured frame
+
+    Returns:
+        (destination address as packed bytes, destination port, payload start, payload end), or None for frames
+        that are not unfragmented UDP over IPv4 or IPv6
+    """
+    ip = get_ip_offset(data, start, end, linktype)
+    if ip < 0 or ip >= end: return None
+    version = data[ip] >> 4
+    if version == 4:
+        if ip + 20 > end or data[ip + 9] != IP_PROTO_UDP: return None
+        if ((data[ip + 6] & 0x3f) << 8) | data[ip + 7]: return None # a fragment (MF set or non zero offset)
+        end = min(end, ip + ((data[ip + 2] << 8) | data[ip + 3])) # drop any ethernet padding
+        address = str(data[ip + 16:ip + 20])
+        udp = ip + (data[ip] & 0x0f) * 4
+    elif version == 6:
+        if ip + 40 > end or data[ip + 6] != IP_PROTO_UDP: return None # extension headers are not followed
+        end = min(end, ip + 40 + ((data[ip + 4] << 8) | data[ip + 5]))
+        address = str(data[ip + 24:ip + 40])
+        udp = ip + 40
+    else:
+        return None
+    if udp + 8 > end: return None
+    port = (data[udp + 2] << 8) | data[udp + 3]
+    end = min(end, udp + ((data[udp + 4] << 8) | data[udp + 5]))
+    return address, port, udp + 8, end
+
+def pack_address(address):
+    '''packs a dotted IPv4 or an IPv6 address for comparison with get_udp_payload() results'''
+    if ':' in address: return socket.inet_pton(socket.AF_INET6, address)
+    return socket.inet_aton(address)
+
+class PcapSource(Source):
+    """Replays TS over UDP or RTP from a pcap or pcapng capture
+
+    Iterating gives the TS packets of the matching datagrams, like any Source. Statistics, on top of those of
+    Source: records, datagrams (UDP datagrams that matched the filter), bad_datagrams (not whole packets),
+    fragments (skipped IP fragments) and rtp (an RtpSequence).
+    """
+    def __init__(self, input, group=None, port=None, speed=None, chunk_size=CHUNK_SIZE):
+        """Constructor
+
+        Arguments:
+            input      -- the capture, anything source.Source accepts
+            group      -- only replay datagrams sent to this address, None for any (default None)
+            port       -- only replay datagrams sent to this UDP port, None for any (default None)
+            speed      -- pace the replay by the capture timestamps, 1.0 is real time, 2.0 twice as fast, None
+                          replays as fast as possible (default None)
+            chunk_size -- bytes of the capture to read at a time (default CHUNK_SIZE)
+        """
+        Source.__init__(self, input, chunk_size)
+        self.address = None
+        if group is not None: self.address = pack_address(group)
+        self.port = port
+        self.speed = speed
+        self.records = 0
+        self.datagrams = 0
+        self.bad_datagrams = 0
+        self.fragments = 0
+        self.rtp = rtp.RtpSequence()
+        self._data = bytearray()
+        self._offset = 0
+
+    def _ensure(self, size):
+        '''makes sure size bytes are buffered from the current offset, returns False at the end of the input'''
+        while len(self._data) - self._offset < size:
+            chunk = self.read_chunk()
+            if not chunk: return False
+            del self._data[:self._offset]
+            self._offset = 0
+            self._data.extend(chunk)
+        return True
+
+    def get_records(self):
+        """Yields (timestamp in seconds or None, linktype, data, start, end) for every captured frame
+
+        The frame is data[start:end]; data is the read buffer itself so it is only valid until the next record.
+        """
+        if not self._ensure(4): return
+        magic = struct.unpack_from('<I', self._data, self._offset)[0]
+        if (magic in (PCAP_MAGIC, PCAP_MAGIC_NANO) or
+            struct.unpack_from('>I', self._data, self._offset)[0] in (PCAP_MAGIC, PCAP_MAGIC_NANO)):
+            records = self._get_pcap_records()
+        elif magic == PCAPNG_SHB:
+            records = self._get_pcapng_records()
+        else:
+            raise ValueError('not a pcap or pcapng capture, magic 0x%08x'%(magic))
+        for record in records:
+            self.records += 1
+            yield record
+
+    def _get_pcap_records(self):
+        if not self._ensure(24): return
+        endian = '<'
+        magic = struct.unpack_from('<I', self._data, self._offset)[0]
+        if magic not in (PCAP_MAGIC, PCAP_MAGIC_NANO):
+            endian = '>'
+            magic = struct.unpack_from('>I', self._data, self._offset)[0]
+        scale = 1e-6
+        if magic == PCAP_MAGIC_NANO: scale = 1e-9
+        linktype = struct.unpack_from(endian + 'I', self._data, self._offset + 20)[0] & 0xffff
+        self._offset += 24
+        header = struct.Struct(endian + 'IIII')
+        while self._ensure(16):
+            seconds, fraction, captured, original = header.unpack_from(self._data, self._offset)
+            if not self._ensure(16 + captured): return # truncated last record
+            start = self._offset + 16
+            yield seconds + fraction * scale, linktype, self._data, start, start + captured
+            self._offset = start + captured
+
+    def _get_pcapng_records(self):
+        endian = '<'
+        interfaces = []
+        while self._ensure(12):
+            block_type = struct.unpack_from(endian + 'I', self._data, self._offset)[0]
+            if block_type == PCAPNG_SHB: # a new section, possibly with another byte order
+                endian = '<'
+                if struct.unpack_from('<I', self._data, self._offset + 8)[0] != PCAPNG_BYTE_ORDER_MAGIC:
+                    endian = '>'
+                interfaces = []
+            length = struct.unpack_from(endian + 'I', self._data, self._offset + 4)[0]
+            if length < 12 or length % 4: raise ValueError('bad pcapng block length %d'%(length))
+            if not self._ensure(length): return
+            offset = self._offset
+            if block_type == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + 'H', self._data, offset + 8)[0]
+                interfaces.append((linktype, self._get_resolution(endian, offset + 16, offset + length - 4)))
+            elif block_type == PCAPNG_EPB:
+                interface, high, low, captured = struct.unpack_from(endian + 'IIII', self._data, offset + 8)
+                linktype, resolution = interfaces[interface]
+                yield ((high << 32) | low) * resolution, linktype, self._data, offset + 28, offset + 28 + captured
+            elif block_type == PCAPNG_SPB and interfaces:
+                captured = min(struct.unpack_from(endian + 'I', self._data, offset + 8)[0], length - 16)
+                yield None, interfaces[0][0], self._data, offset + 12, offset + 12 + captured
+            self._offset = offset + length
+
+    def _get_resolution(self, endian, offset, end):
+        '''returns the timestamp resolution in seconds from the options of an interface description block'''
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + 'HH', self._data, offset)
+            if code == 0: break
+            if code == PCAPNG_IF_TSRESOL and length >= 1:
+                value = self._data[offset + 4]
+                if value & 0x80: return 2.0 ** -(value & 0x7f)
+                return 10.0 ** -value
+            offset += 4 + (length + 3) // 4 * 4
+        return 1e-6
+
+    def _pace(self, timestamp, start):
+        '''sleeps until the capture time of the datagram, start is (first timestamp, wall clock time)'''
+        delay = start[1] + (timestamp - start[0]) / self.speed - time.time()
+        while delay > 0 and not self.stopped:
+            time.sleep(min(delay, POLL_INTERVAL))
+            delay = start[1] + (timestamp - start[0]) / self.speed - time.time()
+
+    def __iter__(self):
+        """Yields the TS packets of the matching datagrams as bytearray slices"""
+        start = None
+        for timestamp, linktype, data, begin, end in self.get_records():
+            if self.stopped: break
+            udp = get_udp_payload(data, begin, end, linktype)
+            if udp is None:
+                ip = get_ip_offset(data, begin, end, linktype)
+                if ip >= 0 and ip + 8 <= end and data[ip] >> 4 == 4 and ((data[ip + 6] & 0x3f) << 8) | data[ip + 7]:
+                    self.fragments += 1
+                continue
+            address, port, begin, end = udp
+            if self.address is not None and address != self.address: continue
+            if self.port is not None and port != self.port: continue
+            self.datagrams += 1
+            if self.speed and timestamp is not None:
+                if start is None: start = (timestamp, time.time())
+                self._pace(timestamp, start)
+            payload = data[begin:end]
+            begin, end = rtp.get_ts_payload(payload, self.rtp)
+            if begin < 0 or (end - begin) % pct.PACKET_SIZE:
+                self.bad_datagrams += 1
+                if begin < 0: continue
+            while begin + pct.PACKET_SIZE <= end:
+                if payload[begin] == pct.SYNC_BYTE:
+                    self.packets += 1
+                    yield payload[begin:begin + pct.PACKET_SIZE]
+                begin += pct.PACKET_SIZE
+
+    def iter_packets(self):
+        """Yields (offset, packet), the offset being that of the packet in a recording of the replayed stream"""
+        offset = 0
+        for packet in self:
+            yield offset, packet
+            offset += pct.PACKET_SIZE
+
+    def __str__(self):
+        return 'PcapSource: records[%d], datagrams[%d], packets[%d], bad datagrams[%d], fragments[%d]\n'%(
+            self.records, self.datagrams, self.packets, self.bad_datagrams, self.fragments) + str(self.rtp)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    import sys
+    from ts_reader import TsReader
+    if len(sys.argv) > 1:
+        group = None
+        port = None
+        if len(sys.argv) > 2: group = sys.argv[2]
+        if len(sys.argv) > 3: port = int(sys.argv[3])
+        source = PcapSource(sys.argv[1], group, port)
+        reader = TsReader(source)
+        reader.start()
+        reader.join()
+        print source
+        print reader
+        sys.exit(0)
+
+    print 'Testing PcapSource class'
+    import unittest
+    from StringIO import StringIO
+    from section_builder import SectionBuilder
+    from mpeg2psi.pat import Pat
+    from mpeg2psi import _known_tables
+
+    def make_pat_packets(count, cc=0):
+        pat = [0] + _known_tables.SAMPLE_PAT
+        packets = []
+        for i in range(count):
+            packets += [pct.SYNC_BYTE, 0x40, 0x00, 0x10 | ((cc + i) & 0x0f)] + pat + [0xff] * (184 - len(pat))
+        return packets
+
+    def make_frame(payload, group='239.1.1.1', port=1234, vlan=False):
+        '''ethernet frame of a UDP/IPv4 datagram, without checksums'''
+        udp = [0x30, 0x39, port >> 8, port & 0xff, (len(payload) + 8) >> 8, (len(payload) + 8) & 0xff, 0, 0]
+        length = 20 + len(udp) + len(payload)
+        ip = [0x45, 0, length >> 8, length & 0xff, 0, 0, 0x40, 0, 16, IP_PROTO_UDP, 0, 0, 10, 0, 0, 1]
+        ip += [ord(c) for c in socket.inet_aton(group)]
+        ethernet = [0x01, 0x00, 0x5e, 0x01, 0x01, 0x01, 0, 1, 2, 3, 4, 5]
+        if vlan: ethernet += [0x81, 0x00, 0x00, 0x64]
+        return bytearray(ethernet + [0x08, 0x00] + ip + udp + list(payload))
+
+    def make_rtp(sequence, payload):
+        return [0x80, rtp.PAYLOAD_TYPE_MP2T, sequence >> 8, sequence & 0xff] + [0] * 8 + payload
+
+    def make_pcap(frames, endian='<'):
+        data = struct.pack(endian + 'IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET)
+        for timestamp, frame in frames:
+            seconds = int(timestamp)
+            data += struct.pack(endian + 'IIII', seconds, int(round((timestamp - seconds) * 1e6)), len(frame),
+                                len(frame)) + str(frame)
+        return data
+
+    def make_pcapng(frames):
+        def block(block_type, body):
+            body += '\0' * (-len(body) % 4)
+            return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+        data = block(PCAPNG_SHB, struct.pack('<IHHq', PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+        options = struct.pack('<HHB', PCAPNG_IF_TSRESOL, 1, 9) + '\0' * 3 + struct.pack('<HH', 0, 0)
+        data += block(PCAPNG_IDB, struct.pack('<HHI', LINKTYPE_ETHERNET, 0, 65535) + options)
+        for timestamp, frame in frames:
+            ticks = int(round(timestamp * 1e9))
+            data += block(PCAPNG_EPB, struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xffffffff, len(frame),
+                                                  len(frame)) + str(frame))
+        return data
+
+    def sample_frames():
+        frames = []
+        for i in range(4):
+            frames.append((1000.0 + i * 0.1, make_frame(make_rtp(i * 2, make_pat_packets(7, i * 7)))))
+        frames.append((1000.05, make_frame(make_pat_packets(7), port=5000, vlan=True)))
+        return frames
+
+    class KnownPcap(unittest.TestCase):
+        def check(self, source, packets=28):
+            reader = TsReader(source)
+            pat = SectionBuilder(None, Pat)
+            reader.link_handler(0x00, pat.process_packet)
+            reader.start()
+            reader.join()
+            self.assertEqual(packets, source.packets)
+            self.assertEqual(packets, reader.pids[0])
+            self.assertEqual(2003, pat.si_table.sections.values()[0].values()[0][0].table[1696])
+
+        def testPcap(self):
+            source = PcapSource(StringIO(make_pcap(sample_frames())), '239.1.1.1', 1234, chunk_size=500)
+            self.check(source)
+            self.assertEqual(5, source.records)
+            self.assertEqual(4, source.datagrams)
+            self.assertEqual(3, source.rtp.lost)
+            self.assertEqual(0, source.bad_datagrams)
+
+        def testBigEndian(self):
+            source = PcapSource(StringIO(make_pcap(sample_frames(), '>')))
+            self.check(source, 35)
+            self.assertEqual(4, source.rtp.received)
+
+        def testPcapng(self):
+            source = PcapSource(StringIO(make_pcapng(sample_frames())), port=5000, chunk_size=333)
+            self.check(source, 7)
+            self.assertEqual(1, source.datagrams)
+            self.assertEqual(0, source.rtp.received)
+
+        def testOffsets(self):
+            source = PcapSource(StringIO(make_pcap(sample_frames())), port=1234)
+            self.assertEqual([index * pct.PACKET_SIZE for index in range(28)],
+                             [offset for offset, packet in source.iter_packets()])
+
+        def testPaced(self):
+            frames = sample_frames()
+            start = time.time()
+            self.assertEqual(28, len(list(PcapSource(StringIO(make_pcapng(frames)), port=1234, speed=2.0))))
+            self.assertTrue(time.time() - start >= 0.14) # 0.3s of capture at twice real time
+            start = time.time()
+            self.assertEqual(28, len(list(PcapSource(StringIO(make_pcap(frames)), port=1234))))
+            self.assertTrue(time.time() - start < 0.1)
+
+        def testNotACapture(self):
+            self.assertRaises(ValueError, list, PcapSource(StringIO('\x47' * 188)))
+
+    unittest.main()
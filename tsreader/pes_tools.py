@@ -0,0 +1,107 @@
+'''
+Tools for decoding the header of a PES packet found at the start of a mpeg2ts payload.
+Only the first payload of a PES (payload start flag set) carries the header so these
+functions expect the payload as returned by packet_tools.get_payload()
+'''
+
+PES_START_CODE_PREFIX = (0x00, 0x00, 0x01)
+
+# stream ids that do not carry the optional PES header (ISO/IEC 13818-1 table 2-21)
+SID_PROGRAM_STREAM_MAP       = 0xBC
+SID_PADDING_STREAM           = 0xBE
+SID_PRIVATE_STREAM_2         = 0xBF
+SID_ECM_STREAM               = 0xF0
+SID_EMM_STREAM               = 0xF1
+SID_PROGRAM_STREAM_DIRECTORY = 0xFF
+SID_DSMCC_STREAM             = 0xF2
+SID_H222_1_TYPE_E            = 0xF8
+
+NO_HEADER_STREAM_IDS = (SID_PROGRAM_STREAM_MAP, SID_PADDING_STREAM, SID_PRIVATE_STREAM_2,
+                        SID_ECM_STREAM, SID_EMM_STREAM, SID_PROGRAM_STREAM_DIRECTORY,
+                        SID_DSMCC_STREAM, SID_H222_1_TYPE_E)
+
+PTS_WRAP = 1 << 33
+
+def is_pes_start(payload):
+    if len(payload) < 6: return False
+    if payload[0] != 0x00 or payload[1] != 0x00 or payload[2] != 0x01: return False
+    return True
+
+def get_stream_id(payload):
+    return payload[3]
+
+def get_packet_length(payload):
+    return (payload[4] << 8) + payload[5]
+
+def has_optional_header(payload):
+    if not is_pes_start(payload): return False
+    if len(payload) < 9: return False
+    return get_stream_id(payload) not in NO_HEADER_STREAM_IDS
+
+def pts_flag(payload):
+    if payload[7] & int('10000000', 2): return True
+    return False
+
+def dts_flag(payload):
+    if payload[7] & int('01000000', 2): return True
+    return False
+
+def get_header_data_length(payload):
+    return payload[8]
+
+def _get_timestamp(data):
+    ts = (data[0] & int('00001110', 2)) << 29
+    ts += data[1] << 22
+    ts += (data[2] & int('11111110', 2)) << 14
+    ts += data[3] << 7
+    ts += (data[4] & int('11111110', 2)) >> 1
+    return ts
+
+def get_pts(payload):
+    '''returns the 33 bit PTS (90kHz units) or None if the payload does not carry one'''
+    if not has_optional_header(payload): return None
+    if not pts_flag(payload): return None
+    if len(payload) < 14: return None
+    return _get_timestamp(payload[9:14])
+
+def get_dts(payload):
+    '''returns the 33 bit DTS (90kHz units) or None if the payload does not carry one'''
+    if not has_optional_header(payload): return None
+    if not (pts_flag(payload) and dts_flag(payload)): return None
+    if len(payload) < 19: return None
+    return _get_timestamp(payload[14:19])
+
+def get_es_data(payload):
+    '''returns the elementary stream bytes that follow the PES header'''
+    if not has_optional_header(payload):
+        return payload[6:]
+    return payload[9 + get_header_data_length(payload):]
+
+if __name__ == '__main__':
+    print 'Testing pes_tools'
+    import unittest
+
+    # PES header for a video stream with PTS = 0x1ABCDEF01 and DTS = 0x12345
+    SAMPLE_PES = [0x00, 0x00, 0x01, 0xE0, 0x00, 0x00, 0x80, 0xC0, 0x0A,
+                  0x3D, 0xAF, 0x37, 0xDE, 0x03,
+                  0x11, 0x00, 0x05, 0x46, 0x8B,
+                  0x00, 0x00, 0x00, 0x01, 0x09]
+
+    class KnownPes(unittest.TestCase):
+        def testPts(self):
+            self.assertEqual(True, is_pes_start(SAMPLE_PES))
+            self.assertEqual(0xE0, get_stream_id(SAMPLE_PES))
+            self.assertEqual(0x1ABCDEF01, get_pts(SAMPLE_PES))
+            self.assertEqual(0x12345, get_dts(SAMPLE_PES))
+            self.assertEqual([0x00, 0x00, 0x00, 0x01, 0x09], get_es_data(SAMPLE_PES))
+
+        def testNotPes(self):
+            self.assertEqual(False, is_pes_start([0x00, 0x42, 0xf0, 0x11, 0x00, 0x00]))
+            self.assertEqual(None, get_pts([0x00, 0x42, 0xf0, 0x11, 0x00, 0x00]))
+
+        def testPadding(self):
+            padding = [0x00, 0x00, 0x01, SID_PADDING_STREAM, 0x00, 0x04, 0xff, 0xff, 0xff, 0xff]
+            self.assertEqual(False, has_optional_header(padding))
+            self.assertEqual(None, get_pts(padding))
+
+    unittest.main()
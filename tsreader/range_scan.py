@@ -0,0 +1,430 @@
+'''
+    Parallel scan of a single large recording.
+
+    The recording is split into byte ranges, 188 byte aligned relative to the start of the file, that are
+    scanned by separate worker processes. Each worker resyncs on three sync bytes at the packet stride from
+    the start of its range and scans every packet that starts before the end of its range, so neighbouring
+    ranges share the same packet grid. Workers return PID counts, continuity errors, PCR samples and the raw
+    PSI/SI sections they assembled, plus the state at their range edges: the first and last continuity
+    counter of every PID, the section bytes seen on a PID before its first payload unit start (head) and
+    the section still being assembled when the range ended (tail). The merge checks continuity across the
+    edges and joins the tail of one range with the head of the next to recover the sections that straddle
+    the edge.
+
+    usage: python range_scan.py [-j WORKERS] [--ranges N] recording.ts
+'''
+
+import array
+import multiprocessing
+import os
+import sys
+import time
+import packet_tools as pct
+import adaptation_field_tools as aft
+from mpeg2psi.section import section_syntax_flag, get_table_id, get_table_id_extension
+from mpeg2psi.section import get_version_number, get_section_number
+from packet_index import READ_SIZE, PCR_WRAP, VALUE_TYPECODE, unwrap
+from scanner import StreamScanner
+from batch_scan import init_worker
+
+PREPASS_PACKETS = 50000 # packets read from the start of the recording to find the PSI/SI PIDs
+MIN_RANGE_SIZE  = pct.PACKET_SIZE * 10000
+
+def split_ranges(file_size, count, min_size=MIN_RANGE_SIZE):
+    """Splits a file into at most count byte ranges of at least min_size bytes
+
+    Range boundaries are multiples of the packet size. Returns a list of (start, end) tuples.
+    """
+    packets = (file_size + pct.PACKET_SIZE - 1) // pct.PACKET_SIZE
+    count = max(1, min(count, packets * pct.PACKET_SIZE // max(min_size, pct.PACKET_SIZE)))
+    ranges = []
+    start = 0
+    for i in range(count):
+        end = (packets * (i + 1) // count) * pct.PACKET_SIZE
+        if i == count - 1: end = file_size
+        if end > start: ranges.append((start, end))
+        start = end
+    return ranges
+
+class SectionAssembler(object):
+    """Splits the payloads of one PID into raw sections
+
+    Until the first payload unit start the bytes belong to a section started before this scan and are kept
+    in head. tail holds the section being assembled, or None between sections.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.head = bytearray()
+        self.started = False
+        self.tail = None
+
+    def add_payload(self, payload, pusi):
+        if pusi:
+            pointer = payload[0]
+            self.add_data(payload[1:1 + pointer])
+            self.started = True
+            self.tail = bytearray(payload[1 + pointer:])
+            self._flush()
+        else:
+            self.add_data(payload)
+
+    def add_data(self, data):
+        '''adds bytes that continue the current section'''
+        if not self.started:
+            self.head.extend(data)
+        elif self.tail is not None:
+            self.tail.extend(data)
+            self._flush()
+
+    def _flush(self):
+        tail = self.tail
+        while True:
+            if len(tail) == 0 or tail[0] == 0xff: # stuffing, the next section starts in a new payload unit
+                self.tail = None
+                return
+            if len(tail) < 3: return
+            length = 3 + (((tail[1] & 0x0f) << 8) | tail[2])
+            if len(tail) < length: return
+            self.callback(str(tail[:length]))
+            del tail[:length]
+
+class RangeScanner(object):
+    """Scans the packets of one byte range of a recording"""
+    def __init__(self, section_pids=(), pcr_spacing=1):
+        """Constructor
+
+        Arguments:
+            section_pids -- PIDs on which PSI/SI sections are assembled (default none)
+            pcr_spacing  -- minimum distance, in packets, between two recorded PCR samples of a PID (default 1)
+        """
+        self.packet_count = 0
+        self.sync_losses  = 0
+        self.pid_counts   = {}
+        self.cc_errors    = {}
+        self.first_cc     = {}
+        self.last_cc      = {}
+        self.pcr_spacing  = pcr_spacing * pct.PACKET_SIZE
+        self.pcrs         = {}
+        self.sections     = []
+        self._seen        = set()
+        self.assemblers   = {}
+        for pid in section_pids:
+            self.assemblers[pid] = SectionAssembler(self._section_callback(pid))
+
+    def _section_callback(self, pid):
+        def add_section(data):
+            if section_syntax_flag(bytearray(data[:3])):
+                header = bytearray(data[:8])
+                key = (pid, get_table_id(header), get_table_id_extension(header), get_version_number(header),
+                       get_section_number(header))
+                if key in self._seen: return
+                self._seen.add(key)
+            self.sections.append((pid, data))
+        return add_section
+
+    def add_packet(self, packet, offset):
+        """Counts a packet found at the given byte offset of the recording"""
+        self.packet_count += 1
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        self.pid_counts[pid] = self.pid_counts.get(pid, 0) + 1
+        af = (packet[3] & 0x30) >> 4
+        if (af & pct.AF_ADAPTATION_FIELD_ONLY) and packet[4] > 0 and aft.pcr_flag(packet):
+            pcrs = self.pcrs.get(pid)
+            if pcrs is None:
+                pcrs = self.pcrs[pid] = (array.array(VALUE_TYPECODE), array.array(VALUE_TYPECODE))
+            if len(pcrs[0]) == 0 or offset - pcrs[0][-1] >= self.pcr_spacing:
+                pcrs[0].append(offset)
+                pcrs[1].append(aft.get_pcr(packet).to_27mhz())
+        if not (af & pct.AF_PAYLOAD_ONLY) or pid == 0x1fff: return
+        cc = packet[3] & 0x0f
+        last = self.last_cc.get(pid)
+        if last is None:
+            self.first_cc[pid] = cc
+        elif cc != last and cc != ((last + 1) & 0x0f):
+            self.cc_errors[pid] = self.cc_errors.get(pid, 0) + 1
+        self.last_cc[pid] = cc
+        assembler = self.assemblers.get(pid)
+        if assembler is not None:
+            assembler.add_payload(pct.get_payload(packet), packet[1] & 0x40)
+
+    def scan(self, fileobj, start, end):
+        """Scans the packets that start in the byte range [start, end) of the open recording"""
+        fileobj.seek(start)
+        data = bytearray()
+        base = start # file offset of data[0]
+        synced = start == 0 # junk at the start of the file counts as a sync loss, as it does for scanner
+        eof = False
+        while not eof and base < end:
+            block = fileobj.read(READ_SIZE)
+            if block: data.extend(block)
+            else: eof = True
+            offset = 0
+            limit = len(data) - pct.PACKET_SIZE
+            while offset <= limit and base + offset < end:
+                if not synced or data[offset] != pct.SYNC_BYTE:
+                    found = pct.find_sync(data, offset)
+                    if found < 0:
+                        offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                        break
+                    if synced: self.sync_losses += 1
+                    synced = True
+                    offset = found
+                    continue
+                self.add_packet(data[offset:offset + pct.PACKET_SIZE], base + offset)
+                offset += pct.PACKET_SIZE
+            del data[:offset]
+            base += offset
+        return self
+
+    def get_result(self, start, end):
+        """Returns the results of the range as a dict of picklable values"""
+        heads, tails, started = {}, {}, []
+        for pid in self.assemblers:
+            assembler = self.assemblers[pid]
+            if assembler.head: heads[pid] = str(assembler.head)
+            if assembler.started:
+                started.append(pid)
+                if assembler.tail is not None: tails[pid] = str(assembler.tail)
+        return {'start'      : start,
+                'end'        : end,
+                'packets'    : self.packet_count,
+                'sync_losses': self.sync_losses,
+                'pids'       : self.pid_counts,
+                'cc_errors'  : self.cc_errors,
+                'first_cc'   : self.first_cc,
+                'last_cc'    : self.last_cc,
+                'pcrs'       : self.pcrs,
+                'sections'   : self.sections,
+                'heads'      : heads,
+                'tails'      : tails,
+                'started'    : started}
+
+def scan_range(filename, start, end, section_pids=(), pcr_spacing=1):
+    """Scans the byte range [start, end) of the recording and returns the RangeScanner.get_result() dict"""
+    f = open(filename, 'rb')
+    try:
+        return RangeScanner(section_pids, pcr_spacing).scan(f, start, end).get_result(start, end)
+    finally:
+        f.close()
+
+def _range_job(job):
+    return scan_range(*job)
+
+def merge_ranges(results, scanner):
+    """Merges the results of consecutive ranges
+
+    Arguments:
+        results -- the scan_range() results in file order
+        scanner -- StreamScanner the sections are added to, with the PMT PIDs already known
+    Returns:
+        The StreamScanner.get_summary() dict with the counts of all ranges and a 'pcrs' entry holding, per
+        PID, arrays of PCR sample offsets and unwrapped 27MHz PCR values
+    """
+    pid_counts, cc_errors, last_cc, carry, pcrs = {}, {}, {}, {}, {}
+    packets = sync_losses = 0
+    for result in results:
+        packets += result['packets']
+        sync_losses += result['sync_losses']
+        for pid, count in result['pids'].iteritems():
+            pid_counts[pid] = pid_counts.get(pid, 0) + count
+        for pid, count in result['cc_errors'].iteritems():
+            cc_errors[pid] = cc_errors.get(pid, 0) + count
+        # continuity across the edge, against the last range the PID was seen in
+        for pid, cc in result['first_cc'].iteritems():
+            last = last_cc.get(pid)
+            if last is not None and cc != last and cc != ((last + 1) & 0x0f):
+                cc_errors[pid] = cc_errors.get(pid, 0) + 1
+        last_cc.update(result['last_cc'])
+        # sections straddling the edge: what was carried over plus the head of this range
+        for pid in set(carry) | set(result['heads']):
+            head = result['heads'].get(pid, '')
+            if pid in carry:
+                assembler = SectionAssembler(lambda data, pid=pid: scanner.add_section(pid, bytearray(data)))
+                assembler.started = True
+                assembler.tail = carry.pop(pid)
+                assembler.add_data(bytearray(head))
+                if pid not in result['started'] and assembler.tail is not None:
+                    carry[pid] = assembler.tail # the section is still not finished
+        for pid, data in result['sections']:
+            scanner.add_section(pid, bytearray(data))
+        for pid, tail in result['tails'].iteritems():
+            carry[pid] = bytearray(tail)
+        for pid, (offsets, values) in result['pcrs'].iteritems():
+            merged = pcrs.get(pid)
+            if merged is None:
+                merged = pcrs[pid] = [array.array(VALUE_TYPECODE), array.array(VALUE_TYPECODE), None, 0]
+            for offset, pcr in zip(offsets, values):
+                value, merged[3] = unwrap(pcr, merged[2], merged[3], PCR_WRAP)
+                merged[2] = pcr
+                merged[0].append(offset)
+                merged[1].append(value)
+    summary = scanner.get_summary()
+    summary['packets'] = packets
+    summary['sync_losses'] = sync_losses
+    summary['pids'] = pid_counts
+    summary['cc_errors'] = cc_errors
+    summary['pcrs'] = dict([(pid, (pcrs[pid][0], pcrs[pid][1])) for pid in pcrs])
+    return summary
+
+def scan_file_parallel(filename, workers=None, ranges=None, pcr_spacing=1, memory_limit=None,
+                       min_range_size=MIN_RANGE_SIZE):
+    """Scans one recording with several worker processes
+
+    Arguments:
+        filename       -- the recording to scan
+        workers        -- number of worker processes, None uses one per CPU, 1 scans in this process
+                          (default None)
+        ranges         -- number of byte ranges to split the recording into, None uses one per worker
+                          (default None)
+        pcr_spacing    -- minimum distance, in packets, between two recorded PCR samples (default 1)
+        memory_limit   -- address space limit of each worker in bytes, None for no limit (default None)
+        min_range_size -- smallest range in bytes, small recordings are split into fewer ranges
+                          (default MIN_RANGE_SIZE)
+    Returns:
+        The merge_ranges() summary with 'filename', 'error' and 'elapsed' added
+    """
+    start = time.time()
+    if workers is None: workers = multiprocessing.cpu_count()
+    if ranges is None: ranges = workers
+    # the PSI/SI PIDs have to be known before the ranges are scanned so the heads can be kept
+    scanner = StreamScanner()
+    f = open(filename, 'rb')
+    try:
+        scanner.scan(f, PREPASS_PACKETS)
+    finally:
+        f.close()
+    section_pids = sorted(scanner.builders)
+    summary_scanner = StreamScanner()
+    for pid in scanner.pmt_pids: summary_scanner.add_pmt_pid(pid)
+
+    jobs = [(filename, range_start, range_end, section_pids, pcr_spacing)
+            for range_start, range_end in split_ranges(os.path.getsize(filename), ranges, min_range_size)]
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        results = map(_range_job, jobs)
+    else:
+        pool = multiprocessing.Pool(workers, init_worker, (memory_limit,))
+        try:
+            results = pool.map(_range_job, jobs)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    summary = merge_ranges(results, summary_scanner)
+    summary['filename'] = filename
+    summary['error'] = None
+    summary['elapsed'] = time.time() - start
+    return summary
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser(description='Scan one transport stream recording in parallel')
+        parser.add_argument('file', help='recording to scan')
+        parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+        parser.add_argument('--ranges', type=int, default=None, help='byte ranges (default: one per worker)')
+        args = parser.parse_args()
+        summary = scan_file_parallel(args.file, args.workers, args.ranges)
+        print '%d packets, %d pids, %d continuity errors, %d sync losses, %d services in %0.1fs'%(
+            summary['packets'], len(summary['pids']), sum(summary['cc_errors'].values()),
+            summary['sync_losses'], len(summary['services']), summary['elapsed'])
+        sys.exit(0)
+
+    print 'Testing range_scan'
+    import tempfile
+    import unittest
+    from scanner import scan_file, PAT_PID, NIT_PID, SDT_PID
+    from mpeg2psi import _known_tables as psi_tables
+    from dvbsi import _known_tables as si_tables
+
+    def make_packet(pid, cc, payload=None, pusi=False, pcr=None):
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0:4] = bytearray([pct.SYNC_BYTE, (pid >> 8) & 0x1f, pid & 0xff, 0x10 | (cc & 0x0f)])
+        if pusi: packet[1] |= 0x40
+        offset = 4
+        if pcr is not None:
+            base, ext = pcr // 300, pcr % 300
+            packet[3] |= 0x20
+            packet[4:12] = bytearray([7, 0x10, (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+                                      (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (ext >> 8), ext & 0xff])
+            offset = 12
+        if payload is not None: packet[offset:offset + len(payload)] = bytearray(payload)
+        return packet
+
+    def write_recording(filename, cycles=30):
+        '''PSI/SI tables interleaved with PCR packets, returns the number of PCRs and the NIT packet offsets'''
+        cc = {}
+        pcr_count = 0
+        nit_offsets = []
+        def next_cc(pid):
+            cc[pid] = (cc.get(pid, -1) + 1) & 0x0f
+            return cc[pid]
+        f = open(filename, 'wb')
+        f.write('\x00' * 7) # junk, so range starts are not packet starts
+        pcr = PCR_WRAP - 27000000 # wraps after a second
+        for cycle in range(cycles):
+            for pid, section in ((PAT_PID, psi_tables.SAMPLE_PAT), (2003, psi_tables.SAMPLE_PMT),
+                                 (SDT_PID, si_tables.SAMPLE_SDT), (NIT_PID, si_tables.SAMPLE_NIT_0)):
+                data = [0] + list(section)
+                first = True
+                while data:
+                    if pid == NIT_PID: nit_offsets.append(f.tell())
+                    f.write(make_packet(pid, next_cc(pid), data[:184], first))
+                    first = False
+                    data = data[184:]
+                    for i in range(7):
+                        pcr = (pcr + 27000) % PCR_WRAP
+                        f.write(make_packet(2003, next_cc(2003), pcr=pcr))
+                        pcr_count += 1
+        f.write(make_packet(2003, cc[2003] + 3)) # continuity error at the very end
+        f.close()
+        return pcr_count, nit_offsets
+
+    class KnownRanges(unittest.TestCase):
+        def setUp(self):
+            fd, self.ts_file = tempfile.mkstemp(suffix='.ts')
+            os.close(fd)
+            self.pcr_count, self.nit_offsets = write_recording(self.ts_file)
+
+        def tearDown(self):
+            os.remove(self.ts_file)
+
+        def testSplit(self):
+            self.assertEqual([(0, 188 * 5), (188 * 5, 188 * 10 + 7)], split_ranges(188 * 10 + 7, 2, 188))
+            self.assertEqual([(0, 188 * 100)], split_ranges(188 * 100, 8, 188 * 60))
+
+        def check(self, workers, ranges):
+            serial = scan_file(self.ts_file)
+            summary = scan_file_parallel(self.ts_file, workers, ranges, min_range_size=188)
+            for key in ('packets', 'pids', 'cc_errors', 'sync_losses', 'pat', 'pmts', 'network'):
+                self.assertEqual(serial[key], summary[key], key)
+            self.assertEqual(sorted(serial['services']), sorted(summary['services']))
+            self.assertEqual({2003: 1}, summary['cc_errors'])
+            offsets, values = summary['pcrs'][2003]
+            self.assertEqual(self.pcr_count, len(values))
+            self.assertEqual(sorted(values), list(values)) # unwrapped across the wrap and the range edges
+
+        def testSerialRanges(self):
+            self.check(1, 13)
+
+        def testPool(self):
+            self.check(3, 7)
+
+        def testStraddlingSection(self):
+            # a single NIT split in the middle, neither range holds all of it
+            pcr_count, nit_offsets = write_recording(self.ts_file, cycles=1)
+            size = os.path.getsize(self.ts_file)
+            edge = (nit_offsets[3] // 188) * 188
+            results = [scan_range(self.ts_file, start, end, (NIT_PID,)) for start, end in ((0, edge), (edge, size))]
+            self.assertEqual([], results[0]['sections'] + results[1]['sections'])
+            self.assertEqual(scan_file(self.ts_file)['packets'], results[0]['packets'] + results[1]['packets'])
+            summary = merge_ranges(results, StreamScanner())
+            self.assertEqual(6144, summary['network']['network_id'])
+            self.assertEqual({2003: 1}, summary['cc_errors'])
+
+    unittest.main()
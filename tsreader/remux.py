@@ -0,0 +1,242 @@
+'''
+    Single programme remultiplexer.
+
+    Cuts one programme out of a multiplex: the PAT gives the PMT PID of the programme, its PMT gives the PID
+    set (Pmt.get_all_pids(), so the PCR and ECM PIDs are kept too) and only the packets of those PIDs are
+    written, along with a PAT rewritten to list that programme alone. The input is read in large chunks and
+    each run of consecutive selected packets is written straight out of the read buffer with a single write,
+    so packets are never copied one at a time. Later versions of the PAT or PMT are followed as they arrive.
+
+    usage: python remux.py INPUT PROGRAM_NUMBER OUTPUT
+'''
+
+import sys
+import packet_tools as pct
+from source import Source
+from carousel import CarouselPid
+from section_builder import SectionBuilder
+from mpeg2psi.section import get_version_number, get_table_id_extension, get_section_number
+from mpeg2psi.pat import Pat
+from mpeg2psi.pmt import Pmt
+
+PAT_PID = 0x00
+
+class LatestSections(object):
+    """Stands in for an SiTable in a SectionBuilder, handing each new version of a section to a callback
+
+    A section is only wanted, and so only parsed, if its version differs from the last one seen for the same
+    table ID extension and section number.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.versions = {}
+
+    def need_section(self, data):
+        key = (get_table_id_extension(data), get_section_number(data))
+        return self.versions.get(key) != get_version_number(data)
+
+    def add_section(self, section):
+        self.versions[(section.table_id_extension, section.section_number)] = section.version
+        self.callback(section)
+
+class Remuxer(object):
+    """Writes the packets of one programme of a transport stream to an output file
+
+    Statistics: packets (read), packets_out (written, the rewritten PAT included), writes (one per run of
+    consecutive packets), pat_versions and pmt_versions (versions followed) and sync_losses.
+    """
+    def __init__(self, program_number, output, extra_pids=()):
+        """Constructor
+
+        Arguments:
+            program_number -- the programme to keep
+            output         -- anything with write(), written with buffer objects over the input chunks
+            extra_pids     -- PIDs to keep as well as those of the programme, eg. the EIT (default none)
+        """
+        self.program_number = program_number
+        self.output = output
+        self.extra_pids = set(extra_pids)
+        self.pmt_pid = None
+        self.pids = set(extra_pids) # PIDs written as they are; the PMT PID is written too but parsed on the way
+        self.pat = CarouselPid(PAT_PID)
+        self.pat_builder = SectionBuilder(None, Pat, LatestSections(self._add_pat))
+        self.pmt_builder = None
+        self.packets = 0
+        self.packets_out = 0
+        self.writes = 0
+        self.pat_versions = 0
+        self.pmt_versions = 0
+        self.sync_losses = 0
+
+    def _add_pat(self, pat):
+        pmt_pid = pat.table.get(self.program_number)
+        if pmt_pid is None: return # not in this section, or dropped from the multiplex
+        self.pat_versions += 1
+        self.pat.set_table([Pat.create(pat.transport_stream_id, {self.program_number: pmt_pid}, version=pat.version)])
+        if pmt_pid != self.pmt_pid:
+            self.pmt_pid = pmt_pid
+            self.pmt_builder = SectionBuilder(None, Pmt, LatestSections(self._add_pmt))
+            self.pids = set(self.extra_pids)
+
+    def _add_pmt(self, pmt):
+        if pmt.program_number != self.program_number: return # another programme sharing the PMT PID
+        self.pmt_versions += 1
+        self.pids = set(pmt.get_all_pids()) | self.extra_pids
+        self.pids.discard(self.pmt_pid)
+
+    def _write(self, data, start, end):
+        if end > start:
+            self.output.write(buffer(data, start, end - start))
+            self.writes += 1
+            self.packets_out += (end - start) // pct.PACKET_SIZE
+
+    def add_chunk(self, data, start=0, end=None):
+        """Filters the whole, synchronised packets in data[start:end]
+
+        Arguments:
+            data  -- bytearray holding the packets
+            start -- offset of the first packet (default 0)
+            end   -- offset after the last packet, None for the end of data (default None)
+        """
+        if end is None: end = len(data)
+        pids = self.pids
+        run = start # start of the current run of selected packets
+        offset = start
+        while offset < end:
+            pid = ((data[offset + 1] & 0x1f) << 8) | data[offset + 2]
+            if pid in pids:
+                offset += pct.PACKET_SIZE
+                continue
+            if pid == self.pmt_pid: # kept, and parsed in case the PMT changes
+                self.pmt_builder.process_packet(data[offset:offset + pct.PACKET_SIZE])
+                pids = self.pids
+                offset += pct.PACKET_SIZE
+                continue
+            self._write(data, run, offset)
+            if pid == PAT_PID:
+                self.pat_builder.process_packet(data[offset:offset + pct.PACKET_SIZE])
+                if data[offset + 1] & 0x40 and self.pat.tables: # a PAT starts here, send ours in its place
+                    self.output.write(self.pat.get_packets())
+                    self.writes += 1
+                    self.packets_out += 1
+                pids = self.pids
+            offset += pct.PACKET_SIZE
+            run = offset
+        self._write(data, run, end)
+        self.packets += (end - start) // pct.PACKET_SIZE
+
+    def remux(self, input):
+        """Filters the whole of the input
+
+        Arguments:
+            input -- a Source, or anything Source() accepts: a path, '-', a file object or a descriptor
+        Raises:
+            ValueError if the programme is not found in the PAT
+        """
+        source = input
+        if not isinstance(source, Source): source = Source(input)
+        data = bytearray()
+        while True:
+            chunk = source.read_chunk()
+            if not chunk: break
+            data.extend(chunk)
+            offset = 0
+            end = len(data) - pct.PACKET_SIZE
+            while offset <= end:
+                if data[offset] != pct.SYNC_BYTE:
+                    synced = pct.find_sync(data, offset)
+                    if synced < 0:
+                        offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                        break
+                    self.sync_losses += 1
+                    offset = synced
+                    continue
+                run_end = offset + pct.PACKET_SIZE # extend over the packets that are still in sync
+                while run_end <= end and data[run_end] == pct.SYNC_BYTE: run_end += pct.PACKET_SIZE
+                self.add_chunk(data, offset, run_end)
+                offset = run_end
+            del data[:offset]
+        if source is not input: source.close()
+        if self.pmt_pid is None: raise ValueError('program %d not found in the PAT'%(self.program_number))
+        return self
+
+    def __str__(self):
+        return 'Remuxer: program[%d] pmt pid[%s], pids%s, packets[%d] -> [%d] in [%d] writes, pat versions[%d], pmt versions[%d]'%(
+            self.program_number, str(self.pmt_pid), sorted(self.pids), self.packets, self.packets_out, self.writes,
+            self.pat_versions, self.pmt_versions)
+
+def remux_file(input, program_number, output, extra_pids=()):
+    """Writes one programme of the input to the output, see Remuxer; '-' for either uses stdin or stdout"""
+    close = False
+    if output == '-':
+        output = sys.stdout
+    elif isinstance(output, basestring):
+        output = open(output, 'wb')
+        close = True
+    try:
+        return Remuxer(program_number, output, extra_pids).remux(input)
+    finally:
+        if close: output.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        remuxer = remux_file(sys.argv[1], int(sys.argv[2], 0), sys.argv[3])
+        sys.stderr.write(str(remuxer) + '\n')
+        sys.exit(0)
+
+    print 'Testing Remuxer class'
+    import unittest
+    from StringIO import StringIO
+    from scanner import StreamScanner
+    from carousel import Carousel
+    from mpeg2psi.pmt import PmtElementaryStream, STREAM_TYPE_H264_VIDEO
+    from mpeg2psi.descriptors import ConditionalAccessDescriptor
+
+    def make_mux(count=200):
+        '''two programmes, 1 on PIDs 0x100-0x102 with an ECM PID 0x103 and 2 on PIDs 0x200-0x201, plus nulls'''
+        carousel = Carousel()
+        carousel.set_table(PAT_PID, Pat.create(7, {1: 0x100, 2: 0x200}, network_pid=0x10))
+        ecm = ConditionalAccessDescriptor([0x09, 0x04, 0x06, 0x06, 0xe1, 0x03])
+        carousel.set_table(0x100, Pmt.create(1, 0x101, [PmtElementaryStream.create(STREAM_TYPE_H264_VIDEO, 0x101),
+                                                       PmtElementaryStream.create(4, 0x102)], [ecm]))
+        carousel.set_table(0x200, Pmt.create(2, 0x201, [PmtElementaryStream.create(STREAM_TYPE_H264_VIDEO, 0x201)]))
+        data = bytearray()
+        cc = {}
+        es_pids = [0x101, 0x101, 0x102, 0x201, 0x201, 0x1fff, 0x103]
+        for i in range(count):
+            if i % 50 == 0: data += carousel.get_cycle()
+            pid = es_pids[i % len(es_pids)]
+            data += bytearray([pct.SYNC_BYTE, pid >> 8, pid & 0xff, 0x10 | cc.get(pid, 0)] + [i & 0xff] * 184)
+            cc[pid] = (cc.get(pid, 0) + 1) & 0x0f
+        return data
+
+    class KnownRemux(unittest.TestCase):
+        def testProgram(self):
+            data = make_mux()
+            output = StringIO()
+            remuxer = Remuxer(1, output).remux(StringIO(str(data)))
+            self.assertEqual(set([0x101, 0x102, 0x103]), remuxer.pids)
+            summary = StreamScanner().scan(StringIO(output.getvalue())).get_summary()
+            self.assertEqual({1: 0x100}, summary['pat']['programs'])
+            self.assertEqual(set([PAT_PID, 0x100, 0x101, 0x102, 0x103]), set(summary['pids']))
+            self.assertEqual({}, summary['cc_errors'])
+            self.assertEqual(4, summary['pids'][PAT_PID])
+            counts = StreamScanner().scan(StringIO(str(data))).pid_counts
+            for pid in (0x100, 0x101, 0x102, 0x103):
+                self.assertEqual(counts[pid], summary['pids'][pid])
+            self.assertEqual(len(output.getvalue()) // pct.PACKET_SIZE, remuxer.packets_out)
+            self.assertTrue(remuxer.writes < remuxer.packets_out / 2)
+
+        def testJunkAndMissingProgram(self):
+            data = make_mux(100)
+            data[1000:1000] = bytearray(17) # junk in the middle of a packet
+            output = StringIO()
+            remuxer = Remuxer(2, output).remux(StringIO(str(data)))
+            self.assertEqual(1, remuxer.sync_losses)
+            self.assertEqual(set([0x201]), remuxer.pids)
+            self.assertRaises(ValueError, Remuxer(3, StringIO()).remux, StringIO(str(data)))
+
+    unittest.main()
@@ -0,0 +1,128 @@
+'''
+    RTP (RFC 3550) helpers for transport stream over IP.
+
+    TS over IP is sent either as plain UDP datagrams of up to 7 packets or wrapped in RTP (RFC 2250, payload
+    type 33). These functions find the TS payload of a datagram and track the RTP sequence numbers so that
+    lost and reordered datagrams can be counted. Shared by the live UDP source and the pcap replay source.
+'''
+
+import packet_tools as pct
+
+RTP_VERSION       = 2
+RTP_HEADER_SIZE   = 12
+PAYLOAD_TYPE_MP2T = 33
+
+def is_rtp(data):
+    '''returns True if the datagram looks like RTP rather than raw TS (which starts with a sync byte)'''
+    return len(data) >= RTP_HEADER_SIZE and data[0] != pct.SYNC_BYTE and (data[0] >> 6) == RTP_VERSION
+
+def get_sequence_number(data):
+    return (data[2] << 8) | data[3]
+
+def get_timestamp(data):
+    return (data[4] << 24) | (data[5] << 16) | (data[6] << 8) | data[7]
+
+def get_payload_type(data):
+    return data[1] & 0x7f
+
+def get_payload_offset(data):
+    '''returns the offset of the RTP payload, after the CSRC list and any header extension, or -1 if the
+    datagram is too short'''
+    offset = RTP_HEADER_SIZE + 4 * (data[0] & 0x0f)
+    if data[0] & 0x10: # header extension: 16 bit profile, 16 bit length in 32 bit words
+        if len(data) < offset + 4: return -1
+        offset += 4 + 4 * ((data[offset + 2] << 8) | data[offset + 3])
+    if offset > len(data): return -1
+    return offset
+
+def get_payload_end(data):
+    '''returns the end of the RTP payload, excluding padding'''
+    end = len(data)
+    if data[0] & 0x20 and end > 0: end -= data[end - 1]
+    return end
+
+class RtpSequence(object):
+    """Tracks the sequence numbers of an RTP stream
+
+    Counts lost datagrams (forward jumps in sequence) and datagrams that arrive late or twice. A jump of
+    more than half the sequence space is taken as a late or duplicate datagram rather than a loss.
+    """
+    def __init__(self):
+        self.last = None
+        self.received  = 0
+        self.lost      = 0
+        self.late      = 0
+        self.gaps      = 0
+
+    def add(self, sequence):
+        """Records a received sequence number, returns the number of datagrams lost just before it"""
+        self.received += 1
+        if self.last is None:
+            self.last = sequence
+            return 0
+        gap = (sequence - self.last - 1) & 0xffff
+        if gap == 0:
+            self.last = sequence
+            return 0
+        if gap < 0x8000:
+            self.lost += gap
+            self.gaps += 1
+            self.last = sequence
+            return gap
+        self.late += 1
+        return 0
+
+    def __str__(self):
+        return 'RTP: received[%d], lost[%d] in [%d] gaps, late or duplicate[%d]\n'%(self.received, self.lost,
+                                                                                  self.gaps, self.late)
+
+def get_ts_payload(data, sequence=None):
+    """Returns (start, end) of the TS packets in a UDP datagram
+
+    RTP headers are skipped, and the sequence number is passed to the RtpSequence if one is given. Returns
+    (-1, -1) for an RTP datagram that is not well formed.
+    """
+    if not is_rtp(data): return 0, len(data)
+    start = get_payload_offset(data)
+    if start < 0: return -1, -1
+    if sequence is not None: sequence.add(get_sequence_number(data))
+    return start, get_payload_end(data)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing rtp'
+    import unittest
+
+    def make_rtp(sequence, payload, csrc=0, extension=None, padding=0):
+        header = [0x80 | csrc, PAYLOAD_TYPE_MP2T, sequence >> 8, sequence & 0xff, 0, 0, 0x12, 0x34, 1, 2, 3, 4]
+        header += [0] * (4 * csrc)
+        if extension is not None:
+            header[0] |= 0x10
+            header += [0xbe, 0xde, 0, len(extension) // 4] + extension
+        if padding:
+            header[0] |= 0x20
+            payload = list(payload) + [0] * (padding - 1) + [padding]
+        return bytearray(header + list(payload))
+
+    class KnownRtp(unittest.TestCase):
+        def testPayload(self):
+            ts = [pct.SYNC_BYTE] + [0] * 187
+            self.assertEqual((0, 188), get_ts_payload(bytearray(ts)))
+            self.assertEqual((12, 200), get_ts_payload(make_rtp(1, ts)))
+            self.assertEqual((20 + 8, 216), get_ts_payload(make_rtp(1, ts, csrc=2, extension=[0] * 4)))
+            self.assertEqual((12, 200), get_ts_payload(make_rtp(1, ts, padding=4)))
+            self.assertEqual(0x1234, get_timestamp(make_rtp(1, ts)))
+            self.assertEqual((-1, -1), get_ts_payload(make_rtp(1, [], csrc=15)[:20]))
+
+        def testSequence(self):
+            sequence = RtpSequence()
+            for number in (0xfffe, 0xffff, 0, 3, 2, 4, 4):
+                sequence.add(number)
+            self.assertEqual(7, sequence.received)
+            self.assertEqual(2, sequence.lost)
+            self.assertEqual(1, sequence.gaps)
+            self.assertEqual(2, sequence.late)
+
+    unittest.main()
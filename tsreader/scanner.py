@@ -0,0 +1,248 @@
+'''
+    Synchronous single recording scanner.
+
+    Reads a recording in large blocks without the Buffer and thread per PID used by TsReader, counts packets
+    and continuity errors per PID and assembles the PAT, the PMTs it points to, the SDT and the NIT. The result
+    is a summary made of plain dicts, lists and numbers so that it can be pickled back from a worker process
+    or written out as JSON.
+'''
+
+import time
+import packet_tools as pct
+from packet_index import READ_SIZE
+from section_builder import SectionBuilder
+from mpeg2psi.pat import Pat
+from mpeg2psi.pmt import Pmt
+from dvbsi.sdt import Sdt
+from dvbsi.nit import Nit
+from dvbsi import descriptors
+
+PAT_PID  = 0x00
+NIT_PID  = 0x10
+SDT_PID  = Sdt.PID
+NULL_PID = 0x1fff
+
+def _get_sections(si_table):
+    '''returns the sections of an SiTable, later versions replacing earlier ones of the same table and number'''
+    res = {}
+    if si_table is None: return []
+    for version in sorted(si_table.sections):
+        for tide in si_table.sections[version]:
+            for number in si_table.sections[version][tide]:
+                res[(tide, number)] = si_table.sections[version][tide][number]
+    return [res[key] for key in sorted(res)]
+
+class StreamScanner(object):
+    """Scans the packets of one transport stream and summarises them
+
+    Packets are pushed with StreamScanner.add_packet() or a whole recording is read with StreamScanner.scan().
+    PMT PIDs are learnt from the PAT as soon as it is complete.
+    """
+    def __init__(self):
+        self.packet_count = 0
+        self.sync_losses  = 0
+        self.pid_counts   = {}
+        self.cc_errors    = {}
+        self.last_cc      = {}
+        self.builders     = {PAT_PID: SectionBuilder(None, Pat),
+                             NIT_PID: SectionBuilder(None, Nit),
+                             SDT_PID: SectionBuilder(None, Sdt)}
+        self.pmt_pids     = set()
+
+    def add_packet(self, packet):
+        """Counts and demultiplexes a single packet"""
+        self.packet_count += 1
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        self.pid_counts[pid] = self.pid_counts.get(pid, 0) + 1
+        if pid == NULL_PID: return
+        if packet[3] & 0x10: # the continuity counter only increments on packets with a payload
+            cc = packet[3] & 0x0f
+            last = self.last_cc.get(pid)
+            if last is not None and cc != last and cc != ((last + 1) & 0x0f):
+                self.cc_errors[pid] = self.cc_errors.get(pid, 0) + 1
+            self.last_cc[pid] = cc
+        builder = self.builders.get(pid)
+        if builder is None: return
+        builder.process_packet(packet)
+        if pid == PAT_PID: self._add_pmt_builders()
+
+    def add_section(self, pid, data):
+        """Adds a complete section received on the PID, eg. one assembled by range_scan"""
+        builder = self.builders.get(pid)
+        if builder is None: return
+        builder.process_section(data)
+        if pid == PAT_PID: self._add_pmt_builders()
+
+    def add_pmt_pid(self, pid):
+        """Assembles PMT sections on the PID, without waiting for a PAT that points at it"""
+        if pid in self.builders: return
+        self.pmt_pids.add(pid)
+        self.builders[pid] = SectionBuilder(None, Pmt)
+
+    def _add_pmt_builders(self):
+        for pat in _get_sections(self.builders[PAT_PID].si_table):
+            for program in pat.table:
+                if program == 0: continue # program 0 points at the NIT
+                self.add_pmt_pid(pat.table[program])
+
+    def scan(self, fileobj, max_packets=None):
+        """Reads packets from the open file until it ends or max_packets have been read
+
+        If sync is lost the scan resumes at the next offset where three consecutive sync bytes are found.
+        """
+        data = bytearray()
+        while max_packets is None or self.packet_count < max_packets:
+            block = fileobj.read(READ_SIZE)
+            if not block: break
+            data.extend(block)
+            offset = 0
+            end = len(data) - pct.PACKET_SIZE
+            while offset <= end:
+                if data[offset] != pct.SYNC_BYTE:
+                    synced = pct.find_sync(data, offset)
+                    if synced < 0:
+                        offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                        break
+                    self.sync_losses += 1
+                    offset = synced
+                    continue
+                self.add_packet(data[offset:offset + pct.PACKET_SIZE])
+                offset += pct.PACKET_SIZE
+                if max_packets is not None and self.packet_count >= max_packets: break
+            del data[:offset]
+        return self
+
+    def scan_packets(self, packets, max_packets=None):
+        """Adds packets from any iterable, eg. a source.Source or a pacer.Pacer.pace() generator"""
+        for packet in packets:
+            if max_packets is not None and self.packet_count >= max_packets: break
+            self.add_packet(packet)
+        return self
+
+    def get_summary(self):
+        """Returns the scan results as a dict of plain picklable values"""
+        summary = {'packets'    : self.packet_count,
+                   'sync_losses': self.sync_losses,
+                   'pids'       : dict(self.pid_counts),
+                   'cc_errors'  : dict(self.cc_errors),
+                   'pat'        : None,
+                   'pmts'       : {},
+                   'services'   : [],
+                   'network'    : None}
+        for pat in _get_sections(self.builders[PAT_PID].si_table):
+            if summary['pat'] is None:
+                summary['pat'] = {'transport_stream_id': pat.transport_stream_id, 'programs': {}}
+            summary['pat']['programs'].update(pat.table)
+        for pid in self.pmt_pids:
+            for pmt in _get_sections(self.builders[pid].si_table):
+                summary['pmts'][pmt.program_number] = {'pid'    : pid,
+                                                       'pcr_pid': pmt.pcr_pid,
+                                                       'streams': [(es.stream_type, es.pid) for es in pmt.es_loop]}
+        for sdt in _get_sections(self.builders[SDT_PID].si_table):
+            for service in sdt.service_loop:
+                summary['services'].append((sdt.original_network_id, sdt.transport_stream_id, service.service_id,
+                                            service.get_service_type(), service.get_service_name()))
+        for nit in _get_sections(self.builders[NIT_PID].si_table):
+            if summary['network'] is None:
+                summary['network'] = {'network_id': nit.network_id, 'name': None, 'transport_streams': []}
+            for desc in nit.descriptors:
+                if type(desc) == descriptors.NetworkNameDescriptor:
+                    summary['network']['name'] = desc.network_name
+            summary['network']['transport_streams'].extend(nit.get_ts_list())
+        return summary
+
+def scan_file(filename, max_packets=None):
+    """Scans one recording and returns its summary
+
+    Errors are reported in the summary rather than raised so that one bad recording does not stop a batch.
+    Arguments:
+        filename    -- the recording to scan
+        max_packets -- stop after this many packets, None scans the whole recording (default None)
+    Returns:
+        The StreamScanner.get_summary() dict with 'filename', 'error' and 'elapsed' added
+    """
+    start = time.time()
+    scanner = StreamScanner()
+    error = None
+    try:
+        f = open(filename, 'rb')
+        try:
+            scanner.scan(f, max_packets)
+        finally:
+            f.close()
+    except MemoryError:
+        error = 'MemoryError: memory limit reached'
+    except Exception, e:
+        error = '%s: %s'%(type(e).__name__, str(e))
+    summary = scanner.get_summary()
+    summary['filename'] = filename
+    summary['error'] = error
+    summary['elapsed'] = time.time() - start
+    return summary
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing StreamScanner class'
+    import os
+    import tempfile
+    import unittest
+    from mpeg2psi import _known_tables as psi_tables
+    from dvbsi import _known_tables as si_tables
+
+    def make_section_packets(pid, section, cc=0):
+        packets = []
+        data = [0] + list(section) # pointer field
+        while data:
+            packet = bytearray([0xff] * pct.PACKET_SIZE)
+            packet[0:4] = bytearray([pct.SYNC_BYTE, (pid >> 8) & 0x1f, pid & 0xff, 0x10 | (cc & 0x0f)])
+            if not packets: packet[1] |= 0x40
+            packet[4:4 + min(len(data), 184)] = bytearray(data[:184])
+            packets.append(packet)
+            data = data[184:]
+            cc += 1
+        return packets
+
+    def write_sample_recording(fileobj, repeat=3):
+        cc = {}
+        for i in range(repeat):
+            for pid, section in ((PAT_PID, psi_tables.SAMPLE_PAT), (2003, psi_tables.SAMPLE_PMT),
+                                 (SDT_PID, si_tables.SAMPLE_SDT), (NIT_PID, si_tables.SAMPLE_NIT_0)):
+                packets = make_section_packets(pid, section, cc.get(pid, 0))
+                cc[pid] = cc.get(pid, 0) + len(packets)
+                for packet in packets: fileobj.write(packet)
+            fileobj.write(bytearray([pct.SYNC_BYTE, 0x1f, 0xff, 0x10] + [0xff] * 184))
+
+    class KnownScan(unittest.TestCase):
+        def setUp(self):
+            fd, self.ts_file = tempfile.mkstemp(suffix='.ts')
+            f = os.fdopen(fd, 'wb')
+            write_sample_recording(f)
+            f.close()
+
+        def tearDown(self):
+            os.remove(self.ts_file)
+
+        def testScanFile(self):
+            summary = scan_file(self.ts_file)
+            self.assertEqual(None, summary['error'])
+            self.assertEqual(3, summary['pids'][NULL_PID])
+            self.assertEqual({}, summary['cc_errors'])
+            self.assertEqual(2003, summary['pat']['programs'][1696])
+            self.assertEqual([(27, 2003), (4, 2004), (6, 2005), (4, 2006)], summary['pmts'][1010]['streams'])
+            names = dict([(service[:3], service[4]) for service in summary['services']])
+            self.assertEqual('SABC1', names[(0x1800, 0x10, 0x654)])
+            self.assertEqual(6144, summary['network']['network_id'])
+
+        def testErrors(self):
+            f = open(self.ts_file, 'ab')
+            f.write(bytearray([pct.SYNC_BYTE, 0x00, 0x00, 0x1f] + [0xff] * 184)) # PAT continuity jumps to 15
+            f.close()
+            summary = scan_file(self.ts_file, max_packets=10)
+            self.assertEqual(10, summary['packets'])
+            summary = scan_file(self.ts_file)
+            self.assertEqual({PAT_PID: 1}, summary['cc_errors'])
+            self.assertTrue(scan_file(self.ts_file + '.missing')['error'].startswith('IOError'))
+
+    unittest.main()
@@ -1,8 +1,19 @@
 from mpeg2psi.section import Section, section_syntax_flag, get_version_number, get_section_number, get_table_id_extension
-from mpeg2psi.section import get_table_id
+from mpeg2psi.section import get_table_id, get_section_length
 from si_table import SiTable
 import packet_tools as pct
+import logging
 from buffer import BufferReader
+from mpeg2psi import metrics
+from mpeg2psi import log
+from mpeg2psi import profiling
+
+LOG = logging.getLogger('tsreader.section_builder')
+
+COMPLETED = metrics.counter('sections_completed_total', 'Sections assembled, by table class', ('table',))
+DROPPED   = metrics.counter('sections_dropped_total', 'Sections not assembled, by table class and reason: '
+                            'repeated (already held), other_table (table ID not built here), filtered (rejected '
+                            'by the section filter) or interrupted (a new section started first)', ('table', 'reason'))
 
 '''
 class SectionBuilder(BufferReader):
@@ -83,9 +94,8 @@ class SectionBuilder1(BufferReader):
             section_data = data[offset:]
 
             if self.current_sct:
-                if offset > 1: print "????????????????????????????"
                 if (not self.current_sct.complete) and (offset > 1):
-                    print "Found it"
+                    LOG.debug('completing a section from the data before the pointer field')
                     self.current_sct.add_data(data[1:offset])
                     if self.current_sct.complete:
                         if self.long_table:
@@ -118,14 +128,24 @@ class SectionBuilder1(BufferReader):
 
 STATE_WAITING_FOR_PSI = 0
 STATE_BUILDING = 1
+STATE_HEADER = 2 # the start of a section is held until the packets that follow complete its header
+
+LONG_HEADER_SIZE  = 8 # bytes up to the last section number, read before a long section is built
+SHORT_HEADER_SIZE = 3 # bytes up to the section length
 
 
 class SectionBuilder(BufferReader):
-    def __init__(self, buffer, section_class=Section):
+    def __init__(self, buffer, section_class=Section, si_table=None, section_filter=None):
         super(SectionBuilder, self).__init__(buffer)
         self.current_sct = None
         self.sct_cls = section_class
+        self.table_ids = getattr(section_class, 'TABLE_IDS', None) # None builds any table ID
+        if self.table_ids is None and hasattr(section_class, 'TABLE_ID'): self.table_ids = (section_class.TABLE_ID,)
         self.long_table = None
+        self.si_table = si_table # anything with need_section(data) and add_section(section), eg. EpgStore
+        self.section_filter = section_filter # a section_filter.SectionFilter checked before a section is built
+        self.sections = [] # completed short sections (eg. TDT, TOT)
+        self.header = None # the start of a section whose header is split across packets
         self.state = STATE_WAITING_FOR_PSI
 
     def _loop(self):
@@ -134,69 +154,127 @@ class SectionBuilder(BufferReader):
             self.halt = True
             return
         if packet == None: return
+        self.process_packet(packet)
+
+    def process_packet(self, packet):
+        '''feeds one packet of the PID directly, for scanners that do not use a Buffer and thread'''
+        frame = profiling.enabled and profiling.begin('assemble', self.sct_cls.__name__)
         psi = pct.payload_start_flag(packet)
         #print ("psi for this packet is %d"%(psi))
         data = pct.get_payload(packet)
         if self.state == STATE_WAITING_FOR_PSI:
             self.waiting_for_psi(data, psi)
-        elif self.state == STATE_BUILDING:
+        else:
             self.building(data, psi)
+        if frame: profiling.end(frame)
 
     def waiting_for_psi(self, data, psi):
         if psi:
             offset = data[0] + 1
             section_data = data[offset:]
             #print "[%d]got section version[%d], number[%d]"%(self.sct_cls.TABLE_ID, get_version_number(section_data), get_section_number(section_data))
-            if self.long_table == None:
-                if section_syntax_flag(section_data):
-                    self.long_table = True
-                    self.si_table = SiTable()
-                else:
-                    self.long_table = False
-            self.process_new_section(section_data)
+            self.process_section(section_data)
         else:
             return
 
+    def process_section(self, data):
+        '''feeds the data of a new section, which may already be complete (eg. assembled by another scanner)'''
+        self.process_new_section(data)
+
+    def get_header_size(self):
+        '''returns the number of bytes of a new section needed to decide whether to build it'''
+        size = LONG_HEADER_SIZE
+        if self.long_table == False: size = SHORT_HEADER_SIZE
+        if self.section_filter is not None: size = max(size, self.section_filter.header_size)
+        return size
+
     def building(self, data, psi):
         #print "building"
         if psi:
-            print "\n\nPROBLEM, got psi while still building a section!!!!!\n\n"
             offset = data[0] + 1
             if offset > 1: #grab the data before the new section
                 self.building(data[1:offset], False)
+            if self.state != STATE_WAITING_FOR_PSI: # the section, or its header, is still incomplete
+                LOG.warning('%s section interrupted, a new section started while still building one',
+                            self.sct_cls.__name__)
+                if metrics.enabled: DROPPED.inc(labels=(self.sct_cls.__name__, 'interrupted'))
+                if log.tracing: log.trace(LOG, 'section_interrupted', table=self.sct_cls.__name__, pointer=data[0])
+            else:
+                LOG.debug('%s section boundary inside a packet, pointer[%d]', self.sct_cls.__name__, data[0])
             section_data = data[offset:]
             self.process_new_section(section_data)
+        elif self.state == STATE_HEADER:
+            header = self.header
+            self.header = None
+            self.process_new_section(header + data)
         else:
             #print "adding data (%d bytes)"%(len(data))
             added = self.current_sct.add_data(data)
+            if log.tracing: log.trace(LOG, 'section_data', table=self.sct_cls.__name__, length=len(data), added=added)
             #print added
             #print "ADDED = %d"%(added)
             if self.current_sct.complete:
                 self.save_current_section()
                 if added < len(data):
-                    print "residual data[%d]"%(len(data))
-                    print "added[%d]"%(added)
+                    LOG.debug('residual data[%d], added[%d]', len(data), added)
                     if data[added] != 0xff:
                         self.process_new_section(data[added:])
                     else:
                         self.state = STATE_WAITING_FOR_PSI
+                else:
+                    self.state = STATE_WAITING_FOR_PSI
 
 
+    def skip_section(self, data):
+        '''skips a section that is not built, going on with any section that follows it in data'''
+        self.current_sct = None
+        self.state = STATE_WAITING_FOR_PSI
+        if len(data) < 3: return
+        end = get_section_length(data) + 3
+        if end < len(data) and data[end] != 0xff:
+            self.process_new_section(data[end:])
+
     def process_new_section(self, data):
+        if len(data) > 0 and data[0] == 0xff: # stuffing after the last section
+            self.state = STATE_WAITING_FOR_PSI
+            return
+        if len(data) < self.get_header_size():
+            LOG.debug('%s section header split across packets, holding %d bytes', self.sct_cls.__name__, len(data))
+            self.current_sct = None
+            self.header = bytearray(data)
+            self.state = STATE_HEADER
+            return
+        if self.long_table == None:
+            self.long_table = section_syntax_flag(data)
+            if self.long_table and self.si_table == None: self.si_table = SiTable()
+        tid = get_table_id(data)
+        if self.table_ids is not None and tid not in self.table_ids:
+            if metrics.enabled: DROPPED.inc(labels=(self.sct_cls.__name__, 'other_table'))
+            if log.tracing: log.trace(LOG, 'section_dropped', table=self.sct_cls.__name__, table_id=tid,
+                                      reason='other_table')
+            self.skip_section(data)
+            return
+        if self.section_filter is not None and not self.section_filter.accept(data):
+            if metrics.enabled: DROPPED.inc(labels=(self.sct_cls.__name__, 'filtered'))
+            if log.tracing: log.trace(LOG, 'section_dropped', table=self.sct_cls.__name__, table_id=tid,
+                                      reason='filtered')
+            self.skip_section(data)
+            return
         if self.long_table:
-            version = get_version_number(data)
-            number  = get_section_number(data)
-            tide    = get_table_id_extension(data)
-            #print "new section - version[%d], num[%d]"%(version, number)
-            tid = get_table_id(data)
-            if tid != self.sct_cls.TABLE_ID:
-                print("wrong table id")
-                return
-            if not self.si_table.do_you_need(version, tide, number):
+            if not self.si_table.need_section(data):
                 #print "dont need this table"
+                if metrics.enabled: DROPPED.inc(labels=(self.sct_cls.__name__, 'repeated'))
+                if log.tracing: log.trace(LOG, 'section_dropped', table=self.sct_cls.__name__, table_id=tid,
+                                          table_id_extension=get_table_id_extension(data),
+                                          version=get_version_number(data), section_number=get_section_number(data),
+                                          reason='repeated')
+                self.skip_section(data)
                 return
 
         self.current_sct = self.sct_cls(data)
+        if log.tracing:
+            log.trace(LOG, 'section_start', table=self.sct_cls.__name__, table_id=tid, available=len(data),
+                      length=getattr(self.current_sct, 'length', None), complete=self.current_sct.complete)
         if self.current_sct.complete:
             #print "section already complete"
             added = self.current_sct.length
@@ -213,11 +291,17 @@ class SectionBuilder(BufferReader):
                 #print "waiting for psi"
                 self.state = STATE_WAITING_FOR_PSI
         else:
-            print "building"
+            LOG.debug('building a %s section', self.sct_cls.__name__)
             self.state = STATE_BUILDING
 
 
     def save_current_section(self):
+        if metrics.enabled: COMPLETED.inc(labels=(self.sct_cls.__name__,))
+        if log.tracing:
+            log.trace(LOG, 'section_saved', table=self.sct_cls.__name__, table_id=self.current_sct.table_id,
+                      table_id_extension=self.current_sct.table_id_extension,
+                      version=getattr(self.current_sct, 'version', None),
+                      section_number=getattr(self.current_sct, 'section_number', None))
         if self.long_table:
             #print self.current_sct
             self.si_table.add_section(self.current_sct)
@@ -225,3 +309,132 @@ class SectionBuilder(BufferReader):
             #print "hello-" + str(self.current_sct)
             self.sections.append(self.current_sct)
         self.current_sct = None
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing SectionBuilder class'
+    import unittest
+    from carousel import packetise
+    from dvbsi.sdt import Sdt, ServiceDescription
+    from dvbsi.descriptors import ServiceDescriptor
+
+    def make_sdt(section_number, last_section_number, *name_lengths):
+        '''an SDT section of 15 bytes plus 10 bytes and the name for each service'''
+        services = [ServiceDescription.create(index + 1, [ServiceDescriptor.create(0x01, u'x' * length)])
+                    for index, length in enumerate(name_lengths)]
+        return Sdt.create(0x10, 0x1800, services, section_number=section_number,
+                          last_section_number=last_section_number).to_bytes()
+
+    def build(sections):
+        builder = SectionBuilder(None, Sdt)
+        data = packetise(sections, 0x11)
+        for offset in range(0, len(data), pct.PACKET_SIZE):
+            builder.process_packet(data[offset:offset + pct.PACKET_SIZE])
+        return builder
+
+    class Records(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self, logging.WARNING)
+            self.records = []
+
+        def emit(self, record):
+            self.records.append(record)
+
+    class KnownSectionBuilder(unittest.TestCase):
+        def setUp(self):
+            metrics.REGISTRY.reset()
+            metrics.enable()
+            self.warnings = Records()
+            LOG.addHandler(self.warnings)
+
+        def tearDown(self):
+            LOG.removeHandler(self.warnings)
+            metrics.disable()
+            metrics.REGISTRY.reset()
+
+        def testPackedSections(self):
+            # the second section ends in the second packet, before the pointer to the third
+            sections = [make_sdt(0, 2, 75), make_sdt(1, 2, 125), make_sdt(2, 2, 10)]
+            self.assertEqual([100, 150, 35], map(len, sections))
+            builder = build(sections)
+            self.assertEqual(3, len(builder.si_table.get_current_sections()))
+            self.assertEqual(STATE_WAITING_FOR_PSI, builder.state)
+            self.assertEqual(3, COMPLETED.get(('Sdt',)))
+            self.assertEqual(None, DROPPED.get(('Sdt', 'interrupted')))
+            self.assertEqual([], self.warnings.records)
+
+        def testEndOfPayload(self):
+            # the first section fills the payload of two packets exactly, the next starts a packet
+            sections = [make_sdt(0, 1, 166, 166), make_sdt(1, 1, 10)]
+            self.assertEqual(pct.PACKET_SIZE - 5 + pct.PACKET_SIZE - 4, len(sections[0]))
+            builder = build(sections)
+            self.assertEqual(2, len(builder.si_table.get_current_sections()))
+            self.assertEqual(None, DROPPED.get(('Sdt', 'interrupted')))
+
+        def testSplitHeader(self):
+            # the second section starts in the last 1 to 7 bytes of the first packet
+            for size in range(176, 184):
+                sections = [make_sdt(0, 2, size - 25), make_sdt(1, 2, 10), make_sdt(2, 2, 150)]
+                builder = build(sections)
+                self.assertEqual([0, 1, 2], sorted([section.section_number
+                                                    for section in builder.si_table.get_current_sections()]))
+            self.assertEqual(None, DROPPED.get(('Sdt', 'interrupted')))
+            builder = SectionBuilder(None, Sdt)
+            data = packetise([make_sdt(0, 1, 155), make_sdt(1, 1, 10)], 0x11)
+            builder.process_packet(data[:pct.PACKET_SIZE]) # section 1 starts 3 bytes before the end of the payload
+            self.assertEqual(STATE_HEADER, builder.state)
+            builder.process_packet(packetise([make_sdt(1, 1, 20)], 0x11)) # the rest of it was lost
+            self.assertEqual(1, DROPPED.get(('Sdt', 'interrupted')))
+            self.assertEqual([(0, 155), (1, 20)], sorted([(section.section_number, section.length - 25)
+                                                          for section in builder.si_table.get_current_sections()]))
+
+        def testDefaultClass(self):
+            builder = SectionBuilder(None)
+            self.assertEqual(None, builder.table_ids)
+            builder.process_packet(packetise([make_sdt(0, 0, 10)], 0x11))
+            sections = builder.si_table.get_current_sections()
+            self.assertEqual([(0x42, 0x10)], [(section.table_id, section.table_id_extension) for section in sections])
+            self.assertEqual(STATE_WAITING_FOR_PSI, builder.state)
+
+        def testInterrupted(self):
+            sections = [make_sdt(0, 1, 200), make_sdt(1, 1, 10)]
+            data = packetise(sections, 0x11)
+            builder = SectionBuilder(None, Sdt)
+            builder.process_packet(data[:pct.PACKET_SIZE]) # the rest of the first section is lost
+            builder.process_packet(packetise(sections[1:], 0x11))
+            self.assertEqual(1, len(builder.si_table.get_current_sections()))
+            self.assertEqual(1, DROPPED.get(('Sdt', 'interrupted')))
+            self.assertEqual(['WARNING'], [record.levelname for record in self.warnings.records])
+
+        def testMetrics(self):
+            from StringIO import StringIO
+            from ts_reader import TsReader
+            from buffer import Buffer
+            from synthetic import make_stream, PAT_PID, NIT_PID
+            from dvbsi.nit import Nit
+            from mpeg2psi.pat import Pat
+            reader = TsReader(StringIO(make_stream(duration=1.0, section_size=600)))
+            buffer = Buffer(188 * 1000)
+            reader.link(NIT_PID, buffer)
+            nit = SectionBuilder(buffer, Nit)
+            pat = SectionBuilder(None, Pat)
+            reader.link_handler(PAT_PID, pat.process_packet)
+            reader.run()
+            nit.start()
+            nit.join()
+            metrics.disable()
+            packets = metrics.REGISTRY.metrics['tsreader_packets_total']
+            self.assertEqual(reader.pids[PAT_PID], packets.get((PAT_PID,)))
+            self.assertEqual(sum(reader.pids.values()), sum(packets.values.values()))
+            self.assertEqual(1, COMPLETED.get(('Nit',)))
+            self.assertEqual(reader.pids[PAT_PID] - 1, DROPPED.get(('Pat', 'repeated')))
+            self.assertEqual(None, DROPPED.get(('Nit', 'interrupted')))
+            self.assertEqual(reader.pids[NIT_PID] * pct.PACKET_SIZE,
+                             metrics.REGISTRY.metrics['buffer_high_water_bytes'].get(('0x10',)))
+            self.assertEqual(0, metrics.REGISTRY.metrics['buffer_depth_bytes'].get(('0x10',)))
+            text = metrics.to_prometheus()
+            self.assertTrue('section_parse_seconds_count{table="Nit"} 1\n' in text)
+
+    unittest.main()
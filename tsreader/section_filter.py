@@ -0,0 +1,165 @@
+'''
+    Section filter in the style of a hardware demux.
+
+    A SectionBuilder given a SectionFilter checks the header of every new section against it before the
+    section is built, so an unwanted section costs a look at its first bytes: no Section object is created, no
+    payload is copied and the packets that carry the rest of the section are skipped. Typical uses are keeping
+    only some of the many table IDs on the EIT PID, only one bouquet of the BAT or only the version of a table
+    that differs from the one already held.
+
+    Besides lists of table IDs and table ID extensions, a filter takes match, mask and mode bytes compared
+    with the start of the section the way Linux DVB demux filters are: byte 0 with the table ID and byte i
+    (i >= 1) with section byte i + 2, so the section length is skipped. Bits set in the mask are compared;
+    those also set in the mode must equal the match bits, and if the mode clears any masked bits at least one
+    of those must differ from the match bits (eg. a version other than the one held).
+'''
+
+from mpeg2psi.section import get_table_id_extension
+
+class SectionFilter(object):
+    """Filter on the table ID, table ID extension and header bytes of a section"""
+    def __init__(self, table_ids=None, table_id_extensions=None, match=None, mask=None, mode=None):
+        """Constructor
+
+        Arguments:
+            table_ids           -- iterable of the table IDs to accept, None accepts any (default None)
+            table_id_extensions -- iterable of the table ID extensions to accept, None accepts any. Only use it
+                                   for tables with the long section syntax (default None)
+            match               -- list of byte values compared with the section, see the module (default None)
+            mask                -- the bits of each match byte that are compared, None compares all of them
+                                   (default None)
+            mode                -- per match byte, the masked bits that must equal the match (1) and those of
+                                   which one must differ (0). None requires them all to be equal (default None)
+        """
+        self.table_ids = None
+        if table_ids is not None: self.table_ids = frozenset(table_ids)
+        self.table_id_extensions = None
+        if table_id_extensions is not None: self.table_id_extensions = frozenset(table_id_extensions)
+        match = list(match or [])
+        if mask is None: mask = [0xff] * len(match)
+        if mode is None: mode = [0xff] * len(match)
+        if not (len(match) == len(mask) == len(mode)):
+            raise ValueError('match, mask and mode need the same number of bytes')
+        self.filter_bytes = [] # (section byte offset, match, bits that must equal, bits of which one must differ)
+        for index in range(len(match)):
+            if mask[index] == 0: continue
+            offset = index
+            if index > 0: offset += 2
+            self.filter_bytes.append((offset, match[index] & mask[index], mask[index] & mode[index],
+                                      mask[index] & ~mode[index] & 0xff))
+        self.negative = len([entry for entry in self.filter_bytes if entry[3]]) > 0
+        self.header_size = 1
+        if self.table_id_extensions is not None: self.header_size = 5
+        if self.filter_bytes: self.header_size = max(self.header_size, self.filter_bytes[-1][0] + 1)
+        self.accepted = 0
+        self.rejected = 0
+
+    def accept(self, data):
+        """Returns True if the section that starts with data passes the filter
+
+        A section whose first packet holds fewer than header_size of its bytes passes, it cannot be checked
+        without assembling it.
+        """
+        if len(data) < self.header_size:
+            self.accepted += 1
+            return True
+        if self.table_ids is not None and data[0] not in self.table_ids:
+            self.rejected += 1
+            return False
+        if self.table_id_extensions is not None and get_table_id_extension(data) not in self.table_id_extensions:
+            self.rejected += 1
+            return False
+        differs = False
+        for offset, value, positive, negative in self.filter_bytes:
+            diff = data[offset] ^ value
+            if diff & positive:
+                self.rejected += 1
+                return False
+            if diff & negative: differs = True
+        if self.negative and not differs:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def __str__(self):
+        return 'SectionFilter: accepted[%d], rejected[%d]'%(self.accepted, self.rejected)
+
+def get_version_change_filter(table_id, table_id_extension, version):
+    """Returns a SectionFilter that only passes the sub-table when its version is not the given one"""
+    return SectionFilter(match=[table_id, table_id_extension >> 8, table_id_extension & 0xff, version << 1],
+                         mask=[0xff, 0xff, 0xff, 0x3e], mode=[0xff, 0xff, 0xff, 0x00])
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing SectionFilter class'
+    import unittest
+    import packet_tools as pct
+    from section_builder import SectionBuilder
+    from carousel import packetise
+    from dvbsi import _known_tables as si_tables
+    from dvbsi.eit import Eit
+    from dvbsi.epg_store import EpgStore
+
+    SERVICE_IDS = (0x654, 0x655)
+
+    def make_eits():
+        '''the sample EIT as present/following and two schedule tables of the same two services'''
+        eits = []
+        for table_id in (0x4e, 0x50, 0x51):
+            for service_id in SERVICE_IDS:
+                eit = Eit(si_tables.SAMPLE_EIT)
+                eit.table_id = table_id
+                eit.table_id_extension = eit.service_id = service_id
+                eits.append(eit)
+        return eits
+
+    def build(eits, section_filter=None):
+        '''builds the EIT PID into an EpgStore, which tells the sections of each table ID apart'''
+        builder = SectionBuilder(None, Eit, EpgStore(), section_filter=section_filter)
+        data = packetise([eit.to_bytes() for eit in eits], 0x12)
+        for offset in range(0, len(data), pct.PACKET_SIZE):
+            builder.process_packet(data[offset:offset + pct.PACKET_SIZE])
+        return builder
+
+    class KnownSectionFilter(unittest.TestCase):
+        def setUp(self):
+            self.eits = make_eits()
+            self.data = [eit.to_bytes() for eit in self.eits]
+
+        def testAccept(self):
+            section_filter = SectionFilter(table_ids=[0x4e])
+            self.assertEqual([True, True, False, False, False, False], map(section_filter.accept, self.data))
+            section_filter = SectionFilter(table_ids=[0x4e, 0x50], table_id_extensions=[SERVICE_IDS[1]])
+            self.assertEqual([False, True, False, True, False, False], map(section_filter.accept, self.data))
+            self.assertEqual('SectionFilter: accepted[2], rejected[4]', str(section_filter))
+            section_filter = SectionFilter(match=[0x50], mask=[0xf0]) # any schedule table ID 0x50 to 0x5f
+            self.assertEqual([False, False, True, True, True, True], map(section_filter.accept, self.data))
+            self.assertTrue(section_filter.accept(self.data[0][:0])) # too short to check, passes
+            self.assertRaises(ValueError, SectionFilter, match=[0x50], mask=[0xf0, 0xff])
+
+        def testVersionChange(self):
+            version = self.eits[0].version
+            section_filter = get_version_change_filter(0x4e, SERVICE_IDS[0], version)
+            self.assertFalse(section_filter.accept(self.data[0]))
+            self.assertFalse(section_filter.accept(self.data[1])) # another service
+            eit = Eit(self.data[0])
+            eit.version = (version + 1) % 32
+            self.assertTrue(section_filter.accept(eit.to_bytes()))
+
+        def testBuilder(self):
+            def get_stored(builder):
+                return sorted([(table_id, triplet[2])
+                               for triplet, table_id, number in builder.si_table.section_versions])
+            builder = build(self.eits)
+            self.assertEqual([(0x4e, 0x654), (0x4e, 0x655), (0x50, 0x654), (0x50, 0x655), (0x51, 0x654),
+                              (0x51, 0x655)], get_stored(builder))
+            section_filter = SectionFilter(table_ids=[0x50], table_id_extensions=[SERVICE_IDS[1]])
+            builder = build(self.eits, section_filter)
+            self.assertEqual([(0x50, 0x655)], get_stored(builder))
+            self.assertEqual(2, builder.si_table.get_event_count())
+            self.assertEqual((1, 5), (section_filter.accepted, section_filter.rejected))
+
+    unittest.main()
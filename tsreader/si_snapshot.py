@@ -0,0 +1,368 @@
+'''
+    Snapshot cache of acquired SI for instant start up.
+
+    The current sections of the SiTables of a reader (PAT, PMTs, SDT, NIT, BAT...) are saved as section bytes,
+    keyed by PID, together with the services of a ServiceList, in one small zlib compressed file. On start up
+    load_snapshot() gives back a ServiceList straight away and a SnapshotTable per PID holding the sections,
+    which are only parsed when first used. Handing a SnapshotTable to a SectionBuilder reconciles it against the
+    live stream: a section that arrives with the cached version is confirmed and not parsed again, one with
+    another version replaces the cached sub-table (every section of that table ID extension).
+
+    File layout, all big endian: the magic 'TSSI', a format version byte and the save time as a double, then
+    the zlib compressed records. Each record is a type byte and a 32 bit length followed by the record: a
+    section record is the PID (16 bits) and the section bytes, a service record the network, transport stream
+    and service IDs (16 bits each), a flags byte telling which of the channel (16 bits), type (8 bits), name
+    and number (both an 8 bit length and UTF-8) follow.
+
+    usage: python si_snapshot.py SNAPSHOT   (prints the content of a snapshot)
+'''
+
+import os
+import struct
+import time
+import zlib
+from si_table import SiTable
+from mpeg2psi.section import Section, get_table_id, get_table_id_extension, get_version_number
+from mpeg2psi.section import get_section_number, get_last_section_number
+from mpeg2psi.pat import Pat
+from mpeg2psi.cat import Cat
+from mpeg2psi.pmt import Pmt
+from dvbsi.nit import Nit
+from dvbsi.sdt import Sdt
+from dvbsi.bat import Bat
+from dvbsi.eit import Eit
+from dvbsi.service import Service
+from dvbsi.service_list import ServiceList
+
+MAGIC          = 'TSSI'
+FORMAT_VERSION = 1
+HEADER         = struct.Struct('>4sBd')
+RECORD_HEADER  = struct.Struct('>BI')
+
+RECORD_SECTION = 1
+RECORD_SERVICE = 2
+
+SERVICE_CHANNEL = 0x01
+SERVICE_TYPE    = 0x02
+SERVICE_NAME    = 0x04
+SERVICE_NUMBER  = 0x08
+
+TABLE_CLASSES = {0x00: Pat, 0x01: Cat, 0x02: Pmt, 0x40: Nit, 0x41: Nit, 0x42: Sdt, 0x46: Sdt, 0x4a: Bat}
+for table_id in Eit.TABLE_IDS: TABLE_CLASSES[table_id] = Eit
+
+class LazySection(object):
+    """A section loaded from a snapshot, parsed the first time anything but its header fields is used
+
+    The header fields (table_id, table_id_extension, version, section_number and last_section_number) are
+    read straight from the bytes; any other attribute parses the section with its table class and is taken
+    from the result, so a LazySection stands in for the parsed section.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.table_id = get_table_id(data)
+        self.table_id_extension = get_table_id_extension(data)
+        self.version = get_version_number(data)
+        self.section_number = get_section_number(data)
+        self.last_section_number = get_last_section_number(data)
+        self.complete = True
+        self.section = None
+
+    def get_section(self):
+        if self.section is None:
+            self.section = TABLE_CLASSES.get(self.table_id, Section)(self.data)
+        return self.section
+
+    def __getattr__(self, name):
+        if name.startswith('__'): raise AttributeError(name)
+        return getattr(self.get_section(), name)
+
+    def to_bytes(self):
+        return bytearray(self.data)
+
+    def __str__(self):
+        return str(self.get_section())
+
+class SnapshotTable(SiTable):
+    """An SiTable filled from a snapshot and reconciled with the live stream by a SectionBuilder
+
+    Statistics: confirmed (cached sections seen again with the same version) and replaced (cached sub-tables
+    dropped because a new version arrived).
+    """
+    def __init__(self):
+        super(SnapshotTable, self).__init__()
+        self.cached = {} # (table id extension, section number) -> version, for sections not yet seen live
+        self.confirmed = 0
+        self.replaced = 0
+
+    def add_cached_section(self, section):
+        self.add_section(section)
+        self.cached[(section.table_id_extension, section.section_number)] = section.version
+
+    def need_section(self, data):
+        tide = get_table_id_extension(data)
+        key = (tide, get_section_number(data))
+        version = self.cached.get(key)
+        if version is not None:
+            if version == get_version_number(data):
+                del self.cached[key]
+                self.confirmed += 1
+                return False
+            self._drop_cached(tide)
+        return super(SnapshotTable, self).need_section(data)
+
+    def _drop_cached(self, tide):
+        '''forgets the cached sections of a sub-table whose version changed'''
+        for key in [key for key in self.cached if key[0] == tide]:
+            version = self.cached.pop(key)
+            sub_table = self.sections.get(version, {}).get(tide, {})
+            sub_table.pop(key[1], None)
+            if not sub_table: self.sections.get(version, {}).pop(tide, None)
+            if self.versions.get(tide) == version: del self.versions[tide]
+        self.replaced += 1
+
+    def is_reconciled(self):
+        '''True once every cached section has been confirmed or replaced by the live stream'''
+        return not self.cached
+
+class Snapshot(object):
+    """The content of a snapshot file: tables is a dict of SnapshotTable by PID, service_list a ServiceList"""
+    def __init__(self, tables, service_list, saved_time):
+        self.tables = tables
+        self.service_list = service_list
+        self.time = saved_time
+
+    def is_reconciled(self):
+        for pid in self.tables:
+            if not self.tables[pid].is_reconciled(): return False
+        return True
+
+    def __str__(self):
+        res = 'Snapshot: saved[%s], services[%d]\n'%(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.time)),
+                                                   self.service_list.get_service_count())
+        for pid in sorted(self.tables):
+            table = self.tables[pid]
+            res += '\tpid[0x%x] - sections[%d], confirmed[%d], replaced[%d]\n'%(
+                pid, len(table.get_current_sections()), table.confirmed, table.replaced)
+        return res
+
+def _encode_text(text):
+    '''returns the text as UTF-8 of at most 255 bytes, cut after a whole character'''
+    if not isinstance(text, unicode): text = str(text).decode('latin-1')
+    data = text.encode('utf-8')
+    if len(data) > 255: data = data[:255].decode('utf-8', 'ignore').encode('utf-8') # drops a partial character
+    return data
+
+def _encode_service(service):
+    flags = 0
+    tail = ''
+    if service.chan is not None:
+        flags |= SERVICE_CHANNEL
+        tail += struct.pack('>H', service.chan)
+    if service.type is not None:
+        flags |= SERVICE_TYPE
+        tail += struct.pack('>B', service.type)
+    for flag, text in ((SERVICE_NAME, service.name), (SERVICE_NUMBER, service.number)):
+        if text is not None:
+            flags |= flag
+            text = _encode_text(text)
+            tail += chr(len(text)) + text
+    return struct.pack('>HHHB', service.nid, service.tsid, service.svid, flags) + tail
+
+def _decode_service(data):
+    nid, tsid, svid, flags = struct.unpack_from('>HHHB', data)
+    service = Service(nid=nid, tsid=tsid, svid=svid)
+    offset = 7
+    if flags & SERVICE_CHANNEL:
+        service.chan = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+    if flags & SERVICE_TYPE:
+        service.type = ord(data[offset])
+        offset += 1
+    for flag, name in ((SERVICE_NAME, 'name'), (SERVICE_NUMBER, 'number')):
+        if flags & flag:
+            length = ord(data[offset])
+            setattr(service, name, data[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+    return service
+
+def encode_snapshot(tables, service_list=None, saved_time=None):
+    """Serialises the current sections of the tables and the services of a service list
+
+    Arguments:
+        tables       -- a dict of SiTable (or SnapshotTable) by PID
+        service_list -- a ServiceList, None saves no services (default None)
+        saved_time   -- time stamp to record, None for now (default None)
+    Returns:
+        The snapshot as a string
+    """
+    records = []
+    for pid in sorted(tables):
+        for section in tables[pid].get_current_sections():
+            data = str(section.to_bytes())
+            records.append(RECORD_HEADER.pack(RECORD_SECTION, len(data) + 2) + struct.pack('>H', pid) + data)
+    if service_list is not None:
+        for triplet in sorted(service_list.svl):
+            data = _encode_service(service_list.svl[triplet])
+            records.append(RECORD_HEADER.pack(RECORD_SERVICE, len(data)) + data)
+    if saved_time is None: saved_time = time.time()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, saved_time) + zlib.compress(''.join(records))
+
+def decode_snapshot(data):
+    """Reads a snapshot made by encode_snapshot()
+
+    Returns:
+        A Snapshot
+    Raises:
+        ValueError if the data is not a snapshot this version can read, or is damaged
+    """
+    if len(data) < HEADER.size: raise ValueError('snapshot too short')
+    magic, version, saved_time = HEADER.unpack_from(data)
+    if magic != MAGIC: raise ValueError('not an SI snapshot')
+    if version != FORMAT_VERSION: raise ValueError('unsupported snapshot format %d'%(version))
+    try:
+        records = zlib.decompress(data[HEADER.size:])
+    except zlib.error, e:
+        raise ValueError('damaged snapshot: %s'%(e))
+    tables = {}
+    service_list = ServiceList()
+    offset = 0
+    while offset < len(records):
+        if offset + RECORD_HEADER.size > len(records): raise ValueError('damaged snapshot record')
+        kind, length = RECORD_HEADER.unpack_from(records, offset)
+        offset += RECORD_HEADER.size
+        record = records[offset:offset + length]
+        if len(record) != length: raise ValueError('damaged snapshot record')
+        offset += length
+        if kind == RECORD_SECTION:
+            pid = struct.unpack_from('>H', record)[0]
+            if pid not in tables: tables[pid] = SnapshotTable()
+            tables[pid].add_cached_section(LazySection(bytearray(record[2:])))
+        elif kind == RECORD_SERVICE:
+            service = _decode_service(record)
+            service_list.svl[service.get_triplet()] = service
+        # records of types added later are skipped
+    return Snapshot(tables, service_list, saved_time)
+
+def save_snapshot(filename, tables, service_list=None):
+    """Writes a snapshot file, see encode_snapshot()
+
+    The file is written under a temporary name and renamed, so a reader never sees half a snapshot.
+    """
+    temp = filename + '.tmp'
+    f = open(temp, 'wb')
+    try:
+        f.write(encode_snapshot(tables, service_list))
+    finally:
+        f.close()
+    os.rename(temp, filename)
+
+def load_snapshot(filename):
+    """Reads a snapshot file, see decode_snapshot()
+
+    Returns:
+        A Snapshot, or None if there is no snapshot file
+    Raises:
+        ValueError if the file is not a readable snapshot
+    """
+    if not os.path.exists(filename): return None
+    f = open(filename, 'rb')
+    try:
+        return decode_snapshot(f.read())
+    finally:
+        f.close()
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        snapshot = load_snapshot(sys.argv[1])
+        print snapshot
+        print snapshot.service_list
+        sys.exit(0)
+
+    print 'Testing SI snapshot'
+    import unittest
+    import tempfile
+    import packet_tools as pct
+    from section_builder import SectionBuilder
+    from carousel import packetise
+    from dvbsi import _known_tables as si_tables
+
+    def acquire(section_class, sections, si_table=None):
+        builder = SectionBuilder(None, section_class, si_table)
+        for section in sections:
+            data = packetise([section.to_bytes()], 0x10)
+            for offset in range(0, len(data), pct.PACKET_SIZE):
+                builder.process_packet(data[offset:offset + pct.PACKET_SIZE])
+        return builder.si_table
+
+    class KnownSnapshot(unittest.TestCase):
+        def setUp(self):
+            self.nits = si_tables.get_sample_nit_sections().values()
+            self.sdt = si_tables.get_sample_sdt_sections()[0]
+            self.tables = {0x10: acquire(Nit, self.nits), 0x11: acquire(Sdt, [self.sdt])}
+            self.service_list = ServiceList()
+            for nit in self.nits: self.service_list.update(nit=nit)
+            self.service_list.update(sdt=self.sdt)
+            self.service_list.svl.values()[0].chan = 101
+
+        def testRoundTrip(self):
+            fd, filename = tempfile.mkstemp(suffix='.si')
+            os.close(fd)
+            try:
+                save_snapshot(filename, self.tables, self.service_list)
+                size = os.path.getsize(filename)
+                snapshot = load_snapshot(filename)
+            finally:
+                os.remove(filename)
+            self.assertEqual(None, load_snapshot(filename))
+            self.assertEqual(len(encode_snapshot(self.tables, self.service_list)), size)
+            self.assertEqual(sorted(self.service_list.svl), sorted(snapshot.service_list.svl))
+            for triplet in self.service_list.svl:
+                before = self.service_list.svl[triplet]
+                after = snapshot.service_list.svl[triplet]
+                self.assertEqual((before.name, before.type, before.chan), (after.name, after.type, after.chan))
+            sdt = snapshot.tables[0x11].get_current_sections()[0]
+            self.assertEqual(None, sdt.section) # not parsed yet
+            self.assertEqual(self.sdt.transport_stream_id, sdt.transport_stream_id)
+            self.assertTrue(isinstance(sdt.section, Sdt))
+            self.assertEqual(self.sdt.to_bytes(), sdt.to_bytes())
+            rebuilt = ServiceList()
+            for nit in snapshot.tables[0x10].get_current_sections(): rebuilt.update(nit=nit)
+            self.assertEqual(self.service_list.get_service_count(), rebuilt.get_service_count())
+
+        def testReconcile(self):
+            snapshot = decode_snapshot(encode_snapshot(self.tables, self.service_list))
+            nit_table = snapshot.tables[0x10]
+            self.assertFalse(snapshot.is_reconciled())
+            acquire(Nit, self.nits, nit_table) # the same versions on air
+            self.assertTrue(nit_table.is_reconciled())
+            self.assertEqual(2, nit_table.confirmed)
+            self.assertEqual(None, nit_table.get_current_sections()[0].section) # confirmed without parsing
+            sdt_table = snapshot.tables[0x11]
+            sdt = Sdt(self.sdt.to_bytes())
+            sdt.version = (sdt.version + 1) % 32
+            acquire(Sdt, [sdt], sdt_table)
+            self.assertTrue(snapshot.is_reconciled())
+            self.assertEqual(1, sdt_table.replaced)
+            current = sdt_table.get_current_sections()
+            self.assertEqual([sdt.version], [section.version for section in current])
+            self.assertTrue(isinstance(current[0], Sdt))
+
+        def testLongName(self):
+            service = self.service_list.svl.values()[0]
+            service.name = u'\u041a\u0430\u043d\u0430\u043b' * 40 # 200 characters, 400 bytes of UTF-8
+            snapshot = decode_snapshot(encode_snapshot(self.tables, self.service_list))
+            name = snapshot.service_list.svl[service.get_triplet()].name
+            self.assertEqual(service.name[:127], name)
+            self.assertEqual(254, len(name.encode('utf-8')))
+
+        def testDamaged(self):
+            data = encode_snapshot(self.tables, self.service_list)
+            self.assertRaises(ValueError, decode_snapshot, 'XXXX' + data[4:])
+            self.assertRaises(ValueError, decode_snapshot, data[:-10])
+            self.assertRaises(ValueError, decode_snapshot, data[:5])
+
+    unittest.main()
@@ -2,9 +2,13 @@
 Section Tables come in parts. This is a tool to manage the acquisition of those parts
 '''
 
+from mpeg2psi.section import get_version_number, get_table_id_extension, get_section_number
+from mpeg2psi import json_output
+
 class SiTable(object):
     def __init__(self):
         self.sections = {}
+        self.versions = {} # table id extension -> version of the section last added
     
     def do_you_need(self, version, table_id_extension, section_number):
         if version in self.sections:
@@ -13,10 +17,15 @@ class SiTable(object):
                     return False
         return True
     
+    def need_section(self, data):
+        '''checks do_you_need() using the header of the given section data'''
+        return self.do_you_need(get_version_number(data), get_table_id_extension(data), get_section_number(data))
+
     def add_section(self, section):
         version  = section.version
         number   = section.section_number
         tide     = section.table_id_extension 
+        self.versions[tide] = version
         #print "new section added version[%d] number[%d]"%(version, number)
         if version in self.sections:
             if tide in self.sections[version]:
@@ -30,7 +39,29 @@ class SiTable(object):
         self.sections[version][tide][number] = section
         #print section
         #print section.get_ca_pids()
+
+    def get_current_sections(self):
+        '''returns the sections of the version last added for each table id extension'''
+        sections = []
+        for tide in self.versions:
+            sections.extend(self.sections[self.versions[tide]][tide].values())
+        return sections
         
+    def get_sorted_sections(self):
+        '''returns get_current_sections() ordered by table id extension and section number'''
+        return sorted(self.get_current_sections(),
+                      key=lambda section: (section.table_id_extension, section.section_number))
+
+    def to_dict(self):
+        return {'sections': [section.to_dict() for section in self.get_sorted_sections()]}
+
+    def iter_json(self):
+        '''yields the JSON of to_dict() a section at a time, see json_output.write_json()'''
+        yield '{"sections":'
+        for piece in json_output.iter_json_array(self.get_sorted_sections()):
+            yield piece
+        yield '}'
+
     def __str__(self):
         res = 'SI Table:-----\n'
         for version in self.sections:
@@ -0,0 +1,261 @@
+'''
+    Packet sources for files, pipes, stdin and file descriptors.
+
+    A Source wraps a path, an open file object, a raw file descriptor or '-' for stdin and hands out whole
+    188 byte packets. Pipes, FIFOs, sockets and character devices are switched to O_NONBLOCK and read in
+    large chunks as soon as select() says data is ready, so a slow producer (dvbv5-zap, ffmpeg) never leaves
+    the reader blocked in a read it cannot stop. Partial packets are carried across chunks and sync is
+    recovered after junk. The time spent waiting for input is measured so stalls in a live feed show up in
+    the statistics.
+'''
+
+import errno
+import os
+import select
+import stat
+import sys
+import time
+import packet_tools as pct
+from mpeg2psi import profiling
+
+CHUNK_SIZE      = pct.PACKET_SIZE * 1024
+STALL_THRESHOLD = 0.1  # seconds without data before a wait counts as a stall
+POLL_INTERVAL   = 0.5  # select() timeout, so that stop() is noticed while the input is idle
+
+def _is_stream(fd):
+    '''True if the descriptor is a pipe, FIFO, socket or character device rather than a regular file'''
+    mode = os.fstat(fd).st_mode
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)
+
+def _set_non_blocking(fd):
+    '''sets O_NONBLOCK on the descriptor, returns its previous flags'''
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return flags
+
+def _restore_flags(fd, flags):
+    import fcntl
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+
+class Source(object):
+    """Reads transport stream packets from a file, pipe or descriptor
+
+    Statistics: bytes_read, chunks, packets, sync_losses, stalls (waits longer than stall_threshold),
+    stall_time (total seconds spent in those waits) and longest_stall.
+    """
+    def __init__(self, input, chunk_size=CHUNK_SIZE, stall_threshold=STALL_THRESHOLD):
+        """Constructor
+
+        Arguments:
+            input           -- a path, '-' for stdin, an open file object (or anything with read()) or an
+                               int file descriptor
+            chunk_size      -- bytes to read at a time (default CHUNK_SIZE)
+            stall_threshold -- seconds a wait for input must last to count as a stall (default STALL_THRESHOLD)
+        """
+        self.chunk_size = chunk_size
+        self.stall_threshold = stall_threshold
+        self.file = None
+        self.fd = None
+        self.owned = False
+        self.stream = False
+        self.saved_flags = None # file status flags to put back on close(), they are shared with other processes
+        self.stopped = False
+        self.bytes_read = 0
+        self.chunks = 0
+        self.packets = 0
+        self.sync_losses = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.longest_stall = 0.0
+        if input == '-':
+            input = sys.stdin
+        elif isinstance(input, basestring):
+            input = open(input, 'rb')
+            self.owned = True
+        if isinstance(input, (int, long)):
+            self.fd = input
+        else:
+            self.file = input
+            try:
+                self.fd = input.fileno()
+            except (AttributeError, IOError, ValueError):
+                self.fd = None # eg. a StringIO, read with read()
+        if self.fd is not None and _is_stream(self.fd):
+            self.stream = True
+            self.saved_flags = _set_non_blocking(self.fd)
+
+    def _wait(self):
+        '''waits until the descriptor is readable, returns False if the source was stopped meanwhile'''
+        start = time.time()
+        while not self.stopped:
+            readable = select.select([self.fd], [], [], POLL_INTERVAL)[0]
+            if readable: break
+        waited = time.time() - start
+        if waited >= self.stall_threshold:
+            self.stalls += 1
+            self.stall_time += waited
+            self.longest_stall = max(self.longest_stall, waited)
+        return not self.stopped
+
+    def read_chunk(self):
+        """Returns the next chunk of input, or an empty string at the end of the input or once stopped"""
+        if profiling.enabled: return profiling.call('read', None, self._read_chunk)
+        return self._read_chunk()
+
+    def _read_chunk(self):
+        if self.stopped: return ''
+        if self.fd is None:
+            data = self.file.read(self.chunk_size)
+        elif not self.stream:
+            data = os.read(self.fd, self.chunk_size)
+        else:
+            while True:
+                try:
+                    data = os.read(self.fd, self.chunk_size)
+                    break
+                except OSError, e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR): raise
+                if not self._wait(): return ''
+        if data:
+            self.chunks += 1
+            self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        """Yields whole packets as bytearray slices until the input ends or the source is stopped
+
+        A trailing partial packet is kept until the next chunk completes it and dropped at the end of the input.
+        If sync is lost reading resumes at the next offset where three consecutive sync bytes are found.
+        """
+        return self._packets(False)
+
+    def iter_packets(self):
+        """Yields (byte offset in the input, packet) pairs, otherwise like iterating the Source"""
+        return self._packets(True)
+
+    def _packets(self, offsets):
+        data = bytearray()
+        base = 0 # input offset of data[0]
+        while True:
+            chunk = self.read_chunk()
+            if not chunk: break
+            data.extend(chunk)
+            offset = 0
+            end = len(data) - pct.PACKET_SIZE
+            while offset <= end:
+                if data[offset] != pct.SYNC_BYTE:
+                    frame = profiling.enabled and profiling.begin('sync')
+                    synced = pct.find_sync(data, offset)
+                    if frame: profiling.end(frame)
+                    if synced < 0:
+                        offset = max(offset, len(data) - 2 * pct.PACKET_SIZE)
+                        break
+                    self.sync_losses += 1
+                    offset = synced
+                    continue
+                self.packets += 1
+                if offsets: yield base + offset, data[offset:offset + pct.PACKET_SIZE]
+                else: yield data[offset:offset + pct.PACKET_SIZE]
+                offset += pct.PACKET_SIZE
+            del data[:offset]
+            base += offset
+
+    def stop(self):
+        '''makes the source end at the next chunk, can be called from another thread'''
+        self.stopped = True
+
+    def close(self):
+        '''stops the source, clears O_NONBLOCK again where it was set and closes a file opened from a path'''
+        self.stopped = True
+        if self.saved_flags is not None:
+            try:
+                _restore_flags(self.fd, self.saved_flags)
+            except (IOError, OSError):
+                pass # the descriptor was already closed by its owner
+            self.saved_flags = None
+        if self.owned: self.file.close()
+
+    def __str__(self):
+        return 'Source: bytes[%d] in [%d] chunks, packets[%d], sync losses[%d], stalls[%d] for %0.3fs (longest %0.3fs)'%(
+            self.bytes_read, self.chunks, self.packets, self.sync_losses, self.stalls, self.stall_time,
+            self.longest_stall)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing Source class'
+    import tempfile
+    import threading
+    import unittest
+    from StringIO import StringIO
+
+    def make_packets(count, pid=0x100):
+        data = bytearray()
+        for cc in range(count):
+            data += bytearray([pct.SYNC_BYTE, pid >> 8, pid & 0xff, 0x10 | (cc & 0x0f)] + [cc & 0xff] * 184)
+        return data
+
+    class KnownSource(unittest.TestCase):
+        def testFileObject(self):
+            data = make_packets(10)
+            source = Source(StringIO(str(bytearray(5) + data)), chunk_size=1000) # 5 bytes of junk first
+            packets = list(source)
+            self.assertEqual(10, len(packets))
+            self.assertEqual(9, packets[9][4])
+            self.assertEqual(1, source.sync_losses)
+            self.assertEqual(len(data) + 5, source.bytes_read)
+            source = Source(StringIO(str(bytearray(5) + data + bytearray(200) + data)), chunk_size=1000)
+            offsets = [offset for offset, packet in source.iter_packets()]
+            self.assertEqual([5 + index * pct.PACKET_SIZE for index in range(10)], offsets[:10])
+            self.assertEqual(5 + len(data) + 200 + 9 * pct.PACKET_SIZE, offsets[-1])
+            self.assertEqual(2, source.sync_losses)
+
+        def testPath(self):
+            fd, filename = tempfile.mkstemp(suffix='.ts')
+            os.write(fd, str(make_packets(20)) + '\x47' * 100) # partial packet at the end
+            os.close(fd)
+            try:
+                source = Source(filename, chunk_size=pct.PACKET_SIZE * 3 + 7)
+                self.assertEqual(20, len(list(source)))
+                self.assertFalse(source.stream)
+                source.close()
+            finally:
+                os.remove(filename)
+
+        def testPipe(self):
+            read_fd, write_fd = os.pipe()
+            data = str(make_packets(30))
+            def produce():
+                for start in range(0, len(data), 1000):
+                    os.write(write_fd, data[start:start + 1000])
+                    if start == 2000: time.sleep(0.2) # a stall in the middle of a packet
+                os.close(write_fd)
+            producer = threading.Thread(target=produce)
+            producer.start()
+            source = Source(read_fd, stall_threshold=0.15)
+            packets = list(source)
+            producer.join()
+            import fcntl
+            self.assertTrue(fcntl.fcntl(read_fd, fcntl.F_GETFL) & os.O_NONBLOCK)
+            source.close()
+            self.assertFalse(fcntl.fcntl(read_fd, fcntl.F_GETFL) & os.O_NONBLOCK) # shared with other processes
+            os.close(read_fd)
+            self.assertTrue(source.stream)
+            self.assertEqual(30, len(packets))
+            self.assertEqual(29, packets[29][4])
+            self.assertEqual(0, source.sync_losses)
+            self.assertEqual(1, source.stalls)
+
+        def testStop(self):
+            read_fd, write_fd = os.pipe()
+            source = Source(read_fd)
+            threading.Timer(0.1, source.stop).start()
+            start = time.time()
+            self.assertEqual([], list(source)) # nothing is ever written, stop() ends the wait
+            self.assertTrue(time.time() - start < 5)
+            os.close(read_fd)
+            os.close(write_fd)
+
+    unittest.main()
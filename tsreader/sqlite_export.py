@@ -0,0 +1,346 @@
+'''
+    Export of acquired SI to an SQLite database.
+
+    SqliteExporter writes the services of a ServiceList, the programs of the PAT, the elementary streams of
+    the PMTs, the delivery parameters of the NIT and the events of the EIT into plain tables that other tools
+    can query. Every export runs in a single transaction and the rows are written with executemany() batches,
+    one per statement, rather than a statement per row.
+
+    Exports are incremental, so the same database can be updated by repeated runs over a stream or a set of
+    recordings. The version of every section written is kept in the table_versions table: a section whose
+    version is unchanged is skipped without touching its rows, one with a new version has the rows it wrote
+    before deleted and its current rows inserted. When a new version has fewer sections (a lower
+    last_section_number) the rows and versions of the sections beyond its last one are deleted as well, so
+    nothing is left of a section that is no longer in its table. Services have no version, they are compared
+    row by row and only the changed, new and removed services are written.
+
+    usage: python sqlite_export.py RECORDING DATABASE   (exports the SI of a recording)
+'''
+
+import sqlite3
+from mpeg2psi.pat import Pat
+from mpeg2psi.pmt import Pmt
+from dvbsi.nit import Nit
+from dvbsi.eit import Eit
+from dvbsi import descriptors
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS table_versions (
+    kind TEXT, key TEXT, version INTEGER,
+    PRIMARY KEY (kind, key));
+CREATE TABLE IF NOT EXISTS services (
+    network_id INTEGER, transport_stream_id INTEGER, service_id INTEGER,
+    name TEXT, service_type INTEGER, channel INTEGER, number TEXT,
+    PRIMARY KEY (network_id, transport_stream_id, service_id));
+CREATE TABLE IF NOT EXISTS programs (
+    transport_stream_id INTEGER, section_number INTEGER, program_number INTEGER, pmt_pid INTEGER,
+    PRIMARY KEY (transport_stream_id, program_number));
+CREATE TABLE IF NOT EXISTS streams (
+    transport_stream_id INTEGER, program_number INTEGER, section_number INTEGER, pcr_pid INTEGER,
+    pid INTEGER, stream_type INTEGER,
+    PRIMARY KEY (transport_stream_id, program_number, pid));
+CREATE TABLE IF NOT EXISTS transport_streams (
+    network_id INTEGER, section_number INTEGER, original_network_id INTEGER, transport_stream_id INTEGER,
+    frequency REAL, orbital_position REAL, east INTEGER, polarization INTEGER, roll_off INTEGER,
+    modulation_system INTEGER, modulation_type INTEGER, symbol_rate INTEGER, fec INTEGER,
+    PRIMARY KEY (network_id, original_network_id, transport_stream_id));
+CREATE TABLE IF NOT EXISTS events (
+    original_network_id INTEGER, transport_stream_id INTEGER, service_id INTEGER, table_id INTEGER,
+    section_number INTEGER, event_id INTEGER, start_time INTEGER, duration INTEGER, running_status INTEGER,
+    free_ca_mode INTEGER, name TEXT, text TEXT,
+    PRIMARY KEY (original_network_id, transport_stream_id, service_id, table_id, event_id));
+CREATE INDEX IF NOT EXISTS events_by_time ON events (original_network_id, transport_stream_id, service_id, start_time);
+'''
+
+# per table: the columns that identify the rows written by one section, ending with the section number, and all
+# the columns
+TABLES = {'programs'         : (('transport_stream_id', 'section_number'),
+                                ('transport_stream_id', 'section_number', 'program_number', 'pmt_pid')),
+          'streams'          : (('transport_stream_id', 'program_number', 'section_number'),
+                                ('transport_stream_id', 'program_number', 'section_number', 'pcr_pid', 'pid',
+                                 'stream_type')),
+          'transport_streams': (('network_id', 'section_number'),
+                                ('network_id', 'section_number', 'original_network_id', 'transport_stream_id',
+                                 'frequency', 'orbital_position', 'east', 'polarization', 'roll_off',
+                                 'modulation_system', 'modulation_type', 'symbol_rate', 'fec')),
+          'events'           : (('original_network_id', 'transport_stream_id', 'service_id', 'table_id',
+                                 'section_number'),
+                                ('original_network_id', 'transport_stream_id', 'service_id', 'table_id',
+                                 'section_number', 'event_id', 'start_time', 'duration', 'running_status',
+                                 'free_ca_mode', 'name', 'text'))}
+
+SERVICE_COLUMNS = ('network_id', 'transport_stream_id', 'service_id', 'name', 'service_type', 'channel', 'number')
+
+def _insert_sql(table, columns):
+    return 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)'%(table, ', '.join(columns), ', '.join(['?'] * len(columns)))
+
+def _delete_sql(table, columns):
+    return 'DELETE FROM %s WHERE %s'%(table, ' AND '.join(['%s = ?'%column for column in columns]))
+
+def _get_delivery_row(ts_item):
+    for desc in ts_item.descriptors:
+        if type(desc) == descriptors.SatelliteDeliverySystemDescriptor:
+            return (desc.frequency, desc.orbital_pos, int(desc.east_flag), desc.polarization, desc.roll_off,
+                    desc.mod_system, desc.mod_type, desc.symbol_rate, desc.fec)
+    return (None,) * 9
+
+class SqliteExporter(object):
+    """Writes SI tables and service lists to an SQLite database
+
+    Arguments:
+        database -- file name of the database, created if needed, or an open sqlite3 connection
+    """
+    def __init__(self, database):
+        if isinstance(database, sqlite3.Connection):
+            self.connection = database
+        else:
+            self.connection = sqlite3.connect(database)
+        self.connection.executescript(SCHEMA)
+        self.transport_stream_id = None
+        self.rows_written      = 0
+        self.rows_deleted      = 0
+        self.sections_written  = 0
+        self.sections_unchanged = 0
+        self.sections_skipped  = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _get_section_rows(self, section):
+        '''returns (table, key, rows) for a section, or None for a section that is not exported'''
+        if isinstance(section, Pat):
+            self.transport_stream_id = section.transport_stream_id
+            key = (section.transport_stream_id, section.section_number)
+            return 'programs', key, [key + (program, section.table[program]) for program in sorted(section.table)]
+        if isinstance(section, Pmt):
+            if self.transport_stream_id is None: # its rows could not be told apart from another stream's
+                self.sections_skipped += 1
+                return None
+            key = (self.transport_stream_id, section.program_number, section.section_number)
+            return 'streams', key, [key + (section.pcr_pid, es.pid, es.stream_type) for es in section.es_loop]
+        if isinstance(section, Nit):
+            key = (section.network_id, section.section_number)
+            return 'transport_streams', key, [key + (item.original_network_id, item.transport_stream_id) +
+                                              _get_delivery_row(item) for item in section.ts_loop]
+        if isinstance(section, Eit):
+            key = (section.original_network_id, section.transport_stream_id, section.service_id,
+                   section.table_id, section.section_number)
+            return 'events', key, [key + (event.event_id, event.start_time, event.duration, event.running_status,
+                                          int(event.free_ca_mode), event.get_name(), event.get_text())
+                                   for event in section.event_loop]
+        return None
+
+    def export(self, sections=(), service_list=None):
+        """Exports sections and a service list in one transaction
+
+        Sections are dispatched on their class: Pat, Pmt, Nit (the actual or other network) and Eit; any other
+        section is ignored. A PMT carries no transport stream ID, it is stored with the one of the last PAT
+        exported by this exporter; PMTs exported before any PAT are skipped (and counted in sections_skipped)
+        so they are written once a PAT has been exported.
+        Arguments:
+            sections     -- iterable of parsed sections, eg. SiTable.get_current_sections()
+            service_list -- a dvbsi ServiceList whose services replace those in the database (default None)
+        """
+        cursor = self.connection.cursor()
+        versions = {}
+        section_numbers = {} # (table, key of the sub-table) -> numbers of its sections that have a version
+        for kind, key, version in cursor.execute('SELECT kind, key, version FROM table_versions'):
+            versions[(kind, key)] = version
+            prefix, number = key.rsplit('.', 1)
+            section_numbers.setdefault((kind, prefix), set()).add(int(number))
+        deletes = {}
+        inserts = {}
+        new_versions = []
+        old_versions = []
+        for section in sections:
+            result = self._get_section_rows(section)
+            if result is None: continue
+            table, key, rows = result
+            version_key = (table, '.'.join([str(value) for value in key]))
+            if versions.get(version_key) == section.version:
+                self.sections_unchanged += 1
+                continue
+            versions[version_key] = section.version
+            new_versions.append(version_key + (section.version,))
+            deletes.setdefault(table, []).append(key)
+            inserts.setdefault(table, []).extend(rows)
+            self.sections_written += 1
+            prefix = version_key[1].rsplit('.', 1)[0]
+            numbers = section_numbers.setdefault((table, prefix), set())
+            numbers.add(section.section_number)
+            for number in [number for number in numbers if number > section.last_section_number]:
+                numbers.discard(number)
+                deletes[table].append(key[:-1] + (number,))
+                old_key = (table, '%s.%d'%(prefix, number))
+                del versions[old_key]
+                old_versions.append(old_key)
+        try:
+            for table in deletes:
+                key_columns, columns = TABLES[table]
+                cursor.executemany(_delete_sql(table, key_columns), deletes[table])
+                self.rows_deleted += max(cursor.rowcount, 0)
+                cursor.executemany(_insert_sql(table, columns), inserts[table])
+                self.rows_written += len(inserts[table])
+            if old_versions:
+                cursor.executemany(_delete_sql('table_versions', ('kind', 'key')), old_versions)
+            if new_versions:
+                cursor.executemany(_insert_sql('table_versions', ('kind', 'key', 'version')), new_versions)
+            if service_list is not None:
+                self._export_services(cursor, service_list)
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+
+    def export_tables(self, tables, service_list=None):
+        """Exports the current sections of SiTables, eg. the dict of PID -> SiTable of a reader, in one transaction"""
+        sections = []
+        for pid in sorted(tables):
+            sections.extend(tables[pid].get_current_sections())
+        sections.sort(key=lambda section: not isinstance(section, Pat)) # PATs first, for the PMT transport stream ID
+        self.export(sections, service_list)
+
+    def _export_services(self, cursor, service_list):
+        existing = {}
+        for row in cursor.execute('SELECT %s FROM services'%', '.join(SERVICE_COLUMNS)):
+            existing[row[:3]] = row
+        changed = []
+        for triplet, service in service_list.svl.items():
+            name = service.name
+            if isinstance(name, str): name = name.decode('latin-1')
+            number = service.number
+            if number is not None: number = unicode(number)
+            row = (service.nid, service.tsid, service.svid, name, service.type, service.chan, number)
+            if existing.pop(row[:3], None) != row: changed.append(row)
+        cursor.executemany(_insert_sql('services', SERVICE_COLUMNS), changed)
+        cursor.executemany(_delete_sql('services', SERVICE_COLUMNS[:3]), existing.keys())
+        self.rows_written += len(changed)
+        self.rows_deleted += len(existing)
+
+    def __str__(self):
+        return 'SqliteExporter: sections written[%d], unchanged[%d], skipped[%d], rows written[%d], deleted[%d]'%(
+            self.sections_written, self.sections_unchanged, self.sections_skipped, self.rows_written,
+            self.rows_deleted)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 2:
+        from scanner import StreamScanner
+        from dvbsi.sdt import Sdt
+        from dvbsi.service_list import ServiceList
+        scanner = StreamScanner()
+        f = open(sys.argv[1], 'rb')
+        try:
+            scanner.scan(f)
+        finally:
+            f.close()
+        tables = dict([(pid, builder.si_table) for pid, builder in scanner.builders.items()
+                       if builder.si_table is not None])
+        service_list = ServiceList()
+        for si_table in tables.values():
+            for section in si_table.get_current_sections():
+                if isinstance(section, Nit): service_list.update(nit=section)
+        for si_table in tables.values():
+            for section in si_table.get_current_sections():
+                if isinstance(section, Sdt): service_list.update(sdt=section)
+        exporter = SqliteExporter(sys.argv[2])
+        exporter.export_tables(tables, service_list)
+        exporter.close()
+        print exporter
+        sys.exit(0)
+
+    print 'Testing SQLite export'
+    import unittest
+    from mpeg2psi import _known_tables as psi_tables
+    from dvbsi import _known_tables as si_tables
+    from dvbsi.service_list import ServiceList
+
+    class KnownSqliteExport(unittest.TestCase):
+        def setUp(self):
+            self.exporter = SqliteExporter(':memory:')
+            self.pat = Pat(psi_tables.SAMPLE_PAT)
+            self.pmt = Pmt(psi_tables.SAMPLE_PMT)
+            self.nits = si_tables.get_sample_nit_sections().values()
+            self.eit = si_tables.get_sample_eit_sections()[0]
+            self.sdt = si_tables.get_sample_sdt_sections()[0]
+            self.service_list = ServiceList()
+            for nit in self.nits: self.service_list.update(nit=nit)
+            self.service_list.update(sdt=self.sdt)
+
+        def query(self, sql):
+            return self.exporter.connection.execute(sql).fetchall()
+
+        def testExport(self):
+            self.exporter.export([self.pat, self.pmt] + self.nits + [self.eit], self.service_list)
+            self.assertEqual(len(self.pat.table), self.query('SELECT COUNT(*) FROM programs')[0][0])
+            self.assertEqual([(self.pat.transport_stream_id, self.pmt.pcr_pid, es.pid, es.stream_type)
+                              for es in self.pmt.es_loop],
+                             self.query('SELECT transport_stream_id, pcr_pid, pid, stream_type FROM streams '
+                                        'ORDER BY rowid'))
+            self.assertEqual(sum([len(nit.ts_loop) for nit in self.nits]),
+                             self.query('SELECT COUNT(*) FROM transport_streams WHERE frequency IS NOT NULL')[0][0])
+            event = self.eit.event_loop[0]
+            self.assertEqual([(event.start_time, event.duration, event.get_name(), event.get_text())],
+                             self.query('SELECT start_time, duration, name, text FROM events WHERE event_id = %d'%
+                                        event.event_id))
+            self.assertEqual(self.service_list.get_service_count(), self.query('SELECT COUNT(*) FROM services')[0][0])
+
+        def testIncremental(self):
+            sections = [self.pat, self.pmt] + self.nits + [self.eit]
+            self.exporter.export(sections, self.service_list)
+            written = self.exporter.rows_written
+            self.exporter.export(sections, self.service_list)
+            self.assertEqual(written, self.exporter.rows_written) # nothing changed, nothing written
+            self.assertEqual(len(sections), self.exporter.sections_unchanged)
+            eit = Eit(self.eit.to_bytes())
+            eit.version = (eit.version + 1) % 32
+            del eit.event_loop[1:]
+            self.exporter.export([eit])
+            self.assertEqual(written + 1, self.exporter.rows_written)
+            self.assertEqual(len(self.eit.event_loop), self.exporter.rows_deleted)
+            self.assertEqual(1, self.query('SELECT COUNT(*) FROM events')[0][0])
+            service = self.service_list.svl.values()[0]
+            service.chan = 101
+            self.exporter.export(service_list=self.service_list)
+            self.assertEqual(written + 2, self.exporter.rows_written)
+            self.assertEqual([(101,)], self.query('SELECT channel FROM services WHERE service_id = %d'%service.svid))
+
+        def testRemovedSection(self):
+            nits = sorted(self.nits, key=lambda nit: nit.section_number)
+            self.exporter.export(nits)
+            self.assertEqual(13, self.query('SELECT COUNT(*) FROM transport_streams')[0][0])
+            nit = Nit(nits[0].to_bytes())
+            nit.version = (nit.version + 1) % 32
+            nit.last_section_number = 0 # section 1 is no longer part of the table
+            self.exporter.export([nit])
+            self.assertEqual([(0, len(nit.ts_loop))], self.query('SELECT section_number, COUNT(*) '
+                                                                 'FROM transport_streams GROUP BY section_number'))
+            self.assertEqual([('6144.0', nit.version)], self.query('SELECT key, version FROM table_versions'))
+            self.exporter.export(nits) # the old version has both sections again
+            self.assertEqual(13, self.query('SELECT COUNT(*) FROM transport_streams')[0][0])
+
+        def testPmtBeforePat(self):
+            pmt = Pmt(self.pmt.to_bytes())
+            self.exporter.export([pmt])
+            pmt.version = (pmt.version + 1) % 32
+            self.exporter.export([pmt])
+            self.assertEqual(2, self.exporter.sections_skipped)
+            self.assertEqual(0, self.query('SELECT COUNT(*) FROM streams')[0][0])
+            self.assertEqual(0, self.query('SELECT COUNT(*) FROM table_versions')[0][0])
+            self.exporter.export([self.pat, pmt])
+            self.exporter.export([self.pat, pmt])
+            self.assertEqual([(len(pmt.es_loop), self.pat.transport_stream_id)],
+                             self.query('SELECT COUNT(*), transport_stream_id FROM streams'))
+
+        def testRollback(self):
+            self.exporter.export([self.pat])
+            class Broken(object):
+                svl = {(1, 2, 3): None}
+            self.assertRaises(AttributeError, self.exporter.export, [self.pmt], Broken())
+            self.assertEqual(0, self.query('SELECT COUNT(*) FROM streams')[0][0])
+            self.assertEqual(1, self.query('SELECT COUNT(*) FROM table_versions')[0][0])
+
+    unittest.main()
@@ -0,0 +1,247 @@
+'''
+    Wall-clock model for transport stream recordings.
+
+    TDT/TOT sections give the UTC time to the second at a few points in the stream while the PCR gives a
+    precise 27MHz time base at many points. StreamClock fits UTC against the unwrapped PCR with least squares
+    and interpolates the PCR between indexed PCR packets, so any byte offset in a recording can be given a
+    wall-clock time. Built from a saved PacketIndex only the TDT packets are read back from the recording.
+'''
+
+import array
+import bisect
+import packet_tools as pct
+from packet_index import PCR_HZ, PCR_WRAP, VALUE_TYPECODE, unwrap
+from dvbsi.tdt import Tdt
+from dvbsi.tot import Tot
+
+TDT_PID = Tdt.PID
+
+MIN_FIT_SPAN = 60 # seconds of PCR covered by the UTC samples before the clock rate is fitted as well
+
+class StreamClock(object):
+    """Maps byte offsets and PCR values of a recording to UTC time
+
+    PCR samples (offset, 27MHz PCR) are stored in parallel arrays and must be added in offset order. UTC
+    samples (offset, seconds since the epoch) come from TDT or TOT sections. While the UTC samples span
+    less than min_fit_span seconds of PCR only the clock offset is fitted and the PCR is assumed to run at
+    its nominal rate; after that the rate is fitted too, which absorbs the drift of the encoder clock.
+    """
+    def __init__(self, min_fit_span=MIN_FIT_SPAN):
+        self.min_fit_span = min_fit_span
+        self.pcr_offsets = array.array(VALUE_TYPECODE)
+        self.pcr_values  = array.array(VALUE_TYPECODE)
+        self.utc_offsets = []
+        self.utc_times   = []
+        self._pcr_raw   = None
+        self._pcr_wraps = 0
+        self._fit = None
+
+    def add_pcr(self, offset, pcr):
+        """Adds a raw (wrapping) 27MHz PCR value seen at the given byte offset"""
+        value, self._pcr_wraps = unwrap(pcr, self._pcr_raw, self._pcr_wraps, PCR_WRAP)
+        self._pcr_raw = pcr
+        self.pcr_offsets.append(offset)
+        self.pcr_values.append(value)
+        self._fit = None
+
+    def add_utc(self, offset, utc_time):
+        """Adds a UTC time, in seconds since the epoch, received at the given byte offset"""
+        if utc_time is None: return
+        self.utc_offsets.append(offset)
+        self.utc_times.append(utc_time)
+        self._fit = None
+
+    def add_section(self, section, offset):
+        """Adds the UTC time of a complete Tdt or Tot section received at the given byte offset"""
+        if section.complete: self.add_utc(offset, section.utc_time)
+
+    def pcr_at_offset(self, offset):
+        """Returns the unwrapped PCR at the given byte offset, or None if no PCR has been added
+
+        The PCR is interpolated linearly between the surrounding PCR packets, ie. a constant bitrate is
+        assumed between them. Before the first and after the last PCR the nearest pair is extrapolated.
+        """
+        count = len(self.pcr_offsets)
+        if count == 0: return None
+        if count == 1: return self.pcr_values[0]
+        i = bisect.bisect_right(self.pcr_offsets, offset)
+        i = min(max(i, 1), count - 1)
+        o0, o1 = self.pcr_offsets[i - 1], self.pcr_offsets[i]
+        v0, v1 = self.pcr_values[i - 1], self.pcr_values[i]
+        if o1 == o0: return v0
+        return v0 + (v1 - v0) * float(offset - o0) / (o1 - o0)
+
+    def offset_at_pcr(self, pcr):
+        """Returns the byte offset at which the given unwrapped PCR is reached, or None if no PCR has been added"""
+        count = len(self.pcr_values)
+        if count == 0: return None
+        if count == 1: return int(self.pcr_offsets[0])
+        i = bisect.bisect_right(self.pcr_values, pcr)
+        i = min(max(i, 1), count - 1)
+        o0, o1 = self.pcr_offsets[i - 1], self.pcr_offsets[i]
+        v0, v1 = self.pcr_values[i - 1], self.pcr_values[i]
+        if v1 == v0: return int(o0)
+        return int(o0 + (o1 - o0) * float(pcr - v0) / (v1 - v0))
+
+    def fit(self):
+        """Fits UTC against PCR time and returns (pcr origin, rate, utc at origin) or None
+
+        utc = utc at origin + rate * (pcr - pcr origin) / PCR_HZ. The origin is the first PCR so the
+        regression is done on small numbers and keeps its precision.
+        """
+        if self._fit is not None: return self._fit
+        if len(self.pcr_values) == 0: return None
+        origin = self.pcr_values[0]
+        xs, ys = [], []
+        for offset, utc_time in zip(self.utc_offsets, self.utc_times):
+            xs.append((self.pcr_at_offset(offset) - origin) / float(PCR_HZ))
+            ys.append(utc_time)
+        count = len(xs)
+        if count == 0: return None
+        mean_x = sum(xs) / count
+        mean_y = sum(ys) / float(count)
+        rate = 1.0
+        if max(xs) - min(xs) >= self.min_fit_span:
+            sxx = sxy = 0.0
+            for x, y in zip(xs, ys):
+                sxx += (x - mean_x) * (x - mean_x)
+                sxy += (x - mean_x) * (y - mean_y)
+            rate = sxy / sxx
+        self._fit = (origin, rate, mean_y - rate * mean_x)
+        return self._fit
+
+    def pcr_to_utc(self, pcr):
+        """Returns the UTC time, in seconds since the epoch, of the given unwrapped PCR or None"""
+        fit = self.fit()
+        if fit is None: return None
+        origin, rate, utc0 = fit
+        return utc0 + rate * (pcr - origin) / float(PCR_HZ)
+
+    def utc_to_pcr(self, utc_time):
+        """Returns the unwrapped PCR at the given UTC time or None"""
+        fit = self.fit()
+        if fit is None: return None
+        origin, rate, utc0 = fit
+        return origin + (utc_time - utc0) / rate * PCR_HZ
+
+    def utc_at_offset(self, offset):
+        """Returns the UTC time, in seconds since the epoch, of the packet at the given byte offset or None"""
+        pcr = self.pcr_at_offset(offset)
+        if pcr is None: return None
+        return self.pcr_to_utc(pcr)
+
+    def offset_at_utc(self, utc_time):
+        """Returns the byte offset in the recording reached at the given UTC time or None"""
+        pcr = self.utc_to_pcr(utc_time)
+        if pcr is None: return None
+        return self.offset_at_pcr(pcr)
+
+    def from_index(cls, index, filename, pcr_pid=None, min_fit_span=MIN_FIT_SPAN):
+        """Builds a StreamClock from a PacketIndex of the recording
+
+        The PCR arrays of the index are shared, not copied. The index must have been built with every
+        payload start on the TDT PID (granularity 1); only those packets are read back from the recording.
+        Sections that do not fit in one packet are skipped, the TDT always fits and a TOT nearly always does.
+        """
+        clock = cls(min_fit_span)
+        if pcr_pid is None: pcr_pid = index.get_pcr_pid()
+        if pcr_pid in index.pids:
+            clock.pcr_offsets = index.pids[pcr_pid].pcr_offsets
+            clock.pcr_values = index.pids[pcr_pid].pcr_values
+        if TDT_PID not in index.pids: return clock
+        f = open(filename, 'rb')
+        try:
+            for offset in index.pids[TDT_PID].pusi_offsets:
+                offset = int(offset)
+                packet = bytearray(index.read_packets(f, offset))
+                if len(packet) < pct.PACKET_SIZE: break
+                payload = pct.get_payload(packet)
+                data = payload[payload[0] + 1:]
+                if len(data) < 3: continue
+                if data[0] == Tdt.TABLE_ID:
+                    clock.add_section(Tdt(data), offset)
+                elif data[0] == Tot.TABLE_ID:
+                    clock.add_section(Tot(data), offset)
+        finally:
+            f.close()
+        return clock
+    from_index = classmethod(from_index)
+
+    def __str__(self):
+        res = 'StreamClock: pcr samples[%d], utc samples[%d]'%(len(self.pcr_values), len(self.utc_times))
+        fit = self.fit()
+        if fit is not None:
+            res += ', rate[%.9f], utc at first pcr[%.3f]'%(fit[1], fit[2])
+        return res + '\n'
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    print 'Testing StreamClock class'
+    import os
+    import tempfile
+    import unittest
+    from packet_index import PacketIndex
+    from dvbsi import _known_tables
+
+    START = 1458000000 # utc time of the first packet
+
+    def make_pcr_packet(pcr):
+        base, ext = pcr // 300, pcr % 300
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0:4] = bytearray([pct.SYNC_BYTE, 0x01, 0x00, 0x20])
+        packet[4:12] = bytearray([183, 0x10, (base >> 25) & 0xff, (base >> 17) & 0xff, (base >> 9) & 0xff,
+                                  (base >> 1) & 0xff, ((base & 1) << 7) | 0x7e | (ext >> 8), ext & 0xff])
+        return packet
+
+    def make_tdt_packet(utc_time):
+        days, seconds = divmod(utc_time, 86400)
+        mjd = days + 40587
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        bcd = lambda n: ((n // 10) << 4) | (n % 10)
+        section = [0x70, 0x70, 0x05, mjd >> 8, mjd & 0xff, bcd(hours), bcd(minutes), bcd(seconds)]
+        packet = bytearray([0xff] * pct.PACKET_SIZE)
+        packet[0:5] = bytearray([pct.SYNC_BYTE, 0x40, TDT_PID, 0x10, 0x00])
+        packet[5:5 + len(section)] = bytearray(section)
+        return packet
+
+    class KnownClock(unittest.TestCase):
+        def setUp(self):
+            # 200 seconds, a PCR packet every 10th of a second, a TDT every 5 seconds. The encoder clock
+            # runs 100ppm fast and the PCR wraps after 100 seconds
+            fd, self.ts_file = tempfile.mkstemp(suffix='.ts')
+            f = os.fdopen(fd, 'wb')
+            start_pcr = PCR_WRAP - 100 * PCR_HZ
+            for i in range(2000):
+                f.write(make_pcr_packet(int(start_pcr + i * PCR_HZ / 10 * 1.0001) % PCR_WRAP))
+                if i % 50 == 25: f.write(make_tdt_packet(START + i // 10))
+            f.close()
+
+        def tearDown(self):
+            os.remove(self.ts_file)
+
+        def testFromIndex(self):
+            index = PacketIndex().build(self.ts_file)
+            clock = StreamClock.from_index(index, self.ts_file)
+            self.assertEqual(40, len(clock.utc_times))
+            origin, rate, utc0 = clock.fit()
+            self.assertAlmostEqual(1 / 1.0001, rate, 4)
+            # a packet 150 seconds in, after the PCR wrapped
+            offset = int(index.pids[0x100].pcr_offsets[1500])
+            self.assertTrue(abs(clock.utc_at_offset(offset) - (START + 150)) < 1)
+            self.assertTrue(abs(clock.offset_at_utc(START + 150) - offset) < 20 * pct.PACKET_SIZE)
+
+        def testNominalRate(self):
+            clock = StreamClock()
+            self.assertEqual(None, clock.utc_at_offset(0))
+            clock.add_pcr(0, 0)
+            clock.add_pcr(188000, PCR_HZ)
+            clock.add_section(_known_tables.get_sample_tdt_sections()[0], 0)
+            self.assertEqual(1, clock.fit()[1])
+            tdt_time = _known_tables.get_sample_tdt_sections()[0].utc_time
+            self.assertEqual(tdt_time + 0.5, clock.utc_at_offset(94000))
+            self.assertEqual(tdt_time + 2, clock.utc_at_offset(376000))
+
+    unittest.main()
@@ -0,0 +1,391 @@
+'''
+    Deterministic synthetic transport stream generator.
+
+    Builds a constant bitrate multiplex of any number of programmes, each with a video stream carrying the
+    PCR and any number of audio streams, with a PAT, PMTs, SDT, NIT and TDT repeated at configurable rates.
+    Elementary streams carry PES headers with a PTS, and the video marks a keyframe (random access indicator
+    and an H.264 IDR slice) every few PES packets so keyframe_index has something to find. The PCR can be
+    given jitter and discontinuities, and packets can be dropped or corrupted, to exercise error handling.
+
+    Everything is driven by one seeded random.Random, so the same options always give the same bytes and
+    benchmarks can be repeated anywhere without real captures.
+
+    usage: python synthetic.py OUTPUT [SECONDS [BITRATE [PROGRAMS [STREAMS]]]]
+'''
+
+import random
+import sys
+from collections import deque
+import packet_tools as pct
+from packet_index import PCR_HZ, PCR_WRAP, PTS_WRAP
+from carousel import Carousel, packetise
+from mpeg2psi.pat import Pat
+from mpeg2psi.pmt import Pmt, PmtElementaryStream, STREAM_TYPE_H264_VIDEO, STREAM_TYPE_MPEG2_AUDIO
+from dvbsi.sdt import Sdt, ServiceDescription
+from dvbsi.nit import Nit, TsItem
+from dvbsi.tdt import Tdt
+from dvbsi.descriptors import ServiceDescriptor, NetworkNameDescriptor
+
+PAT_PID  = 0x00
+NIT_PID  = 0x10
+SDT_PID  = 0x11
+TDT_PID  = 0x14
+NULL_PID = 0x1fff
+FIRST_PMT_PID = 0x110 # programme n has its PMT on FIRST_PMT_PID + PID_STEP * (n - 1), its streams after it
+PID_STEP      = 0x10
+
+# seconds between repetitions of each table
+SI_INTERVALS = {'pat': 0.1, 'pmt': 0.1, 'sdt': 0.5, 'nit': 1.0, 'tdt': 1.0}
+
+TRANSPORT_STREAM_ID = 1
+NETWORK_ID          = 1
+START_TIME          = 1458000000 # UTC time of the first packet, 2016-03-15
+SERVICES_PER_SDT    = 25         # services per SDT section, keeps each section under 1024 bytes
+MAX_SECTION_SIZE    = 1024
+PES_PACKETS         = 20         # TS packets per PES packet
+GOP_SIZE            = 12         # PES packets per keyframe
+PTS_DELAY           = 0.5        # seconds the PTS runs ahead of the PCR
+PCR_JUMP            = 10.0       # seconds the PCR jumps at a discontinuity
+
+IDR_PAYLOAD   = bytearray([0, 0, 0, 1, 0x09, 0x10, 0, 0, 0, 1, 0x65, 0x88]) # access unit delimiter, IDR slice
+SLICE_PAYLOAD = bytearray([0, 0, 0, 1, 0x09, 0x30, 0, 0, 0, 1, 0x41, 0x9a])
+
+def encode_timestamp(buffer, offset, prefix, value):
+    '''writes a 33 bit PES timestamp in its 5 byte form'''
+    buffer[offset]     = (prefix << 4) | ((value >> 29) & 0x0e) | 1
+    buffer[offset + 1] = (value >> 22) & 0xff
+    buffer[offset + 2] = ((value >> 14) & 0xfe) | 1
+    buffer[offset + 3] = (value >> 7) & 0xff
+    buffer[offset + 4] = ((value << 1) & 0xfe) | 1
+
+def encode_pcr(buffer, offset, pcr):
+    '''writes a 27MHz PCR value as its 6 byte base and extension'''
+    base, extension = divmod(pcr % PCR_WRAP, 300)
+    buffer[offset]     = (base >> 25) & 0xff
+    buffer[offset + 1] = (base >> 17) & 0xff
+    buffer[offset + 2] = (base >> 9) & 0xff
+    buffer[offset + 3] = (base >> 1) & 0xff
+    buffer[offset + 4] = ((base & 1) << 7) | 0x7e | (extension >> 8)
+    buffer[offset + 5] = extension & 0xff
+
+class ElementaryStream(object):
+    '''the state of one synthetic elementary stream'''
+    def __init__(self, pid, stream_type, stream_id, pcr=False):
+        self.pid = pid
+        self.stream_type = stream_type
+        self.stream_id = stream_id
+        self.pcr = pcr
+        self.cc = 0
+        self.remaining = 0 # TS packets left in the current PES packet
+        self.pes_count = 0
+        self.last_pcr = None
+
+class SyntheticStream(object):
+    """Generates the packets of a synthetic multiplex
+
+    Programme n (from 1) has its PMT on PID 0x100 + 0x10 * n and its streams on the PIDs after it, the video
+    first, so there can be at most 15 streams per programme and 494 programmes. Statistics: packets (generated),
+    lost, corrupted, null_packets, si_packets and pcr_discontinuities.
+    """
+    def __init__(self, programs=2, streams=2, bitrate=10000000, es_fill=0.9, si_intervals=None,
+                 section_size=0, pcr_interval=0.04, pcr_jitter=0.0, pcr_discontinuity=None, loss_rate=0.0,
+                 corrupt_rate=0.0, seed=0, start_time=START_TIME):
+        """Constructor
+
+        Arguments:
+            programs          -- number of programmes (default 2)
+            streams           -- elementary streams per programme, a video and streams - 1 audio (default 2)
+            bitrate           -- bits per second of the multiplex (default 10 Mbit/s)
+            es_fill           -- share of the packets left by the SI that carry elementary streams, the
+                                 rest are null packets (default 0.9)
+            si_intervals      -- dict updating SI_INTERVALS, seconds between repetitions of 'pat', 'pmt',
+                                 'sdt', 'nit' and 'tdt'; None leaves a table out (default None)
+            section_size      -- bytes the NIT section is padded up to with extra transport streams, up to
+                                 MAX_SECTION_SIZE (default 0, no padding)
+            pcr_interval      -- seconds between PCRs (default 0.04)
+            pcr_jitter        -- largest error in seconds added to each PCR, either way (default 0.0)
+            pcr_discontinuity -- seconds between PCR discontinuities, None for none (default None)
+            loss_rate         -- share of packets dropped (default 0.0)
+            corrupt_rate      -- share of packets with one byte corrupted, the sync byte included (default 0.0)
+            seed              -- seed of the random generator (default 0)
+            start_time        -- UTC time of the first packet in the TDT (default START_TIME)
+        Raises:
+            ValueError if the PIDs of the programmes and streams do not fit below the null PID
+        """
+        if not 1 <= streams < PID_STEP:
+            raise ValueError('%d streams per programme, there is room for 1 to %d'%(streams, PID_STEP - 1))
+        if self.get_pmt_pid(programs) + streams >= NULL_PID:
+            raise ValueError('%d programmes of %d streams go past the last PID'%(programs, streams))
+        self.programs = programs
+        self.streams = streams
+        self.bitrate = bitrate
+        self.es_fill = es_fill
+        self.si_intervals = dict(SI_INTERVALS)
+        if si_intervals: self.si_intervals.update(si_intervals)
+        self.section_size = min(section_size, MAX_SECTION_SIZE)
+        self.pcr_interval = pcr_interval
+        self.pcr_jitter = pcr_jitter
+        self.pcr_discontinuity = pcr_discontinuity
+        self.loss_rate = loss_rate
+        self.corrupt_rate = corrupt_rate
+        self.start_time = start_time
+        self.random = random.Random(seed)
+        self.packet_time = float(pct.PACKET_SIZE * 8) / bitrate
+        self.index = 0
+        self.es_credit = 0.0
+        self.pcr_offset = 0.0 # seconds added by the discontinuities so far
+        self.next_discontinuity = pcr_discontinuity
+        self.si_queue = deque()
+        self.si_due = {}
+        self.tdt_cc = 0
+        self.packets = 0
+        self.lost = 0
+        self.corrupted = 0
+        self.null_packets = 0
+        self.si_packets = 0
+        self.pcr_discontinuities = 0
+        self.es = []
+        self.pmt_pids = []
+        for program in range(1, programs + 1):
+            pmt_pid = self.get_pmt_pid(program)
+            self.pmt_pids.append(pmt_pid)
+            self.es.append(ElementaryStream(pmt_pid + 1, STREAM_TYPE_H264_VIDEO, 0xe0, pcr=True))
+            for audio in range(streams - 1):
+                self.es.append(ElementaryStream(pmt_pid + 2 + audio, STREAM_TYPE_MPEG2_AUDIO, 0xc0 + audio))
+        self.es_index = 0
+        self.carousel = Carousel()
+        self._set_tables()
+        for name in self.si_intervals:
+            if self.si_intervals[name] is not None: self.si_due[name] = 0.0
+
+    def get_pmt_pid(self, program):
+        return FIRST_PMT_PID + PID_STEP * (program - 1)
+
+    def _set_tables(self):
+        programs = {}
+        for program, pmt_pid in enumerate(self.pmt_pids):
+            program += 1
+            programs[program] = pmt_pid
+            es_loop = [PmtElementaryStream.create(es.stream_type, es.pid) for es in self.es
+                       if pmt_pid < es.pid < pmt_pid + 0x10]
+            self.carousel.set_table(pmt_pid, Pmt.create(program, pmt_pid + 1, es_loop))
+        self.carousel.set_table(PAT_PID, Pat.create(TRANSPORT_STREAM_ID, programs, network_pid=NIT_PID))
+        services = [ServiceDescription.create(program, [ServiceDescriptor.create(0x19, u'Service %d'%(program),
+                                                                                 u'Synthetic')])
+                    for program in sorted(programs)]
+        chunks = [services[start:start + SERVICES_PER_SDT] for start in range(0, len(services), SERVICES_PER_SDT)]
+        self.carousel.set_table(SDT_PID, [Sdt.create(TRANSPORT_STREAM_ID, NETWORK_ID, chunk, section_number=number,
+                                                     last_section_number=len(chunks) - 1)
+                                          for number, chunk in enumerate(chunks)])
+        nit = Nit.create(NETWORK_ID, [NetworkNameDescriptor.create(u'Synthetic network')],
+                         [TsItem.create(TRANSPORT_STREAM_ID, NETWORK_ID)])
+        while nit.get_size() + 6 <= self.section_size:
+            nit.ts_loop.append(TsItem.create(TRANSPORT_STREAM_ID + len(nit.ts_loop), NETWORK_ID))
+        self.carousel.set_table(NIT_PID, nit)
+
+    def _get_pids(self, name):
+        if name == 'pat': return [PAT_PID]
+        if name == 'pmt': return self.pmt_pids
+        if name == 'sdt': return [SDT_PID]
+        if name == 'nit': return [NIT_PID]
+        return []
+
+    def _queue_si(self, now):
+        '''queues the packets of every table that is due'''
+        for name in self.si_due:
+            if self.si_due[name] > now: continue
+            self.si_due[name] += self.si_intervals[name]
+            if name == 'tdt':
+                tdt = Tdt.create(self.start_time + int(now))
+                data = packetise([tdt.to_bytes()], TDT_PID, self.tdt_cc)
+                self.tdt_cc = (self.tdt_cc + len(data) // pct.PACKET_SIZE) & 0x0f
+            else:
+                data = ''.join([self.carousel.get_packets(pid) for pid in self._get_pids(name)])
+            for offset in range(0, len(data), pct.PACKET_SIZE):
+                self.si_queue.append(bytearray(data[offset:offset + pct.PACKET_SIZE]))
+
+    def _get_pcr(self, now):
+        if self.next_discontinuity is not None and now >= self.next_discontinuity:
+            self.next_discontinuity += self.pcr_discontinuity
+            self.pcr_offset += PCR_JUMP
+            self.pcr_discontinuities += 1
+            discontinuity = True
+        else:
+            discontinuity = False
+        error = 0.0
+        if self.pcr_jitter: error = self.random.uniform(-self.pcr_jitter, self.pcr_jitter)
+        return int((now + self.pcr_offset + error) * PCR_HZ), discontinuity
+
+    def _es_packet(self, es, now):
+        packet = bytearray(pct.PACKET_SIZE)
+        packet[0] = pct.SYNC_BYTE
+        packet[1] = es.pid >> 8
+        packet[2] = es.pid & 0xff
+        packet[3] = 0x10 | es.cc
+        es.cc = (es.cc + 1) & 0x0f
+        start = es.remaining == 0
+        keyframe = start and es.pcr and es.pes_count % GOP_SIZE == 0
+        offset = 4
+        if (es.pcr and (es.last_pcr is None or now - es.last_pcr >= self.pcr_interval)) or keyframe:
+            packet[3] |= 0x20
+            flags = 0
+            af_length = 1
+            if keyframe: flags |= 0x40
+            if es.pcr and (es.last_pcr is None or now - es.last_pcr >= self.pcr_interval):
+                es.last_pcr = now
+                pcr, discontinuity = self._get_pcr(now)
+                flags |= 0x10
+                if discontinuity: flags |= 0x80
+                encode_pcr(packet, 6, pcr)
+                af_length += 6
+            packet[4] = af_length
+            packet[5] = flags
+            offset += 1 + af_length
+        if start:
+            packet[1] |= 0x40
+            es.remaining = PES_PACKETS
+            es.pes_count += 1
+            pts = int((now + self.pcr_offset + PTS_DELAY) * 90000) % PTS_WRAP
+            packet[offset:offset + 9] = bytearray([0, 0, 1, es.stream_id, 0, 0, 0x80, 0x80, 5])
+            encode_timestamp(packet, offset + 9, 0x2, pts)
+            offset += 14
+            if es.pcr:
+                payload = SLICE_PAYLOAD
+                if keyframe: payload = IDR_PAYLOAD
+                packet[offset:offset + len(payload)] = payload
+        es.remaining -= 1
+        return packet
+
+    def _null_packet(self):
+        self.null_packets += 1
+        return bytearray([pct.SYNC_BYTE, NULL_PID >> 8, NULL_PID & 0xff, 0x10]) + bytearray('\xff' * 184)
+
+    def next_packet(self):
+        """Returns the next packet, or None if the impairments dropped it"""
+        now = self.index * self.packet_time
+        self.index += 1
+        self._queue_si(now)
+        if self.si_queue:
+            packet = self.si_queue.popleft()
+            self.si_packets += 1
+        else:
+            self.es_credit += self.es_fill
+            if self.es_credit >= 1.0 and self.es:
+                self.es_credit -= 1.0
+                packet = self._es_packet(self.es[self.es_index], now)
+                self.es_index = (self.es_index + 1) % len(self.es)
+            else:
+                packet = self._null_packet()
+        self.packets += 1
+        if self.loss_rate or self.corrupt_rate:
+            draw = self.random.random()
+            if draw < self.loss_rate:
+                self.lost += 1
+                return None
+            if draw < self.loss_rate + self.corrupt_rate:
+                self.corrupted += 1
+                packet[self.random.randrange(pct.PACKET_SIZE)] ^= self.random.randrange(1, 256)
+        return packet
+
+    def generate(self, count=None, duration=None):
+        """Yields packets until count have been generated or duration seconds of stream, forever if neither"""
+        if duration is not None:
+            end = int(duration / self.packet_time)
+            if count is None or end < count: count = end
+        while count is None or self.packets < count:
+            packet = self.next_packet()
+            if packet is not None: yield packet
+
+    def write(self, fileobj, count=None, duration=None, packets_per_write=1000):
+        """Writes packets to an open file in blocks, see SyntheticStream.generate()"""
+        block = bytearray()
+        for packet in self.generate(count, duration):
+            block += packet
+            if len(block) >= packets_per_write * pct.PACKET_SIZE:
+                fileobj.write(block)
+                block = bytearray()
+        if block: fileobj.write(block)
+
+    def __str__(self):
+        return 'SyntheticStream: programs[%d] x streams[%d] at [%0.3f Mbit/s], packets[%d] (si[%d], null[%d]), lost[%d], corrupted[%d], pcr discontinuities[%d]'%(
+            self.programs, self.streams, self.bitrate / 1e6, self.packets, self.si_packets, self.null_packets,
+            self.lost, self.corrupted, self.pcr_discontinuities)
+
+def make_stream(count=None, duration=None, **options):
+    """Returns the packets of a synthetic stream as one string, see SyntheticStream for the options"""
+    stream = SyntheticStream(**options)
+    return ''.join([str(packet) for packet in stream.generate(count, duration)])
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        options = {}
+        duration = 10.0
+        if len(sys.argv) > 2: duration = float(sys.argv[2])
+        if len(sys.argv) > 3: options['bitrate'] = int(float(sys.argv[3]))
+        if len(sys.argv) > 4: options['programs'] = int(sys.argv[4])
+        if len(sys.argv) > 5: options['streams'] = int(sys.argv[5])
+        stream = SyntheticStream(**options)
+        f = open(sys.argv[1], 'wb')
+        stream.write(f, duration=duration)
+        f.close()
+        print stream
+        sys.exit(0)
+
+    print 'Testing SyntheticStream class'
+    import unittest
+    from StringIO import StringIO
+    from scanner import StreamScanner
+    from pacer import Pacer
+
+    def scan(data):
+        return StreamScanner().scan(StringIO(data))
+
+    class KnownSynthetic(unittest.TestCase):
+        def testTables(self):
+            data = make_stream(duration=1.0, programs=3, streams=3, section_size=600)
+            summary = scan(data).get_summary()
+            self.assertEqual({1: 0x110, 2: 0x120, 3: 0x130}, summary['pat']['programs'])
+            self.assertEqual([(STREAM_TYPE_H264_VIDEO, 0x121), (STREAM_TYPE_MPEG2_AUDIO, 0x122),
+                              (STREAM_TYPE_MPEG2_AUDIO, 0x123)], summary['pmts'][2]['streams'])
+            self.assertEqual(0x121, summary['pmts'][2]['pcr_pid'])
+            self.assertEqual(u'Service 3', summary['services'][2][4])
+            self.assertEqual(u'Synthetic network', summary['network']['name'])
+            self.assertTrue(90 < len(summary['network']['transport_streams']) < 100)
+            self.assertEqual({}, summary['cc_errors'])
+            self.assertEqual(10, summary['pids'][PAT_PID])
+
+        def testDeterministic(self):
+            options = {'duration': 0.2, 'loss_rate': 0.01, 'corrupt_rate': 0.01, 'pcr_jitter': 0.001}
+            self.assertEqual(make_stream(seed=5, **options), make_stream(seed=5, **options))
+            self.assertNotEqual(make_stream(seed=5, **options), make_stream(seed=6, **options))
+
+        def testBitrateAndPcr(self):
+            stream = SyntheticStream(bitrate=2000000, pcr_discontinuity=0.5)
+            pacer = Pacer()
+            packets = list(stream.generate(duration=1.0))
+            self.assertEqual(int(1.0 / stream.packet_time), len(packets))
+            for packet in pacer.pace(packets[:200]): pass # measures the rate from the PCRs, not paced yet
+            self.assertAlmostEqual(2000000, pacer.bitrate, -3)
+            self.assertEqual(1, stream.pcr_discontinuities)
+            self.assertTrue(abs(stream.null_packets - 0.1 * (len(packets) - stream.si_packets)) < 2)
+
+        def testPidLayout(self):
+            stream = SyntheticStream(programs=494, streams=15, si_intervals={'sdt': None, 'nit': None})
+            self.assertEqual(0x1fef, stream.es[-1].pid)
+            self.assertRaises(ValueError, SyntheticStream, programs=495, streams=15)
+            self.assertRaises(ValueError, SyntheticStream, programs=500)
+            self.assertRaises(ValueError, SyntheticStream, streams=16)
+            self.assertRaises(ValueError, SyntheticStream, streams=0)
+
+        def testImpairments(self):
+            stream = SyntheticStream(loss_rate=0.01, corrupt_rate=0.01, seed=1)
+            data = ''.join([str(packet) for packet in stream.generate(5000)])
+            self.assertEqual(5000 - stream.lost, len(data) // pct.PACKET_SIZE)
+            self.assertTrue(20 < stream.lost < 80 and 20 < stream.corrupted < 80)
+            scanner = scan(data)
+            self.assertTrue(len(scanner.cc_errors) > 0)
+
+    unittest.main()
@@ -1,10 +1,12 @@
 '''
     An example tool for reading a file from the HDD and processing the DVB info inside.
-    You will need your own TS file to test with.
+    Give it your own TS file, or run it without one to read a synthetic stream (see synthetic.py).
+    The input can also be a pipe, an open file object, a file descriptor or '-' for stdin, see source.Source.
 '''
 
+import logging
 from buffer import Buffer
-import struct
+from source import Source
 import time
 import threading
 import packet_tools
@@ -17,15 +19,26 @@ from dvbsi.sdt import Sdt
 from mpeg2psi.cat import Cat
 from mpeg2psi.pmt import Pmt
 import dvbsi.service_list as service_list
+from mpeg2psi import metrics
+from mpeg2psi import profiling
+
+LOG = logging.getLogger('tsreader.ts_reader')
+
+PACKETS = metrics.counter('tsreader_packets_total', 'TS packets read, by PID', ('pid',))
 
 
 class TsReader(threading.Thread):
     sync_byte = 0x47
-    def __init__(self, file):
+    def __init__(self, file=None, pacer=None):
+        '''file is a source.Source (eg. a pcap_source.PcapSource) or anything Source accepts: a path, '-', an
+        open file object or a file descriptor. A pacer.Pacer replays the input at its native rate.'''
         self.file = file
+        self.pacer = pacer
         self.input = None
         self.links = {}
+        self.handlers = {}
         self.pids  = {}
+        self.last_pcr = 0
         threading.Thread.__init__(self)#super(TsReader, self).__init__()#
 
     def __str__(self):
@@ -37,63 +50,93 @@ class TsReader(threading.Thread):
     def link(self, pid, buffer):
         if pid not in self.links:
             self.links[pid] = []
+        if buffer.name is None:
+            buffer.name = '0x%x'%(pid)
+            if self.links[pid]: buffer.name += '.%d'%(len(self.links[pid]))
         self.links[pid].append(buffer)
         buffer.link()
 
+    def link_handler(self, pid, handler):
+        '''calls handler(packet) for every packet of the PID from the thread feeding the reader, eg. with
+        SectionBuilder.process_packet, so no Buffer and thread are needed per table'''
+        if pid not in self.handlers:
+            self.handlers[pid] = []
+        self.handlers[pid].append(handler)
+
     def unlink(self, pid):
         pass
 
     def run(self):
-        self.input = open(self.file, 'rb')
-        self.stop = False
-        self.loop()
+        self.input = self.file
+        if not isinstance(self.input, Source): self.input = Source(self.file)
+        try:
+            self.loop()
+        finally:
+            self.input.close()
 
     def stop(self):
-        self.stop = True
-        self.input.close()
+        '''ends the loop at the next chunk, even while waiting on an idle pipe'''
+        if self.input: self.input.stop()
+        if self.pacer: self.pacer.stop()
 
     def loop(self):
-        last_pcr = 0
-        while not self.stop and self.input:
-            packt_data = self.input.read(188) # read a packet
-            if len(packt_data) < 188: break
-            packet = struct.unpack('188B', packt_data)
-            pid = packet_tools.get_pid(packet)
-            if pid in self.links:
-                for buffer in self.links[pid]:
-                    buffer.write(packet)
-            if pid not in self.pids:
-                self.pids[pid] = 0
-                print "new pid: ", hex(pid), "-- total = ", len(self.pids)
-            self.pids[pid] = self.pids[pid] + 1
-            af = packet_tools.get_adaptation_field(packet)
-            if af == packet_tools.AF_ADAPTATION_FIELD_ONLY or af == packet_tools.AF_AF_AND_PL:
-                #print 'af'
-                #if adaptation_field_tools.opcr_flag(packet):
-            #		print adaptation_field_tools.get_opcr(packet)
-                if adaptation_field_tools.pcr_flag(packet):
-                    pcr = adaptation_field_tools.get_pcr(packet)
-                    #print pcr
-                    ms =  pcr.to_micro_seconds()
-                    #print '%d micro_seconds'%(ms)
-                    delta = ms - last_pcr
-                    #print '%d ms delta between pcrs'%(delta/1000)
-                    last_pcr = ms
-
+        packets = self.input
+        if self.pacer is not None: packets = self.pacer.pace(packets)
+        for packet in packets:
+            self.feed_packet(packet)
+        self.unlink_all()
+
+    def feed_packet(self, packet):
+        '''demultiplexes one packet to the buffers and handlers linked to its PID, for any packet source'''
+        frame = profiling.enabled and profiling.begin('dispatch')
+        pid = packet_tools.get_pid(packet)
+        if pid in self.links:
+            for buffer in self.links[pid]:
+                buffer.write(packet)
+        if pid in self.handlers:
+            for handler in self.handlers[pid]:
+                handler(packet)
+        if pid not in self.pids:
+            self.pids[pid] = 0
+            LOG.debug('new pid: 0x%x -- total = %d', pid, len(self.pids))
+        self.pids[pid] = self.pids[pid] + 1
+        if metrics.enabled: PACKETS.inc(labels=(pid,))
+        af = packet_tools.get_adaptation_field(packet)
+        if af == packet_tools.AF_ADAPTATION_FIELD_ONLY or af == packet_tools.AF_AF_AND_PL:
+            #print 'af'
+            #if adaptation_field_tools.opcr_flag(packet):
+        #		print adaptation_field_tools.get_opcr(packet)
+            if adaptation_field_tools.pcr_flag(packet):
+                pcr = adaptation_field_tools.get_pcr(packet)
+                #print pcr
+                ms =  pcr.to_micro_seconds()
+                #print '%d micro_seconds'%(ms)
+                delta = ms - self.last_pcr
+                #print '%d ms delta between pcrs'%(delta/1000)
+                self.last_pcr = ms
+        if frame: profiling.end(frame)
+
+    def unlink_all(self):
+        '''tells the linked buffers that no more packets will come'''
         for pid in self.links:
             for buffer in self.links[pid]:
                 buffer.unlink()
 
-    def sync(self): # sync after 5 x 0x47 -- lose sync after 3 non 0x47
-        while True:
-            byte = struct.unpack('1B', self.input.read(1))
-            if byte == TsReader.sync_byte: break
-        self.input.seek(-1, 1)
-
 
 if __name__ == '__main__':
+    # usage: python ts_reader.py [FILE [PMT_PID]], without a file a few seconds of synthetic stream are read
+    import sys
+    if len(sys.argv) > 1:
+        input = sys.argv[1]
+        pmt_pid = 0x07f2
+        if len(sys.argv) > 2: pmt_pid = int(sys.argv[2], 0)
+    else:
+        from StringIO import StringIO
+        import synthetic
+        input = StringIO(synthetic.make_stream(duration=2.0))
+        pmt_pid = synthetic.SyntheticStream().get_pmt_pid(1)
     t1 = time.time()
-    dmx = TsReader('Your-ts-file-name-here.ts')
+    dmx = TsReader(input)
     buf = Buffer(188*10000)
     dmx.link(0x10, buf)
     buf2 = Buffer(188*10000)
@@ -106,7 +149,7 @@ if __name__ == '__main__':
     dmx.link(0x01, buf5)
 
     buf6 = Buffer(188*1000)
-    dmx.link(0x07f2, buf6)
+    dmx.link(pmt_pid, buf6)
 
 
     #nit = section_builder.SectionBuilder(buf, Nit)
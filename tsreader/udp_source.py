@@ -0,0 +1,201 @@
+'''
+    Live transport stream input from UDP or RTP, unicast or multicast.
+
+    Python 2 has no asyncio, so the receiver is an asyncore dispatcher: any number of sources share one
+    asyncore loop in a single thread, and every packet goes straight to TsReader.feed_packet(), whose
+    handlers (eg. SectionBuilder.process_packet) run in that same thread. RTP headers are stripped and
+    sequence gaps counted with the rtp module.
+
+    usage: python udp_source.py GROUP PORT [INTERFACE]
+'''
+
+import asyncore
+import logging
+import socket
+import struct
+import time
+import packet_tools as pct
+import rtp
+
+LOG = logging.getLogger('tsreader.udp_source')
+
+MAX_DATAGRAM   = 65536
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+def is_multicast(address):
+    first = int(address.split('.')[0])
+    return 224 <= first <= 239
+
+class UdpSource(asyncore.dispatcher):
+    """Receives TS over UDP or RTP and feeds the packets to a TsReader
+
+    Each datagram normally carries 7 packets. Plain UDP and RTP are told apart per datagram. Statistics:
+    datagrams, packets, bad_datagrams (datagrams that are not whole packets) and rtp (an RtpSequence).
+    """
+    def __init__(self, reader, address, port, interface='0.0.0.0', socket_map=None):
+        """Constructor
+
+        Arguments:
+            reader     -- the TsReader (or anything with feed_packet(packet)) fed with the packets
+            address    -- multicast group to join, or the local address to bind to for unicast
+            port       -- UDP port, 0 binds to any free port (see UdpSource.get_port())
+            interface  -- address of the interface to join the multicast group on (default any)
+            socket_map -- asyncore socket map, None uses the global one (default None)
+        """
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self.reader = reader
+        self.datagrams = 0
+        self.packets = 0
+        self.bad_datagrams = 0
+        self.rtp = rtp.RtpSequence()
+        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.set_reuse_addr()
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except socket.error:
+            pass # keep the system default
+        if is_multicast(address):
+            self.bind(('', port))
+            membership = struct.pack('4s4s', socket.inet_aton(address), socket.inet_aton(interface))
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        else:
+            self.bind((address, port))
+
+    def get_port(self):
+        return self.socket.getsockname()[1]
+
+    def writable(self):
+        return False
+
+    def handle_connect(self):
+        pass
+
+    def handle_read(self):
+        try:
+            data = self.socket.recv(MAX_DATAGRAM)
+        except socket.error:
+            return
+        self.process_datagram(data)
+
+    def process_datagram(self, data):
+        """Strips any RTP header from the datagram and feeds its packets to the reader"""
+        self.datagrams += 1
+        data = bytearray(data)
+        start, end = rtp.get_ts_payload(data, self.rtp)
+        if start < 0 or (end - start) % pct.PACKET_SIZE:
+            self.bad_datagrams += 1
+            if start < 0: return
+        feed_packet = self.reader.feed_packet
+        while start + pct.PACKET_SIZE <= end:
+            if data[start] == pct.SYNC_BYTE:
+                self.packets += 1
+                feed_packet(data[start:start + pct.PACKET_SIZE])
+            start += pct.PACKET_SIZE
+
+    def handle_error(self):
+        # a handler failing on one datagram must not close a live source
+        nil, t, v, tbinfo = asyncore.compact_traceback()
+        LOG.error('error handling datagram %s:%s %s', t, v, tbinfo)
+        self.bad_datagrams += 1
+
+    def __str__(self):
+        return 'UdpSource: datagrams[%d], packets[%d], bad datagrams[%d]\n'%(self.datagrams, self.packets,
+                                                                              self.bad_datagrams) + str(self.rtp)
+
+def run(duration=None, socket_map=None, timeout=0.1):
+    """Runs the asyncore loop for the given number of seconds, or until every source is closed"""
+    end = None
+    if duration is not None: end = time.time() + duration
+    if socket_map is None: socket_map = asyncore.socket_map
+    while socket_map and (end is None or time.time() < end):
+        asyncore.loop(timeout, False, socket_map, 1)
+
+'''UNIT TESTS -------------------------------------------------------------------------------------------------------------
+---------------------------------------------------------------------------------------------------------------------------
+'''
+if __name__ == '__main__':
+    import sys
+    from ts_reader import TsReader
+    if len(sys.argv) > 2:
+        reader = TsReader()
+        interface = '0.0.0.0'
+        if len(sys.argv) > 3: interface = sys.argv[3]
+        source = UdpSource(reader, sys.argv[1], int(sys.argv[2]), interface)
+        try:
+            run()
+        except KeyboardInterrupt:
+            pass
+        print source
+        print reader
+        sys.exit(0)
+
+    print 'Testing UdpSource class'
+    import unittest
+    from section_builder import SectionBuilder
+    from mpeg2psi.pat import Pat
+    from mpeg2psi import _known_tables
+
+    def make_pat_packet(cc):
+        pat = [0] + _known_tables.SAMPLE_PAT
+        return [pct.SYNC_BYTE, 0x40, 0x00, 0x10 | (cc & 0x0f)] + pat + [0xff] * (184 - len(pat))
+
+    class LoopbackSender(object):
+        '''stands in for a headend, sends 7 PAT packets per datagram to the local source'''
+        def __init__(self, port, use_rtp):
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.port = port
+            self.use_rtp = use_rtp
+            self.cc = 0
+
+        def send(self, sequence):
+            data = []
+            if self.use_rtp:
+                data = [0x80, rtp.PAYLOAD_TYPE_MP2T, sequence >> 8, sequence & 0xff] + [0] * 8
+            for i in range(7):
+                data += make_pat_packet(self.cc)
+                self.cc += 1
+            self.socket.sendto(str(bytearray(data)), ('127.0.0.1', self.port))
+
+        def close(self):
+            self.socket.close()
+
+    class Loopback(unittest.TestCase):
+        def setUp(self):
+            self.socket_map = {}
+            self.reader = TsReader()
+            self.pat = SectionBuilder(None, Pat)
+            self.reader.link_handler(0x00, self.pat.process_packet)
+            self.source = UdpSource(self.reader, '127.0.0.1', 0, socket_map=self.socket_map)
+
+        def tearDown(self):
+            self.source.close()
+
+        def receive(self, datagrams):
+            end = time.time() + 5
+            while self.source.datagrams < datagrams and time.time() < end:
+                asyncore.loop(0.05, False, self.socket_map, 1)
+
+        def testRtp(self):
+            sender = LoopbackSender(self.source.get_port(), True)
+            for sequence in (0xfffe, 0xffff, 0, 2, 3): # sequence 1 is lost
+                sender.send(sequence)
+            sender.close()
+            self.receive(5)
+            self.assertEqual(35, self.source.packets)
+            self.assertEqual(35, self.reader.pids[0])
+            self.assertEqual(1, self.source.rtp.lost)
+            self.assertEqual(0, self.source.bad_datagrams)
+            pat = self.pat.si_table.sections.values()[0].values()[0][0]
+            self.assertEqual(2003, pat.table[1696])
+
+        def testUdp(self):
+            sender = LoopbackSender(self.source.get_port(), False)
+            sender.send(0)
+            sender.socket.sendto('\x47' * 100, ('127.0.0.1', self.source.get_port()))
+            sender.close()
+            self.receive(2)
+            self.assertEqual(7, self.source.packets)
+            self.assertEqual(1, self.source.bad_datagrams)
+            self.assertEqual(0, self.source.rtp.received)
+
+    unittest.main()